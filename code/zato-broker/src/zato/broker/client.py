@@ -10,6 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging, time
+from hashlib import sha1
+from time import time as now_time
 from traceback import format_exc
 
 # anyjson
@@ -19,7 +21,7 @@ from anyjson import dumps, loads
 from bunch import Bunch
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn
 
 # Redis
 import redis
@@ -46,7 +48,22 @@ NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
-def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
+# Work queue that TO_PARALLEL_ANY messages are sent through, if enabled, along with keys that each of its consumers uses
+WORK_QUEUE_TOPIC = TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]
+WORK_QUEUE_KEY = b'zato:broker{}:queue'.format(KEYS[MESSAGE_TYPE.TO_PARALLEL_ANY])
+WORK_QUEUE_PROCESSING_KEY = WORK_QUEUE_KEY + b':processing:{}'
+WORK_QUEUE_CONSUMERS_KEY = WORK_QUEUE_KEY + b':consumers'
+WORK_QUEUE_CONSUMER_KEY = WORK_QUEUE_KEY + b':consumer:{}'
+WORK_QUEUE_CLAIM_KEY = WORK_QUEUE_KEY + b':claim:{}'
+
+# How long to block waiting for new messages, how often to confirm that a consumer is alive, or that it is still handling
+# a message, and after how much time without such confirmations its unacknowledged messages are given to other consumers,
+# all in seconds.
+WORK_QUEUE_POP_TIMEOUT = 1
+WORK_QUEUE_HEARTBEAT_INTERVAL = 10
+WORK_QUEUE_HEARTBEAT_TTL = 30
+
+def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, invoke_async_queue=False):
 
     # Imported here so it's guaranteed to be monkey-patched using gevent.monkey.patch_all by whoever called us
     from thread import start_new_thread
@@ -133,14 +150,29 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+           Alternatively, if invoke_async_queue is True, such messages are pushed to a Redis list
+           instead. Each client subscribed to the topic pops them off the list into its own processing list
+           and removes them from there once they are handled. Before a message is handed over to its callback,
+           the client claims it, and it keeps renewing the claim for as long as the callback runs.
+
+           Messages left in processing lists of clients that stopped confirming that they are alive
+           are moved back to the work queue, except for ones that are still claimed, i.e. ones that a slow
+           rather than dead client is still handling. A message that is already claimed is not handled again.
+           This means that each message is handled once unless a client dies, or its whole process is blocked
+           for longer than WORK_QUEUE_HEARTBEAT_TTL, in the middle of handling it.
         """
-        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
+        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs, invoke_async_queue=False):
             self.kvdb = kvdb
             self.decrypt_func = kvdb.decrypt_func
             self.name = '{}-{}'.format(client_type, new_cid())
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
             self.ready = False
+            self.invoke_async_queue = invoke_async_queue
+            self.keep_consuming = True
+            self.queue_processing_key = WORK_QUEUE_PROCESSING_KEY.format(self.name)
+            self.queue_consumer_key = WORK_QUEUE_CONSUMER_KEY.format(self.name)
 
         def run(self):
             logger.debug('Starting broker client, host:`%s`, port:`%s`, name:`%s`, topics:`%s`',
@@ -152,6 +184,10 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             start_new_thread(self.pub_client.run, ())
             start_new_thread(self.sub_client.run, ())
 
+            # Messages sent through the work queue are consumed by the same callback that the topic has
+            if WORK_QUEUE_TOPIC in self.topic_callbacks:
+                start_new_thread(self.run_queue_consumer, ())
+
             for client in(self.pub_client, self.sub_client):
                 while client.keep_running == ZATO_NONE:
                     time.sleep(0.01)
@@ -164,21 +200,177 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
 
         def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
             msg['msg_type'] = msg_type
+            use_queue = self.invoke_async_queue and msg_type == MESSAGE_TYPE.TO_PARALLEL_ANY
 
             try:
-                msg = dumps(msg)
+                data = dumps({'id': new_cid(), 'expires_at': now_time() + expiration, 'msg': msg} if use_queue else msg)
             except Exception:
                 error_msg = 'JSON serialization failed for msg:`%r`, e:`%s`'
                 logger.error(error_msg, msg, format_exc())
                 raise
             else:
-                topic = TOPICS[msg_type]
-                key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
 
-                self.kvdb.conn.set(key, str(msg))
-                self.kvdb.conn.expire(key, expiration)  # In seconds
+                # A single command is needed for the message to be picked up by one of consumers at a time ..
+                if use_queue:
+                    self.kvdb.conn.lpush(WORK_QUEUE_KEY, data)
+
+                # .. whereas here all the subscribers will race to get it.
+                else:
+                    topic = TOPICS[msg_type]
+                    key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
+
+                    self.kvdb.conn.set(key, str(data))
+                    self.kvdb.conn.expire(key, expiration)  # In seconds
+
+                    self.pub_client.publish(topic, broker_msg)
+
+        def run_queue_consumer(self):
+            """ Consumes messages from the work queue until the client is closed.
+            """
+            kvdb = self.kvdb.copy()
+            kvdb.init()
+
+            last_heartbeat = 0
+
+            while self.keep_consuming:
+                try:
+
+                    # Confirm that we are still alive and take over messages of consumers that are not
+                    if now_time() - last_heartbeat > WORK_QUEUE_HEARTBEAT_INTERVAL:
+                        self.on_queue_heartbeat(kvdb.conn)
+                        last_heartbeat = now_time()
+
+                    data = kvdb.conn.brpoplpush(WORK_QUEUE_KEY, self.queue_processing_key, WORK_QUEUE_POP_TIMEOUT)
+
+                    if data:
+                        self.on_queue_message(kvdb.conn, data)
+
+                except Exception:
+                    if self.keep_consuming:
+                        logger.warn('Work queue consumer error, will retry after %ss, e:`%s`', WORK_QUEUE_POP_TIMEOUT,
+                            format_exc())
+                        sleep(WORK_QUEUE_POP_TIMEOUT)
+
+        def on_queue_heartbeat(self, conn):
+            """ Confirms that this consumer is alive and moves messages of consumers that are not back to the work queue.
+            """
+            with conn.pipeline() as pipeline:
+                pipeline.set(self.queue_consumer_key, self.name, ex=WORK_QUEUE_HEARTBEAT_TTL)
+                pipeline.sadd(WORK_QUEUE_CONSUMERS_KEY, self.name)
+                pipeline.execute()
+
+            for name in conn.smembers(WORK_QUEUE_CONSUMERS_KEY):
+                if name != self.name and not conn.exists(WORK_QUEUE_CONSUMER_KEY.format(name)):
+
+                    moved, left = self.requeue_messages(conn, name)
+
+                    if moved:
+                        logger.info('Moved %d unacknowledged message(s) of `%s` back to the work queue', moved, name)
+
+                    # Messages still being handled will be visited again during one of the next heartbeats
+                    if left:
+                        logger.info('Left %d message(s) still being handled by `%s` in its processing list', left, name)
+                    else:
+                        conn.srem(WORK_QUEUE_CONSUMERS_KEY, name)
+
+        def requeue_messages(self, conn, name):
+            """ Moves messages of a consumer that is not alive back to the work queue, except for ones that are still claimed.
+            Returns the number of messages moved and of ones left in the consumer's processing list.
+            """
+            processing_key = WORK_QUEUE_PROCESSING_KEY.format(name)
+            moved = left = 0
+
+            # Oldest messages first
+            for data in reversed(conn.lrange(processing_key, 0, -1)):
+                claim_key = WORK_QUEUE_CLAIM_KEY.format(self.get_queue_msg_id(data))
+
+                with conn.pipeline() as pipeline:
+                    try:
+                        # The message is not moved if anyone claims it, or moves it, in the meantime
+                        pipeline.watch(processing_key, claim_key)
+
+                        if pipeline.exists(claim_key):
+                            left += 1
+                            continue
+
+                        pipeline.multi()
+                        pipeline.lrem(processing_key, 1, data)
+                        pipeline.lpush(WORK_QUEUE_KEY, data)
+                        pipeline.execute()
+
+                    except redis.WatchError:
+                        left += 1
+
+                    else:
+                        moved += 1
+
+            return moved, left
+
+        def get_queue_msg_id(self, data, item=None):
+            """ Returns the ID of a work queue message, computing one for messages sent by older clients, which had none.
+            """
+            if item is None:
+                try:
+                    item = loads(data)
+                except Exception:
+                    item = {}
+
+            return item.get('id') or sha1(data).hexdigest()
+
+        def renew_queue_claim(self, conn, claim_key):
+            """ Keeps confirming that a message is still being handled - runs until killed.
+            """
+            while True:
+                sleep(WORK_QUEUE_HEARTBEAT_INTERVAL)
+                try:
+                    conn.expire(claim_key, WORK_QUEUE_HEARTBEAT_TTL)
+                except Exception:
+                    logger.warn('Could not renew work queue claim `%s`, e:`%s`', claim_key, format_exc())
+
+        def on_queue_message(self, conn, data):
+            """ Hands a message consumed from the work queue over to its callback unless it has already expired.
+            """
+            try:
+                item = loads(data)
+            except Exception:
+                logger.warn('Could not parse work queue message `%r`, e:`%s`', data, format_exc())
+                conn.lrem(self.queue_processing_key, 1, data)
+            else:
+                if item['expires_at'] < now_time():
+                    logger.info('Dropping expired work queue message `%s`', item['msg'])
+                    conn.lrem(self.queue_processing_key, 1, data)
+                else:
+                    spawn(self.on_queue_payload, conn, data, item)
+
+        def on_queue_payload(self, conn, data, item):
+            """ Claims the message, invokes the callback and acknowledges the message, i.e. removes it
+            from this consumer's processing list.
+            """
+            payload = Bunch(item['msg'])
+            claim_key = WORK_QUEUE_CLAIM_KEY.format(self.get_queue_msg_id(data, item))
+
+            if has_debug:
+                logger.debug('Got work queue payload `%s`', payload)
+
+            # The message was moved back to the work queue while another consumer, or this one, was still handling it
+            if not conn.set(claim_key, self.name, ex=WORK_QUEUE_HEARTBEAT_TTL, nx=True):
+                logger.info('Dropping work queue message `%s` already claimed by `%s`', payload, conn.get(claim_key))
+                conn.lrem(self.queue_processing_key, 1, data)
+                return
+
+            renew_claim = spawn(self.renew_queue_claim, conn, claim_key)
+
+            try:
+                self.topic_callbacks[WORK_QUEUE_TOPIC](payload)
+            except Exception:
+                logger.warn('Could not handle work queue message `%s`, e:`%s`', payload, format_exc())
+            finally:
+                renew_claim.kill(block=False)
 
-                self.pub_client.publish(topic, broker_msg)
+                # The claim is kept until the message expires, so that if it was moved back to the work queue
+                # in the meantime, it will not be handled again by anyone.
+                conn.expireat(claim_key, int(item['expires_at']) + 1)
+                conn.lrem(self.queue_processing_key, 1, data)
 
         def on_message(self, msg):
             if has_debug:
@@ -215,11 +407,12 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                         logger.debug('No payload in msg: `%s`', msg)
 
         def close(self):
+            self.keep_consuming = False
             for client in(self.pub_client, self.sub_client):
                 client.keep_running = False
                 client.kvdb.close()
 
-    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
+    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, invoke_async_queue)
     start_new_thread(client.run, ())
 
     return client
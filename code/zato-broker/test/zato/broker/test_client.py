@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import deque
+from time import time
+from unittest import TestCase
+
+# anyjson
+from anyjson import dumps, loads
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import Mock, patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.broker.client import BrokerClient, WORK_QUEUE_CLAIM_KEY, WORK_QUEUE_CONSUMER_KEY, WORK_QUEUE_CONSUMERS_KEY, \
+     WORK_QUEUE_KEY, WORK_QUEUE_PROCESSING_KEY, WORK_QUEUE_TOPIC
+
+# ################################################################################################################################
+
+class _Redis(object):
+    """ Stands in for a Redis connection, implementing only the commands that the work queue uses.
+    """
+    def __init__(self):
+        self.lists = {}
+        self.sets = {}
+        self.keys = {}
+        self.expire_at = {}
+
+    def _list(self, key):
+        return self.lists.setdefault(key, deque())
+
+    def lpush(self, key, value):
+        self._list(key).appendleft(value)
+
+    def rpoplpush(self, src, dst):
+        src = self._list(src)
+        if src:
+            value = src.pop()
+            self._list(dst).appendleft(value)
+            return value
+
+    def lrange(self, key, start, stop):
+        return list(self._list(key))
+
+    def lrem(self, key, count, value):
+        if value in self._list(key):
+            self._list(key).remove(value)
+            return 1
+        return 0
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def get(self, key):
+        return self.keys.get(key)
+
+    def exists(self, key):
+        return key in self.keys
+
+    def expire(self, key, time):
+        pass
+
+    def expireat(self, key, when):
+        self.expire_at[key] = when
+
+    def sadd(self, key, value):
+        self.sets.setdefault(key, set()).add(value)
+
+    def srem(self, key, value):
+        self.sets.setdefault(key, set()).discard(value)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def pipeline(self):
+        return _Pipeline(self)
+
+# ################################################################################################################################
+
+class _Pipeline(object):
+    """ Runs commands immediately rather than when the pipeline is executed, which is enough for tests.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def watch(self, *keys):
+        pass
+
+    def multi(self):
+        pass
+
+    def execute(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+# ################################################################################################################################
+
+class WorkQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.conn = _Redis()
+        self.payloads = []
+        self.callback_error = None
+
+        # Threads are not started because only methods that the consumer thread calls are tested
+        with patch('thread.start_new_thread'):
+            self.client = BrokerClient(Bunch(conn=self.conn, decrypt_func=None), 'test',
+                {WORK_QUEUE_TOPIC: self.callback}, {}, True)
+
+        self.processing = self.conn._list(self.client.queue_processing_key)
+
+    def callback(self, payload):
+        self.payloads.append(payload)
+        if self.callback_error:
+            raise self.callback_error
+
+    def get_data(self, expires_in=60, msg_id='id1', **msg):
+        return dumps({'id': msg_id, 'expires_at': time() + expires_in, 'msg': msg})
+
+    def spawn(self, func, *args):
+        """ Invokes the callback in the current greenlet and does not start renewing claims.
+        """
+        if func.__name__ == 'on_queue_payload':
+            func(*args)
+        return Mock()
+
+    def consume(self, data):
+        """ Does what the consumer thread does with each message.
+        """
+        self.conn.lpush(WORK_QUEUE_KEY, data)
+        data = self.conn.rpoplpush(WORK_QUEUE_KEY, self.client.queue_processing_key)
+
+        with patch('zato.broker.client.spawn', self.spawn):
+            self.client.on_queue_message(self.conn, data)
+
+# ################################################################################################################################
+
+    def test_on_queue_message(self):
+        data = self.get_data(action='abc')
+        self.consume(data)
+
+        eq_(self.payloads, [{'action': 'abc'}])
+        eq_(list(self.processing), [])
+
+        # The message is claimed until it expires ..
+        claim_key = WORK_QUEUE_CLAIM_KEY.format('id1')
+        eq_(self.conn.get(claim_key), self.client.name)
+        eq_(self.conn.expire_at[claim_key], int(loads(data)['expires_at']) + 1)
+
+        # .. so if it was put back in the work queue in the meantime, it is not handled again.
+        self.consume(data)
+
+        eq_(self.payloads, [{'action': 'abc'}])
+        eq_(list(self.processing), [])
+
+    def test_on_queue_message_claimed(self):
+
+        # Another consumer is still handling the message
+        self.conn.set(WORK_QUEUE_CLAIM_KEY.format('id1'), 'other')
+        self.consume(self.get_data(action='abc'))
+
+        eq_(self.payloads, [])
+        eq_(list(self.processing), [])
+        eq_(self.conn.get(WORK_QUEUE_CLAIM_KEY.format('id1')), 'other')
+
+    def test_on_queue_message_expired(self):
+        self.consume(self.get_data(-1, action='abc'))
+
+        # Dropped without invoking the callback but still acknowledged
+        eq_(self.payloads, [])
+        eq_(list(self.processing), [])
+
+    def test_on_queue_message_unparseable(self):
+        self.consume(b'{not-json')
+
+        eq_(self.payloads, [])
+        eq_(list(self.processing), [])
+
+    def test_on_queue_payload_callback_error(self):
+        self.callback_error = ValueError('Cannot handle message')
+        self.consume(self.get_data(action='abc'))
+
+        # Acknowledged even though the callback raised an exception - it will not be handed out again
+        eq_(self.payloads, [{'action': 'abc'}])
+        eq_(list(self.processing), [])
+        eq_(list(self.conn._list(WORK_QUEUE_KEY)), [])
+
+# ################################################################################################################################
+
+    def test_on_queue_heartbeat(self):
+
+        # One consumer stopped confirming that it is alive while there were still messages in its processing list ..
+        self.conn.sadd(WORK_QUEUE_CONSUMERS_KEY, 'dead')
+        self.conn.lpush(WORK_QUEUE_PROCESSING_KEY.format('dead'), 'msg1')
+        self.conn.lpush(WORK_QUEUE_PROCESSING_KEY.format('dead'), 'msg2')
+
+        # .. whereas another one is alive.
+        self.conn.sadd(WORK_QUEUE_CONSUMERS_KEY, 'alive')
+        self.conn.set(WORK_QUEUE_CONSUMER_KEY.format('alive'), 'alive')
+        self.conn.lpush(WORK_QUEUE_PROCESSING_KEY.format('alive'), 'msg3')
+
+        self.client.on_queue_heartbeat(self.conn)
+
+        # This consumer confirmed that it is alive ..
+        self.assertTrue(self.conn.exists(self.client.queue_consumer_key))
+        eq_(self.conn.smembers(WORK_QUEUE_CONSUMERS_KEY), set([self.client.name, 'alive']))
+
+        # .. and messages of the dead consumer are back in the work queue, in the same order as they were originally sent ..
+        eq_(list(self.conn._list(WORK_QUEUE_KEY)), ['msg2', 'msg1'])
+        eq_(list(self.conn._list(WORK_QUEUE_PROCESSING_KEY.format('dead'))), [])
+
+        # .. while these of the live one are left as they were.
+        eq_(list(self.conn._list(WORK_QUEUE_PROCESSING_KEY.format('alive'))), ['msg3'])
+
+    def test_on_queue_heartbeat_claimed(self):
+
+        data1 = self.get_data(msg_id='id1', action='abc')
+        data2 = self.get_data(msg_id='id2', action='abc')
+
+        # This consumer stopped confirming that it is alive but it is still handling one of its messages
+        self.conn.sadd(WORK_QUEUE_CONSUMERS_KEY, 'slow')
+        self.conn.lpush(WORK_QUEUE_PROCESSING_KEY.format('slow'), data1)
+        self.conn.lpush(WORK_QUEUE_PROCESSING_KEY.format('slow'), data2)
+        self.conn.set(WORK_QUEUE_CLAIM_KEY.format('id1'), 'slow')
+
+        self.client.on_queue_heartbeat(self.conn)
+
+        # Only the message not claimed is moved back to the work queue ..
+        eq_(list(self.conn._list(WORK_QUEUE_KEY)), [data2])
+        eq_(list(self.conn._list(WORK_QUEUE_PROCESSING_KEY.format('slow'))), [data1])
+
+        # .. and the consumer will be visited again to check if the other one is still claimed.
+        self.assertIn('slow', self.conn.smembers(WORK_QUEUE_CONSUMERS_KEY))
+
+# ################################################################################################################################
@@ -933,11 +933,13 @@ class Create(ZatoCommand):
         impl_name1 = 'zato.server.service.internal.pubsub.pubapi.TopicService'
         impl_name2 = 'zato.server.service.internal.pubsub.pubapi.SubscribeService'
         impl_name3 = 'zato.server.service.internal.pubsub.pubapi.MessageService'
+        impl_name4 = 'zato.server.service.internal.pubsub.pubapi.PublishManyService'
         impl_demo = 'zato.server.service.internal.helpers.JSONRawRequestLogger'
 
         service_topic = Service(None, 'zato.pubsub.pubapi.topic-service', True, impl_name1, True, cluster)
         service_sub = Service(None, 'zato.pubsub.pubapi.subscribe-service', True, impl_name2, True, cluster)
         service_msg = Service(None, 'zato.pubsub.pubapi.message-service', True, impl_name3, True, cluster)
+        service_publish_many = Service(None, 'zato.pubsub.pubapi.publish-many-service', True, impl_name4, True, cluster)
         service_demo = Service(None, 'zato.pubsub.helpers.json-raw-request-logger', True, impl_demo, True, cluster)
 
         # Opaque data that lets clients use topic contain slash characters
@@ -958,6 +960,11 @@ class Create(ZatoCommand):
             None, '', None, DATA_FORMAT.JSON, security=None, service=service_msg, opaque=opaque,
             cluster=cluster)
 
+        chan_publish_many = HTTPSOAP(None, 'zato.pubsub.publish', True, True, CONNECTION.CHANNEL,
+            URL_TYPE.PLAIN_HTTP, None, '/zato/pubsub/publish',
+            None, '', None, DATA_FORMAT.JSON, security=None, service=service_publish_many,
+            cluster=cluster)
+
         chan_demo = HTTPSOAP(None, 'pubsub.demo.sample.channel', True, True, CONNECTION.CHANNEL,
             URL_TYPE.PLAIN_HTTP, None, '/zato/pubsub/zato.demo.sample',
             None, '', None, DATA_FORMAT.JSON, security=sec_demo, service=service_demo, opaque=opaque,
@@ -1016,10 +1023,12 @@ class Create(ZatoCommand):
         session.add(service_topic)
         session.add(service_sub)
         session.add(service_msg)
+        session.add(service_publish_many)
 
         session.add(chan_topic)
         session.add(chan_sub)
         session.add(chan_msg)
+        session.add(chan_publish_many)
 
         session.add(chan_demo)
         session.add(outconn_demo)
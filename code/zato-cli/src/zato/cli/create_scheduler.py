@@ -58,6 +58,7 @@ redis_sentinels=
 redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
+invoke_async_queue=True
 
 [secret_keys]
 key1={secret_key1}
@@ -127,18 +127,27 @@ http_server_header=Zato
 zeromq_connect_sleep=0.1
 aws_host=
 use_soap_envelope=True
-fifo_response_buffer_size=0.2 # In MB
 jwt_secret=zato+secret://zato.server_conf.misc.jwt_secret
 enforce_service_invokes=False
 return_tracebacks=True
 default_error_message="An error has occurred"
 startup_callable=
+url_match_cache_size=10000 # How many URL paths matched by channels with path parameters to keep, 0 = disabled
+http_cache_memo_size=1000 # How many ready-to-send responses from channel caches each worker keeps, 0 = disabled
+http_cache_coalesce_timeout=10 # In seconds, how long requests wait for a response to the same request that is still being computed
+http_cache_stale_while_revalidate=False # Whether to serve previously cached responses while new ones are still being computed
+gzip_min_size=1024 # In bytes, responses from channels using gzip smaller than that are sent uncompressed
+gzip_level=6 # From 1 (fastest) to 9 (best compression)
+gzip_chunk_size=262144 # In bytes, responses larger than that are compressed and sent in chunks of that size
+config_snapshot_timeout=120 # In seconds, for how long workers may use configuration read by the first one, 0 = each worker reads its own
+config_snapshot_wait_timeout=30 # In seconds, how long workers wait for the first one to read configuration before they read it themselves
 
 [ibm_mq]
 ipc_tcp_start_port=34567
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+flush_interval=5 # In seconds, how often each worker stores statistics collected in RAM in KVDB
 
 [kvdb]
 host={{kvdb_host}}
@@ -155,6 +164,9 @@ redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
 
+[broker]
+invoke_async_queue=True # If True, each invoke_async message is consumed off a work queue by one server instead of being published to all
+
 [startup_services_first_worker]
 zato.helpers.input-logger=Sample payload for a startup service (first worker)
 zato.notif.init-notifiers=
@@ -222,6 +234,7 @@ log_if_wsx_deliv_server_not_found=False
 data_prefix_len=2048
 data_prefix_short_len=64
 sk_server_table_columns=6, 15, 8, 6, 17, 80
+sync_batch_window=5 # In milliseconds, how long to wait for more messages before notifying delivery tasks of new ones
 
 [pubsub_meta_topic]
 enabled=True
@@ -242,6 +255,14 @@ data_len=0
 [wsx]
 hook_service=
 
+[cache]
+sync_batch_window=5 # In milliseconds, 0 = each change is published to other workers separately
+sync_batch_max_ops=500
+
+[jwt]
+verified_cache_ttl=30 # In seconds, how long a verified token is accepted without looking it up in KVDB, 0 = disabled
+renew_interval=5 # In seconds, how often expiration of tokens used in the meantime is renewed, 0 = on each request
+
 [content_type]
 json = {JSON}
 plain_xml = {PLAIN_XML}
@@ -355,6 +376,8 @@ name=
 [hash_secret]
 rounds=100000
 salt_size=64 # In bytes = 512 bits
+pool_size=2 # Threads hashing secrets in each worker, 0 = hash in the worker's own thread, blocking other requests
+pool_max_queued=100 # Requests to hash secrets waiting for a thread above that are rejected
 
 [apps]
 all=CRM
@@ -373,6 +396,10 @@ inform_if_not_approved=True
 
 [session]
 expiry=60 # In minutes
+cache_ttl=10 # In seconds, for how long each worker may use sessions without reading them from SQL, 0 = disabled
+# Sessions invalidated while KVDB cannot be reached may still be accepted by workers for up to cache_ttl seconds
+cache_max_size=10000 # How many sessions each worker may keep in its cache
+renew_flush_interval=2 # In seconds, how often renewed expiration times of cached sessions are saved in SQL
 
 [password]
 expiry=730 # In days, 365 days * 2 years = 730 days
@@ -10,13 +10,17 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import os
+from json import dumps
+from traceback import format_exc
 
 # Bunch
 from bunch import Bunch
 
 # Zato
 from zato.cli import ZatoCommand, common_odb_opts
+from zato.common.broker_message import MESSAGE_TYPE, TOPICS
 from zato.common.crypto import CryptoManager
+from zato.common.kvdb import KVDB
 from zato.common.odb.model.sso import _SSOAttr, _SSOSession, _SSOUser, Base as SSOModelBase
 from zato.common.util import asbool, get_config, current_host
 from zato.sso import ValidationError
@@ -55,8 +59,27 @@ class SSOCommand(ZatoCommand):
         def _hash_secret(_secret):
             return crypto_manager.hash_secret(_secret, 'sso.super-user')
 
-        return UserAPI(None, sso_conf, _get_session, crypto_manager.encrypt, crypto_manager.decrypt, _hash_secret, None,
+        def _publish_broker_msg(msg):
+
+            # There is no broker client in CLI so messages are published directly to KVDB,
+            # on the same topic that servers' broker clients subscribe to.
+            try:
+                kvdb = KVDB(None, Bunch(dict(server_conf.kvdb.items())), crypto_manager.decrypt)
+                kvdb.init()
+                try:
+                    msg['msg_type'] = MESSAGE_TYPE.TO_PARALLEL_ALL
+                    kvdb.conn.publish(TOPICS[MESSAGE_TYPE.TO_PARALLEL_ALL], dumps(msg))
+                finally:
+                    kvdb.close()
+            except Exception:
+                self.logger.warn('Could not publish broker message `%s`, servers may still use cached SSO sessions '
+                    'for up to sso.conf\'s session.cache_ttl seconds, e:`%s`', msg, format_exc())
+
+        user_api = UserAPI(None, sso_conf, _get_session, crypto_manager.encrypt, crypto_manager.decrypt, _hash_secret, None,
             new_user_id)
+        user_api.set_broker_publish_func(_publish_broker_msg)
+
+        return user_api
 
 # ################################################################################################################################
 
@@ -193,7 +216,7 @@ class UnlockUser(SSOCommand):
     ]
 
     def _on_sso_command(self, args, user, user_api):
-        user_api.lock_user_cli(user.user_id)
+        user_api.unlock_user_cli(user.user_id)
         self.logger.info('Unlocked user account `%s`', args.username)
 
 # ################################################################################################################################
@@ -454,9 +454,14 @@ class CACHE:
         SET_CONTAINS_ANY = 'SET_CONTAINS_ANY'
 
 
+    class ENGINE:
+        LINKED = 'linked' # A doubly linked list, O(1) for all operations
+        LIST = 'list'     # A Python list, O(n) for all operations
+
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 1000 # In characters for string/unicode, bytes otherwise
+        ENGINE = 'linked'
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -508,6 +513,8 @@ class KVDB(Attrs):
     SERVICE_TIME_BASIC = 'zato:stats:service:time:basic:'
     SERVICE_TIME_RAW = 'zato:stats:service:time:raw:'
     SERVICE_TIME_RAW_BY_MINUTE = 'zato:stats:service:time:raw-by-minute:'
+    SERVICE_TIME_HISTOGRAM = 'zato:stats:service:time:histogram:'
+    SERVICE_TIME_HISTOGRAM_BY_MINUTE = 'zato:stats:service:time:histogram-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_MINUTE = 'zato:stats:service:time:aggr-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_HOUR = 'zato:stats:service:time:aggr-by-hour:'
     SERVICE_TIME_AGGREGATED_BY_DAY = 'zato:stats:service:time:aggr-by-day:'
@@ -630,6 +637,17 @@ class BROKER:
 
 class MISC:
     DEFAULT_HTTP_TIMEOUT=10
+    DEFAULT_URL_MATCH_CACHE_SIZE = 10000
+    DEFAULT_HTTP_CACHE_MEMO_SIZE = 1000
+    DEFAULT_HTTP_CACHE_COALESCE_TIMEOUT = 10
+    DEFAULT_GZIP_MIN_SIZE = 1024
+    DEFAULT_GZIP_LEVEL = 6
+    DEFAULT_GZIP_CHUNK_SIZE = 262144
+    DEFAULT_CONFIG_SNAPSHOT_TIMEOUT = 120
+    DEFAULT_CONFIG_SNAPSHOT_WAIT_TIMEOUT = 30
+    DEFAULT_WORKER_PIDS_TTL = 10 # In seconds
+    DEFAULT_HASH_POOL_SIZE = 2
+    DEFAULT_HASH_POOL_MAX_QUEUED = 100
     OAUTH_SIG_METHODS = ['HMAC-SHA1', 'PLAINTEXT']
     PIDFILE = 'pidfile'
     SEPARATOR = ':::'
@@ -769,6 +787,8 @@ class PUBSUB:
         TOPIC_MAX_DEPTH_GD = 10000
         TOPIC_MAX_DEPTH_NON_GD = 1000
         DEPTH_CHECK_FREQ = 100
+        GD_DEPTH_RECOUNT_CHECKS = 10 # A topic's GD depth kept in RAM is counted anew in SQL every that many depth checks ..
+        GD_DEPTH_RECOUNT_INTERVAL = 60 # .. or once in that many seconds, whichever comes first
         EXPIRATION = 2147483647 * 1000 # (2 ** 31 - 1) * 1000 milliseconds = around 70 years
         GET_BATCH_SIZE = 50
         DELIVERY_BATCH_SIZE = 15000
@@ -1013,6 +1033,9 @@ class IPC:
         FAILURE = 'zf'
         LENGTH = 2 # Length of either success or failure messages
 
+    class DEFAULT:
+        SEND_TIMEOUT = 5000 # In milliseconds, how long a request may wait until there is room for it in a queue to a process
+
     class CONNECTOR:
         class IBM_MQ:
             USERNAME = 'zato.connector.wmq'
@@ -1023,6 +1046,12 @@ class WEB_SOCKET:
         TOKEN_TTL = 3600
         FQDN_UNKNOWN = '(Unknown)'
         INTERACT_UPDATE_INTERVAL = 60 # 60 minutes = 1 hour
+        PING_INTERVAL = 30 # In seconds
+        PING_BUCKETS = 30 # Connections are pinged in that many groups spread evenly across PING_INTERVAL
+        PING_BATCH_SIZE = 500 # Other greenlets run in between pinging each that many connections
+        PING_RTT_SAMPLES = 1000 # How many most recent ping round-trip times to compute percentiles from
+        PING_SEND_TIMEOUT = 5 # A connection whose ping cannot be sent in that many seconds is closed
+        PING_MAX_SENDING = 100 # At most that many pings are being sent at a time
 
     class PATTERN:
         BY_EXT_ID = 'zato.by-ext-id.{}'
@@ -136,6 +136,8 @@ class SECURITY(Constants):
     TLS_KEY_CERT_EDIT = ValueConstant('')
     TLS_KEY_CERT_DELETE = ValueConstant('')
 
+    JWT_TOKEN_DELETE = ValueConstant('')
+
 class DEFINITION(Constants):
     code_start = 100600
 
@@ -473,6 +475,8 @@ class CACHE(Constants):
     MEMCACHED_EDIT = ValueConstant('')
     MEMCACHED_DELETE = ValueConstant('')
 
+    BUILTIN_STATE_CHANGED_BATCH = ValueConstant('')
+
 class SERVER_STATUS(Constants):
     code_start = 106800
 
@@ -486,6 +490,11 @@ class GENERIC(Constants):
     CONNECTION_DELETE = ValueConstant('')
     CONNECTION_CHANGE_PASSWORD = ValueConstant('')
 
+class SSO(Constants):
+    code_start = 107200
+
+    SESSION_INVALIDATE = ValueConstant('')
+
 code_to_name = {}
 
 # To prevent 'RuntimeError: dictionary changed size during iteration'
@@ -9,27 +9,23 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import errno
 import logging
-import os
-import stat
-import tempfile
-from cStringIO import StringIO
-from datetime import datetime, timedelta
-from fcntl import fcntl
 from traceback import format_exc
-from uuid import uuid4
 
 # gevent
-from gevent import sleep
+from gevent import Timeout
+from gevent.event import AsyncResult
 
 # pyrapidjson
 from rapidjson import loads
 
+# ZeroMQ
+import zmq.green as zmq
+
 # Zato
 from zato.common import IPC
-from zato.common.ipc.publisher import Publisher
-from zato.common.ipc.subscriber import Subscriber
+from zato.common.ipc.client import Client
+from zato.common.ipc.server import Server
 from zato.common.util import fs_safe_name, spawn_greenlet
 
 # ################################################################################################################################
@@ -38,14 +34,6 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
-fifo_create_mode = stat.S_IRUSR | stat.S_IWUSR
-fifo_ignore_err = errno.EAGAIN, errno.EWOULDBLOCK
-
-# On Linux, this is F_LINUX_SPECIFIC_BASE (1024) + 7
-_F_SETPIPE_SZ = 1031
-
-# ################################################################################################################################
-
 class IPCAPI(object):
     """ API through which IPC is performed.
     """
@@ -53,8 +41,9 @@ class IPCAPI(object):
         self.name = name
         self.on_message_callback = on_message_callback
         self.pid = pid
-        self.pid_publishers = {} # Target PID -> Publisher object connected to that target PID's subscriber socket
-        self.subscriber = None
+        self.pid_clients = {} # Target PID -> Client object connected to that target PID's server socket
+        self.pid_clients_pending = {} # Target PID -> AsyncResult set once a Client for that PID is created
+        self.server = None
 
 # ################################################################################################################################
 
@@ -65,124 +54,122 @@ class IPCAPI(object):
 # ################################################################################################################################
 
     def run(self):
-        self.subscriber = Subscriber(self.on_message_callback, self.name, self.pid)
-        spawn_greenlet(self.subscriber.serve_forever)
+        self.server = Server(self.on_message_callback, self.name, self.pid)
+        spawn_greenlet(self.server.serve_forever)
 
 # ################################################################################################################################
 
     def close(self):
-        if self.subscriber:
-            self.subscriber.close()
-        for publisher in self.pid_publishers.values():
-            publisher.close()
-
-# ################################################################################################################################
-
-    def publish(self, payload):
-        self.publisher.publish(payload)
+        if self.server:
+            self.server.close()
+        for client in self.pid_clients.values():
+            client.close()
 
 # ################################################################################################################################
 
-    def _get_pid_publisher(self, cluster_name, server_name, target_pid):
+    def _get_pid_client(self, cluster_name, server_name, target_pid):
 
-        # We do no have a publisher connected to that PID, so we need to create it ..
-        if target_pid not in self.pid_publishers:
+        # We already have a client connected to that PID ..
+        client = self.pid_clients.get(target_pid)
+        if client:
+            return client
 
-            # Create a publisher and sleep for a moment until it connects to the other socket
-            publisher = Publisher(self.get_endpoint_name(cluster_name, server_name, target_pid), self.pid)
+        # .. or another greenlet is creating it, in which case we wait until it is ready ..
+        pending = self.pid_clients_pending.get(target_pid)
+        if pending:
+            return pending.get()
 
-            # We can tolerate it because it happens only the very first time our PID invokes target_pid
-            sleep(0.1)
+        # .. otherwise, we need to create it ourselves. Creating a client may yield to other greenlets,
+        # so the PID is reserved before that, or else each concurrent caller would create its own client.
+        pending = self.pid_clients_pending[target_pid] = AsyncResult()
 
-            # We can now store it for later use
-            self.pid_publishers[target_pid] = publisher
-
-        # At this point we are sure we have a publisher for target PID
-        return self.pid_publishers[target_pid]
+        try:
+            # There is no need to wait until it connects because requests are queued up until it does ..
+            client = Client(self.get_endpoint_name(cluster_name, server_name, target_pid), self.pid)
+        except Exception, e:
+            pending.set_exception(e)
+            raise
+        else:
+            # .. and the connection is kept for all subsequent requests to that PID.
+            self.pid_clients[target_pid] = client
+            pending.set(client)
+            return client
+        finally:
+            del self.pid_clients_pending[target_pid]
 
 # ################################################################################################################################
 
-    def _get_response(self, fifo, buffer_size, read_size=21, fifo_ignore_err=fifo_ignore_err, empty=('', None)):
-
-        try:
-            buff = StringIO()
-            data = object() # Use a sentinel because '' or None are expected from os.read
+    def remove_pid_client(self, target_pid, client=None):
+        """ Closes and forgets a client connected to a given PID, if there is one. If client is given,
+        it is removed only if it is still the current one for that PID.
+        """
+        if client and self.pid_clients.get(target_pid) is not client:
+            return
 
-            # The most common use-case for IPC are publish/subscribe messages and the most
-            # common response is this: 'zs;{"r": {"r": null}}'
-            # which is 21 bytes.
+        client = self.pid_clients.pop(target_pid, None)
+        if client:
+            client.close()
 
-            while data not in empty:
-                data = os.read(fifo, read_size)
-                buff.write(data)
+# ################################################################################################################################
 
-            response = buff.getvalue()
+    def remove_stale_pid_clients(self, pids):
+        """ Closes clients connected to PIDs other than the ones given on input, i.e. to processes that no longer exist.
+        """
+        for target_pid in list(self.pid_clients):
+            if target_pid not in pids:
+                logger.info('Closing IPC client to PID `%s` which is not among current PIDs `%s`', target_pid, pids)
+                self.remove_pid_client(target_pid)
 
-            status = response[:IPC.STATUS.LENGTH]
-            response = response[IPC.STATUS.LENGTH+1:] # Add 1 to account for the separator
-            is_success = status == IPC.STATUS.SUCCESS
+# ################################################################################################################################
 
-            if is_success:
-                response = loads(response) if response else ''
+    def _parse_response(self, response):
 
-            buff.close()
+        status = response[:IPC.STATUS.LENGTH]
+        response = response[IPC.STATUS.LENGTH+1:] # Add 1 to account for the separator
+        is_success = status == IPC.STATUS.SUCCESS
 
-            return is_success, response
+        if is_success:
+            response = loads(response) if response else ''
 
-        except OSError, e:
-            if e.errno not in fifo_ignore_err:
-                raise
+        return is_success, response
 
 # ################################################################################################################################
 
-    def invoke_by_pid(self, service, payload, cluster_name, server_name, target_pid,
-        fifo_response_buffer_size, timeout=90, is_async=False):
+    def invoke_by_pid(self, service, payload, cluster_name, server_name, target_pid, timeout=90, is_async=False):
         """ Invokes a service through IPC, synchronously or in background. If target_pid is an exact PID then this one worker
         process will be invoked if it exists at all.
         """
-        # Create a FIFO pipe to receive replies to come through
-        fifo_path = os.path.join(tempfile.tempdir, 'zato-ipc-fifo-{}'.format(uuid4().hex))
-        os.mkfifo(fifo_path, fifo_create_mode)
-
         try:
-            publisher = self._get_pid_publisher(cluster_name, server_name, target_pid)
-            publisher.publish(payload, service, target_pid, reply_to_fifo=fifo_path)
+            client = self._get_pid_client(cluster_name, server_name, target_pid)
+
+            try:
+                request_id, result = client.send(payload, service, target_pid, needs_response=not is_async)
+
+            # The queue to that PID is full, most likely because the process is no longer there
+            except zmq.Again:
+                logger.warn('IPC request to `%s` could not be sent to PID `%s` in %sms, closing its client',
+                    service, target_pid, IPC.DEFAULT.SEND_TIMEOUT)
+                self.remove_pid_client(target_pid, client)
+                return
 
             # Async = we do not need to wait for any response
             if is_async:
                 return
 
-            is_success, response = False, None
-
             try:
+                return self._parse_response(result.get(timeout=timeout))
+            except Timeout:
+                client.forget(request_id)
+                logger.warn('IPC response to `%s` (%s) not received from PID `%s` in %ss', service, request_id, target_pid, timeout)
 
-                # Open the pipe for reading ..
-                fifo_fd = os.open(fifo_path, os.O_RDONLY|os.O_NONBLOCK)
-                fcntl(fifo_fd, _F_SETPIPE_SZ, 1000000)
-
-                # .. and wait for response ..
-                now = datetime.utcnow()
-                until = now + timedelta(seconds=timeout)
-
-                while now < until:
-                    sleep(0.05)
-                    is_success, response = self._get_response(fifo_fd, fifo_response_buffer_size)
-                    if response:
-                        break
-                    else:
-                        now = datetime.utcnow()
+                # The process may not exist anymore, in which case there is no point in keeping its client. If it does,
+                # a new client will be created on next request, but the ones still waiting for responses are not affected.
+                if not client.pending:
+                    self.remove_pid_client(target_pid, client)
 
-            except Exception:
-                logger.warn('Exception in IPC FIFO, e:`%s`', format_exc())
-
-            finally:
-                os.close(fifo_fd)
-
-            return is_success, response
+                return False, None
 
         except Exception, e:
             logger.warn(format_exc(e))
-        finally:
-            os.remove(fifo_path)
 
 # ################################################################################################################################
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from errno import ENOTSOCK
+from traceback import format_exc
+
+# gevent
+from gevent.event import AsyncResult
+from gevent.lock import RLock
+
+# ZeroMQ
+import zmq.green as zmq
+
+# Zato
+from zato.common import IPC
+from zato.common.ipc import IPCEndpoint, Request
+from zato.common.util import spawn_greenlet
+
+# ################################################################################################################################
+
+class Client(IPCEndpoint):
+    """ A long-lived connection to one worker process' IPC server. Any number of requests may be in flight at a time,
+    each response is matched to its request by request_id and delivered to an AsyncResult the caller waits on.
+    """
+    socket_method = 'connect'
+    socket_type = 'dealer'
+
+    def __init__(self, *args, **kwargs):
+        self.pending = {} # Request ID -> AsyncResult waiting for a response to that request
+        self.send_lock = RLock()
+        super(Client, self).__init__(*args, **kwargs)
+        spawn_greenlet(self.read_responses)
+
+# ################################################################################################################################
+
+    def set_up_sockets(self):
+        super(Client, self).set_up_sockets()
+
+        # Once the queue to a process that does not read from it is full, e.g. because the process no longer exists,
+        # sending would block indefinitely, so a zmq.Again is raised instead.
+        self.socket.setsockopt(zmq.SNDTIMEO, IPC.DEFAULT.SEND_TIMEOUT)
+
+# ################################################################################################################################
+
+    def send(self, payload, service='', target_pid=None, action=IPC.ACTION.INVOKE_SERVICE, needs_response=True):
+        """ Sends a request to the server and returns an AsyncResult that will receive the response,
+        or None if no response is needed.
+        """
+        request = Request(self.name, self.pid)
+
+        request.payload = payload
+        request.service = service
+        request.action = action
+        request.target_pid = target_pid
+        request.needs_response = needs_response
+
+        result = None
+
+        if needs_response:
+            result = self.pending[request.request_id] = AsyncResult()
+
+        try:
+            with self.send_lock:
+                self.socket.send_pyobj(request)
+        except Exception:
+            self.pending.pop(request.request_id, None)
+            raise
+
+        return request.request_id, result
+
+# ################################################################################################################################
+
+    def forget(self, request_id):
+        """ Stops waiting for a response to a given request, e.g. because it timed out.
+        """
+        self.pending.pop(request_id, None)
+
+# ################################################################################################################################
+
+    def read_responses(self):
+
+        while self.keep_running:
+            try:
+                request_id, data = self.socket.recv_multipart()
+
+                result = self.pending.pop(request_id, None)
+                if result:
+                    result.set(data)
+                else:
+                    self.logger.info('Ignoring IPC response to an unknown or expired request `%s`', request_id)
+
+            except zmq.ZMQError as e:
+                if e.errno == ENOTSOCK:
+                    self.logger.debug('Stopping IPC socket `%s` (ENOTSOCK)', self.name)
+                    self.keep_running = False
+            except Exception:
+                self.logger.warn('Error in IPC client, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def close(self):
+
+        # Wake up everyone still waiting for a response
+        for result in self.pending.values():
+            result.set_exception(Exception('IPC client `{}` closed'.format(self.address)))
+        self.pending.clear()
+
+        super(Client, self).close()
+
+# ################################################################################################################################
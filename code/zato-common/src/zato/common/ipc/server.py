@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from cPickle import loads
+from errno import ENOTSOCK
+from traceback import format_exc
+
+# gevent
+from gevent import spawn
+from gevent.lock import RLock
+
+# ZeroMQ
+import zmq.green as zmq
+
+# Zato
+from zato.common.ipc import IPCEndpoint, Request
+
+# This is needed so that unpickling of requests works
+Request = Request
+
+# ################################################################################################################################
+
+class Server(IPCEndpoint):
+    """ Accepts IPC requests from clients in other worker processes. Each request is handled in its own greenlet
+    and its response, as returned by on_message_callback, is sent back to the client the request came from.
+    """
+    socket_method = 'bind'
+    socket_type = 'router'
+
+    def __init__(self, on_message_callback, *args, **kwargs):
+        self.on_message_callback = on_message_callback
+        self.send_lock = RLock()
+        super(Server, self).__init__(*args, **kwargs)
+
+# ################################################################################################################################
+
+    def serve_forever(self):
+
+        while self.keep_running:
+            try:
+                client_id, data = self.socket.recv_multipart()
+                spawn(self.handle_request, client_id, data)
+            except zmq.ZMQError as e:
+                if e.errno == ENOTSOCK:
+                    self.logger.debug('Stopping IPC socket `%s` (ENOTSOCK)', self.name)
+                    self.keep_running = False
+            except Exception:
+                self.logger.warn('Error in IPC server, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def handle_request(self, client_id, data):
+
+        try:
+            request = loads(data)
+            response = self.on_message_callback(request)
+
+            # Asynchronous invocations do not expect any response
+            if request.needs_response:
+                with self.send_lock:
+                    self.socket.send_multipart([client_id, request.request_id.encode('utf8'), response])
+
+        except Exception:
+            self.logger.warn('Could not handle IPC request, e:`%s`', format_exc())
+
+# ################################################################################################################################
@@ -23,7 +23,7 @@ from traceback import format_exc
 from springpython.context import DisposableObject
 
 # SQLAlchemy
-from sqlalchemy import create_engine, event
+from sqlalchemy import bindparam, create_engine, event
 from sqlalchemy.exc import IntegrityError, ProgrammingError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.query import Query
@@ -669,6 +669,150 @@ class ODBManager(SessionWrapper):
             logger.error('Could not add service, name:`%s`, e:`%s`', name, format_exc().decode('utf-8'))
             self._session.rollback()
 
+# ################################################################################################################################
+
+    def _get_services_by_name(self, names, batch_size):
+        """ Returns a dictionary of service names to (service_id, is_active, slow_threshold) tuples for services
+        of this server's cluster, looked up in batches.
+        """
+        out = {}
+
+        for idx in xrange(0, len(names), batch_size):
+            for item in self._session.query(Service.id, Service.name, Service.is_active, Service.slow_threshold).\
+                filter(Service.cluster_id==self.cluster.id).\
+                filter(Service.name.in_(names[idx:idx+batch_size])):
+                out[item.name] = (item.id, item.is_active, item.slow_threshold)
+
+        return out
+
+# ################################################################################################################################
+
+    def _add_services(self, items, deployment_time, batch_size):
+        """ Implements add_services without committing or rolling back the transaction.
+        """
+        service_table = Service.__table__
+        deployed_table = DeployedService.__table__
+
+        out = {}
+
+        # Services whose IDs our caller already knows ..
+        for item in items:
+            if item.service_info:
+                out[item.name] = (item.service_info['id'], item.service_info['is_active'],
+                    item.service_info['slow_threshold'])
+
+        # .. and ones that may need to be inserted first, unless they were already added to the ODB previously.
+        names = list(set(item.name for item in items if not item.service_info))
+
+        if names:
+            existing = self._get_services_by_name(names, batch_size)
+
+            new_services = {}
+            for item in items:
+                if not item.service_info and item.name not in existing and item.name not in new_services:
+                    new_services[item.name] = {
+                        'name': item.name,
+                        'is_active': True,
+                        'impl_name': item.impl_name,
+                        'is_internal': item.is_internal,
+                        'cluster_id': self.cluster.id,
+                    }
+
+            if new_services:
+                new_services = list(new_services.values())
+                for idx in xrange(0, len(new_services), batch_size):
+                    self._session.execute(service_table.insert(), new_services[idx:idx+batch_size])
+
+                existing.update(self._get_services_by_name([elem['name'] for elem in new_services], batch_size))
+
+            out.update(existing)
+
+        # Now, all services have their IDs and we can store information about their deployment on this server,
+        # updating rows from previous deployments and inserting all the other ones.
+        deployed = {}
+        for item in items:
+            deployed[out[item.name][0]] = {
+                'deployment_time': deployment_time,
+                'details': item.details,
+                'source': item.source_info.source,
+                'source_path': item.source_info.path,
+                'source_hash': item.source_info.hash,
+                'source_hash_method': item.source_info.hash_method,
+            }
+
+        service_ids = list(deployed)
+        already_deployed = set()
+
+        for idx in xrange(0, len(service_ids), batch_size):
+            for item in self._session.query(DeployedService.service_id).\
+                filter(DeployedService.server_id==self.server.id).\
+                filter(DeployedService.service_id.in_(service_ids[idx:idx+batch_size])):
+                already_deployed.add(item.service_id)
+
+        to_insert = []
+        to_update = []
+
+        for service_id, values in deployed.items():
+            if service_id in already_deployed:
+                values['b_server_id'] = self.server.id
+                values['b_service_id'] = service_id
+                to_update.append(values)
+            else:
+                values['server_id'] = self.server.id
+                values['service_id'] = service_id
+                to_insert.append(values)
+
+        update_stmt = deployed_table.update().\
+            where(deployed_table.c.server_id==bindparam('b_server_id')).\
+            where(deployed_table.c.service_id==bindparam('b_service_id'))
+
+        for idx in xrange(0, len(to_update), batch_size):
+            self._session.execute(update_stmt, to_update[idx:idx+batch_size])
+
+        for idx in xrange(0, len(to_insert), batch_size):
+            self._session.execute(deployed_table.insert(), to_insert[idx:idx+batch_size])
+
+        return out
+
+# ################################################################################################################################
+
+    def add_services(self, items, deployment_time, batch_size=500, retries=3):
+        """ Adds information about many services and their deployment on this server into the ODB at once. Each item is
+        a Bunch with the same information that add_service expects. Rows are inserted or updated in batches,
+        all within a single transaction. Returns a dictionary of service names to (service_id, is_active, slow_threshold)
+        tuples - services that could not be added are not in the dictionary.
+        """
+        for attempt in xrange(retries):
+            try:
+                out = self._add_services(items, deployment_time, batch_size)
+                self._session.commit()
+                return out
+
+            # Other workers or servers may be adding the same rows concurrently, if so, we try again
+            # and this time the rows they added will be already visible to us.
+            except(IntegrityError, ProgrammingError):
+                logger.log(TRACE1, 'IntegrityError (add_services), e:`%s`', format_exc().decode('utf-8'))
+                self._session.rollback()
+
+            except Exception:
+                logger.warn('Could not add services in bulk, e:`%s`', format_exc().decode('utf-8'))
+                self._session.rollback()
+                break
+
+        # We get here only if services could not be added in bulk, in which case each is added individually
+        out = {}
+
+        for item in items:
+            result = self.add_service(
+                item.name, item.impl_name, item.is_internal, deployment_time, item.details, item.source_info, item.service_info)
+
+            if item.service_info:
+                out[item.name] = (item.service_info['id'], item.service_info['is_active'], item.service_info['slow_threshold'])
+            elif result:
+                out[item.name] = result
+
+        return out
+
 # ################################################################################################################################
 
     def drop_deployed_services(self, server_id):
@@ -110,6 +110,51 @@ def sql_publish_with_retry(*args):
 
 # ################################################################################################################################
 
+def _sql_publish_many_with_retry(session, cid, cluster_id, topic_msg_list, now):
+    """ A low-level implementation of sql_publish_many_with_retry.
+    """
+    gd_msg_list = []
+    queue_msgs = []
+
+    for topic_id, subscriptions_by_topic, topic_gd_msg_list in topic_msg_list:
+        gd_msg_list.extend(topic_gd_msg_list)
+        queue_msgs.extend(get_queue_messages(cluster_id, subscriptions_by_topic, topic_gd_msg_list, topic_id, now))
+
+    # One INSERT for messages of all the topics ..
+    topic_messages_inserted = insert_topic_messages(session, cid, gd_msg_list)
+
+    if has_debug:
+        logger_zato.info('With topic_messages_inserted (many) `%s` `%s` `%s` `%s` `%s`',
+                cid, topic_messages_inserted, cluster_id, len(gd_msg_list), len(queue_msgs))
+
+    # .. and, if there are any subscribers, one INSERT for all of their queues.
+    if queue_msgs:
+        try:
+            sql_op_with_deadlock_retry(cid, 'insert_queue_messages', _insert_queue_messages, session, queue_msgs)
+        except IntegrityError:
+
+            if has_debug:
+                logger_zato.info('Caught IntegrityError (_sql_publish_many_with_retry) `%s` `%s`', cid, format_exc())
+
+            # Same as in _sql_publish_with_retry, the whole transaction needs to be repeated
+            return False
+
+    return True
+
+# ################################################################################################################################
+
+def sql_publish_many_with_retry(*args):
+    """ Like sql_publish_with_retry but for messages published to multiple topics at once. Each element of topic_msg_list
+    is a three-tuple of topic_id, subscriptions_by_topic and GD messages for that topic. Messages for all topics
+    are stored using one multi-row INSERT and all their queue messages using another one.
+    """
+    is_ok = False
+
+    while not is_ok:
+        is_ok = _sql_publish_many_with_retry(*args)
+
+# ################################################################################################################################
+
 def _insert_topic_messages(session, msg_list):
     """ A low-level implementation for insert_topic_messages.
     """
@@ -143,9 +188,8 @@ def _insert_queue_messages(session, queue_msgs):
 
 # ################################################################################################################################
 
-def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list, topic_id, now, cid, _initialized=_initialized):
-    """ Moves messages to each subscriber's queue, i.e. runs an INSERT that adds relevant references to the topic message.
-    Also, updates each message's is_in_sub_queue flag to indicate that it is no longer available for other subscribers.
+def get_queue_messages(cluster_id, subscriptions_by_topic, msg_list, topic_id, now):
+    """ Returns rows to be inserted to subscriber queues, one for each message and subscriber.
     """
     queue_msgs = []
 
@@ -163,6 +207,16 @@ def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list,
                 'sub_pattern_matched': msg['sub_pattern_matched'][sub.sub_key],
             })
 
+    return queue_msgs
+
+# ################################################################################################################################
+
+def insert_queue_messages(session, cluster_id, subscriptions_by_topic, msg_list, topic_id, now, cid, _initialized=_initialized):
+    """ Moves messages to each subscriber's queue, i.e. runs an INSERT that adds relevant references to the topic message.
+    Also, updates each message's is_in_sub_queue flag to indicate that it is no longer available for other subscribers.
+    """
+    queue_msgs = get_queue_messages(cluster_id, subscriptions_by_topic, msg_list, topic_id, now)
+
     # Move the message to endpoint queues
     return sql_op_with_deadlock_retry(cid, 'insert_queue_messages', _insert_queue_messages, session, queue_msgs)
 
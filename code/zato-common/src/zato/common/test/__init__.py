@@ -176,12 +176,12 @@ def enrich_with_static_config(object_):
 
     is_allowed = target_match
 
-    object_._worker_config = Bunch(out_odoo=None, out_soap=None)
+    object_._worker_config = Bunch(out_odoo=None, out_soap=None, out_sap=None)
     object_._worker_store = Bunch(
         sql_pool_store=None, stomp_outconn_api=None, outgoing_web_sockets=None, cassandra_api=None,
         cassandra_query_api=None, email_smtp_api=None, email_imap_api=None, search_es_api=None, search_solr_api=None,
         target_matcher=Bunch(target_match=target_match, is_allowed=is_allowed), invoke_matcher=Bunch(is_allowed=is_allowed),
-        vault_conn_api=None, sms_twilio_api=None)
+        vault_conn_api=None, sms_twilio_api=None, outconn_wsx=None, zmq_out_api=None, cache_api=None)
 
 # ################################################################################################################################
 
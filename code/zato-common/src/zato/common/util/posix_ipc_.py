@@ -12,7 +12,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from datetime import datetime, timedelta
 from json import dumps, loads
 from logging import getLogger
-from mmap import mmap
+from mmap import ACCESS_READ, mmap
 from time import sleep
 
 # posix-ipc
@@ -159,6 +159,7 @@ class ServerStartupIPC(SharedMemoryIPC):
     """ A shared memory-backed IPC object for server startup initialization.
     """
     pubsub_pid = '/pubsub/pid'
+    config_snapshot = '/config/snapshot'
 
     def create(self, deployment_key, size):
         super(ServerStartupIPC, self).create('server-{}'.format(deployment_key), size)
@@ -169,4 +170,63 @@ class ServerStartupIPC(SharedMemoryIPC):
     def get_pubsub_pid(self, timeout=60):
         return self.get_key(self.pubsub_pid, 'current', timeout)
 
+    def set_config_snapshot(self, info):
+        self.set_key(self.config_snapshot, 'current', info)
+
+    def get_config_snapshot(self, timeout=60):
+        return self.get_key(self.config_snapshot, 'current', timeout)
+
+# ################################################################################################################################
+
+class ConfigSnapshotIPC(object):
+    """ A read-only blob of data, such as a server's configuration, that one worker process publishes in shared memory
+    and other workers map in. Unlike with SharedMemoryIPC, its size is known only once the data is ready,
+    so each snapshot is a separate shared memory object named after the deployment key and version it belongs to.
+    """
+    def __init__(self):
+        self.shmem_name = ''
+        self._mem = None
+
+    def get_shmem_name(self, deployment_key, version):
+        return _shmem_pattern.format('config-{}-{}'.format(deployment_key, version))
+
+    def publish(self, deployment_key, version, data):
+        """ Stores data in a new shared memory object, which is an error if one already exists for that key and version.
+        """
+        self.shmem_name = self.get_shmem_name(deployment_key, version)
+
+        # Only the current user may read the snapshot
+        self._mem = ipc.SharedMemory(self.shmem_name, ipc.O_CREX, mode=0o600, size=len(data))
+
+        try:
+            _mmap = mmap(self._mem.fd, len(data))
+            _mmap.write(data)
+            _mmap.close()
+        finally:
+            self._mem.close_fd()
+
+    def load(self, deployment_key, version, size):
+        """ Returns data published under input key and version.
+        """
+        mem = ipc.SharedMemory(self.get_shmem_name(deployment_key, version), read_only=True)
+
+        try:
+            _mmap = mmap(mem.fd, size, access=ACCESS_READ)
+            data = _mmap[:]
+            _mmap.close()
+        finally:
+            mem.close_fd()
+
+        return data
+
+    def close(self):
+        """ Removes the snapshot from RAM - workers that have already loaded it are not affected.
+        """
+        if self._mem:
+            try:
+                self._mem.unlink()
+            except ipc.ExistentialError:
+                pass
+            self._mem = None
+
 # ################################################################################################################################
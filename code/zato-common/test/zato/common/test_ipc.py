@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import dumps
+from unittest import TestCase
+
+# gevent
+from gevent import sleep, spawn
+
+# mock
+from mock import Mock, patch
+
+# Nose
+from nose.tools import eq_
+
+# ZeroMQ
+import zmq.green as zmq
+
+# Zato
+from zato.common import IPC
+from zato.common.ipc.api import IPCAPI
+from zato.common.ipc.client import Client
+from zato.common.test import rand_string
+
+# ##############################################################################
+
+class IPCAPITestCase(TestCase):
+
+    def setUp(self):
+        self.cluster_name = rand_string()
+        self.server_name = rand_string()
+        self.pid = 123
+
+        self.server_api = IPCAPI(pid=self.pid)
+        self.server_api.name = IPCAPI.get_endpoint_name(self.cluster_name, self.server_name, self.pid)
+
+        self.client_api = IPCAPI(pid=456)
+
+    def tearDown(self):
+        self.client_api.close()
+        self.server_api.close()
+
+    def test_invoke_by_pid_pipelined(self):
+
+        def on_message(msg):
+
+            # Respond in reverse order of arrival to confirm that responses are matched by request ID
+            sleep(0.01 * (10 - int(msg.payload)))
+            return '{};{}'.format(IPC.STATUS.SUCCESS, dumps({'service': msg.service, 'payload': msg.payload})).encode('utf8')
+
+        self.server_api.on_message_callback = on_message
+        self.server_api.run()
+
+        def invoke(idx):
+            return self.client_api.invoke_by_pid(
+                'my.service', str(idx), self.cluster_name, self.server_name, self.pid, timeout=5)
+
+        with patch('zato.common.ipc.api.Client', wraps=Client) as client_class:
+
+            greenlets = [spawn(invoke, idx) for idx in range(10)]
+
+            for idx, g in enumerate(greenlets):
+                is_success, response = g.get()
+                eq_(is_success, True)
+                eq_(response, {'service': 'my.service', 'payload': str(idx)})
+
+        # All the calls went through a single connection, even though they all asked for it at the same time
+        eq_(client_class.call_count, 1)
+        eq_(list(self.client_api.pid_clients), [self.pid])
+        eq_(self.client_api.pid_clients_pending, {})
+
+    def test_invoke_by_pid_failure(self):
+
+        self.server_api.on_message_callback = lambda msg: '{};{}'.format(IPC.STATUS.FAILURE, 'Error').encode('utf8')
+        self.server_api.run()
+
+        is_success, response = self.client_api.invoke_by_pid(
+            'my.service', '', self.cluster_name, self.server_name, self.pid, timeout=5)
+
+        eq_(is_success, False)
+        eq_(response, 'Error')
+
+    def test_invoke_by_pid_timeout(self):
+
+        def on_message(msg):
+            sleep(1)
+            return '{};'.format(IPC.STATUS.SUCCESS).encode('utf8')
+
+        self.server_api.on_message_callback = on_message
+        self.server_api.run()
+
+        is_success, response = self.client_api.invoke_by_pid(
+            'my.service', '', self.cluster_name, self.server_name, self.pid, timeout=0.1)
+
+        eq_(is_success, False)
+        eq_(response, None)
+
+        # There were no other requests waiting for responses from that PID so its client was closed
+        eq_(self.client_api.pid_clients, {})
+
+    def test_invoke_by_pid_send_timeout(self):
+
+        self.server_api.on_message_callback = lambda msg: '{};'.format(IPC.STATUS.SUCCESS).encode('utf8')
+        self.server_api.run()
+
+        with patch('zato.common.ipc.api.Client.send', side_effect=zmq.Again()):
+            response = self.client_api.invoke_by_pid('my.service', '', self.cluster_name, self.server_name, self.pid, timeout=5)
+
+        # Nothing could be sent so the client was closed and a new one is created for the next request
+        eq_(response, None)
+        eq_(self.client_api.pid_clients, {})
+
+        is_success, response = self.client_api.invoke_by_pid(
+            'my.service', '', self.cluster_name, self.server_name, self.pid, timeout=5)
+
+        eq_(is_success, True)
+        eq_(list(self.client_api.pid_clients), [self.pid])
+
+    def test_remove_stale_pid_clients(self):
+
+        with patch('zato.common.ipc.api.Client', side_effect=lambda *args: Mock()):
+            for pid in 1, 2, 3:
+                self.client_api._get_pid_client(self.cluster_name, self.server_name, pid)
+
+        clients = dict(self.client_api.pid_clients)
+        self.client_api.remove_stale_pid_clients([2, 4])
+
+        eq_(list(self.client_api.pid_clients), [2])
+        eq_(clients[1].close.call_count, 1)
+        eq_(clients[3].close.call_count, 1)
+        eq_(clients[2].close.call_count, 0)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+
+# Zato
+from zato.common.odb.query.pubsub.publish import sql_publish_many_with_retry
+
+# ################################################################################################################################
+
+class SQLPublishManyTestCase(TestCase):
+
+    def get_topic_msg_list(self):
+        sub1 = Bunch(sub_key='sk.1', endpoint_id=10)
+        sub2 = Bunch(sub_key='sk.2', endpoint_id=20)
+
+        def get_msg(pub_msg_id, *sub_keys):
+            return {'pub_msg_id': pub_msg_id, 'sub_pattern_matched': dict((sub_key, 'sub=/*') for sub_key in sub_keys)}
+
+        return [
+            (1, [sub1, sub2], [get_msg('m1', 'sk.1', 'sk.2'), get_msg('m2', 'sk.1', 'sk.2')]),
+            (2, [], [get_msg('m3')]),
+            (3, [sub1], [get_msg('m4', 'sk.1')]),
+        ]
+
+    @patch('zato.common.odb.query.pubsub.publish._insert_queue_messages')
+    @patch('zato.common.odb.query.pubsub.publish._insert_topic_messages')
+    def test_publish_many(self, insert_topic_messages, insert_queue_messages):
+
+        sql_publish_many_with_retry(None, 'cid1', 1, self.get_topic_msg_list(), 123.0)
+
+        # Messages of all the topics are inserted at once ..
+        eq_(insert_topic_messages.call_count, 1)
+        eq_([msg['pub_msg_id'] for msg in insert_topic_messages.call_args[0][1]], ['m1', 'm2', 'm3', 'm4'])
+
+        # .. and so are all of their subscriber queue entries.
+        eq_(insert_queue_messages.call_count, 1)
+        eq_([(elem['topic_id'], elem['sub_key'], elem['pub_msg_id']) for elem in insert_queue_messages.call_args[0][1]], [
+            (1, 'sk.1', 'm1'),
+            (1, 'sk.1', 'm2'),
+            (1, 'sk.2', 'm1'),
+            (1, 'sk.2', 'm2'),
+            (3, 'sk.1', 'm4'),
+        ])
+
+    @patch('zato.common.odb.query.pubsub.publish._insert_queue_messages')
+    @patch('zato.common.odb.query.pubsub.publish._insert_topic_messages')
+    def test_publish_many_no_subscribers(self, insert_topic_messages, insert_queue_messages):
+
+        sql_publish_many_with_retry(None, 'cid1', 1, [self.get_topic_msg_list()[1]], 123.0)
+
+        eq_(insert_topic_messages.call_count, 1)
+        eq_(insert_queue_messages.call_count, 0)
+
+    @patch('zato.common.odb.query.pubsub.publish._insert_queue_messages')
+    @patch('zato.common.odb.query.pubsub.publish._insert_topic_messages')
+    def test_publish_many_retry(self, insert_topic_messages, insert_queue_messages):
+
+        # The whole transaction is repeated if inserting queue messages was rolled back
+        insert_queue_messages.side_effect = [IntegrityError('INSERT', {}, Exception('Deadlock')), None]
+
+        sql_publish_many_with_retry(None, 'cid1', 1, self.get_topic_msg_list(), 123.0)
+
+        eq_(insert_topic_messages.call_count, 2)
+        eq_(insert_queue_messages.call_count, 2)
+
+# ################################################################################################################################
@@ -9,7 +9,6 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import time
 from datetime import datetime, timedelta
 from random import choice, seed
 from unittest import TestCase
@@ -22,6 +21,7 @@ from crontab import CronTab
 
 # dateutil
 from dateutil.parser import parse
+from dateutil.rrule import rrule, SECONDLY
 
 # gevent
 from gevent import sleep, spawn
@@ -32,7 +32,7 @@ from mock import patch
 # Zato
 from zato.common import SCHEDULER
 from zato.common.test import is_like_cid, rand_bool, rand_date_utc, rand_int, rand_string
-from zato.scheduler.backend import Interval, Job, Scheduler
+from zato.scheduler.backend import CronSchedule, get_cron_schedule, Interval, Job, Scheduler
 
 seed()
 
@@ -219,22 +219,12 @@ class JobTestCase(TestCase):
 
             self.assertDictEqual(ctx, expected)
 
-    def test_main_loop_keep_running_false(self):
-
-        job = get_job()
-        job.keep_running = False
-
-        self.assertTrue(job.main_loop())
-        self.assertFalse(job.keep_running)
-        self.assertFalse(job.max_repeats_reached)
-
-        self.assertEquals(job.current_run, 0)
-
-    def test_main_loop_max_repeats_reached(self):
+    def test_run_max_repeats_reached(self):
 
         runs_ctx = []
 
-        def callback(ctx):
+        def spawn(_self, callback, ctx):
+            self.assertIs(callback, dummy_callback)
             runs_ctx.append(ctx)
 
         cb_kwargs = {
@@ -242,120 +232,77 @@ class JobTestCase(TestCase):
             rand_string():rand_string()
         }
 
-        interval_in_seconds = 0.01
+        interval_in_seconds = 5
         max_repeats = choice(range(2, 5))
 
-        job = get_job(interval_in_seconds=interval_in_seconds, max_repeats=max_repeats)
-        job.callback = callback
-        job.cb_kwargs = cb_kwargs
+        with patch('zato.scheduler.backend.Job._spawn', spawn):
+
+            job = get_job(interval_in_seconds=interval_in_seconds, max_repeats=max_repeats)
+            job.cb_kwargs = cb_kwargs
+            job.next_run_time = job.start_time
+
+            for idx in range(1, max_repeats):
+                next_run_time = job.run(job.next_run_time)
+                self.assertEquals(next_run_time, job.start_time + timedelta(seconds=interval_in_seconds * idx))
+                self.assertTrue(job.keep_running)
 
-        self.assertTrue(job.main_loop())
-        sleep(0.2)
+            # The last run returns no next run time
+            self.assertIs(job.run(job.next_run_time), None)
 
         len_runs_ctx = len(runs_ctx)
         self.assertEquals(len_runs_ctx, max_repeats)
-
         self.assertFalse(job.keep_running)
-        self.assertIs(job.callback, callback)
+        self.assertTrue(job.max_repeats_reached)
 
         for idx, ctx in enumerate(runs_ctx, 1):
             self.check_ctx(ctx, job, interval_in_seconds, max_repeats, idx, cb_kwargs, len_runs_ctx)
 
-    def test_main_loop_sleep_spawn_called(self):
-
-        wait_time = 0.2
-        sleep_time = rand_int()
-
-        now_values = [parse('2019-12-23 22:19:03'), parse('2021-05-13 17:35:48')]
+    def test_run_one_time(self):
 
-        sleep_history = []
         spawn_history = []
-        sleep_time_history = []
-
-        def sleep(value):
-            if value != wait_time:
-                sleep_history.append(value)
-
-        def spawn(*args, **kwargs):
-            spawn_history.append([args, kwargs])
-
-        def get_sleep_time(*args, **kwargs):
-            sleep_time_history.append(args[1])
-            return sleep_time
-
-        with patch('gevent.sleep', sleep):
-            with patch('zato.scheduler.backend.Job._spawn', spawn):
-                with patch('zato.scheduler.backend.Job.get_sleep_time', get_sleep_time):
-                    for now in now_values:
-                        self.now = now
-                        with patch('zato.scheduler.backend.datetime', self._datetime):
-                            for job_type in SCHEDULER.JOB_TYPE.CRON_STYLE, SCHEDULER.JOB_TYPE.INTERVAL_BASED:
 
-                                max_repeats = choice(range(2, 5))
+        def spawn(_self, callback, ctx):
+            spawn_history.append(ctx)
 
-                                cb_kwargs = {
-                                    rand_string():rand_string(),
-                                    rand_string():rand_string()
-                                }
+        with patch('zato.scheduler.backend.Job._spawn', spawn):
+            job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.ONE_TIME, Interval(seconds=5), callback=dummy_callback)
+            job.next_run_time = job.start_time
 
-                                interval = Interval(seconds=sleep_time) if job_type == SCHEDULER.JOB_TYPE.INTERVAL_BASED \
-                                    else CronTab(DEFAULT_CRON_DEFINITION)
+            self.assertIs(job.run(job.start_time), None)
+            self.assertEquals(len(spawn_history), 1)
 
-                                job = Job(rand_int(), rand_string(), job_type, interval, max_repeats=max_repeats)
+    def test_run_failed_still_scheduled(self):
 
-                                if job.type == SCHEDULER.JOB_TYPE.CRON_STYLE:
-                                    job.cron_definition = DEFAULT_CRON_DEFINITION
+        def spawn(_self, callback, ctx):
+            raise Exception('Cannot spawn')
 
-                                job.cb_kwargs = cb_kwargs
-                                job.start_time = datetime.utcnow()
-                                job.callback = dummy_callback
+        with patch('zato.scheduler.backend.Job._spawn', spawn):
 
-                                self.assertTrue(job.main_loop())
-                                time.sleep(0.5)
+            job = get_job(interval_in_seconds=5)
+            job.next_run_time = job.start_time
 
-                                self.assertEquals(max_repeats, len(sleep_history))
-                                self.assertEquals(max_repeats, len(spawn_history))
-
-                                for item in sleep_history:
-                                    self.assertEquals(sleep_time, item)
-
-                                for idx, (callback, ctx_dict) in enumerate(spawn_history, 1):
-                                    self.assertEquals(2, len(callback))
-                                    callback = callback[1]
-                                    self.check_ctx(
-                                        ctx_dict['ctx'], job, sleep_time, max_repeats, idx, cb_kwargs, len(spawn_history), job_type)
-                                    self.assertIs(callback, dummy_callback)
-
-                                del sleep_history[:]
-                                del spawn_history[:]
-
-                            for item in sleep_time_history:
-                                self.assertEquals(item, now)
-
-                            del sleep_time_history[:]
-
-    def test_run(self):
-
-        data = {'main_loop_called':False, 'sleep': False}
-
-        def main_loop():
-            data['main_loop_called'] = True
+            # A recurring job is run again even if it could not be run this time
+            self.assertEquals(job.run(job.next_run_time), job.start_time + timedelta(seconds=5))
+            self.assertTrue(job.keep_running)
 
-        def sleep(value):
-            data['sleep'] = value # Should not be executed if start_time is None
+    def test_get_next_run_time_interval_based(self):
 
-        start_time = datetime.utcnow() + timedelta(seconds=1.2)
+        run_time = parse('2019-12-23 22:19:03')
+        job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=5), run_time)
 
-        with patch('gevent.sleep', sleep):
+        # On time, a bit late and late by more than one interval - the result is always aligned to the schedule
+        self.assertEquals(job.get_next_run_time(run_time, run_time), parse('2019-12-23 22:19:08'))
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:03.3')), parse('2019-12-23 22:19:08'))
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:12')), parse('2019-12-23 22:19:13'))
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:13')), parse('2019-12-23 22:19:18'))
 
-            job = get_job()
-            job.main_loop = main_loop
-            job.start_time = start_time
+    def test_get_next_run_time_cron_style(self):
 
-            job.run()
+        run_time = parse('2015-11-27 19:13:00')
+        now = parse('2015-11-27 19:13:37.274')
 
-            self.assertTrue(data['main_loop_called'])
-            self.assertEquals(data['sleep'], 1)
+        job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.CRON_STYLE, CronTab(DEFAULT_CRON_DEFINITION), run_time)
+        self.assertEquals(job.get_next_run_time(run_time, now), parse('2015-11-27 19:14:00'))
 
     def test_hash_eq(self):
         job1 = get_job(name='a')
@@ -402,39 +349,17 @@ class JobStartTimeTestCase(TestCase):
         expected = parse(expected)
 
         interval = 1 # Days
-        data = {'start_time':[], 'now':[]}
-
-        def wait_iter_cb(start_time, now, *ignored):
-            data['start_time'].append(start_time)
-            data['now'].append(now)
 
         with patch('zato.scheduler.backend.datetime', self._datetime):
 
             interval = Interval(days=interval)
             job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=start_time, interval=interval)
-            job.wait_iter_cb = wait_iter_cb
-            job.wait_sleep_time = 0.1
 
             self.assertEquals(job.start_time, expected)
             self.assertTrue(job.keep_running)
             self.assertFalse(job.max_repeats_reached)
             self.assertIs(job.max_repeats_reached_at, None)
 
-            spawn(job.run)
-            sleep(0.2)
-
-            len_start_time = len(data['start_time'])
-            len_now = len(data['now'])
-
-            self.assertNotEquals(len_start_time, 0)
-            self.assertNotEquals(len_now, 0)
-
-            for item in data['start_time']:
-                self.assertEquals(expected, item)
-
-            for item in data['now']:
-                self.assertEquals(self.now, item)
-
     def test_get_start_time_result_in_future(self):
         self.check_get_start_time('2017-03-20 19:11:37', '2017-03-21 15:11:37', '2017-03-21 19:11:37')
 
@@ -456,110 +381,126 @@ class JobStartTimeTestCase(TestCase):
             self.assertEquals(job.max_repeats_reached_at, expected)
             self.assertFalse(job.start_time)
 
-class SchedulerTestCase(TestCase):
+    def test_get_start_time_long_running_job(self):
 
-    def test_create(self):
+        # A one-second job started two years ago
+        start_time = parse('2017-03-20 19:11:37')
+        self.now = parse('2019-03-21 21:11:37.5')
+        expected = parse('2019-03-21 21:11:38')
 
-        data = {'spawned_jobs': 0}
+        with patch('zato.scheduler.backend.datetime', self._datetime):
+            job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=start_time,
+                interval=Interval(seconds=1))
 
-        def on_job_executed(*ignored):
-            pass
+            self.assertEquals(job.start_time, expected)
+            self.assertTrue(job.keep_running)
 
-        def job_run(*ignored):
-            pass
+    def test_get_last_run_time_same_as_rrule(self):
 
-        def spawn(scheduler_instance, func):
-            self.assertIs(func, job_run)
-            data['spawned_jobs'] += 1
+        for _ in range(200):
 
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
+            start_time = parse('2017-03-20 19:11:37')
+            now = start_time + timedelta(seconds=choice(range(1, 100000)))
+            interval = choice(range(1, 5000))
+            max_repeats = choice([None, choice(range(1, 50))])
 
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.on_job_executed = on_job_executed
+            job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=interval), start_time,
+                max_repeats=max_repeats, clone_start_time=True)
 
-            job1 = get_job()
-            job1.run = job_run
+            expected = rrule(SECONDLY, interval=interval, dtstart=start_time, count=max_repeats).before(now)
+            self.assertEquals(job.get_last_run_time(start_time, now), expected,
+                '{} {} {} {}'.format(start_time, now, interval, max_repeats))
 
-            job2 = get_job()
-            job2.run = job_run
+class CronScheduleTestCase(TestCase):
 
-            job3 = get_job(name=job2.name)
-            job3.run = job_run
+    def test_next(self):
+        schedule = CronSchedule('*/5 * * * *')
+        cron_tab = CronTab('*/5 * * * *')
 
-            job4 = get_job()
-            job5 = get_job()
+        for now in ('2015-11-27 19:13:37.274', '2015-11-27 19:13:37.9', '2015-11-27 19:15:00', '2015-11-27 23:59:59.999'):
+            now = parse(now)
+            self.assertAlmostEquals(schedule.next(now), cron_tab.next(now), places=6)
 
-            job6 = get_job(prefix='inactive')
-            job6.is_active = False
+    def test_get_cron_schedule(self):
+        schedule1 = get_cron_schedule('*/5 * * * *')
+        schedule2 = get_cron_schedule('*/5 * * * *')
+        schedule3 = get_cron_schedule('*/7 * * * *')
 
-            scheduler.create(job1)
-            scheduler.create(job2)
+        self.assertIs(schedule1, schedule2)
+        self.assertIsNot(schedule1, schedule3)
 
-            # These two won't be added because scheduler.jobs is a set hashed by a job's name.
-            scheduler.create(job2)
-            scheduler.create(job3)
+class SchedulerTestCase(TestCase):
+
+    def get_scheduler(self, test_wait_time=None):
+        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler.init_jobs = lambda: None
+
+        if test_wait_time:
+            scheduler.iter_cb = iter_cb
+            scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
-            # The first one won't be spawned but the second one will.
-            scheduler.create(job4, spawn=False)
-            scheduler.create(job5, spawn=True)
+        return scheduler
 
-            # Won't be added anywhere nor spawned because it's inactive.
-            scheduler.create(job6)
+    def test_create(self):
 
-            self.assertEquals(scheduler.lock.called, 7)
-            self.assertEquals(len(scheduler.jobs), 5)
+        scheduler = self.get_scheduler()
+        scheduler.lock = RLock()
 
-            self.assertIn(job1, scheduler.jobs)
-            self.assertIn(job2, scheduler.jobs)
+        job1 = get_job()
+        job2 = get_job()
+        job3 = get_job(name=job2.name)
+        job4 = get_job()
+        job5 = get_job()
 
-            self.assertIs(job1.callback, scheduler.on_job_executed)
-            self.assertIs(job2.callback, scheduler.on_job_executed)
+        job6 = get_job(prefix='inactive')
+        job6.is_active = False
 
-            self.assertEquals(data['spawned_jobs'], 4)
+        scheduler.create(job1)
+        scheduler.create(job2)
 
-    def test_run(self):
+        # These two won't be added because scheduler.jobs is a dict keyed by a job's name,
+        # job3 replaces job2 and makes its entry in the heap stale.
+        scheduler.create(job2)
+        scheduler.create(job3)
 
-        test_wait_time = 0.3
-        sched_sleep_time = 0.1
+        # The first one won't be scheduled but the second one will.
+        scheduler.create(job4, spawn=False)
+        scheduler.create(job5, spawn=True)
+
+        # Won't be scheduled because it's inactive.
+        scheduler.create(job6)
+
+        self.assertEquals(scheduler.lock.called, 7)
+        self.assertEquals(len(scheduler.jobs), 5)
+
+        self.assertIs(scheduler.jobs[job1.name], job1)
+        self.assertIs(scheduler.jobs[job2.name], job3)
 
-        data = {'sleep': [], 'jobs':set()}
+        self.assertIs(job1.callback.im_func, scheduler.on_job_executed.im_func)
+        self.assertIs(job3.callback.im_func, scheduler.on_job_executed.im_func)
+
+        # job1, job2 (twice), job3 and job5
+        self.assertEquals(len(scheduler.job_heap), 5)
+
+        scheduled = set(entry[2].name for entry in scheduler.job_heap if scheduler._is_scheduled(entry[1], entry[2]))
+        self.assertSetEqual(scheduled, set([job1.name, job3.name, job5.name]))
+
+    def test_run(self):
 
-        def _sleep(value):
-            data['sleep'].append(value)
+        data = {'jobs':set()}
 
         def spawn_job(job):
             data['jobs'].add(job)
 
-        def job_run(self):
-            pass
-
         job1, job2, job3 = [get_job(str(x)) for x in range(3)]
 
         # Already run out of max_repeats and should not be started
         job4 = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=parse('1997-12-23 21:24:27'),
             interval=Interval(seconds=5), max_repeats=3)
 
-        job1.run = job_run
-        job2.run = job_run
-        job3.run = job_run
-        job4.run = job_run
-
-        config = Bunch()
-        config.on_job_executed_cb = dummy_callback
-        config._add_startup_jobs = False
-        config._add_scheduler_jobs = False
-        config.startup_jobs = []
-        config.odb = None
-        config.job_log_level = 'info'
-
-        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler = self.get_scheduler(0.3)
         scheduler.spawn_job = spawn_job
         scheduler.lock = RLock()
-        scheduler.sleep = _sleep
-        scheduler.sleep_time = sched_sleep_time
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         scheduler.create(job1, spawn=False)
         scheduler.create(job2, spawn=False)
@@ -571,29 +512,85 @@ class SchedulerTestCase(TestCase):
         self.assertEquals(3, len(data['jobs']))
         self.assertTrue(scheduler.lock.called)
 
-        for item in data['sleep']:
-            self.assertEquals(sched_sleep_time, item)
-
         for job in job1, job2, job3:
             self.assertIn(job, data['jobs'])
 
         self.assertNotIn(job4, data['jobs'])
 
+    def test_run_due_jobs(self):
+
+        now = parse('2019-12-23 22:19:03')
+        data = {'runs':[]}
+
+        def on_job_executed_cb(ctx):
+            data['runs'].append(ctx['name'])
+
+        scheduler = self.get_scheduler()
+        scheduler.on_job_executed_cb = on_job_executed_cb
+
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=5), now + timedelta(seconds=1),
+            clone_start_time=True)
+        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=3), now + timedelta(seconds=2),
+            clone_start_time=True)
+
+        with patch('zato.scheduler.backend.Job._spawn', lambda _self, func, ctx: func(ctx)):
+
+            scheduler.create(job1)
+            scheduler.create(job2)
+
+            # Nothing is due yet
+            self.assertEquals(scheduler.run_due_jobs(now), 1)
+            self.assertListEqual(data['runs'], [])
+
+            # Only job1 is due
+            self.assertEquals(scheduler.run_due_jobs(now + timedelta(seconds=1)), 1)
+            self.assertListEqual(data['runs'], ['a'])
+            self.assertEquals(job1.next_run_time, now + timedelta(seconds=6))
+
+            # Both are due now, job2 is late but its next run is still computed from its schedule
+            self.assertEquals(scheduler.run_due_jobs(now + timedelta(seconds=6.5)), 1.5)
+            self.assertListEqual(data['runs'], ['a', 'b', 'a'])
+            self.assertEquals(job1.next_run_time, now + timedelta(seconds=11))
+            self.assertEquals(job2.next_run_time, now + timedelta(seconds=8))
+
+        # Each job has exactly one entry in the heap
+        self.assertEquals(len(scheduler.job_heap), 2)
+
+    def test_compact_job_heap(self):
+
+        start_time = datetime.utcnow() + timedelta(days=1)
+
+        scheduler = self.get_scheduler()
+        jobs = [Job(rand_int(), str(idx), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=5), start_time)
+            for idx in range(10)]
+
+        for job in jobs:
+            scheduler.create(job)
+
+        for job in jobs[:6]:
+            scheduler.unschedule(job)
+
+        self.assertEquals(len(scheduler.job_heap), 10)
+        self.assertEquals(scheduler.job_heap_stale, 6)
+
+        scheduler.run_due_jobs(datetime.utcnow())
+
+        self.assertEquals(scheduler.job_heap_stale, 0)
+        self.assertSetEqual(set(entry[2].name for entry in scheduler.job_heap), set(job.name for job in jobs[6:]))
+
     def test_on_max_repeats_reached(self):
 
         test_wait_time = 0.5
-        job_sleep_time = 0.02
         job_max_repeats = 3
 
         data = {'job':None, 'called':0}
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
 
         # Just to make sure it's inactive by default.
         self.assertTrue(job.is_active)
 
-        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler = self.get_scheduler(test_wait_time)
         data['old_on_max_repeats_reached'] = scheduler.on_max_repeats_reached
 
         def on_max_repeats_reached(job):
@@ -602,8 +599,6 @@ class SchedulerTestCase(TestCase):
             data['old_on_max_repeats_reached'](job)
 
         scheduler.on_max_repeats_reached = on_max_repeats_reached
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         scheduler.create(job)
         scheduler.run()
@@ -622,94 +617,49 @@ class SchedulerTestCase(TestCase):
         self.assertFalse(job.is_active)
 
     def test_delete(self):
-        test_wait_time = 0.5
-        job_sleep_time = 10
-        job_max_repeats = 30
 
-        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job1.wait_sleep_time = job_sleep_time
+        data = {'runs':[]}
 
-        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job2.wait_sleep_time = job_sleep_time
+        def on_job_executed_cb(ctx):
+            data['runs'].append(ctx['name'])
 
-        scheduler = Scheduler(get_scheduler_config(), None)
-        scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1))
+        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1))
+
+        scheduler = self.get_scheduler()
+        scheduler.on_job_executed_cb = on_job_executed_cb
 
         scheduler.create(job1)
         scheduler.create(job2)
-        scheduler.run()
 
         scheduler.unschedule(job1)
 
-        self.assertIn(job2, scheduler.jobs)
-        self.assertNotIn(job1, scheduler.jobs)
+        self.assertIn(job2.name, scheduler.jobs)
+        self.assertNotIn(job1.name, scheduler.jobs)
         self.assertFalse(job1.keep_running)
+        self.assertTrue(job2.keep_running)
 
-        # run - 1
-        # create - 2
-        # delete - 1
-        # on_max_repeats_reached - 0 (because of how long it takes to run job_max_repeats with test_wait_time)
-        # 1+2+1 = 4
-        self.assertEquals(scheduler.lock.called, 4)
-
-    def test_job_greenlets(self):
-
-        data = {'spawned':[], 'stopped': []}
-
-        class FakeGreenlet(object):
-            def __init__(_self, run):
-                _self.run = _self._run = run
-
-            def kill(_self, *args, **kwargs):
-                data['stopped'].append([_self, args, kwargs])
-
-        def spawn(scheduler_instance, job, *args, **kwargs):
-            g = FakeGreenlet(job)
-            data['spawned'].append(g)
-            return g
-
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
-
-            test_wait_time = 0.5
-            job_sleep_time = 10
-            job_max_repeats = 30
-
-            job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job1.wait_sleep_time = job_sleep_time
-
-            job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job2.wait_sleep_time = job_sleep_time
-
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.iter_cb = iter_cb
-            scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
-
-            scheduler.create(job1)
-            scheduler.create(job2)
-            scheduler.run()
+        spawn(scheduler.run)
+        sleep(0.5)
+        scheduler.keep_running = False
 
-            self.assertEquals(scheduler.job_greenlets[job1.name]._run, job1.run)
-            self.assertEquals(scheduler.job_greenlets[job2.name]._run, job2.run)
+        self.assertNotIn('a', data['runs'])
+        self.assertIn('b', data['runs'])
 
-            self.assertTrue(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+    def test_unschedule_by_name(self):
 
-            scheduler.unschedule(job1)
+        scheduler = self.get_scheduler()
 
-            self.assertFalse(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+        job1 = get_job(name='a')
+        job2 = get_job(name='b')
 
-            self.assertNotIn(job1.name, scheduler.job_greenlets)
-            self.assertEquals(scheduler.job_greenlets[job2.name]._run, job2.run)
+        scheduler.create(job1)
+        scheduler.create(job2)
+        scheduler.unschedule_by_name('a')
 
-            self.assertEquals(len(data['stopped']), 1)
-            g, args, kwargs = data['stopped'][0]
-            self.assertIs(g.run.im_func, job1.run.im_func) # That's how we know it was job1 deleted not job2
-            self.assertIs(args, ())
-            self.assertDictEqual(kwargs, {'timeout':2.0, 'block':False})
+        self.assertListEqual(scheduler.jobs.keys(), ['b'])
+        self.assertFalse(job1.keep_running)
+        self.assertTrue(job2.keep_running)
 
     def test_edit(self):
 
@@ -722,30 +672,27 @@ class SchedulerTestCase(TestCase):
         start_time = datetime.utcnow()
         test_wait_time = 0.5
         job_interval1, job_interval2 = 2, 3
-        job_sleep_time = 10
         job_max_repeats1, job_max_repeats2 = 20, 30
 
-        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler = self.get_scheduler(test_wait_time)
         scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         def check(scheduler, job, label):
-            self.assertIn(job.name, scheduler.job_greenlets)
-            self.assertIn(job, scheduler.jobs)
-
-            self.assertEquals(1, len(scheduler.job_greenlets))
+            self.assertIn(job.name, scheduler.jobs)
             self.assertEquals(1, len(scheduler.jobs))
 
-            self.assertIs(job.run.im_func, scheduler.job_greenlets.values()[0]._run.im_func)
-
-            clone = list(scheduler.jobs)[0]
+            clone = scheduler.jobs[job.name]
 
             for name in 'name', 'interval', 'cb_kwargs', 'max_repeats', 'is_active':
                 expected = getattr(job, name)
                 given = getattr(clone, name)
                 self.assertEquals(expected, given, '{} != {} ({})'.format(expected, given, name))
 
+            # Exactly one entry in the heap is that of the job
+            scheduled = [entry for entry in scheduler.job_heap if scheduler._is_scheduled(entry[1], entry[2])]
+            self.assertEquals(1, len(scheduled))
+            self.assertIs(scheduled[0][2], clone)
+
             job_cb = job.callback
             clone_cb = clone.callback
 
@@ -765,18 +712,14 @@ class SchedulerTestCase(TestCase):
         job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval1), start_time, max_repeats=job_max_repeats1)
         job1.callback = callback
         job1.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job1.wait_sleep_time = job_sleep_time
 
         job2 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval2), start_time, max_repeats=job_max_repeats2)
         job2.callback = callback
         job2.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job2.wait_sleep_time = job_sleep_time
 
         scheduler.run()
         scheduler.create(job1)
 
-        sleep(test_wait_time)
-
         # We have only job1 at this point
         check(scheduler, job1, 'first')
 
@@ -799,22 +742,20 @@ class SchedulerTestCase(TestCase):
             data['runs'].append(ctx)
 
         test_wait_time = 0.5
-        job_sleep_time = 0.1
         job_max_repeats = 10
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
         job.get_context = get_context
 
-        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler = self.get_scheduler(test_wait_time)
         scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
         scheduler.on_job_executed_cb = on_job_executed_cb
 
         scheduler.create(job, spawn=False)
         scheduler.run()
+        sleep(0)
 
+        self.assertTrue(data['runs'])
         self.assertEquals(len(data['runs']), len(data['ctx']))
 
         for idx, item in enumerate(data['runs']):
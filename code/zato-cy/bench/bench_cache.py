@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Compares engines of the built-in cache - run it with a Python interpreter that has zato-cy built and installed, e.g.:
+#
+# $ ./bin/py zato-cy/bench/bench_cache.py
+# $ ./bin/py zato-cy/bench/bench_cache.py --sizes 1000,100000 --ops 5000
+#
+# Note that filling the list engine with a million entries alone will take minutes.
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from argparse import ArgumentParser
+from random import Random
+from time import time
+
+# Zato
+from zato.cache import Cache, CACHE
+
+# ################################################################################################################################
+
+default_sizes = '1000,100000,1000000'
+default_ops = 10000
+
+# ################################################################################################################################
+
+def run_ops(func, keys):
+    """ Calls func with each of keys on input and returns average time per call, in microseconds.
+    """
+    start = time()
+    for key in keys:
+        func(key)
+    return (time() - start) / len(keys) * 1000000
+
+# ################################################################################################################################
+
+def bench_engine(engine, size, ops):
+
+    random = Random(size)
+    cache = Cache(size, engine=engine)
+
+    # Fill the cache up to its max_size
+    start = time()
+    for idx in xrange(size):
+        cache.set(idx, idx, 0.0, False)
+    fill_time = time() - start
+
+    # Keys that exist in the cache, each one at a random position in the index
+    hit_keys = [random.randrange(size) for _ in xrange(ops)]
+
+    # Keys that do not exist yet so each .set evicts the least recently used entry
+    new_keys = range(size, size + ops)
+
+    results = {
+        'fill': fill_time,
+        'get': run_ops(lambda key: cache.get(key, None, False), hit_keys),
+        'update': run_ops(lambda key: cache.set(key, key, 0.0, False), hit_keys),
+        'set_evict': run_ops(lambda key: cache.set(key, key, 0.0, False), new_keys),
+        'index': run_ops(cache.index, hit_keys[:min(ops, 1000)]),
+    }
+    results['delete'] = run_ops(cache.delete, new_keys)
+
+    return results
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Compares the performance of built-in cache engines')
+    parser.add_argument('--sizes', default=default_sizes, help='Comma-separated cache sizes (default: %(default)s)')
+    parser.add_argument('--ops', type=int, default=default_ops, help='Operations per measurement (default: %(default)s)')
+    parser.add_argument('--engines', default='{},{}'.format(CACHE.ENGINE.LIST, CACHE.ENGINE.LINKED),
+        help='Comma-separated engines to compare (default: %(default)s)')
+    args = parser.parse_args()
+
+    header = '{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'
+    row = '{:>8} {:>10} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'
+
+    print('Fill time in seconds, other columns in microseconds per operation')
+    print(header.format('engine', 'size', 'fill', 'get', 'update', 'set_evict', 'index', 'delete'))
+
+    for size in [int(elem) for elem in args.sizes.split(',')]:
+        for engine in args.engines.split(','):
+            results = bench_engine(engine, size, args.ops)
+            print(row.format(engine, size, results['fill'], results['get'], results['update'], results['set_evict'],
+                results['index'], results['delete']))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
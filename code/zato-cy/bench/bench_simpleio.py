@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Measures per-request overhead of SimpleIO - run it with a Python interpreter that has zato-cy built and installed, e.g.:
+#
+# $ ./bin/py zato-cy/bench/bench_simpleio.py
+# $ ./bin/py zato-cy/bench/bench_simpleio.py --sizes 1,100 --requests 5000
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from argparse import ArgumentParser
+from time import time
+
+# Zato
+from zato.common import DATA_FORMAT, PARAMS_PRIORITY
+from zato.server.service.reqresp import Request, Response
+from zato.server.service.reqresp.sio import AsIs, Boolean, compile_sio, CSV, Integer
+
+# ################################################################################################################################
+
+logger = logging.getLogger(__name__)
+
+default_sizes = '1,100,10000'
+default_requests = 2000
+
+# The same as in a default simple-io.conf file
+simple_io_config = {
+    'int_parameters': ['id'],
+    'int_parameter_suffixes': ['_count', '_id', '_size', '_timeout'],
+    'bool_parameter_prefixes': ['by_', 'has_', 'is_', 'may_', 'needs_', 'should_'],
+}
+
+# ################################################################################################################################
+
+class SimpleIO(object):
+    input_required = ('name', 'user_id', 'is_active', Integer('max_count'))
+    input_optional = ('description', 'group_id', Boolean('flag'), CSV('tags'), AsIs('raw_id'), 'password')
+    output_required = ('id', 'name', 'user_id', 'is_active')
+    output_optional = ('description', 'group_id', Boolean('flag'), CSV('tags'), AsIs('raw_id'), 'created')
+
+request_data = {
+    'name': 'My name',
+    'user_id': '123',
+    'is_active': 'true',
+    'max_count': '10',
+    'description': 'My description',
+    'group_id': '456',
+    'flag': 'false',
+    'tags': 'abc,def',
+    'raw_id': '0001',
+}
+
+response_item = {
+    'id': 1,
+    'name': 'My name',
+    'user_id': '123',
+    'is_active': True,
+    'description': 'My description',
+    'group_id': 456,
+    'flag': 'false',
+    'tags': ['abc', 'def'],
+    'raw_id': '0001',
+    'created': '2019-01-02T03:04:05',
+}
+
+# ################################################################################################################################
+
+def run(func, requests):
+    """ Calls func the number of times given on input and returns average time per call, in microseconds.
+    """
+    start = time()
+    for _ in xrange(requests):
+        func()
+    return (time() - start) / requests * 1000000
+
+# ################################################################################################################################
+
+def get_request():
+    request = Request(logger)
+    request.simple_io_config = simple_io_config
+    request.payload = request.raw_request = request_data
+    request.params_priority = PARAMS_PRIORITY.DEFAULT
+    return request
+
+# ################################################################################################################################
+
+def bench_input(plan, requests):
+
+    def with_plan():
+        request = get_request()
+        request.init(True, 'cid', SimpleIO, DATA_FORMAT.JSON, None, {}, None, plan)
+
+    def elem_by_elem():
+        request = get_request()
+        request.data_format = DATA_FORMAT.JSON
+        request.has_simple_io_config = True
+        request.bool_parameter_prefixes = simple_io_config['bool_parameter_prefixes']
+        request.int_parameters = simple_io_config['int_parameters']
+        request.int_parameter_suffixes = simple_io_config['int_parameter_suffixes']
+        request.get_params(plan.input.required_params, False, 'request')
+        request.get_params(plan.input.optional_params, False, 'request', is_required=False)
+
+    return run(with_plan, requests), run(elem_by_elem, requests)
+
+# ################################################################################################################################
+
+def bench_output(plan, size, requests):
+
+    items = [response_item] * size
+
+    def flat():
+        response = Response(logger, simple_io_config=simple_io_config)
+        response.init('cid', SimpleIO, DATA_FORMAT.JSON, plan)
+        response.payload = response_item
+        response.payload.getvalue(False)
+
+    def as_list():
+        response = Response(logger, simple_io_config=simple_io_config)
+        response.init('cid', SimpleIO, DATA_FORMAT.JSON, plan)
+        response.payload[:] = items
+        response.payload.getvalue(False)
+
+    return run(flat, requests), run(as_list, max(1, requests // size))
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Measures per-request overhead of SimpleIO')
+    parser.add_argument('--sizes', default=default_sizes, help='Comma-separated sizes of list responses (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=default_requests,
+        help='Requests per measurement (default: %(default)s)')
+    args = parser.parse_args()
+
+    plan = compile_sio(SimpleIO, simple_io_config)
+
+    print('All times in microseconds per request')
+    print('compile: {:.2f}'.format(run(lambda: compile_sio(SimpleIO, simple_io_config), args.requests)))
+
+    with_plan, elem_by_elem = bench_input(plan, args.requests)
+    print('input: {:.2f}, element by element: {:.2f}'.format(with_plan, elem_by_elem))
+
+    header = '{:>8} {:>12} {:>12} {:>12}'
+    row = '{:>8} {:>12.2f} {:>12.2f} {:>12.2f}'
+
+    print(header.format('size', 'flat', 'list', 'list/item'))
+
+    for size in [int(elem) for elem in args.sizes.split(',')]:
+        flat, as_list = bench_output(plan, size, args.requests)
+        print(row.format(size, flat, as_list, as_list / size))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
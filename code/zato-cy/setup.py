@@ -35,6 +35,7 @@ setup(
           Extension(name='zato.bunch', sources=['src/zato/cy/bunch.pyx']),
           Extension(name='zato.url_dispatcher', sources=['src/zato/cy/url_dispatcher.pyx']),
           Extension(name='zato.cache', sources=['src/zato/cy/cache.pyx']),
+          Extension(name='zato.simpleio', sources=['src/zato/cy/simpleio/plan.pyx']),
         ]),
 
       zip_safe = False,
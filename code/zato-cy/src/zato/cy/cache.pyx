@@ -12,6 +12,7 @@ from datetime import datetime
 from decimal import Decimal
 from email.utils import formatdate as stdlib_format_date
 from hashlib import sha256
+from heapq import heapify, heappop, heappush
 from json import dumps as json_dumps, JSONEncoder
 from logging import getLogger
 from sys import getsizeof, maxint
@@ -21,12 +22,13 @@ from arrow import Arrow
 
 # Cython
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
-    PyDict_Values
+    PyDict_Size, PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
 from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
 from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
 from cpython.sequence cimport PySequence_ITEM
-from libc.stdint cimport uint64_t
+from libc.stdint cimport uint32_t, uint64_t
+from libc.stdlib cimport calloc, free
 from posix.time cimport timeval, timezone, gettimeofday
 
 # regex
@@ -56,6 +58,14 @@ key_types = len_values + integer_types
 class CACHE:
     DEFAULT_SIZE = _COMMON_CACHE.DEFAULT.MAX_SIZE
     MAX_ITEM_SIZE = _COMMON_CACHE.DEFAULT.MAX_ITEM_SIZE
+    ENGINE = _COMMON_CACHE.ENGINE
+    DEFAULT_ENGINE = _COMMON_CACHE.DEFAULT.ENGINE
+
+    # How many stamps a linked index will have room for at least, regardless of how many entries it holds
+    MIN_STAMP_CAPACITY = 1024
+
+    # The expiry heap is not compacted if it has fewer entries than that
+    MIN_EXPIRY_HEAP_COMPACT = 1024
 
 # ################################################################################################################################
 
@@ -107,6 +117,17 @@ cdef class Entry:
         # This entry's position in index
         public long position
 
+        # Neighbours in a linked index - prev is the more recently used one, next is the less recently used one
+        Entry prev
+        Entry next
+
+        # A monotonically growing number assigned each time the entry is moved to the head of a linked index,
+        # used to compute the entry's position without walking the list.
+        Py_ssize_t stamp
+
+        # Sequence number of this entry's current node in the expiry heap, 0 if there is none
+        uint64_t expiry_seq
+
         # Hashed in SHA256
         public str hash
 
@@ -191,9 +212,271 @@ cdef class Entry:
 
 # ################################################################################################################################
 
+cdef class _RecencyIndex:
+    """ Base class for indexes that keep cache entries in the order of their use - the most recently used entry
+    is always at position 0 and the least recently used one is the first to be evicted. All methods must be called
+    with the cache's lock held and, except for push_head, only with entries that are known to be in the index.
+    """
+    cdef int push_head(self, Entry entry) except -1:
+        """ Adds a new entry at the head position.
+        """
+
+    cdef long promote(self, Entry entry) except -1:
+        """ Moves an existing entry to the head position and returns the position it had been at before.
+        """
+
+    cdef void remove(self, Entry entry):
+        """ Removes an entry from the index.
+        """
+
+    cdef object pop_tail(self):
+        """ Removes the least recently used entry and returns its key.
+        """
+
+    cdef long position(self, Entry entry):
+        """ Returns the current position of an entry.
+        """
+
+    cdef list keys(self):
+        """ Returns all keys, from the most to the least recently used one.
+        """
+
+    cdef int clear(self) except -1:
+        """ Removes all entries from the index.
+        """
+
+# ################################################################################################################################
+
+cdef class _ListIndex(_RecencyIndex):
+    """ Keeps keys in a Python list - each lookup by key is a linear scan and each move to the head
+    shifts the whole list so this index's operations are O(n).
+    """
+    cdef list _keys
+
+    def __cinit__(self):
+        self._keys = []
+
+    cdef inline long _find(self, object key):
+        cdef Py_ssize_t index_idx = 0
+        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._keys)
+
+        while index_idx < cache_size:
+            if PyObject_RichCompareBool(PySequence_ITEM(self._keys, index_idx), <object>key, Py_EQ):
+                return index_idx
+            index_idx += 1
+
+    cdef inline object _remove_by_idx(self, long idx):
+        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
+        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+        """
+        cdef object index_key = PySequence_ITEM(self._keys, idx)
+        PyList_SetSlice(self._keys, idx, idx+1, <object>NULL)
+
+        return index_key
+
+    cdef int push_head(self, Entry entry) except -1:
+        PyList_Insert(self._keys, 0, entry.key)
+
+    cdef long promote(self, Entry entry) except -1:
+        cdef long index_idx = self._find(entry.key)
+        PyList_Insert(self._keys, 0, self._remove_by_idx(index_idx))
+        return index_idx
+
+    cdef void remove(self, Entry entry):
+        self._remove_by_idx(self._find(entry.key))
+
+    cdef object pop_tail(self):
+        return self._keys.pop()
+
+    cdef long position(self, Entry entry):
+        return self._find(entry.key)
+
+    cdef list keys(self):
+        return list(self._keys)
+
+    cdef int clear(self) except -1:
+        self._keys[:] = []
+
+# ################################################################################################################################
+
+cdef class _LinkedIndex(_RecencyIndex):
+    """ Keeps entries in a doubly linked list threaded through the entries themselves, which makes adding, promoting,
+    removing and evicting entries O(1) operations. To be able to report positions, each entry moved to the head
+    receives a new stamp and a Fenwick tree counts how many live stamps there are - an entry's position
+    is the number of entries with stamps greater than its own, which is an O(log n) query.
+    Once stamps run out, they are reassigned to all entries, from the tail to the head, which happens
+    at most once per each capacity / 2 operations and keeps the amortised cost of all operations constant.
+    """
+    cdef:
+        Entry head
+        Entry tail
+        Py_ssize_t size
+        Py_ssize_t capacity
+        Py_ssize_t next_stamp
+        uint32_t *tree
+
+    def __cinit__(self):
+        self.size = 0
+        self.capacity = 0
+        self.next_stamp = 1
+        self.tree = NULL
+        self._rebuild_stamps()
+
+    def __dealloc__(self):
+        free(self.tree)
+
+# ################################################################################################################################
+
+    cdef inline void _tree_add(self, Py_ssize_t stamp, int value):
+        while stamp <= self.capacity:
+            self.tree[stamp] += value
+            stamp += stamp & -stamp
+
+# ################################################################################################################################
+
+    cdef inline Py_ssize_t _tree_sum(self, Py_ssize_t stamp):
+        cdef Py_ssize_t out = 0
+
+        while stamp > 0:
+            out += self.tree[stamp]
+            stamp -= stamp & -stamp
+
+        return out
+
+# ################################################################################################################################
+
+    cdef int _rebuild_stamps(self) except -1:
+        """ Allocates a new tree, twice as large as current size requires, and assigns consecutive stamps to all entries.
+        """
+        cdef Entry entry = self.tail
+        cdef Py_ssize_t capacity = max(2 * (self.size + 1), CACHE.MIN_STAMP_CAPACITY)
+        cdef Py_ssize_t stamp = 0
+        cdef Py_ssize_t parent
+        cdef uint32_t *tree = <uint32_t *>calloc(capacity + 1, sizeof(uint32_t))
+
+        if tree is NULL:
+            raise MemoryError()
+
+        while entry is not None:
+            stamp += 1
+            entry.stamp = stamp
+            tree[stamp] = 1
+            entry = entry.prev
+
+        # Build the Fenwick tree in linear time - each node passes its count on to its parent
+        for stamp in range(1, capacity + 1):
+            parent = stamp + (stamp & -stamp)
+            if parent <= capacity:
+                tree[parent] += tree[stamp]
+
+        free(self.tree)
+        self.tree = tree
+        self.capacity = capacity
+        self.next_stamp = self.size + 1
+
+# ################################################################################################################################
+
+    cdef inline int _link_head(self, Entry entry) except -1:
+
+        if self.next_stamp > self.capacity:
+            self._rebuild_stamps()
+
+        entry.stamp = self.next_stamp
+        self.next_stamp += 1
+        self._tree_add(entry.stamp, 1)
+
+        entry.prev = None
+        entry.next = self.head
+
+        if self.head is not None:
+            self.head.prev = entry
+        else:
+            self.tail = entry
+
+        self.head = entry
+        self.size += 1
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, Entry entry):
+
+        self._tree_add(entry.stamp, -1)
+
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self.head = entry.next
+
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self.tail = entry.prev
+
+        entry.prev = None
+        entry.next = None
+        self.size -= 1
+
+# ################################################################################################################################
+
+    cdef int push_head(self, Entry entry) except -1:
+        self._link_head(entry)
+
+    cdef long promote(self, Entry entry) except -1:
+        cdef long position
+
+        # Already at the head, nothing to do
+        if entry is self.head:
+            return 0
+
+        position = self.position(entry)
+        self._unlink(entry)
+        self._link_head(entry)
+
+        return position
+
+    cdef void remove(self, Entry entry):
+        self._unlink(entry)
+
+    cdef object pop_tail(self):
+        cdef Entry entry = self.tail
+        self._unlink(entry)
+        return entry.key
+
+    cdef long position(self, Entry entry):
+        return self.size - self._tree_sum(entry.stamp)
+
+    cdef list keys(self):
+        cdef list out = []
+        cdef Entry entry = self.head
+
+        while entry is not None:
+            out.append(entry.key)
+            entry = entry.next
+
+        return out
+
+    cdef int clear(self) except -1:
+        cdef Entry entry = self.head
+        cdef Entry next_entry
+
+        # Break the links explicitly rather than leave potentially many reference cycles to the garbage collector
+        while entry is not None:
+            next_entry = entry.next
+            entry.prev = None
+            entry.next = None
+            entry = next_entry
+
+        self.head = None
+        self.tail = None
+        self.size = 0
+        self._rebuild_stamps()
+
+# ################################################################################################################################
+
 cdef class Cache(object):
     """ An LRU cache that optionally rejects entries bigger than N bytes. Entries can have a TTL assigned - periodic processes
-    will clean up entries older than allowed.
+    will clean up entries older than allowed. The order in which entries were used is kept by an index whose type
+    depends on the engine given on input - by default, it is a linked one whose all operations are O(1).
     """
     cdef:
         public long max_size
@@ -202,31 +485,53 @@ cdef class Cache(object):
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
         public dict _data
-        public list _index
+        readonly object engine
+        _RecencyIndex _index
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
         public uint64_t get_ops
         public dict hits_per_position # How many times a given position in cache was used
         public list _expired_on_op    # Keys that were found to have expired during a .get or .set operation
+        public list _expiry_heap      # (expires_at, expiry_seq, entry) nodes, ordered by when entries will expire
+        public uint64_t _expiry_seq   # Last sequence number assigned to a node in the expiry heap
+        public uint64_t _expiry_stale # How many nodes in the expiry heap no longer point to their entries
+        public uint64_t expired_total        # How many expired entries were deleted by self.delete_expired in total
+        public uint64_t last_sweep_deleted   # How many expired entries the last call to self.delete_expired deleted
+        public double last_sweep_duration    # How long, in seconds, the last call to self.delete_expired held the lock
         public object _lock
         public object default_get # A singleton indicating that no default value was given for self.get
         public dict _regex_cache
 
     def __cinit__(self):
         self._data = {}
-        self._index = []
         self.hits_per_position = {}
         self._expired_on_op = []
+        self._expiry_heap = []
+        self._expiry_seq = 0
+        self._expiry_stale = 0
+        self.expired_total = 0
+        self.last_sweep_deleted = 0
+        self.last_sweep_duration = 0.0
         self.hits = 0
         self.misses = 0
         self.set_ops = 0
         self.get_ops = 0
         self._regex_cache = {}
 
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None,
+        engine=None):
         self._lock = lock or RLock()
         self.default_get = object()
+        self.engine = engine or CACHE.DEFAULT_ENGINE
+
+        if self.engine == CACHE.ENGINE.LINKED:
+            self._index = _LinkedIndex()
+        elif self.engine == CACHE.ENGINE.LIST:
+            self._index = _ListIndex()
+        else:
+            raise ValueError('Unrecognized engine `{}`'.format(self.engine))
+
         with self._lock:
             self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
 
@@ -252,11 +557,11 @@ cdef class Cache(object):
             get_to_set_ops = (round(1.0 * self.get_ops / self.set_ops, 1)) if self.set_ops and self.get_ops else 'n/a'
             get_to_set_ops = ' ({})'.format(get_to_set_ops)
 
-            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}>'.format(
+            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}, engine:{}>'.format(
                 self.__class__.__name__, hex(id(self)), len(self._data), self.max_size,
                 self.hits, self.misses, hits_to_misses,
                 self.get_ops, self.set_ops, get_to_set_ops,
-                self.max_item_size
+                self.max_item_size, self.engine
             )
 
 # ################################################################################################################################
@@ -269,7 +574,7 @@ cdef class Cache(object):
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return PyDict_Size(self._data)
 
 # ################################################################################################################################
 
@@ -287,7 +592,7 @@ cdef class Cache(object):
 
     cpdef list keys_by_position(self):
         with self._lock:
-            return list(self._index)
+            return self._index.keys()
 
 # ################################################################################################################################
 
@@ -317,10 +622,11 @@ cdef class Cache(object):
 
     def get_slice(self, start, stop, step):
         with self._lock:
-            for key in self._index[start:stop:step]:
-                entry = self._data[key]
+            keys = self._index.keys()
+            for position in xrange(*slice(start, stop, step).indices(len(keys))):
+                entry = self._data[keys[position]]
                 as_dict = entry.to_dict()
-                as_dict['position'] = self._get_index(key)
+                as_dict['position'] = position
                 yield as_dict
 
 # ################################################################################################################################
@@ -331,9 +637,15 @@ cdef class Cache(object):
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
         with self._lock:
             self._data.clear()
-            self._index[:] = []
+            self._index.clear()
             self.hits_per_position.clear()
             self._expired_on_op[:] = []
+            self._expiry_heap[:] = []
+            self._expiry_seq = 0
+            self._expiry_stale = 0
+            self.expired_total = 0
+            self.last_sweep_deleted = 0
+            self.last_sweep_duration = 0.0
             self.hits = 0
             self.misses = 0
             self.set_ops = 0
@@ -349,13 +661,39 @@ cdef class Cache(object):
             return
         else:
             # We run under self.lock so at this point we know that the key was valid
-            # and _remove_from_index_by_idx is safe to call.
+            # and the entry can be safely removed from index.
             out = entry.value
             del self._data[key]
-            self._remove_from_index_by_idx(self._get_index(key))
+            self._index.remove(entry)
+            self._unschedule_expiry(entry)
 
             return out
 
+# ################################################################################################################################
+
+    cdef inline int _schedule_expiry(self, Entry entry) except -1:
+        """ Adds a node for entry to the expiry heap - must be called each time entry's expires_at changes from 0.0
+        to a time in the future. Later extensions of expires_at do not need new nodes because self.delete_expired
+        will find them when the original node is due.
+        """
+        if entry.expiry_seq:
+            self._expiry_stale += 1
+
+        self._expiry_seq += 1
+        entry.expiry_seq = self._expiry_seq
+        heappush(self._expiry_heap, (entry.expires_at, entry.expiry_seq, entry))
+
+        return 0
+
+# ################################################################################################################################
+
+    cdef inline void _unschedule_expiry(self, Entry entry):
+        """ Marks entry's node in the expiry heap as stale - it will be discarded when it is popped or the heap is compacted.
+        """
+        if entry.expiry_seq:
+            entry.expiry_seq = 0
+            self._expiry_stale += 1
+
 # ################################################################################################################################
 
     cpdef object delete(self, object key):
@@ -594,21 +932,6 @@ cdef class Cache(object):
 
         return out
 
-# ################################################################################################################################
-
-    cdef inline long _get_index(self, object key):
-        """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
-        """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
-
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
-                return index_idx
-            index_idx += 1
-
 # ################################################################################################################################
 
     cpdef object index(self, object key):
@@ -616,18 +939,7 @@ cdef class Cache(object):
         """
         with self._lock:
             if PyDict_Contains(self._data, key):
-                return self._get_index(key)
-
-# ################################################################################################################################
-
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
-        """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
-
-        return index_key
+                return self._index.position(<Entry>PyDict_GetItem(self._data, key))
 
 # ################################################################################################################################
 
@@ -654,9 +966,8 @@ cdef class Cache(object):
         cdef Entry entry
         cdef double _now
         cdef double _orig_now = 0.0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
+        cdef Py_ssize_t cache_size = PyDict_Size(self._data)
+        cdef object evicted_key
         cdef long hits_per_position
         cdef long len_value
 
@@ -689,6 +1000,7 @@ cdef class Cache(object):
                 if expiry:
                     entry.expiry = expiry
                     entry.expires_at = _now + expiry
+                    self._schedule_expiry(entry)
             else:
                 # Mark as deleted an entry that has already expired
                 if _now >= entry.expires_at:
@@ -700,6 +1012,7 @@ cdef class Cache(object):
                     if expiry == 0.0:
                         entry.expires_at = 0.0
                         entry.expiry = 0.0
+                        self._unschedule_expiry(entry)
                     else:
                         # The entry exists and has not expired so now, if we are configured to, prolong its expiration time
                         if self.extend_expiry_on_set and entry.expiry:
@@ -718,7 +1031,9 @@ cdef class Cache(object):
 
             # Make sure there is room for the new key
             if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+                evicted_key = self._index.pop_tail()
+                self._unschedule_expiry(<Entry>PyDict_GetItem(self._data, evicted_key))
+                PyDict_DelItem(self._data, evicted_key)
 
             # Actually insert entry
             entry = Entry()
@@ -734,7 +1049,10 @@ cdef class Cache(object):
             entry.set_metadata()
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._index.push_head(entry)
+
+            if expiry:
+                self._schedule_expiry(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
@@ -1063,16 +1381,15 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cdef object _get(self, object key, object default, bint details):
+    cdef object _get(self, object key, object default, bint details, object orig_now=None):
         """ Returns data for key in cache if present. Otherwise returns None. If 'details' is True,
         returns a dictionary with value and metadata instead of value alone.
         """
         cdef object _item
         cdef Entry entry
-        cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
-        cdef double _now = self._get_timestamp()
+        cdef long index_idx
+        cdef long hits_per_position
+        cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         try:
             entry = <Entry>self._data[key]
@@ -1099,8 +1416,8 @@ cdef class Cache(object):
             # Update total hits counter
             self.hits += 1
 
-            # Current position of that key in index
-            index_idx = self._get_index(key)
+            # Current position of that key in index - the key is moved to the head position in the same step
+            index_idx = self._index.promote(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
@@ -1108,12 +1425,6 @@ cdef class Cache(object):
             hits_per_position += 1
             PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
 
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
-
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
-
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
             entry.last_read = _now
@@ -1135,11 +1446,11 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cpdef get(self, object key, object default, bint details):
+    cpdef get(self, object key, object default, bint details, object orig_now=None):
         """ Returns a value by key, or None if the value is not found.
         """
         with self._lock:
-            return self._get(key, default, details)
+            return self._get(key, default, details, orig_now)
 
 # ################################################################################################################################
 
@@ -1492,6 +1803,7 @@ cdef class Cache(object):
         a given entry's expiry/expires_at attributes.
         """
         cdef Entry entry
+        cdef bint needs_schedule
 
         with self._lock:
             try:
@@ -1506,34 +1818,71 @@ cdef class Cache(object):
                 # i.e. it's possible that our current worker already updated expiration metadata before this request was received
                 # and without this condition, we would set expiration data back in the past.
                 if expires_at > entry.expires_at:
+                    needs_schedule = not entry.expires_at
                     entry.expiry = expiry
                     entry.expires_at = expires_at
 
+                    if needs_schedule:
+                        self._schedule_expiry(entry)
+
 # ################################################################################################################################
 
-    cpdef list delete_expired(self):
-        """ Deletes all entries expired as of now. Also, deletes all entries possibly found to have expired by .get or .set calls.
+    cpdef list delete_expired(self, long limit=0, object orig_now=None):
+        """ Deletes entries expired as of now, or as of orig_now if it is given, up to limit of them if limit is given -
+        in this case, the caller should invoke this method again if the number of entries returned was equal to limit.
+        Also, deletes all entries possibly found to have expired by .get or .set calls. Only entries that are actually due
+        are visited.
         """
         cdef list deleted
-        cdef double _now = self._get_timestamp()
+        cdef list heap = self._expiry_heap
+        cdef double _started = self._get_timestamp()
+        cdef double _now = orig_now if orig_now else _started
         cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef uint64_t seq
+        cdef uint64_t expired_deleted = 0
+        cdef Entry entry
 
         with self._lock:
 
+            # Keys deleted by .get or .set operations
             deleted = self._expired_on_op[:]
+            self._expired_on_op[:] = []
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
-                    self._delete(key)
-                    deleted.append(key)
+            # Stale nodes are normally discarded when popped but if there are too many of them
+            # and they are not due for a long time, we need to discard them here.
+            if self._expiry_stale > len(heap) // 2 and len(heap) > CACHE.MIN_EXPIRY_HEAP_COMPACT:
+                heap[:] = [node for node in heap if (<Entry>node[2]).expiry_seq == node[1]]
+                heapify(heap)
+                self._expiry_stale = 0
 
-            # Collect keys deleted by .get operations
-            self._expired_on_op[:] = []
+            while heap and heap[0][0] < _now:
+
+                if limit and expired_deleted == limit:
+                    break
+
+                expires_at, seq, entry = heappop(heap)
+
+                # The entry was deleted or got a newer node in the meantime
+                if entry.expiry_seq != seq:
+                    if self._expiry_stale:
+                        self._expiry_stale -= 1
+                    continue
+
+                # The entry is expired so it can be deleted - we have just popped its node so it cannot be marked as stale
+                if _now > entry.expires_at:
+                    entry.expiry_seq = 0
+                    self._delete(entry.key)
+                    deleted.append(entry.key)
+                    expired_deleted += 1
+
+                # Its expiration time was extended after the node had been added so it needs a new one
+                else:
+                    entry.expiry_seq = 0
+                    self._schedule_expiry(entry)
+
+            self.expired_total += expired_deleted
+            self.last_sweep_deleted = expired_deleted
+            self.last_sweep_duration = self._get_timestamp() - _started
 
         return deleted
 
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Paste
+from paste.util.converters import asbool
+
+# Zato
+from zato.common import NO_DEFAULT_VALUE, ZATO_NONE, ZATO_SEC_USE_RBAC
+from zato.common.pubsub import PubSubMessage
+
+# ################################################################################################################################
+
+# Redefined from zato.server.service.reqresp.sio so as not to depend on zato-server
+NOT_GIVEN = b'ZATO_NOT_GIVEN'
+
+# Kinds of elements - each one is converted in a different way, as established when a plan is compiled
+ELEM_PLAIN = 0
+ELEM_BOOL = 1
+ELEM_INT = 2
+ELEM_SECRET = 3
+ELEM_FORCE_TYPE = 4
+
+# ################################################################################################################################
+
+cdef tuple _special_values = (str(ZATO_NONE), str(ZATO_SEC_USE_RBAC))
+
+# ################################################################################################################################
+
+cdef class Elem(object):
+    """ A single SimpleIO element along with everything that can be established about it before a request arrives.
+    """
+    cdef:
+        public object param
+        public object name
+        public int kind
+        public bint is_required
+        public bint is_complex
+        public bint in_as_is
+        public bint out_as_is
+        public bint is_force_empty
+        public object in_default
+        public object out_default
+
+    def __init__(self, param, name, kind, is_required, is_complex, in_as_is, out_as_is, is_force_empty, in_default,
+            out_default):
+        self.param = param
+        self.name = name
+        self.kind = kind
+        self.is_required = is_required
+        self.is_complex = is_complex
+        self.in_as_is = in_as_is
+        self.out_as_is = out_as_is
+        self.is_force_empty = is_force_empty
+        self.in_default = in_default
+        self.out_default = out_default
+
+    def __repr__(self):
+        return '<{} at {} name:`{}` kind:`{}`>'.format(self.__class__.__name__, hex(id(self)), self.name, self.kind)
+
+# ################################################################################################################################
+
+cdef object convert_value(Elem elem, object value, bint force_empty_keys, bint has_simple_io_config, bint encrypt_secrets,
+    object encrypt_func, object data_format, bint from_sio_to_external):
+    """ Does what zato.server.service.reqresp.sio.convert_sio does, without having to find out what kind of an element it is.
+    """
+    cdef int kind = elem.kind
+
+    if kind == ELEM_BOOL:
+        if value == '':
+            return None if force_empty_keys else elem.out_default
+        return asbool(value or None) # value can be an empty string and asbool chokes on that
+
+    if value is None:
+        return value
+
+    if kind == ELEM_FORCE_TYPE:
+        if value == '':
+            return None if force_empty_keys else elem.out_default
+        return elem.param.convert(value, elem.name, data_format, from_sio_to_external)
+
+    # Empty strings sent in lieu of integers are equivalent to None
+    if kind == ELEM_INT and value == b'':
+        return None
+
+    if value and has_simple_io_config and (value not in _special_values):
+        if kind == ELEM_INT:
+            return int(value)
+        elif kind == ELEM_SECRET and encrypt_secrets and encrypt_func:
+            return encrypt_func(value)
+
+    return value
+
+# ################################################################################################################################
+
+cdef class InputPlan(object):
+    """ Compiled input part of a service's SimpleIO definition.
+    """
+    cdef:
+        public list required
+        public list optional
+        public list required_params
+        public list optional_params
+        public object path_prefix
+        public object default_value
+        public object use_text
+        public object use_channel_params_only
+        public object encrypt_secrets
+
+    def __init__(self, required, optional, path_prefix, default_value, use_text, use_channel_params_only, encrypt_secrets):
+        self.required = required
+        self.optional = optional
+        self.required_params = [elem.param for elem in required]
+        self.optional_params = [elem.param for elem in optional]
+        self.path_prefix = path_prefix
+        self.default_value = default_value
+        self.use_text = use_text
+        self.use_channel_params_only = use_channel_params_only
+        self.encrypt_secrets = encrypt_secrets
+
+# ################################################################################################################################
+
+    cpdef dict get_params(self, object payload, object channel_params, bint channel_over_msg, bint has_simple_io_config,
+        object encrypt_func, bint encrypt_secrets, object data_format, object fallback):
+        """ Returns input parameters out of a dict-like payload and channel_params. Any element that cannot be converted
+        is given to fallback(param, is_required) which is expected to either return its value or raise an exception.
+        """
+        cdef dict params = {}
+        cdef bint has_default_value = self.default_value != NO_DEFAULT_VALUE
+        cdef bint needs_fallback
+        cdef Elem elem
+        cdef list elems
+        cdef object value, channel_value
+
+        for elems in (self.required, self.optional):
+            for elem in elems:
+
+                needs_fallback = False
+
+                try:
+
+                    # Parameters from the channel, e.g. from a query string, are looked up first ..
+                    channel_value = channel_params.get(elem.name, ZATO_NONE)
+
+                    if channel_value != ZATO_NONE:
+                        channel_value = convert_value(elem, channel_value, True, has_simple_io_config, encrypt_secrets,
+                            encrypt_func, data_format, False)
+
+                        # .. and they may take priority over the message itself.
+                        if channel_over_msg:
+                            params[elem.name] = channel_value
+                            continue
+
+                    value = (payload or {}).get(elem.name, NOT_GIVEN) if payload is not None else NOT_GIVEN
+
+                    if (not isinstance(value, PubSubMessage)) and value == NOT_GIVEN:
+                        if has_default_value:
+                            value = self.default_value
+                        elif elem.is_required:
+                            if channel_value is None or channel_value == ZATO_NONE:
+                                needs_fallback = True
+                            else:
+                                value = channel_value
+                        else:
+                            value = elem.in_default
+                    else:
+                        if value is not None and not elem.is_complex:
+                            if isinstance(value, str):
+                                value = value.decode('utf-8')
+                            else:
+                                value = unicode(value)
+
+                        if not elem.in_as_is:
+                            value = convert_value(elem, value, True, has_simple_io_config, encrypt_secrets, encrypt_func,
+                                data_format, False)
+
+                except Exception:
+                    needs_fallback = True
+
+                # Let the caller report what is missing or what could not be converted
+                if needs_fallback:
+                    value = fallback(elem.param, elem.is_required)
+
+                params[elem.name] = value
+
+        return params
+
+# ################################################################################################################################
+
+cdef class OutputPlan(object):
+    """ Compiled output part of a service's SimpleIO definition.
+    """
+    cdef:
+        public list elems
+        public object required_list
+        public object optional_list
+        public set all_attrs
+        public object response_elem
+        public object namespace
+        public object output_repeated
+        public object skip_empty_keys
+        public object force_empty_keys
+        public object allow_empty_required
+        public bint has_output
+
+    def __init__(self, elems, required_list, optional_list, response_elem, namespace, output_repeated, skip_empty_keys,
+            force_empty_keys, allow_empty_required):
+        self.elems = elems
+        self.required_list = required_list
+        self.optional_list = optional_list
+        self.all_attrs = set(elem.name for elem in elems)
+        self.response_elem = response_elem
+        self.namespace = namespace
+        self.output_repeated = output_repeated
+        self.skip_empty_keys = skip_empty_keys
+        self.force_empty_keys = force_empty_keys
+        self.allow_empty_required = allow_empty_required
+        self.has_output = bool(elems)
+
+# ################################################################################################################################
+
+    cpdef list get_items(self, list output, bint is_sa_namedtuple, bint skip_empty_keys, bint allow_empty_required,
+        object data_format, object new_item, bint is_xml, object fallback):
+        """ Returns a list of items to produce a response out of, each created by new_item and filled in with
+        values of output elements. Empty required elements, as well as ones that cannot be converted, are given to
+        fallback(param, item, is_sa_namedtuple, is_required, leave_as_is) which either returns a value or raises an exception.
+        """
+        cdef list out = []
+        cdef Elem elem
+        cdef object item, out_item, value
+        cdef bint use_getattr
+
+        for item in output:
+
+            use_getattr = is_sa_namedtuple or hasattr(item, '_sa_class_manager')
+            out_item = new_item()
+
+            for elem in self.elems:
+
+                value = getattr(item, elem.name, '') if use_getattr else item.get(elem.name, '')
+
+                if isinstance(value, basestring) and not value:
+                    if not allow_empty_required:
+                        value = fallback(elem.param, item, is_sa_namedtuple, elem.is_required, elem.out_as_is)
+
+                elif not elem.out_as_is:
+                    try:
+                        value = convert_value(elem, value, skip_empty_keys, True, False, None, data_format, True)
+                    except Exception:
+                        value = fallback(elem.param, item, is_sa_namedtuple, elem.is_required, False)
+
+                if not value and value != 0:
+                    if skip_empty_keys and not elem.is_force_empty:
+                        continue
+
+                if isinstance(value, str):
+                    value = value.decode('utf-8')
+
+                if is_xml:
+                    setattr(out_item, elem.name, value)
+                else:
+                    out_item[elem.name] = value
+
+            out.append(out_item)
+
+        return out
+
+# ################################################################################################################################
+
+cdef class SIOPlan(object):
+    """ A service's SimpleIO definition compiled for a given simple_io_config.
+    """
+    cdef:
+        public object simple_io_config
+        public InputPlan input
+        public OutputPlan output
+
+    def __init__(self, simple_io_config, input, output):
+        self.simple_io_config = simple_io_config
+        self.input = input
+        self.output = output
+
+# ################################################################################################################################
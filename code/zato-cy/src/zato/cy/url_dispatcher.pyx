@@ -15,6 +15,9 @@ from logging import getLogger
 from operator import itemgetter
 from uuid import uuid4
 
+# Cython
+from libc.stdint cimport uint64_t
+
 # regex
 from regex import compile as re_compile
 
@@ -36,6 +39,15 @@ target_separator = ':::'
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# Segments of patterns that contain any of these characters can be matched only by their regular expressions
+_regex_chars = frozenset('.^$*+?{}[]\\|()')
+
+# Patterns with any of these may match targets that do not start with their literal segments
+_regex_unindexable_chars = frozenset('|(')
+
+# A segment starting with any of these makes the slash preceding it optional or repeated
+_regex_quantifier_chars = frozenset('?*+')
+
 # ################################################################################################################################
 
 cdef class Matcher(object):
@@ -105,19 +117,277 @@ cdef class Matcher(object):
 
 # ################################################################################################################################
 
+cdef class _RouteNode(object):
+    """ A node in the trie of URL path segments. Each edge is a literal segment of at least one pattern
+    and each node keeps channels whose patterns consist of literal segments leading to this node followed by a non-literal one,
+    i.e. ones that can be matched only by their regular expressions.
+    """
+    cdef:
+        dict children
+        list candidates # (channel_idx, channel_item) tuples, sorted by channel_idx
+
+    def __cinit__(self):
+        self.children = {}
+        self.candidates = []
+
+# ################################################################################################################################
+
+cdef inline bint _is_literal(unicode segment, _regex_chars=_regex_chars):
+    for char in segment:
+        if char in _regex_chars:
+            return False
+    return True
+
+# ################################################################################################################################
+
+cdef class _MatchCacheEntry(object):
+    cdef:
+        unicode target
+        dict match
+        object item
+        _MatchCacheEntry prev
+        _MatchCacheEntry next
+
+# ################################################################################################################################
+
+cdef class _MatchCache(object):
+    """ A size-bounded LRU cache of targets matched by channels with path parameters, along with the parameters extracted.
+    Entries are kept in a doubly linked list, from the most to the least recently used one, which is evicted once the cache
+    is full.
+    """
+    cdef:
+        dict _data
+        _MatchCacheEntry head
+        _MatchCacheEntry tail
+        public Py_ssize_t max_size
+        public uint64_t hits
+        public uint64_t misses
+        public uint64_t evictions
+
+    def __cinit__(self, Py_ssize_t max_size):
+        self._data = {}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, _MatchCacheEntry entry):
+        if entry.prev is None:
+            self.head = entry.next
+        else:
+            entry.prev.next = entry.next
+
+        if entry.next is None:
+            self.tail = entry.prev
+        else:
+            entry.next.prev = entry.prev
+
+        entry.prev = entry.next = None
+
+# ################################################################################################################################
+
+    cdef inline void _push_head(self, _MatchCacheEntry entry):
+        entry.next = self.head
+        if self.head is not None:
+            self.head.prev = entry
+        self.head = entry
+
+        if self.tail is None:
+            self.tail = entry
+
+# ################################################################################################################################
+
+    cdef _MatchCacheEntry get(self, unicode target):
+        cdef _MatchCacheEntry entry = self._data.get(target)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if entry is not self.head:
+                self._unlink(entry)
+                self._push_head(entry)
+
+        return entry
+
+# ################################################################################################################################
+
+    cdef set(self, unicode target, dict match, object item):
+        cdef _MatchCacheEntry entry
+
+        if target in self._data:
+            return
+
+        if len(self._data) >= self.max_size:
+            entry = self.tail
+            self._unlink(entry)
+            del self._data[entry.target]
+            self.evictions += 1
+
+        entry = _MatchCacheEntry()
+        entry.target = target
+        entry.match = match
+        entry.item = item
+
+        self._data[target] = entry
+        self._push_head(entry)
+
+# ################################################################################################################################
+
+    cpdef clear(self):
+        self._data.clear()
+        self.head = self.tail = None
+
+# ################################################################################################################################
+
+    cpdef dict get_stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+# ################################################################################################################################
+
 cdef class CyURLData(object):
+    """ Matches incoming requests against HTTP channels. Instead of running each channel's regex in turn, channels
+    are indexed by literal segments of their patterns - a lookup walks the segments of an incoming target and runs regexes
+    only of channels found along the way, in the same order they have in self.channel_data. The index is rebuilt
+    on first match after self.channel_data was replaced or changed its length, or after invalidate_index was called.
 
+    Targets matched by channels with path parameters are kept in a bounded LRU cache, if match_cache_size is greater than zero,
+    which is cleared along with the index.
+    """
     cdef:
         public list channel_data
         public dict url_path_cache
         dict url_target_cache
         bint has_trace1
+        dict _static_targets # Target -> (channel_idx, channel_item) of channels whose patterns are literal in whole
+        _RouteNode _route_root
+        object _indexed_data # The self.channel_data list that the index was built for
+        Py_ssize_t _indexed_len
+        _MatchCache _match_cache # None if caching of dynamic targets is disabled
 
-    def __init__(self, channel_data=None):
+    def __init__(self, channel_data=None, match_cache_size=MISC.DEFAULT_URL_MATCH_CACHE_SIZE):
         self.channel_data = channel_data
         self.url_path_cache = {}
         self.url_target_cache = {}
         self.has_trace1 = logger.isEnabledFor(TRACE1)
+        self._indexed_data = None
+        self._indexed_len = 0
+        self._match_cache = _MatchCache(match_cache_size) if match_cache_size > 0 else None
+
+# ################################################################################################################################
+
+    cpdef invalidate_index(self):
+        """ Makes the next match rebuild the index, e.g. after self.channel_data was re-sorted in place.
+        """
+        self._indexed_data = None
+
+        if self._match_cache is not None:
+            self._match_cache.clear()
+
+# ################################################################################################################################
+
+    cpdef dict get_match_cache_stats(self):
+        """ Returns statistics of the cache of targets matched by channels with path parameters.
+        """
+        return self._match_cache.get_stats() if self._match_cache is not None else {}
+
+# ################################################################################################################################
+
+    cpdef build_index(self):
+        """ Indexes self.channel_data by literal segments of each channel's match target.
+        """
+        cdef dict static_targets = {}
+        cdef _RouteNode root = _RouteNode()
+        cdef _RouteNode node
+        cdef _RouteNode prev_node
+        cdef _RouteNode child
+        cdef unicode pattern
+        cdef unicode segment
+        cdef list segments
+        cdef Py_ssize_t idx
+
+        for idx, item in enumerate(self.channel_data or ()):
+            pattern = unicode(item['match_target'])
+
+            # Alternatives or groups can make anything match so such patterns will be always tried
+            if _regex_unindexable_chars.intersection(pattern):
+                root.candidates.append((idx, item))
+                continue
+
+            segments = pattern.split('/')
+            node = prev_node = root
+
+            for segment in segments:
+                if not _is_literal(segment):
+                    if segment[0] in _regex_quantifier_chars:
+                        prev_node.candidates.append((idx, item))
+                    else:
+                        node.candidates.append((idx, item))
+                    break
+
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _RouteNode()
+                prev_node = node
+                node = child
+
+            # All segments were literal so the pattern can be matched by equality alone,
+            # though only the first channel with a given pattern will ever be matched.
+            else:
+                if pattern not in static_targets:
+                    static_targets[pattern] = (idx, item)
+
+        self._static_targets = static_targets
+        self._route_root = root
+        self._indexed_data = self.channel_data
+        self._indexed_len = len(self.channel_data or ())
+
+        if self._match_cache is not None:
+            self._match_cache.clear()
+
+# ################################################################################################################################
+
+    cdef inline int _ensure_index(self) except -1:
+        if self._indexed_data is not self.channel_data or self._indexed_len != len(self.channel_data or ()):
+            self.build_index()
+
+# ################################################################################################################################
+
+    cdef list _get_candidates(self, unicode target):
+        """ Returns (channel_idx, channel_item) tuples of all channels that may match the target, in the order of their
+        positions in self.channel_data.
+        """
+        cdef list out = []
+        cdef _RouteNode node
+        cdef _RouteNode child
+        cdef object static_item
+        cdef unicode segment
+
+        node = self._route_root
+        static_item = self._static_targets.get(target)
+
+        for segment in target.split('/'):
+            out.extend(node.candidates)
+
+            child = node.children.get(segment)
+            if child is None:
+                break
+            node = child
+
+        if static_item is not None:
+            out.append(static_item)
+
+        out.sort()
+
+        return out
 
 # ################################################################################################################################
 
@@ -130,6 +400,7 @@ cdef class CyURLData(object):
         cdef Matcher matcher
         cdef dict item
         cdef object item_bunch
+        cdef _MatchCacheEntry cache_entry
         cdef unicode target
         cdef unicode target_cache_key = (url_path + soap_action) if has_soap_action else url_path
 
@@ -143,9 +414,19 @@ cdef class CyURLData(object):
         try:
             return {}, self.url_path_cache[target]
         except KeyError:
+
+            self._ensure_index()
+
+            # Return from cache of dynamic targets if it was matched recently. The dict of parameters
+            # is copied because it becomes part of each request and may be modified by services.
+            if self._match_cache is not None:
+                cache_entry = self._match_cache.get(target)
+                if cache_entry is not None:
+                    return dict(cache_entry.match), cache_entry.item
+
             needs_user = not url_path.startswith('/zato')
 
-            for item in self.channel_data:
+            for _, item in self._get_candidates(target):
                 matcher = item['match_target_compiled']
                 if needs_user and matcher.is_internal:
                     continue
@@ -161,9 +442,12 @@ cdef class CyURLData(object):
 
                     item_bunch = _bunchify(item)
 
-                    # Cache that URL if it's a static one, i.e. does not contain dynamically computed variables
+                    # Cache that URL if it's a static one, i.e. does not contain dynamically computed variables,
+                    # otherwise, remember the variables extracted in this target.
                     if matcher.is_static:
                         self.url_path_cache[target] = item_bunch
+                    elif self._match_cache is not None:
+                        self._match_cache.set(target, dict(match), item_bunch)
 
                     return match, item_bunch
 
@@ -195,7 +479,7 @@ cdef class CyURLData(object):
                 url_path = '/zato/{}/{}'.format(prefix, str(uuid4()).replace('-', '/'))
                 channel_data.append(self.get_item(url_path, soap_action))
 
-        self.channel_data = tuple(sorted(channel_data, key=itemgetter('name')))
+        self.channel_data = sorted(channel_data, key=itemgetter('name'))
 
 # ################################################################################################################################
 
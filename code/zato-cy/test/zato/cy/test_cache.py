@@ -14,7 +14,7 @@ from unittest import main as unittest_main, TestCase
 from uuid import uuid4
 
 # Zato
-from zato.cache import Cache, KeyExpiredError
+from zato.cache import Cache, CACHE, KeyExpiredError
 
 # ################################################################################################################################
 
@@ -363,6 +363,67 @@ class CacheTestCace(TestCase):
         self.assertIn(key2, c)
         self.assertNotIn(key3, c)
 
+# ################################################################################################################################
+
+    def test_delete_expired_limit(self):
+
+        c = Cache()
+        now = c.get_timestamp()
+
+        for idx in range(10):
+            c.set('key{}'.format(idx), idx, 10.0, None, orig_now=now)
+
+        c.set('no_expiry', 'value', 0.0, None, orig_now=now)
+
+        # Nothing is due yet
+        self.assertListEqual(c.delete_expired(4, now + 9), [])
+        self.assertEquals(c.last_sweep_deleted, 0)
+
+        deleted1 = c.delete_expired(4, now + 11)
+        self.assertEquals(len(deleted1), 4)
+        self.assertEquals(c.last_sweep_deleted, 4)
+        self.assertGreaterEqual(c.last_sweep_duration, 0.0)
+
+        deleted2 = c.delete_expired(4, now + 11)
+        self.assertEquals(len(deleted2), 4)
+
+        deleted3 = c.delete_expired(4, now + 11)
+        self.assertEquals(len(deleted3), 2)
+
+        self.assertEquals(sorted(deleted1 + deleted2 + deleted3), sorted('key{}'.format(idx) for idx in range(10)))
+        self.assertEquals(c.expired_total, 10)
+        self.assertEquals(len(c), 1)
+        self.assertIn('no_expiry', c)
+
+# ################################################################################################################################
+
+    def test_delete_expired_extended_and_reset(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+
+        c = Cache(extend_expiry_on_get=True)
+        now = c.get_timestamp()
+
+        c.set(key1, expected1, 10.0, None, orig_now=now)
+        c.set(key2, expected2, 10.0, None, orig_now=now)
+
+        # Extends expiry of key1 past its original expiration time
+        c.get(key1, None, False, now + 6)
+
+        # Resets expiry of key2 - it will never expire now
+        c.set(key2, expected2, 0.0, None, orig_now=now + 6)
+
+        deleted = c.delete_expired(0, now + 12)
+        self.assertListEqual(deleted, [])
+        self.assertIn(key1, c)
+        self.assertIn(key2, c)
+
+        deleted = c.delete_expired(0, now + 17)
+        self.assertListEqual(deleted, [key1])
+        self.assertNotIn(key1, c)
+        self.assertIn(key2, c)
+
 # ################################################################################################################################
 
     def test_get_deletes_expired_key(self):
@@ -480,6 +541,69 @@ class CacheTestCace(TestCase):
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_engines_keep_same_order(self):
+
+        max_size = 50
+
+        linked = Cache(max_size, engine=CACHE.ENGINE.LINKED)
+        list_ = Cache(max_size, engine=CACHE.ENGINE.LIST)
+
+        # A repeatable mix of operations over more keys than there is room for so as to exercise evictions too
+        for idx in range(5000):
+            key = 'key{}'.format((idx * 7919) % 80)
+
+            for c in linked, list_:
+                if idx % 5 == 0:
+                    c.delete(key)
+                elif idx % 3 == 0:
+                    c.get(key, None, False)
+                else:
+                    c.set(key, idx, 0.0, None)
+
+            self.assertEquals(linked.index(key), list_.index(key))
+
+        self.assertEquals(len(linked), len(list_))
+        self.assertListEqual(linked.keys_by_position(), list_.keys_by_position())
+        self.assertDictEqual(linked.hits_per_position, list_.hits_per_position)
+
+        linked_slice = [(elem['key'], elem['position']) for elem in linked.get_slice(1, 30, 3)]
+        list_slice = [(elem['key'], elem['position']) for elem in list_.get_slice(1, 30, 3)]
+        self.assertListEqual(linked_slice, list_slice)
+
+# ################################################################################################################################
+
+    def test_linked_engine_positions(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+        key3, expected3 = 'key3', 'value3'
+
+        c = Cache(engine=CACHE.ENGINE.LINKED)
+        c.set(key1, expected1, 0.0, None)
+        c.set(key2, expected2, 0.0, None)
+        c.set(key3, expected3, 0.0, None)
+
+        self.assertListEqual(c.keys_by_position(), [key3, key2, key1])
+
+        returned1 = c.get(key1, None, True)
+        self.assertEquals(returned1.position, 2)
+        self.assertListEqual(c.keys_by_position(), [key1, key3, key2])
+
+        c.delete(key3)
+        self.assertListEqual(c.keys_by_position(), [key1, key2])
+        self.assertEquals(c.index(key2), 1)
+
+        c.clear()
+        self.assertListEqual(c.keys_by_position(), [])
+        self.assertEquals(len(c), 0)
+
+# ################################################################################################################################
+
+    def test_invalid_engine(self):
+        self.assertRaises(ValueError, Cache, engine='invalid')
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
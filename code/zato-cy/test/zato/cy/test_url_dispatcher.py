@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from itertools import product
+from random import choice, randint, seed
+from unittest import TestCase
+
+# Zato
+from zato.url_dispatcher import CyURLData, Matcher, target_separator
+
+# ################################################################################################################################
+
+def get_item(name, url_path, soap_action='', match_slash=True):
+    match_target = '{}{}{}'.format(soap_action, target_separator, url_path)
+    return {
+        'name': name,
+        'match_target': match_target,
+        'match_target_compiled': Matcher(match_target, match_slash),
+    }
+
+# ################################################################################################################################
+
+class URLDispatcherTestCase(TestCase):
+
+    def get_linear_match(self, channel_data, url_path, soap_action=''):
+        """ Matches the same way CyURLData did before it had an index, i.e. by running each channel's regex in turn.
+        """
+        target = '{}{}{}'.format(soap_action, target_separator, url_path)
+        needs_user = not url_path.startswith('/zato')
+
+        for item in channel_data:
+            matcher = item['match_target_compiled']
+            if needs_user and matcher.is_internal:
+                continue
+            match = matcher.matcher.match(target)
+            if match:
+                return dict(zip(matcher.group_names, match.groups())), item['name']
+
+        return None, None
+
+    def assert_same_as_linear(self, channel_data, url_path, soap_action=''):
+        url_data = CyURLData(channel_data)
+        match, item = url_data.match(url_path, soap_action, bool(soap_action))
+        self.assertEquals((match, item.name if item else None), self.get_linear_match(channel_data, url_path, soap_action))
+
+# ################################################################################################################################
+
+    def test_order_is_kept(self):
+
+        static_first = [get_item('1', '/customer/list'), get_item('2', '/customer/{cid}')]
+        dynamic_first = [get_item('1', '/customer/{cid}'), get_item('2', '/customer/list')]
+
+        match, item = CyURLData(static_first).match('/customer/list', '', False)
+        self.assertEquals(match, {})
+        self.assertEquals(item.name, '1')
+
+        match, item = CyURLData(dynamic_first).match('/customer/list', '', False)
+        self.assertEquals(match, {'cid':'list'})
+        self.assertEquals(item.name, '1')
+
+        match, item = CyURLData(static_first).match('/customer/123', '', False)
+        self.assertEquals(match, {'cid':'123'})
+        self.assertEquals(item.name, '2')
+
+# ################################################################################################################################
+
+    def test_soap_action(self):
+        channel_data = [get_item('1', '/customer/{cid}', 'get'), get_item('2', '/customer/{cid}')]
+
+        match, item = CyURLData(channel_data).match('/customer/123', 'get', True)
+        self.assertEquals(match, {'cid':'123'})
+        self.assertEquals(item.name, '1')
+
+        match, item = CyURLData(channel_data).match('/customer/123', '', False)
+        self.assertEquals(item.name, '2')
+
+# ################################################################################################################################
+
+    def test_internal_skipped(self):
+        channel_data = [get_item('1', '/zato/ping'), get_item('2', '/zato/{name}')]
+        url_data = CyURLData(channel_data)
+
+        self.assertEquals(url_data.match('/zato/ping', '', False)[1].name, '1')
+        self.assertEquals(url_data.match('/zato/abc', '', False)[1].name, '2')
+        self.assertEquals(url_data.match('/zatoabc', '', False), (None, None))
+
+# ################################################################################################################################
+
+    def test_match_slash(self):
+        channel_data = [get_item('1', '/files/{path}'), get_item('2', '/docs/{path}', match_slash=False)]
+        url_data = CyURLData(channel_data)
+
+        self.assertEquals(url_data.match('/files/a/b/c', '', False)[0], {'path':'a/b/c'})
+        self.assertEquals(url_data.match('/docs/a/b/c', '', False), (None, None))
+        self.assertEquals(url_data.match('/docs/abc', '', False)[0], {'path':'abc'})
+
+# ################################################################################################################################
+
+    def test_regex_segments(self):
+        channel_data = [
+            get_item('1', '/api/v1.0/{id}'),
+            get_item('2', '/opt/?ional'),
+            get_item('3', '/alt1|/alt2'),
+            get_item('4', '/num/[0-9]+/x'),
+        ]
+
+        for url_path in ('/api/v1.0/123', '/api/v1x0/123', '/opt/ional', '/optional', '/alt1', '/alt1/x', '/alt2', '/num/12/x',
+            '/num/ab/x', '/other'):
+            self.assert_same_as_linear(channel_data, url_path)
+
+        self.assertEquals(CyURLData(channel_data).match('/optional', '', False)[1].name, '2')
+        self.assertEquals(CyURLData(channel_data).match('/alt1/x', '', False)[1].name, '3')
+
+# ################################################################################################################################
+
+    def test_channel_data_changed(self):
+        channel_data = [get_item('1', '/customer/{cid}')]
+        url_data = CyURLData(channel_data)
+
+        self.assertEquals(url_data.match('/order/123', '', False), (None, None))
+
+        # Appending to the list is noticed without explicitly rebuilding the index ..
+        channel_data.append(get_item('2', '/order/{oid}'))
+        self.assertEquals(url_data.match('/order/123', '', False)[1].name, '2')
+
+        # .. whereas re-ordering it in place requires invalidating it.
+        channel_data.append(get_item('3', '/order/{id}'))
+        channel_data.reverse()
+        url_data.invalidate_index()
+        self.assertEquals(url_data.match('/order/123', '', False)[1].name, '3')
+
+        # Replacing the list altogether
+        url_data.channel_data = []
+        self.assertEquals(url_data.match('/customer/123', '', False), (None, None))
+
+# ################################################################################################################################
+
+    def test_same_as_linear(self):
+        seed(8)
+
+        segments = ['a', 'b', 'zato', '{x}', '{y}', 'a.b', 'c*']
+        paths = ['a', 'b', 'zato', 'a.b', 'axb', 'ccc', '123', '']
+
+        for idx in range(30):
+            channel_data = []
+            for name in range(randint(1, 20)):
+                url_path = '/' + '/'.join(choice(segments) for _ in range(randint(1, 4)))
+                channel_data.append(get_item(str(name), url_path, match_slash=choice((True, False))))
+
+            for length in range(1, 4):
+                for url_path in product(paths, repeat=length):
+                    self.assert_same_as_linear(channel_data, '/' + '/'.join(url_path))
+
+# ################################################################################################################################
+
+    def test_match_cache(self):
+        channel_data = [get_item('1', '/customer/{cid}')]
+        url_data = CyURLData(channel_data, match_cache_size=2)
+
+        for _ in range(3):
+            match, item = url_data.match('/customer/123', '', False)
+            self.assertEquals(match, {'cid':'123'})
+            self.assertEquals(item.name, '1')
+
+        # Parameters returned are separate for each request
+        match['cid'] = 'abc'
+        self.assertEquals(url_data.match('/customer/123', '', False)[0], {'cid':'123'})
+
+        stats = url_data.get_match_cache_stats()
+        self.assertEquals((stats['size'], stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1, 0))
+
+        # /customer/123 was used more recently than /customer/456 so the latter is evicted
+        url_data.match('/customer/456', '', False)
+        url_data.match('/customer/123', '', False)
+        url_data.match('/customer/789', '', False)
+
+        stats = url_data.get_match_cache_stats()
+        self.assertEquals((stats['size'], stats['hits'], stats['misses'], stats['evictions']), (2, 4, 3, 1))
+
+        url_data.match('/customer/123', '', False)
+        url_data.match('/customer/456', '', False)
+
+        stats = url_data.get_match_cache_stats()
+        self.assertEquals((stats['hits'], stats['misses']), (5, 4))
+
+        # A new channel takes precedence so the cache needs to be cleared
+        channel_data.insert(0, get_item('0', '/customer/{id}'))
+        url_data.invalidate_index()
+
+        self.assertEquals(url_data.get_match_cache_stats()['size'], 0)
+        match, item = url_data.match('/customer/123', '', False)
+        self.assertEquals(match, {'id':'123'})
+        self.assertEquals(item.name, '0')
+
+# ################################################################################################################################
+
+    def test_match_cache_disabled(self):
+        url_data = CyURLData([get_item('1', '/customer/{cid}')], match_cache_size=0)
+
+        self.assertEquals(url_data.match('/customer/123', '', False)[0], {'cid':'123'})
+        self.assertEquals(url_data.match('/customer/123', '', False)[0], {'cid':'123'})
+        self.assertEquals(url_data.get_match_cache_stats(), {})
+
+# ################################################################################################################################
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Measures scheduling precision and CPU usage of the scheduler with many interval-based jobs, e.g.:
+#
+# $ ./bin/py zato-scheduler/bench/bench_scheduler.py
+# $ ./bin/py zato-scheduler/bench/bench_scheduler.py --jobs 10000,100000 --duration 30
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import randint, random
+from resource import getrusage, RUSAGE_SELF
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import SCHEDULER
+from zato.scheduler.backend import Interval, Job, Scheduler
+
+# ################################################################################################################################
+
+default_jobs = '10000,100000'
+default_duration = 20 # In seconds
+default_max_interval = 10 # In seconds
+
+# ################################################################################################################################
+
+def get_cpu_time():
+    usage = getrusage(RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# ################################################################################################################################
+
+def get_scheduler(duration):
+
+    config = Bunch()
+    config.on_job_executed_cb = lambda ctx: None
+    config._add_startup_jobs = False
+    config._add_scheduler_jobs = False
+    config.startup_jobs = []
+    config.odb = None
+    config.job_log_level = 'debug'
+
+    scheduler = Scheduler(config, None)
+    scheduler.init_jobs = lambda: None
+
+    def iter_cb(stop_at):
+        if datetime.utcnow() >= stop_at:
+            scheduler.keep_running = False
+
+    scheduler.iter_cb = iter_cb
+    scheduler.iter_cb_args = (datetime.utcnow() + timedelta(seconds=duration),)
+
+    return scheduler
+
+# ################################################################################################################################
+
+def bench(job_count, duration, max_interval):
+    """ Runs job_count jobs for duration seconds and returns per-job creation time in microseconds, the number of runs,
+    their median and maximum delay in milliseconds and CPU time used per wall-clock second.
+    """
+    delays = []
+    _utcnow = datetime.utcnow
+    _run = Job.run
+
+    def run(job, now):
+        delays.append((_utcnow() - job.next_run_time).total_seconds())
+        return _run(job, now)
+
+    Job.run = run
+
+    try:
+        scheduler = get_scheduler(duration)
+        start_time = datetime.utcnow() + timedelta(seconds=1)
+
+        jobs = []
+        for idx in xrange(job_count):
+
+            # Jobs are spread evenly across the first interval so that they do not all run at once
+            interval = randint(1, max_interval)
+            job_start_time = start_time + timedelta(seconds=random() * interval)
+
+            jobs.append(Job(idx, 'job.{}'.format(idx), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=interval),
+                job_start_time, clone_start_time=True))
+
+        start = time()
+        for job in jobs:
+            scheduler.create(job)
+        create_time = (time() - start) / job_count * 1000000
+
+        cpu_start = get_cpu_time()
+        wall_start = time()
+
+        scheduler.run()
+
+        cpu_usage = (get_cpu_time() - cpu_start) / (time() - wall_start)
+
+    finally:
+        Job.run = _run
+
+    delays.sort()
+    median = delays[len(delays) // 2] * 1000 if delays else 0
+    maximum = delays[-1] * 1000 if delays else 0
+
+    return create_time, len(delays), median, maximum, cpu_usage
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Measures scheduling precision and CPU usage of the scheduler')
+    parser.add_argument('--jobs', default=default_jobs, help='Comma-separated numbers of jobs (default: %(default)s)')
+    parser.add_argument('--duration', type=int, default=default_duration,
+        help='How long to run each measurement for, in seconds (default: %(default)s)')
+    parser.add_argument('--max-interval', type=int, default=default_max_interval,
+        help='Jobs have random intervals from 1 second up to this many seconds (default: %(default)s)')
+    args = parser.parse_args()
+
+    header = '{:>8} {:>12} {:>10} {:>12} {:>12} {:>8}'
+    row = '{:>8} {:>12.2f} {:>10} {:>12.3f} {:>12.3f} {:>8.2f}'
+
+    print(header.format('jobs', 'create (us)', 'runs', 'median (ms)', 'max (ms)', 'cpu'))
+
+    for job_count in [int(elem) for elem in args.jobs.split(',')]:
+        print(row.format(job_count, *bench(job_count, args.duration, args.max_interval)))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Measures how long it takes to compute start times of long-lived jobs when the scheduler starts, e.g.:
+#
+# $ ./bin/py zato-scheduler/bench/bench_startup.py
+# $ ./bin/py zato-scheduler/bench/bench_startup.py --jobs 10000 --age 730 --rrule-sample 3
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import randint
+from time import time
+
+# dateutil
+from dateutil.rrule import rrule, SECONDLY
+
+# Zato
+from zato.common import SCHEDULER
+from zato.scheduler.backend import get_cron_schedule, Interval, Job
+
+# ################################################################################################################################
+
+default_jobs = 5000
+default_age = 730 # In days
+default_rrule_sample = 0
+
+cron_definitions = ['* * * * *', '*/5 * * * *', '0 * * * *', '30 2 * * 1-5', '0 0 1 * *']
+
+# ################################################################################################################################
+
+def bench_interval_based(jobs, start_time):
+    """ Creates interval-based jobs with intervals of 1 to 60 seconds and returns the total time it took, in seconds.
+    """
+    start = time()
+
+    for idx in xrange(jobs):
+        Job(idx, 'job.{}'.format(idx), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=randint(1, 60)), start_time)
+
+    return time() - start
+
+# ################################################################################################################################
+
+def bench_cron_style(jobs):
+    """ Creates cron-style jobs sharing a few definitions and returns the total time it took, in seconds.
+    """
+    start = time()
+
+    for idx in xrange(jobs):
+        interval = get_cron_schedule(cron_definitions[idx % len(cron_definitions)])
+        Job(idx, 'job.{}'.format(idx), SCHEDULER.JOB_TYPE.CRON_STYLE, interval)
+
+    return time() - start
+
+# ################################################################################################################################
+
+def bench_rrule(jobs, start_time):
+    """ Finds the last run of one-second jobs the way it used to be done, by iterating over all of their past runs.
+    """
+    now = datetime.utcnow()
+    start = time()
+
+    for _ in xrange(jobs):
+        rrule(SECONDLY, interval=1, dtstart=start_time).before(now)
+
+    return time() - start
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Measures how long it takes to compute start times of long-lived jobs')
+    parser.add_argument('--jobs', type=int, default=default_jobs, help='How many jobs of each type to create (default: %(default)s)')
+    parser.add_argument('--age', type=int, default=default_age,
+        help='How many days ago interval-based jobs were started (default: %(default)s)')
+    parser.add_argument('--rrule-sample', type=int, default=default_rrule_sample,
+        help='For comparison, how many jobs to find the last run of by iterating over their past runs (default: %(default)s)')
+    args = parser.parse_args()
+
+    start_time = datetime.utcnow() - timedelta(days=args.age)
+
+    total = bench_interval_based(args.jobs, start_time)
+    print('interval-based: {} jobs in {:.3f} s ({:.2f} us per job)'.format(args.jobs, total, total / args.jobs * 1000000))
+
+    total = bench_cron_style(args.jobs)
+    print('cron-style: {} jobs in {:.3f} s ({:.2f} us per job)'.format(args.jobs, total, total / args.jobs * 1000000))
+
+    if args.rrule_sample:
+        total = bench_rrule(args.rrule_sample, start_time)
+        print('rrule: {} jobs in {:.3f} s ({:.2f} s per job)'.format(args.rrule_sample, total, total / args.rrule_sample))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
@@ -12,15 +12,15 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 from traceback import format_exc
 
-# crontab
-from crontab import CronTab
-
 # dateutil
 from dateutil.parser import parse
 
 # gevent
 from gevent import sleep
 
+# Paste
+from paste.util.converters import asbool
+
 # Zato
 from zato.broker import BrokerMessageReceiver
 from zato.broker.client import BrokerClient
@@ -28,7 +28,7 @@ from zato.common import CHANNEL, DATA_FORMAT, SCHEDULER, ZATO_NONE
 from zato.common.broker_message import MESSAGE_TYPE, SCHEDULER as SCHEDULER_MSG, SERVICE, TOPICS
 from zato.common.kvdb import KVDB
 from zato.common.util import new_cid, spawn_greenlet
-from zato.scheduler.backend import Interval, Job, Scheduler as _Scheduler
+from zato.scheduler.backend import get_cron_schedule, Interval, Job, Scheduler as _Scheduler
 
 # ################################################################################################################################
 
@@ -63,7 +63,8 @@ class Scheduler(BrokerMessageReceiver):
             TOPICS[MESSAGE_TYPE.TO_SCHEDULER]: self.on_broker_msg,
         }
 
-        self.broker_client = BrokerClient(self.broker_conn, 'scheduler', self.broker_callbacks, [])
+        self.broker_client = BrokerClient(self.broker_conn, 'scheduler', self.broker_callbacks, [],
+            asbool(self.config.main.broker.get('invoke_async_queue', False)))
 
         if run:
             self.serve_forever()
@@ -147,7 +148,7 @@ class Scheduler(BrokerMessageReceiver):
         }
 
         if job_type == SCHEDULER.JOB_TYPE.CRON_STYLE:
-            interval = CronTab(cron_definition)
+            interval = get_cron_schedule(cron_definition)
         else:
             interval = Interval(days=days, hours=hours, minutes=minutes, seconds=seconds)
 
@@ -10,15 +10,18 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import datetime
+from heapq import heapify, heappop, heappush
+from itertools import count
 from logging import getLogger
 from traceback import format_exc
 
-# datetime
-from dateutil.rrule import rrule, SECONDLY
+# crontab
+from crontab import CronTab
 
 # gevent
 import gevent # Imported directly so it can be mocked out in tests
 from gevent import lock, sleep
+from gevent.event import Event
 
 # paodate
 from paodate import Delta
@@ -28,7 +31,7 @@ from paste.util.converters import asbool
 
 # Zato
 from zato.common import SCHEDULER
-from zato.common.util import add_scheduler_jobs, add_startup_jobs, make_repr, new_cid, spawn_greenlet
+from zato.common.util import add_scheduler_jobs, add_startup_jobs, make_repr, new_cid
 
 # ################################################################################################################################
 
@@ -40,6 +43,11 @@ initial_sleep = 30
 
 # ################################################################################################################################
 
+def _to_microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+# ################################################################################################################################
+
 class Interval(object):
     def __init__(self, days=0, hours=0, minutes=0, seconds=0, in_seconds=0):
         self.days = days
@@ -58,6 +66,49 @@ class Interval(object):
 
 # ################################################################################################################################
 
+class CronSchedule(object):
+    """ A parsed cron definition, shared by all jobs that use the same one. Remembers the last next run time it computed
+    so that jobs scheduled within the same second, e.g. all of them during startup, do not compute it again.
+    """
+    __slots__ = ('definition', 'cron_tab', 'last_second', 'last_next_run_time')
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.cron_tab = CronTab(definition)
+        self.last_second = None
+        self.last_next_run_time = None
+
+    def __str__(self):
+        return make_repr(self)
+
+    __repr__ = __str__
+
+    def next(self, now):
+        """ Returns the number of seconds from now to the next run, as CronTab.next does.
+        """
+        second = now.replace(microsecond=0)
+
+        # Cron definitions have a resolution of one second at most so the result is the same for the whole second
+        if second != self.last_second:
+            self.last_next_run_time = second + datetime.timedelta(seconds=self.cron_tab.next(second))
+            self.last_second = second
+
+        return (self.last_next_run_time - now).total_seconds()
+
+# ################################################################################################################################
+
+_cron_schedules = {}
+
+def get_cron_schedule(definition):
+    """ Returns a CronSchedule for a given cron definition, parsing each distinct definition only once.
+    """
+    schedule = _cron_schedules.get(definition)
+    if not schedule:
+        schedule = _cron_schedules[definition] = CronSchedule(definition)
+    return schedule
+
+# ################################################################################################################################
+
 class Job(object):
     def __init__(self, id, name, type, interval, start_time=None, callback=None, cb_kwargs=None, max_repeats=None,
             on_max_repeats_reached_cb=None, is_active=True, clone_start_time=False, cron_definition=None, old_name=None):
@@ -79,6 +130,8 @@ class Job(object):
         self.max_repeats_reached = False
         self.max_repeats_reached_at = None
         self.keep_running = True
+        self.next_run_time = None # Set by the scheduler once the job is scheduled
+        self.schedule_seq = None # Sequence number of the job's current entry in the scheduler's heap
 
         if clone_start_time:
             self.start_time = start_time
@@ -90,10 +143,6 @@ class Job(object):
         else:
             self.start_time = self.get_start_time(start_time if start_time is not None else datetime.datetime.utcnow())
 
-        self.wait_sleep_time = 1
-        self.wait_iter_cb = None
-        self.wait_iter_cb_args = ()
-
         # TODO: Add skip_days, skip_hours and skip_dates
 
     def __str__(self):
@@ -159,8 +208,7 @@ class Job(object):
             return first_run_time
 
         else:
-            runs = rrule(SECONDLY, interval=int(self.interval.in_seconds), dtstart=start_time, count=self.max_repeats)
-            last_run_time = runs.before(now)
+            last_run_time = self.get_last_run_time(start_time, now)
             next_run_time = last_run_time + interval
 
             if next_run_time >= now:
@@ -182,6 +230,23 @@ class Job(object):
                     'Cannot compute start_time. Job `%s` max repeats reached at `%s` (UTC)',
                     self.name, self.max_repeats_reached_at)
 
+    def get_last_run_time(self, start_time, now):
+        """ Returns the time of the latest run before now of a job that runs each interval seconds since start_time,
+        taking max_repeats into account. The result is computed directly rather than by iterating over all the runs
+        there have been since start_time, of which there may be millions.
+        """
+        interval = _to_microseconds(datetime.timedelta(seconds=self.interval.in_seconds))
+        elapsed = _to_microseconds(now - start_time)
+
+        # How many intervals ago was the last run strictly before now ..
+        runs = (elapsed - 1) // interval
+
+        # .. unless it had no chance to take place because there were not that many repeats allowed.
+        if self.max_repeats:
+            runs = min(runs, self.max_repeats - 1)
+
+        return start_time + datetime.timedelta(microseconds=runs * interval)
+
     def get_context(self):
         ctx = {
             'cid':new_cid(),
@@ -211,84 +276,72 @@ class Job(object):
         else:
             raise ValueError('Unsupported job type `{}` ({})'.format(self.type, self.name))
 
-    def _spawn(self, *args, **kwargs):
-        """ A thin wrapper so that it is easier to mock this method out in unit-tests.
+    def get_next_run_time(self, run_time, now):
+        """ Returns the earliest time after now the job should run at, given the time it was last scheduled to run at.
+        The result is computed from the schedule rather than from the time the previous run actually took place,
+        which means that any delays in running the job do not accumulate. Runs that were missed altogether,
+        e.g. because the process was busy, are skipped rather than executed all at once.
         """
-        return spawn_greenlet(*args, **kwargs)
+        if self.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED:
+            interval = self.interval.in_seconds
+            behind = (now - run_time).total_seconds()
+            runs = int(behind // interval) + 1 if behind >= 0 else 1
+            return run_time + datetime.timedelta(seconds=interval * runs)
 
-    def main_loop(self):
+        elif self.type == SCHEDULER.JOB_TYPE.CRON_STYLE:
+            run_time = max(run_time, now)
+            return run_time + datetime.timedelta(seconds=self.get_sleep_time(run_time))
 
-        logger.info('Job entering main loop `%s`', self)
+        else:
+            raise ValueError('Unsupported job type `{}` ({})'.format(self.type, self.name))
 
-        _sleep = gevent.sleep
+    def _spawn(self, *args, **kwargs):
+        """ A thin wrapper so that it is easier to mock this method out in unit-tests.
+        """
+        return gevent.spawn(*args, **kwargs)
 
+    def run(self, now):
+        """ Runs the job once, in a new greenlet, and returns the time it should run next at
+        or None if it should not be run anymore.
+        """
         try:
-            while self.keep_running:
-                try:
-                    self.current_run += 1
-
-                    # Perhaps we've already been executed enough times
-                    if self.max_repeats and self.current_run == self.max_repeats:
-                        self.keep_running = False
-                        self.max_repeats_reached = True
-                        self.max_repeats_reached_at = datetime.datetime.utcnow()
-
-                        if self.on_max_repeats_reached_cb:
-                            self.on_max_repeats_reached_cb(self)
+            self.current_run += 1
 
-                    # Invoke callback in a new greenlet so it doesn't block the current one.
-                    self._spawn(self.callback, **{'ctx':self.get_context()})
-
-                except Exception, e:
-                    logger.warn(format_exc(e))
+            # Perhaps we've already been executed enough times
+            if self.max_repeats and self.current_run == self.max_repeats:
+                self.keep_running = False
+                self.max_repeats_reached = True
+                self.max_repeats_reached_at = now
 
-                finally:
-                    # Pause the greenlet for however long is needed if it is not a one-off job
-                    if self.type == SCHEDULER.JOB_TYPE.ONE_TIME:
-                        return True
-                    else:
-                        _sleep(self.get_sleep_time(datetime.datetime.utcnow()))
+                if self.on_max_repeats_reached_cb:
+                    self.on_max_repeats_reached_cb(self)
 
-            logger.info('Job leaving main loop `%s` after %d iterations', self, self.current_run)
+            # Invoke callback in a new greenlet so it doesn't block the scheduler.
+            self._spawn(self.callback, **{'ctx':self.get_context()})
 
         except Exception, e:
             logger.warn(format_exc(e))
 
-        return True
-
-    def run(self):
+        # One-off jobs and the ones that reached max_repeats are not run again. Other jobs are,
+        # even if this run failed above, e.g. because of a transient error, otherwise they would never run again.
+        if self.type == SCHEDULER.JOB_TYPE.ONE_TIME or not self.keep_running:
+            return
 
-        # OK, we're ready
         try:
-
-            if not self.start_time:
-                logger.warn('Job `%s` cannot start without start_time set', self.name)
-                return
-
-            logger.info('Job starting `%s`', self)
-
-            _utcnow = datetime.datetime.utcnow
-            _sleep = gevent.sleep
-
-            # If the job has a start time in the future, sleep until it's ready to go.
-            now = _utcnow()
-
-            while self.start_time > now:
-                _sleep(self.wait_sleep_time)
-
-                if self.wait_iter_cb:
-                    self.wait_iter_cb(self.start_time, now, *self.wait_iter_cb_args)
-
-                now = _utcnow()
-
-            self.main_loop()
-
+            self.next_run_time = self.get_next_run_time(self.next_run_time, now)
         except Exception, e:
-            logger.warn(format_exc(e))
+            logger.warn('Could not compute next run time of job `%s`, it will not run anymore, e:`%s`', self.name, format_exc(e))
+        else:
+            return self.next_run_time
 
 # ################################################################################################################################
 
 class Scheduler(object):
+    """ Runs all jobs from a single dispatcher loop. Jobs waiting for their next run are kept in a heap of
+    (next_run_time, sequence, job) entries so that the dispatcher only ever needs to look at the ones that are due
+    and scheduling a job is O(log n). Unscheduled jobs are not searched for in the heap, their entries are
+    skipped when popped and the heap is rebuilt once there are more stale entries than live ones.
+    """
     def __init__(self, config, api):
         self.config = config
         self.api = api
@@ -296,10 +349,13 @@ class Scheduler(object):
         self.startup_jobs = config.startup_jobs
         self.odb = config.odb
         self.jobs = {}
-        self.job_greenlets = {}
+        self.job_heap = []
+        self.job_heap_seq = count()
+        self.job_heap_stale = 0
+        self.job_heap_changed = Event()
         self.keep_running = True
         self.lock = lock.RLock()
-        self.sleep_time = 0.1
+        self.sleep_time = 0.1 # The longest the dispatcher will wait for without checking if it should keep running
         self.iter_cb = None
         self.iter_cb_args = ()
         self.ready = False
@@ -315,6 +371,11 @@ class Scheduler(object):
         """ Actually creates a job. Must be called with self.lock held.
         """
         try:
+            # Any entry a previous job of that name has in the heap is now stale
+            previous = self.jobs.get(job.name)
+            if previous and previous.next_run_time:
+                self.job_heap_stale += 1
+
             self.jobs[job.name] = job
             if job.is_active:
                 if spawn:
@@ -343,19 +404,19 @@ class Scheduler(object):
         """
         # The job could have been renamed so we need to unschedule it by the previous name, if there is one
         name = job.old_name if job.old_name else job.name
-        found = False
         job.keep_running = False
 
-        if name in self.jobs.iterkeys():
-            del self.jobs[name]
-            found = True
+        scheduled = self.jobs.pop(name, None)
+        if not scheduled:
+            return False
 
-        if name in self.job_greenlets.keys():
-            self.job_greenlets[name].kill(block=False, timeout=2.0)
-            del self.job_greenlets[name]
-            found = True
+        scheduled.keep_running = False
 
-        return found
+        # Its entry in the heap, if any, is now stale and will be skipped
+        if scheduled.next_run_time:
+            self.job_heap_stale += 1
+
+        return True
 
     def _unschedule_stop(self, job, message):
         """ API for job deletion and stopping. Must be called with a self.lock held.
@@ -375,17 +436,10 @@ class Scheduler(object):
     def unschedule_by_name(self, name):
         """ Deletes a job by its name.
         """
-        _job = None
-
         with self.lock:
-            for job in self.jobs.itervalues():
-                if job.name == name:
-                    _job = job
-                    break
-
-        # We can't do it with self.lock because deleting changes the set = RuntimeError
-        if _job:
-            self.unschedule(job)
+            job = self.jobs.get(name)
+            if job:
+                self._unschedule_stop(job, '(src:unschedule)')
 
     def stop_job(self, job):
         """ Stops a job by deleting it.
@@ -397,23 +451,19 @@ class Scheduler(object):
         """ Stops all jobs and the scheduler itself.
         """
         with self.lock:
-            jobs = sorted(self.jobs)
-            for job in jobs:
-                self._unschedule_stop(job.clone(), 'stopped')
+            for name in sorted(self.jobs):
+                self._unschedule_stop(self.jobs[name], 'stopped')
 
-    def sleep(self, value):
-        """ A method introduced so the class is easier to mock out in tests.
-        """
-        gevent.sleep(value)
+        self.keep_running = False
+        self.job_heap_changed.set()
 
     def execute(self, name):
         """ Executes a job no matter if it's active or not. One-time job are not unscheduled afterwards.
         """
         with self.lock:
-            for job in self.jobs.itervalues():
-                if job.name == name:
-                    self.on_job_executed(job.get_context(), False)
-                    break
+            job = self.jobs.get(name)
+            if job:
+                self.on_job_executed(job.get_context(), False)
             else:
                 logger.warn('No such job `%s` in `%s`', name, [elem.get_context() for elem in self.jobs.itervalues()])
 
@@ -425,17 +475,65 @@ class Scheduler(object):
         if ctx['type'] == SCHEDULER.JOB_TYPE.ONE_TIME and unschedule_one_time:
             self.unschedule_by_name(ctx['name'])
 
-    def _spawn(self, *args, **kwargs):
-        """ As in the Job class, this is a thin wrapper so that it is easier to mock this method out in unit-tests.
+    def _push_job(self, job, next_run_time):
+        """ Adds a job to the heap of jobs waiting for their next run. Must be called with self.lock held.
         """
-        return spawn_greenlet(*args, **kwargs)
+        job.schedule_seq = next(self.job_heap_seq)
+        entry = (next_run_time, job.schedule_seq, job)
+        heappush(self.job_heap, entry)
+
+        # Wake up the dispatcher if the job is to run before anything it has been waiting for
+        if self.job_heap[0] is entry:
+            self.job_heap_changed.set()
 
     def spawn_job(self, job):
-        """ Spawns a job's greenlet. Must be called with self.lock held.
+        """ Schedules a job's first run. Must be called with self.lock held.
         """
+        if not job.start_time:
+            logger.warn('Job `%s` cannot start without start_time set', job.name)
+            return
+
         job.callback = self.on_job_executed
         job.on_max_repeats_reached_cb = self.on_max_repeats_reached
-        self.job_greenlets[job.name] = self._spawn(job.run)
+        job.next_run_time = job.start_time
+
+        self._push_job(job, job.next_run_time)
+
+    def _is_scheduled(self, seq, job):
+        return job.keep_running and job.schedule_seq == seq and self.jobs.get(job.name) is job
+
+    def _compact_job_heap(self):
+        """ Removes entries of jobs that are no longer scheduled. Must be called with self.lock held.
+        """
+        self.job_heap[:] = [entry for entry in self.job_heap if self._is_scheduled(entry[1], entry[2])]
+        heapify(self.job_heap)
+        self.job_heap_stale = 0
+
+    def run_due_jobs(self, now):
+        """ Runs all jobs that are due and schedules their next runs. Returns the number of seconds until the next job
+        is due or None if there are no jobs at all.
+        """
+        _heap = self.job_heap
+
+        with self.lock:
+
+            while _heap and _heap[0][0] <= now:
+                _, seq, job = heappop(_heap)
+
+                if not self._is_scheduled(seq, job):
+                    self.job_heap_stale = max(self.job_heap_stale - 1, 0)
+                    continue
+
+                next_run_time = job.run(now)
+
+                if next_run_time:
+                    self._push_job(job, next_run_time)
+
+            if self.job_heap_stale > len(_heap) // 2:
+                self._compact_job_heap()
+
+            if _heap:
+                return (_heap[0][0] - now).total_seconds()
 
     def init_jobs(self):
         sleep(initial_sleep) # To make sure that at least one server is running if the environment was started from quickstart scripts
@@ -455,8 +553,10 @@ class Scheduler(object):
             # Add default jobs to the ODB and start all of them, the default and user-defined ones
             self.init_jobs()
 
-            _sleep = self.sleep
+            _utcnow = datetime.datetime.utcnow
             _sleep_time = self.sleep_time
+            _wait = self.job_heap_changed.wait
+            _clear = self.job_heap_changed.clear
 
             with self.lock:
                 for job in sorted(self.jobs.itervalues()):
@@ -471,7 +571,15 @@ class Scheduler(object):
             logger.info('Scheduler started')
 
             while self.keep_running:
-                _sleep(_sleep_time)
+                try:
+                    _clear()
+                    next_due = self.run_due_jobs(_utcnow())
+
+                    # Sleep until the next job is due or until a job that is due earlier is scheduled
+                    _wait(_sleep_time if next_due is None else min(next_due, _sleep_time))
+
+                except Exception, e:
+                    logger.warn(format_exc(e))
 
                 if self.iter_cb:
                     self.iter_cb(*self.iter_cb_args)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Measures how long it takes to store information about services deployed during server startup in the ODB,
+# one service at a time vs. all of them in bulk, e.g.:
+#
+# $ ./bin/py zato-server/bench/bench_deploy.py
+# $ ./bin/py zato-server/bench/bench_deploy.py --services 2000 --per-module 20
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from argparse import ArgumentParser
+from datetime import datetime
+from hashlib import sha256
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import SourceInfo
+from zato.common.odb.api import ODBManager
+from zato.common.odb.model import Cluster, DeployedService, Server, Service
+
+# ################################################################################################################################
+
+default_services = 800
+default_per_module = 10
+
+# ################################################################################################################################
+
+def get_odb(db_path):
+    """ Returns an ODBManager using a new SQLite database with a single cluster and server in it.
+    """
+    engine = create_engine('sqlite:///{}'.format(db_path))
+
+    for class_ in Cluster, Server, Service, DeployedService:
+        class_.__table__.create(engine)
+
+    session = sessionmaker(bind=engine)()
+
+    cluster = Cluster(None, 'bench', None, 'sqlite', None, None, None, None, None, 'localhost', 1, 'localhost', 2, 3)
+    server = Server(None, 'server1', cluster, 'token1')
+
+    session.add(cluster)
+    session.add(server)
+    session.commit()
+
+    odb = ODBManager()
+    odb._session = session
+    odb.cluster = cluster
+    odb.server = Bunch(id=server.id)
+
+    return odb
+
+# ################################################################################################################################
+
+def get_items(services, per_module):
+    """ Returns information about services as the service store collects it, sharing source code info per module.
+    """
+    items = []
+    source_info = None
+
+    for idx in range(services):
+
+        if idx % per_module == 0:
+            source_info = SourceInfo()
+            source_info.source = b'# Module {}\n'.format(idx) + b'x = 1\n' * 1000
+            source_info.path = '/tmp/bench/mod{}.py'.format(idx)
+            source_info.hash = sha256(source_info.source).hexdigest()
+            source_info.hash_method = 'SHA-256'
+
+        name = 'bench.service{}'.format(idx)
+
+        items.append(Bunch(name=name, impl_name='{}.Service'.format(name), is_internal=False, details='{}',
+            source_info=source_info, service_info=None))
+
+    return items
+
+# ################################################################################################################################
+
+def one_by_one(odb, items, now):
+    for item in items:
+        odb.add_service(item.name, item.impl_name, item.is_internal, now, item.details, item.source_info)
+
+def bulk(odb, items, now):
+    odb.add_services(items, now)
+
+# ################################################################################################################################
+
+def bench(func, services, per_module):
+    """ Returns time, in milliseconds, of the initial deployment and of a subsequent redeployment of the same services.
+    """
+    out = []
+    tmp_dir = mkdtemp()
+
+    try:
+        odb = get_odb(os.path.join(tmp_dir, 'odb.db'))
+        items = get_items(services, per_module)
+
+        # First time services are added and then they are all updated on a redeployment
+        for x in range(2):
+            start = time()
+            func(odb, items, datetime.utcnow())
+            out.append((time() - start) * 1000)
+
+    finally:
+        rmtree(tmp_dir)
+
+    return out
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Measures how long it takes to add information about deployed services to the ODB')
+    parser.add_argument('--services', type=int, default=default_services,
+        help='Services to deploy (default: %(default)s)')
+    parser.add_argument('--per-module', type=int, default=default_per_module,
+        help='Services per module (default: %(default)s)')
+    args = parser.parse_args()
+
+    print('{} services, {} per module, all times in milliseconds'.format(args.services, args.per_module))
+
+    header = '{:>12} {:>12} {:>12}'
+    row = '{:>12} {:>12.1f} {:>12.1f}'
+
+    print(header.format('mode', 'deploy', 'redeploy'))
+
+    for name, func in ('one-by-one', one_by_one), ('bulk', bulk):
+        print(row.format(name, *bench(func, args.services, args.per_module)))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
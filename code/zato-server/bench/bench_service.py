@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Measures the cost of creating and invoking an empty service, e.g.:
+#
+# $ ./bin/py zato-server/bench/bench_service.py
+# $ ./bin/py zato-server/bench/bench_service.py --requests 100000
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from argparse import ArgumentParser
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import CHANNEL, DATA_FORMAT, SIMPLE_IO
+from zato.common.test import enrich_with_static_config
+from zato.common.util import new_cid
+from zato.server.service import Service
+from zato.server.service.store import ServiceStore, set_up_class_attributes
+
+# ################################################################################################################################
+
+default_requests = 20000
+
+simple_io_config = {
+    'int_parameters': SIMPLE_IO.INT_PARAMETERS.VALUES,
+    'int_parameter_suffixes': SIMPLE_IO.INT_PARAMETERS.SUFFIXES,
+    'bool_parameter_prefixes': SIMPLE_IO.BOOL_PARAMETERS.SUFFIXES,
+}
+
+# ################################################################################################################################
+
+class EmptyService(Service):
+    def handle(self):
+        pass
+
+class OutgoingService(Service):
+    def handle(self):
+        self.out
+
+# ################################################################################################################################
+
+def run(func, requests):
+    """ Calls func the number of times given on input and returns average time per call, in microseconds.
+    """
+    start = time()
+    for _ in xrange(requests):
+        func()
+    return (time() - start) / requests * 1000000
+
+# ################################################################################################################################
+
+def get_service_store(*classes):
+
+    services = {}
+
+    for class_ in classes:
+        set_up_class_attributes(class_)
+        enrich_with_static_config(class_)
+
+        class_.component_enabled_cassandra = False
+        class_.component_enabled_email = False
+        class_.component_enabled_search = False
+        class_.component_enabled_msg_path = True
+
+        services[class_.get_impl_name()] = {
+            'service_class': class_,
+            'is_active': True,
+            'slow_threshold': 99999,
+        }
+
+    server = Bunch()
+    server.kvdb = Bunch(translate=None)
+    server.user_config = Bunch()
+    server.static_config = Bunch()
+    server.time_util = None
+    server.encrypt = None
+    server.component_enabled = Bunch(stats=False, slow_response=False)
+    server.service_store = ServiceStore(services, server=server)
+
+    return server.service_store
+
+# ################################################################################################################################
+
+def bench(service_store, class_, requests):
+
+    server = service_store.server
+    impl_name = class_.get_impl_name()
+
+    def set_response_func(service, **ignored):
+        return service.response
+
+    def new_instance():
+        service_store.new_instance(impl_name)
+
+    def new_instance_update_handle():
+        service, _ = service_store.new_instance(impl_name)
+        service.update_handle(set_response_func, service, '', CHANNEL.INVOKE, DATA_FORMAT.DICT, None, server, None,
+            service._worker_store, new_cid(), simple_io_config)
+
+    return run(new_instance, requests), run(new_instance_update_handle, requests)
+
+# ################################################################################################################################
+
+def main():
+
+    parser = ArgumentParser(description='Measures the cost of creating and invoking an empty service')
+    parser.add_argument('--requests', type=int, default=default_requests,
+        help='Requests per measurement (default: %(default)s)')
+    args = parser.parse_args()
+
+    service_store = get_service_store(EmptyService, OutgoingService)
+
+    print('All times in microseconds per request')
+
+    header = '{:>20} {:>14} {:>28}'
+    row = '{:>20} {:>14.2f} {:>28.2f}'
+
+    print(header.format('service', 'new_instance', 'new_instance + update_handle'))
+
+    for class_ in EmptyService, OutgoingService:
+        print(row.format(class_.__name__, *bench(service_store, class_, args.requests)))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
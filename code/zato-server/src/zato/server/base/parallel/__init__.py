@@ -14,6 +14,7 @@ from datetime import datetime, timedelta
 from logging import INFO
 from re import IGNORECASE
 from tempfile import mkstemp
+from time import time
 from traceback import format_exc
 from uuid import uuid4
 
@@ -40,22 +41,23 @@ from springpython.context import DisposableObject
 from zato.broker import BrokerMessageReceiver
 from zato.broker.client import BrokerClient
 from zato.bunch import Bunch
-from zato.common import DATA_FORMAT, default_internal_modules, KVDB, SECRETS, SERVER_STARTUP, SERVER_UP_STATUS, \
+from zato.common import DATA_FORMAT, default_internal_modules, KVDB, MISC, SECRETS, SERVER_STARTUP, SERVER_UP_STATUS, \
      ZATO_ODB_POOL_NAME
 from zato.common.audit import audit_pii
 from zato.common.broker_message import HOT_DEPLOY, MESSAGE_TYPE, TOPICS
 from zato.common.ipc.api import IPCAPI
 from zato.common.zato_keyutils import KeyUtils
 from zato.common.pubsub import SkipDelivery
-from zato.common.util import absolutize, get_config, get_kvdb_config_for_log, get_user_config_name, hot_deploy, \
+from zato.common.util import absolutize, get_config, get_kvdb_config_for_log, get_user_config_name, get_worker_pids, hot_deploy, \
      invoke_startup_services as _invoke_startup_services, new_cid, spawn_greenlet, StaticConfig, \
      register_diag_handlers
-from zato.common.util.posix_ipc_ import ServerStartupIPC
+from zato.common.util.posix_ipc_ import ConfigSnapshotIPC, ServerStartupIPC
 from zato.common.util.time_ import TimeUtil
 from zato.distlock import LockManager
 from zato.server.base.worker import WorkerStore
 from zato.server.config import ConfigStore
 from zato.server.connection.server import Servers
+from zato.server.hash_pool import HashPool
 from zato.server.base.parallel.config import ConfigLoader
 from zato.server.base.parallel.http import HTTPHandler
 from zato.server.base.parallel.wmq import WMQIPC
@@ -133,10 +135,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.sync_internal = None
         self.ipc_api = IPCAPI()
         self.wmq_ipc_tcp_port = None
-        self.fifo_response_buffer_size = None # Will be in megabytes
         self.is_first_worker = None
         self.shmem_size = -1.0
         self.server_startup_ipc = ServerStartupIPC()
+        self.config_snapshot_ipc = ConfigSnapshotIPC()
         self.keyutils = KeyUtils()
         self.sso_api = None
         self.is_sso_enabled = False
@@ -146,6 +148,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self._hash_secret_method = None
         self._hash_secret_rounds = None
         self._hash_secret_salt_size = None
+        self._worker_pids = None
+        self.hash_pool = HashPool(0, 0) # Replaced with an actual pool once configuration is read
+        self._worker_pids_time = 0
 
         # Allows users store arbitrary data across service invocations
         self.user_ctx = Bunch()
@@ -366,9 +371,6 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
             self.user_config[get_user_config_name(file_name)] = conf
 
-        # Convert size of FIFO response buffers to megabytes
-        self.fifo_response_buffer_size = int(float(self.fs_server_config.misc.fifo_response_buffer_size) * megabyte)
-
         is_first, locally_deployed = self.maybe_on_first_worker(server, self.kvdb.conn)
 
         return is_first, locally_deployed
@@ -477,6 +479,11 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         salt_size = self.sso_config.hash_secret.salt_size
         self.crypto_manager.add_hash_scheme('zato.default', self.sso_config.hash_secret.rounds, salt_size)
 
+        # Hashing may take a sizeable fraction of a second so it is done in native threads of each worker
+        self.hash_pool = HashPool(
+            int(self.sso_config.hash_secret.get('pool_size', MISC.DEFAULT_HASH_POOL_SIZE)),
+            int(self.sso_config.hash_secret.get('pool_max_queued', MISC.DEFAULT_HASH_POOL_MAX_QUEUED)))
+
         for name in('current_work_dir', 'backup_work_dir', 'last_backup_work_dir', 'delete_after_pickup'):
 
             # New in 2.0
@@ -501,7 +508,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             TOPICS[MESSAGE_TYPE.TO_PARALLEL_ALL]: self.worker_store.on_broker_msg,
         }
 
-        self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs())
+        # Whether invoke_async messages go through a work queue rather than being published to all servers
+        invoke_async_queue = asbool(self.fs_server_config.get('broker', {}).get('invoke_async_queue', False))
+
+        self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs(), invoke_async_queue)
         self.worker_store.set_broker_client(self.broker_client)
 
         # Make sure that broker client's connection is ready before continuing
@@ -686,39 +696,75 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         """
         return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value)
 
+# ################################################################################################################################
+
+    def get_worker_pids(self, _now=time):
+        """ Returns PIDs of all worker processes of this server. They rarely change so they are cached for a few seconds.
+        """
+        if not self._worker_pids or _now() - self._worker_pids_time > MISC.DEFAULT_WORKER_PIDS_TTL:
+            self._worker_pids = get_worker_pids()
+            self._worker_pids_time = _now()
+
+            # Connections to processes that no longer exist are not needed anymore
+            self.ipc_api.remove_stale_pid_clients(self._worker_pids)
+
+        return self._worker_pids
+
 # ################################################################################################################################
 
     def invoke_all_pids(self, service, request, timeout=5, *args, **kwargs):
-        """ Invokes a given service in each of processes current server has.
+        """ Invokes a given service in each of processes current server has. All processes are invoked concurrently
+        and timeout is the deadline for all of them, responses not received in time are reported as errors.
         """
-        try:
-            # PID -> response from that process
-            out = {}
+        # PID -> response from that process
+        out = {}
 
-            # Get all current PIDs
-            data = self.invoke('zato.info.get-worker-pids', serialize=False).getvalue(False)
-            pids = data['response']['pids']
+        try:
+            # Greenlet -> PID it invokes
+            greenlets = {}
 
             # Underlying IPC needs strings on input instead of None
             request = request or ''
 
-            for pid in pids:
-                response = {
+            for pid in self.get_worker_pids():
+                out[pid] = {
                     'is_ok': False,
                     'pid_data': None,
                     'error_info': None
                 }
+                g = gevent.spawn(self.invoke_by_pid, service, request, pid, timeout=timeout, *args, **kwargs)
+                greenlets[g] = pid
+
+            # Each invocation times out on its own but, as a safety net, none can take much longer than that
+            gevent.joinall(greenlets, timeout=timeout + 1)
+
+            for g, pid in greenlets.items():
+                response = out[pid]
+
+                if not g.ready():
+                    g.kill(block=False)
+                    response['error_info'] = 'No response from PID {} in {}s'.format(pid, timeout)
+
+                elif not g.successful():
+                    response['error_info'] = repr(g.exception)
 
-                try:
-                    is_ok, pid_data = self.invoke_by_pid(service, request, pid, timeout=timeout, *args, **kwargs)
+                # IPC returns None if it could not invoke the process at all
+                elif g.value is None:
+                    response['error_info'] = 'Could not invoke PID {}'.format(pid)
+
+                else:
+                    is_ok, pid_data = g.value
                     response['is_ok'] = is_ok
                     response['pid_data' if is_ok else 'error_info'] = pid_data
 
-                except Exception:
-                    e = format_exc()
-                    response['error_info'] = e
-                finally:
-                    out[pid] = response
+                    # Timeouts are indicated by no data at all
+                    if not is_ok and pid_data is None:
+                        response['error_info'] = 'No response from PID {} in {}s'.format(pid, timeout)
+
+                # The process may not exist anymore so the list of PIDs will be refreshed on next invocation
+                if not response['is_ok']:
+                    self._worker_pids = None
+
         except Exception:
             logger.warn('PID invocation error `%s`', format_exc())
         finally:
@@ -729,8 +775,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
     def invoke_by_pid(self, service, request, target_pid, *args, **kwargs):
         """ Invokes a service in a worker process by the latter's PID.
         """
-        return self.ipc_api.invoke_by_pid(service, request, self.cluster.name, self.name, target_pid,
-            self.fifo_response_buffer_size, *args, **kwargs)
+        return self.ipc_api.invoke_by_pid(service, request, self.cluster.name, self.name, target_pid, *args, **kwargs)
 
 # ################################################################################################################################
 
@@ -806,12 +851,12 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 # ################################################################################################################################
 
     def hash_secret(self, data, name='zato.default'):
-        return self.crypto_manager.hash_secret(data, name)
+        return self.hash_pool.run(self.crypto_manager.hash_secret, data, name)
 
 # ################################################################################################################################
 
     def verify_hash(self, given, expected, name='zato.default'):
-        return self.crypto_manager.verify_hash(given, expected, name)
+        return self.hash_pool.run(self.crypto_manager.verify_hash, given, expected, name)
 
 # ################################################################################################################################
 
@@ -882,10 +927,15 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
             # Close all POSIX IPC structures
             self.server_startup_ipc.close()
+            self.config_snapshot_ipc.close()
 
             # Close ZeroMQ-based IPC
             self.ipc_api.close()
 
+            # Save SSO session renewals that are still waiting for their batch to be flushed
+            if self.is_sso_enabled:
+                self.sso_api.user.session.cache.flush()
+
             # Delete persistent information about all clients currently connected
             wsx_service = 'zato.channel.web-socket.client.delete-by-server'
             if self.service_store.is_deployed(wsx_service):
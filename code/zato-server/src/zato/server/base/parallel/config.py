@@ -10,8 +10,14 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from contextlib import closing
+from cPickle import dumps as pickle_dumps, HIGHEST_PROTOCOL, loads as pickle_loads
+from logging import getLogger
+from traceback import format_exc
 import os
 
+# gevent
+from gevent import spawn_later
+
 # Paste
 from paste.util.converters import asbool
 
@@ -25,6 +31,15 @@ from zato.url_dispatcher import Matcher
 
 # ################################################################################################################################
 
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+# Needs to be increased each time the layout of configuration snapshots changes
+_config_snapshot_version = 1
+
+# ################################################################################################################################
+
 class ConfigLoader(object):
     """ Loads server's configuration.
     """
@@ -37,6 +52,53 @@ class ConfigLoader(object):
         self.component_enabled.stats = asbool(self.fs_server_config.component_enabled.stats)
         self.component_enabled.slow_response = asbool(self.fs_server_config.component_enabled.slow_response)
 
+        # Configuration kept in ODB is read by the first worker only, other ones map in a snapshot of what it read
+        if not self._set_up_config_from_snapshot():
+
+            try:
+                self._set_up_odb_config(server)
+            except Exception:
+                # Let other workers know right away that they should not wait for a snapshot
+                if self.is_first_worker:
+                    self._set_config_snapshot_unavailable()
+                raise
+
+            if self.is_first_worker:
+                self._publish_config_snapshot()
+
+        # Compiled URL patterns are not part of snapshots so each worker prepares its own
+        for hs_item in self.config.http_soap:
+            hs_item['match_target_compiled'] = Matcher(hs_item['match_target'], hs_item.get('match_slash', ''))
+
+        # SimpleIO
+        # In preparation for a SIO rewrite, we loaded SIO config from a file
+        # but actual code paths require the pre-3.0 format so let's prepare it here.
+        self.config.simple_io = ConfigDict('simple_io', Bunch())
+
+        int_exact = self.sio_config.int.exact
+        int_suffix = self.sio_config.int.suffix
+        bool_prefix = self.sio_config.bool.prefix
+
+        self.config.simple_io['int_parameters'] = int_exact if isinstance(int_exact, list) else [int_exact]
+        self.config.simple_io['int_parameter_suffixes'] = int_suffix if isinstance(int_suffix, list) else [int_suffix]
+        self.config.simple_io['bool_parameter_prefixes'] = bool_prefix if isinstance(bool_prefix, list) else [bool_prefix]
+
+        # Pub/sub
+        self.config.pubsub = Bunch()
+
+        # Message paths
+        self.config.msg_ns_store = NamespaceStore()
+        self.config.json_pointer_store = JSONPointerStore()
+        self.config.xpath_store = XPathStore()
+
+        # Assign config to worker
+        self.worker_store.worker_config = self.config
+
+# ################################################################################################################################
+
+    def _set_up_odb_config(self, server):
+        """ Reads in all configuration kept in ODB.
+        """
         #
         # Cassandra - start
         #
@@ -323,7 +385,6 @@ class ConfigLoader(object):
                 hs_item[key] = getattr(item, key)
 
             hs_item['match_target'] = '{}{}{}'.format(hs_item['soap_action'], MISC.SEPARATOR, hs_item['url_path'])
-            hs_item['match_target_compiled'] = Matcher(hs_item['match_target'], hs_item.get('match_slash', ''))
 
             http_soap.append(hs_item)
 
@@ -341,22 +402,6 @@ class ConfigLoader(object):
         query = self.odb.get_json_pointer_list(server.cluster.id, True)
         self.config.json_pointer = ConfigDict.from_query('json_pointer', query, decrypt_func=self.decrypt)
 
-        # SimpleIO
-        # In preparation for a SIO rewrite, we loaded SIO config from a file
-        # but actual code paths require the pre-3.0 format so let's prepare it here.
-        self.config.simple_io = ConfigDict('simple_io', Bunch())
-
-        int_exact = self.sio_config.int.exact
-        int_suffix = self.sio_config.int.suffix
-        bool_prefix = self.sio_config.bool.prefix
-
-        self.config.simple_io['int_parameters'] = int_exact if isinstance(int_exact, list) else [int_exact]
-        self.config.simple_io['int_parameter_suffixes'] = int_suffix if isinstance(int_suffix, list) else [int_suffix]
-        self.config.simple_io['bool_parameter_prefixes'] = bool_prefix if isinstance(bool_prefix, list) else [bool_prefix]
-
-        # Pub/sub
-        self.config.pubsub = Bunch()
-
         # Pub/sub - endpoints
         query = self.odb.get_pubsub_endpoint_list(server.cluster.id, True)
         self.config.pubsub_endpoint = ConfigDict.from_query('pubsub_endpoint', query, decrypt_func=self.decrypt)
@@ -377,13 +422,97 @@ class ConfigLoader(object):
         query = self.odb.get_email_imap_list(server.cluster.id, True)
         self.config.email_imap = ConfigDict.from_query('email_imap', query, decrypt_func=self.decrypt)
 
-        # Message paths
-        self.config.msg_ns_store = NamespaceStore()
-        self.config.json_pointer_store = JSONPointerStore()
-        self.config.xpath_store = XPathStore()
+# ################################################################################################################################
 
-        # Assign config to worker
-        self.worker_store.worker_config = self.config
+    def _get_config_snapshot_timeout(self):
+        return int(self.fs_server_config.misc.get('config_snapshot_timeout', MISC.DEFAULT_CONFIG_SNAPSHOT_TIMEOUT))
+
+    def _get_config_snapshot_wait_timeout(self):
+        return int(self.fs_server_config.misc.get(
+            'config_snapshot_wait_timeout', MISC.DEFAULT_CONFIG_SNAPSHOT_WAIT_TIMEOUT))
+
+# ################################################################################################################################
+
+    def _publish_config_snapshot(self, _version=_config_snapshot_version):
+        """ Makes configuration read from ODB available to other workers of this server.
+        """
+        timeout = self._get_config_snapshot_timeout()
+        if not timeout:
+            return
+
+        snapshot = {
+            'config_dict': {},
+            'http_soap': self.config.http_soap,
+        }
+
+        for key, value in vars(self.config).items():
+            if isinstance(value, ConfigDict):
+                snapshot['config_dict'][key] = (value.name, value._impl)
+
+        try:
+            # Configuration contains decrypted secrets, which is why it is encrypted as a whole before it is stored
+            # in shared memory - this way, even a snapshot left over by a server that was killed does not reveal them.
+            data = self.crypto_manager.encrypt(pickle_dumps(snapshot, HIGHEST_PROTOCOL))
+            self.config_snapshot_ipc.publish(self.deployment_key, _version, data)
+        except Exception:
+            logger.warn('Could not publish configuration snapshot, e:`%s`', format_exc())
+            self._set_config_snapshot_unavailable()
+        else:
+            self.server_startup_ipc.set_config_snapshot({'version': _version, 'size': len(data)})
+            logger.info('Published configuration snapshot (%s bytes)', len(data))
+
+            # Workers started long after this one, e.g. ones that were restarted, cannot use a snapshot because
+            # configuration may have changed in the meantime, hence it is available only for as long as other workers
+            # are expected to be still starting.
+            spawn_later(timeout, self._remove_config_snapshot)
+
+# ################################################################################################################################
+
+    def _set_config_snapshot_unavailable(self):
+        """ Tells other workers that there is no snapshot and they need to read configuration from ODB.
+        """
+        self.server_startup_ipc.set_config_snapshot({'version': None})
+
+# ################################################################################################################################
+
+    def _remove_config_snapshot(self):
+        self._set_config_snapshot_unavailable()
+        self.config_snapshot_ipc.close()
+
+# ################################################################################################################################
+
+    def _set_up_config_from_snapshot(self, _version=_config_snapshot_version):
+        """ Sets up configuration from a snapshot published by the first worker. Returns False if there is no snapshot
+        that could be used, in which case configuration needs to be read from ODB.
+        """
+        if self.is_first_worker or not self._get_config_snapshot_timeout():
+            return False
+
+        wait_timeout = self._get_config_snapshot_wait_timeout()
+
+        try:
+            info = self.server_startup_ipc.get_config_snapshot(wait_timeout)
+        except KeyError:
+            logger.warn('Configuration snapshot not published within %ss, reading configuration from ODB', wait_timeout)
+            return False
+
+        # Either already removed, not published because of an error or published by a different version of this code
+        if info['version'] != _version:
+            return False
+
+        try:
+            data = self.config_snapshot_ipc.load(self.deployment_key, info['version'], info['size'])
+            snapshot = pickle_loads(self.crypto_manager.decrypt(data))
+        except Exception:
+            logger.warn('Could not load configuration snapshot, e:`%s`', format_exc())
+            return False
+
+        for key, (name, impl) in snapshot['config_dict'].items():
+            setattr(self.config, key, ConfigDict(name, impl))
+
+        self.config.http_soap = snapshot['http_soap']
+
+        return True
 
 # ################################################################################################################################
 
@@ -13,6 +13,7 @@ from datetime import datetime
 from httplib import INTERNAL_SERVER_ERROR, responses
 from logging import getLogger, INFO
 from traceback import format_exc
+from types import GeneratorType
 
 # pytz
 from pytz import UTC
@@ -39,7 +40,7 @@ class HTTPHandler(object):
     """
     def on_wsgi_request(self, wsgi_environ, start_response, _new_cid=new_cid, _local_zone=get_localzone(),
         _utcnow=datetime.utcnow, _INFO=INFO, _UTC=UTC, _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT,
-        _no_remote_address=NO_REMOTE_ADDRESS, **kwargs):
+        _no_remote_address=NO_REMOTE_ADDRESS, _GeneratorType=GeneratorType, **kwargs):
         """ Handles incoming HTTP requests.
         """
         cid = kwargs.get('cid', _new_cid())
@@ -85,6 +86,9 @@ class HTTPHandler(object):
         if isinstance(payload, unicode):
             payload = payload.encode('utf-8')
 
+        # Payload is produced chunk by chunk, e.g. when it is being compressed, so its size is not known upfront
+        is_stream = isinstance(payload, _GeneratorType)
+
         if self.needs_access_log:
 
             self.access_logger_log(_INFO, '', None, None, {
@@ -97,8 +101,8 @@ class HTTPHandler(object):
                 'path': wsgi_environ['PATH_INFO'],
                 'http_version': wsgi_environ['SERVER_PROTOCOL'],
                 'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                'response_size': len(payload),
+                'response_size': '-' if is_stream else len(payload),
                 'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
             })
 
-        return [payload]
+        return payload if is_stream else [payload]
@@ -40,7 +40,7 @@ from gunicorn.workers.sync import SyncWorker as GunicornSyncWorker
 # Zato
 from zato.broker import BrokerMessageReceiver
 from zato.bunch import Bunch
-from zato.common import broker_message, CHANNEL, GENERIC, HTTP_SOAP_SERIALIZATION_TYPE, IPC, KVDB, NOTIF, PUBSUB, SEC_DEF_TYPE, \
+from zato.common import broker_message, CHANNEL, GENERIC, HTTP_SOAP_SERIALIZATION_TYPE, IPC, KVDB, MISC, NOTIF, PUBSUB, SEC_DEF_TYPE, \
      simple_types, URL_TYPE, TRACE1, ZATO_NONE, ZATO_ODB_POOL_NAME, ZMQ
 from zato.common.broker_message import code_to_name, SERVICE
 from zato.common.dispatch import dispatcher
@@ -70,11 +70,12 @@ from zato.server.connection.sms.twilio import TwilioAPI, TwilioConnStore
 from zato.server.connection.stomp import ChannelSTOMPConnStore, STOMPAPI, channel_main_loop as stomp_channel_main_loop, \
      OutconnSTOMPConnStore
 from zato.server.connection.web_socket import ChannelWebSocket
+from zato.server.connection.web_socket.ping import PingScheduler
 from zato.server.connection.vault import VaultConnAPI
 from zato.server.pubsub import PubSub
 from zato.server.query import CassandraQueryAPI, CassandraQueryStore
 from zato.server.rbac_ import RBAC
-from zato.server.stats import MaintenanceTool
+from zato.server.stats import MaintenanceTool, ServiceStatsCollector
 from zato.zmq_.channel import MDPv01 as ChannelZMQMDPv01, Simple as ChannelZMQSimple
 from zato.zmq_.outgoing import Simple as OutZMQSimple
 
@@ -136,6 +137,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self.kvdb = server.kvdb
         self.broker_client = None
         self.pubsub = PubSub(self.server.cluster_id, self.server)
+        self.wsx_ping_scheduler = PingScheduler()
         self.rbac = RBAC()
         self.worker_idx = int(os.environ['ZATO_SERVER_WORKER_IDX'])
 
@@ -155,6 +157,13 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         # Statistics maintenance
         self.stats_maint = MaintenanceTool(self.kvdb.conn)
 
+        # Statistics of services invoked in this worker, stored in KVDB periodically
+        self.stats_collector = ServiceStatsCollector(self.kvdb.conn,
+            float(self.server.fs_server_config.get('stats', {}).get('flush_interval', 5)))
+
+        if self.server.component_enabled.stats:
+            self.stats_collector.start()
+
         self.msg_ns_store = self.worker_config.msg_ns_store
         self.json_pointer_store = self.worker_config.json_pointer_store
         self.xpath_store = self.worker_config.xpath_store
@@ -263,8 +272,13 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         # Request dispatcher - matches URLs, checks security and dispatches HTTP
         # requests to services.
 
+        misc = self.server.fs_server_config.misc
+
         self.request_dispatcher = RequestDispatcher(simple_io_config=self.worker_config.simple_io,
-            return_tracebacks=self.server.return_tracebacks, default_error_message=self.server.default_error_message)
+            return_tracebacks=self.server.return_tracebacks, default_error_message=self.server.default_error_message,
+            gzip_min_size=int(misc.get('gzip_min_size', MISC.DEFAULT_GZIP_MIN_SIZE)),
+            gzip_level=int(misc.get('gzip_level', MISC.DEFAULT_GZIP_LEVEL)),
+            gzip_chunk_size=int(misc.get('gzip_chunk_size', MISC.DEFAULT_GZIP_CHUNK_SIZE)))
         self.request_dispatcher.url_data = URLData(
             self, self.worker_config.http_soap,
             self.server.odb.get_url_security(self.server.cluster_id, 'channel')[0],
@@ -1090,6 +1104,11 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self._update_auth(msg, code_to_name[msg.action], SEC_DEF_TYPE.JWT,
                 self._visit_wrapper_change_password)
 
+    def on_broker_msg_SECURITY_JWT_TOKEN_DELETE(self, msg, *args):
+        """ Makes this worker forget a JWT token deleted in any server.
+        """
+        self.request_dispatcher.url_data.on_broker_msg_SECURITY_JWT_TOKEN_DELETE(msg)
+
 # ################################################################################################################################
 
     def oauth_get(self, name):
@@ -2065,7 +2084,8 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
 # ################################################################################################################################
 
     def on_ipc_message(self, msg, success=IPC.STATUS.SUCCESS, failure=IPC.STATUS.FAILURE):
-
+        """ Invokes a service on behalf of another worker process and returns the response to be sent back to it.
+        """
         # If there is target_pid we cannot continue if we are not the recipient.
         if msg.target_pid and msg.target_pid != self.server.pid:
             return
@@ -2078,13 +2098,8 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         except Exception, e:
             response = format_exc(e)
             status = failure
-        finally:
-            data = '{};{}'.format(status, response)
 
-        try:
-            with open(msg.reply_to_fifo, 'wb') as fifo:
-                fifo.write(data)
-        except Exception:
-            logger.warn('Could not write to FIFO, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
+        data = '{};{}'.format(status, response)
+        return data.encode('utf8') if isinstance(data, unicode) else data
 
 # ################################################################################################################################
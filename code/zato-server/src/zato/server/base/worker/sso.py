@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Zato
+from zato.server.base.worker.common import WorkerImpl
+
+# ################################################################################################################################
+
+class SSO(WorkerImpl):
+    """ Callbacks for messages related to SSO.
+    """
+
+# ################################################################################################################################
+
+    def on_broker_msg_SSO_SESSION_INVALIDATE(self, msg):
+        """ Removes a session, or all sessions of a user, from this worker's cache of SSO sessions.
+        """
+        if self.server.is_sso_enabled:
+            self.server.sso_api.user.session.cache.invalidate(msg.ust, msg.user_id)
+
+# ################################################################################################################################
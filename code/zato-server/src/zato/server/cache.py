@@ -103,6 +103,63 @@ class RobustCache(object):
         if not async:
             gevent.joinall(greenlets)
 
+# ################################################################################################################################
+
+    def _kvdb_renew_many(self, renewals):
+        try:
+            pipeline = self.kvdb.conn.pipeline()
+            for key, ttl in renewals.items():
+                pipeline.expire(key, ttl)
+            pipeline.execute()
+
+        except Exception:
+            logger.exception('KVDB Exception while renewing %d key(s).', len(renewals))
+
+# ################################################################################################################################
+
+    def _odb_renew_many(self, renewals, chunk_size):
+
+        # Keys with the same TTL can be updated in one statement
+        by_ttl = {}
+        for key, ttl in renewals.items():
+            by_ttl.setdefault(ttl, []).append(self._get_odb_key(key))
+
+        now = datetime.datetime.utcnow()
+
+        with closing(self.odb.session()) as session:
+            try:
+                for ttl, keys in by_ttl.items():
+                    expiry_time = now + datetime.timedelta(seconds=ttl)
+                    for idx in range(0, len(keys), chunk_size):
+                        session.query(KVData).\
+                            filter(KVData.key.in_(keys[idx:idx+chunk_size])).\
+                            update({'creation_time':now, 'expiry_time':expiry_time}, synchronize_session=False)
+
+                session.commit()
+
+            except Exception:
+                logger.exception('Unable to renew %d key(s) in ODB', len(renewals))
+                session.rollback()
+
+                raise
+
+# ################################################################################################################################
+
+    def renew_many(self, renewals, async=True, chunk_size=500):
+        """ Renews expiration of multiple keys, given as a dict of keys to their TTLs, in both KVDB and ODB, in parallel.
+        Unlike self.put, keys that do not exist, e.g. because they were deleted in the meantime, are not created.
+        """
+        if not renewals:
+            return
+
+        greenlets = [
+            gevent.spawn(self._kvdb_renew_many, renewals),
+            gevent.spawn(self._odb_renew_many, renewals, chunk_size)
+        ]
+
+        if not async:
+            gevent.joinall(greenlets)
+
 # ################################################################################################################################
 
     def get(self, key):
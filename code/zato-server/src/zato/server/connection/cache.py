@@ -13,8 +13,11 @@ from cPickle import dumps as pickle_dumps
 from logging import getLogger
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
 from gevent.lock import RLock
 
 # python-memcached
@@ -55,12 +58,19 @@ builtin_ops = [
 ]
 
 builtin_op_to_broker_msg = {}
+broker_msg_to_sync_func = {} # Broker message -> name of a method that applies its state change in another worker
 
 for builtin_op in builtin_ops:
     common_key = getattr(CACHE.STATE_CHANGED, builtin_op)
     broker_msg_value = getattr(CACHE_BROKER_MSG, 'BUILTIN_STATE_CHANGED_{}'.format(builtin_op)).value
 
     builtin_op_to_broker_msg[common_key] = broker_msg_value
+    broker_msg_to_sync_func[broker_msg_value] = 'sync_after_{}'.format(builtin_op.lower())
+
+# ################################################################################################################################
+
+default_sync_batch_window = 5   # In milliseconds, 0 = each state change is published separately
+default_sync_batch_max_ops = 500
 
 # ################################################################################################################################
 
@@ -78,6 +88,11 @@ class Cache(object):
         self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
         self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
             self.config.extend_expiry_on_set)
+
+        # Metrics of the most recent pass of self._delete_expired, which may consist of multiple batches
+        self.last_sweep_deleted = 0
+        self.last_sweep_duration = 0.0
+
         spawn(self._delete_expired)
 
 # ################################################################################################################################
@@ -630,20 +645,39 @@ class Cache(object):
 
 # ################################################################################################################################
 
-    def _delete_expired(self, interval=5, _sleep=sleep):
-        """ Invokes in its own greenlet in background to delete expired cache entries.
+    def _delete_expired(self, interval=5, batch_size=1000, _sleep=sleep):
+        """ Invokes in its own greenlet in background to delete expired cache entries. Each pass is split into batches
+        of at most batch_size entries so that the cache's lock is never held for long, and other greenlets get a chance
+        to run in between the batches.
         """
         try:
             while True:
                 try:
                     _sleep(interval)
-                    deleted = self.impl.delete_expired()
+
+                    deleted_total = 0
+                    sweep_duration = 0.0
+
+                    while True:
+                        deleted = self.impl.delete_expired(batch_size)
+                        deleted_total += len(deleted)
+                        sweep_duration += self.impl.last_sweep_duration
+
+                        if self.impl.last_sweep_deleted < batch_size:
+                            break
+
+                        _sleep(0)
+
+                    self.last_sweep_deleted = deleted_total
+                    self.last_sweep_duration = sweep_duration
+
                 except Exception, e:
                     logger.warn('Exception while deleting expired keys %s', format_exc(e))
                     _sleep(2)
                 else:
-                    if deleted:
-                        logger.info('Cache `%s` deleted keys expired in the last %ss - %s', self.config.name, interval, deleted)
+                    if deleted_total:
+                        logger.info('Cache `%s` deleted %d key(s) expired in the last %ss in %.6fs',
+                            self.config.name, deleted_total, interval, sweep_duration)
         except Exception, e:
             logger.warn('Exception in _delete_expired loop %s', format_exc(e))
 
@@ -792,11 +826,27 @@ class Cache(object):
 
 # ################################################################################################################################
 
-    def sync_after_clear(self):
+    def sync_after_clear(self, data=None):
         """ Invoked by Cache API to synchronizes this worker's cache after a .clear operation in another worker process.
         """
         self.impl.clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, ops, _sync_func=broker_msg_to_sync_func):
+        """ Invoked by Cache API to synchronizes this worker's cache after a batch of operations in another worker process.
+        All of them are applied in the order they were carried out in, under a single acquisition of the cache's lock.
+        An operation that cannot be applied, e.g. because its key no longer exists in this worker, does not stop the ones
+        following it in the batch.
+        """
+        with self.impl._lock:
+            for data in ops:
+                try:
+                    getattr(self, _sync_func[data['action']])(Bunch(data))
+                except Exception:
+                    logger.warn('Could not sync operation in cache `%s`, data:`%s`, e:`%s`',
+                        self.config.name, data, format_exc())
+
 # ################################################################################################################################
 
 class _NotConfiguredAPI(object):
@@ -806,6 +856,15 @@ class _NotConfiguredAPI(object):
 
 # ################################################################################################################################
 
+class _SyncBatch(object):
+    """ State changes of a single cache waiting to be published to other workers.
+    """
+    def __init__(self):
+        self.ops = []          # (op, data) tuples in the order the changes were made in, None for ones replaced by later ones
+        self.last_set_idx = {} # Key -> index in self.ops of the most recent .set of that key that may be still replaced
+
+# ################################################################################################################################
+
 class CacheAPI(object):
     """ Base class for all cache objects.
     """
@@ -821,44 +880,122 @@ class CacheAPI(object):
         self.builtin = self.caches[CACHE.TYPE.BUILTIN]
         self.memcached = self.caches[CACHE.TYPE.MEMCACHED]
 
+        # State changes are published to other workers in batches, collected for up to that many seconds
+        # or until that many of them are waiting to be published, whichever comes first.
+        cache_config = self.server.fs_server_config.get('cache', {})
+        self.sync_batch_window = float(cache_config.get('sync_batch_window', default_sync_batch_window)) / 1000
+        self.sync_batch_max_ops = int(cache_config.get('sync_batch_max_ops', default_sync_batch_max_ops))
+        self.sync_batches = {} # Cache name -> _SyncBatch
+
     def _maybe_set_default(self, config, cache):
         if config.is_default:
             self.default = cache
 
 # ################################################################################################################################
 
-    def after_state_changed(self, op, cache_name, data, _broker_msg=builtin_op_to_broker_msg, _pickle_dumps=pickle_dumps):
+    def after_state_changed(self, op, cache_name, data, _SET=CACHE.STATE_CHANGED.SET):
         """ Callback method invoked by each cache if it requires synchronization with other worker processes.
+        Unless batching is disabled, the state change is published along with other ones made in the same cache
+        within self.sync_batch_window seconds. Each .set of a key replaces the previous .set of the same key
+        in the batch, unless any other operation was made in the cache in between or expiry was different.
         """
         try:
 
-            data['action'] = _broker_msg[op]
-            data['cache_name'] = cache_name
-            data['source_worker_id'] = self.server.worker_id
+            # Batching is disabled so we can publish the state change immediately
+            if not self.sync_batch_window:
+                self._publish_state_changed(cache_name, self._get_sync_data(op, data))
+                return
 
-            key = data['key']
-            value = data.get('value')
+            batch = self.sync_batches.get(cache_name)
 
-            if isinstance(key, basestring):
-                data['is_key_pickled'] = False
-            else:
-                data['is_key_pickled'] = True
-                data['key'] = _pickle_dumps(key)
+            if not batch:
+                batch = self.sync_batches[cache_name] = _SyncBatch()
+                spawn_later(self.sync_batch_window, self._flush_sync_batch, cache_name, batch)
 
-            if value:
-                if isinstance(value, basestring):
-                    data['is_value_pickled'] = False
-                else:
-                    data['is_value_pickled'] = True
-                    data['value'] = _pickle_dumps(value)
+            if op == _SET:
+                key = data['key']
+                prev_idx = batch.last_set_idx.get(key)
+
+                if prev_idx is not None and batch.ops[prev_idx][1]['expiry'] == data['expiry']:
+                    batch.ops[prev_idx] = None
+
+                batch.last_set_idx[key] = len(batch.ops)
+
+            # Any other operation may depend on previous .set calls so none of them can be replaced now
             else:
-                data['is_value_pickled'] = False
+                batch.last_set_idx.clear()
+
+            batch.ops.append((op, data))
+
+            if len(batch.ops) >= self.sync_batch_max_ops:
+                self._flush_sync_batch(cache_name, batch)
 
-            self.server.broker_client.publish(data)
         except Exception:
             logger.warn('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
                 op, cache_name, data, format_exc())
 
+# ################################################################################################################################
+
+    def _flush_sync_batch(self, cache_name, batch, _batch_action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        """ Publishes all state changes collected in a batch to other worker processes - a batch of a single change
+        is published in the same format as if batching were disabled.
+        """
+        # The batch was already published because it reached self.sync_batch_max_ops
+        if self.sync_batches.get(cache_name) is not batch:
+            return
+
+        del self.sync_batches[cache_name]
+
+        try:
+            ops = [self._get_sync_data(op, data) for op, data in filter(None, batch.ops)]
+
+            if len(ops) == 1:
+                self._publish_state_changed(cache_name, ops[0])
+            else:
+                self._publish_state_changed(cache_name, {
+                    'action': _batch_action,
+                    'ops': ops,
+                })
+
+        except Exception:
+            logger.warn('Could not publish a batch of %d state change(s) in cache `%s`, e:`%s`',
+                len(batch.ops), cache_name, format_exc())
+
+# ################################################################################################################################
+
+    def _get_sync_data(self, op, data, _broker_msg=builtin_op_to_broker_msg, _pickle_dumps=pickle_dumps):
+        """ Returns data describing a state change in a format that can be published to other workers.
+        """
+        data['action'] = _broker_msg[op]
+
+        key = data.get('key')
+        value = data.get('value')
+
+        if key is None or isinstance(key, basestring):
+            data['is_key_pickled'] = False
+        else:
+            data['is_key_pickled'] = True
+            data['key'] = _pickle_dumps(key)
+
+        if value:
+            if isinstance(value, basestring):
+                data['is_value_pickled'] = False
+            else:
+                data['is_value_pickled'] = True
+                data['value'] = _pickle_dumps(value)
+        else:
+            data['is_value_pickled'] = False
+
+        return data
+
+# ################################################################################################################################
+
+    def _publish_state_changed(self, cache_name, data):
+        data['cache_name'] = cache_name
+        data['source_worker_id'] = self.server.worker_id
+
+        self.server.broker_client.publish(data)
+
 # ################################################################################################################################
 
     def _create_builtin(self, config):
@@ -988,6 +1125,18 @@ class CacheAPI(object):
         """
         return len(self.caches[cache_type][name])
 
+# ################################################################################################################################
+
+    def get_sweep_stats(self, name):
+        """ Returns metrics of background deletion of expired entries in a given built-in cache.
+        """
+        cache = self.caches[CACHE.TYPE.BUILTIN][name]
+        return {
+            'expired_total': cache.impl.expired_total,
+            'last_sweep_deleted': cache.last_sweep_deleted,
+            'last_sweep_duration': cache.last_sweep_duration,
+        }
+
 # ################################################################################################################################
 
     def sync_after_set(self, cache_type, data):
@@ -1121,4 +1270,11 @@ class CacheAPI(object):
         """
         self.caches[cache_type][data.cache_name].sync_after_clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, cache_type, data):
+        """ Synchronizes the state of this worker's cache after a batch of operations in another worker process.
+        """
+        self.caches[cache_type][data.cache_name].sync_after_batch(data.ops)
+
 # ################################################################################################################################
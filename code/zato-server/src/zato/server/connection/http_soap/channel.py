@@ -10,11 +10,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
-from cStringIO import StringIO
-from gzip import GzipFile
 from hashlib import sha256
 from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
 from traceback import format_exc
+from zlib import compressobj, DEFLATED, MAX_WBITS
 
 # anyjson
 from anyjson import dumps, loads
@@ -22,14 +21,14 @@ from anyjson import dumps, loads
 # Django
 from django.http import QueryDict
 
+# gevent
+from gevent.event import AsyncResult
+
 # Paste
 from paste.util.converters import asbool
 
-# regex
-from regex import compile as regex_compile
-
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, HTTP_RESPONSES, SEC_DEF_TYPE, SIMPLE_IO, TOO_MANY_REQUESTS, TRACE1, \
+from zato.common import CHANNEL, DATA_FORMAT, HTTP_RESPONSES, MISC, SEC_DEF_TYPE, SIMPLE_IO, TOO_MANY_REQUESTS, TRACE1, \
      URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.util import payload_from_request
 from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, MethodNotAllowed, NotFound, \
@@ -94,6 +93,69 @@ response_404 = b'CID:`{}` Unknown URL:`{}` or SOAP action:`{}`'
 
 # ################################################################################################################################
 
+# With that many window bits zlib produces output in the gzip format rather than a raw zlib stream
+_gzip_wbits = 16 + MAX_WBITS
+
+# ################################################################################################################################
+
+def gzip_compress(data, level, _compressobj=compressobj, _DEFLATED=DEFLATED, _gzip_wbits=_gzip_wbits):
+    """ Compresses input data with gzip in one go.
+    """
+    compressor = _compressobj(level, _DEFLATED, _gzip_wbits)
+    return compressor.compress(data) + compressor.flush()
+
+# ################################################################################################################################
+
+def gzip_stream(data, level, chunk_size, _compressobj=compressobj, _DEFLATED=DEFLATED, _gzip_wbits=_gzip_wbits):
+    """ Compresses input data with gzip chunk by chunk, yielding each part of the output as soon as it is available,
+    which means that the whole of compressed data never has to be kept in memory.
+    """
+    compressor = _compressobj(level, _DEFLATED, _gzip_wbits)
+
+    for idx in xrange(0, len(data), chunk_size):
+        out = compressor.compress(buffer(data, idx, chunk_size))
+        if out:
+            yield out
+
+    yield compressor.flush()
+
+# ################################################################################################################################
+
+def accepts_gzip(accept_encoding):
+    """ Returns True if value of an Accept-Encoding header allows for responses to be compressed with gzip.
+    An explicit gzip entry takes precedence over a wildcard one, e.g. '*;q=0, gzip' still allows for gzip.
+    """
+    if not accept_encoding:
+        return False
+
+    # Set only if there is a wildcard entry
+    any_allowed = None
+
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+
+        if coding in ('gzip', 'x-gzip', '*'):
+            params = params.replace(' ', '')
+
+            # Explicitly disallowed, e.g. gzip;q=0
+            if params.startswith('q='):
+                try:
+                    is_allowed = float(params[2:]) > 0
+                except ValueError:
+                    is_allowed = False
+            else:
+                is_allowed = True
+
+            if coding == '*':
+                any_allowed = is_allowed
+            else:
+                return is_allowed
+
+    return bool(any_allowed)
+
+# ################################################################################################################################
+
 def client_json_error(cid, faultstring):
     zato_env = {'zato_env':{'result':ZATO_ERROR, 'cid':cid, 'details':faultstring}}
     return dumps(zato_env)
@@ -129,13 +191,20 @@ def get_client_error_wrapper(transport, data_format):
 class _CachedResponse(object):
     """ A wrapper for responses served from caches.
     """
-    __slots__ = ('payload', 'content_type', 'headers', 'status_code')
+    __slots__ = ('payload', 'content_type', 'headers', 'status_code', 'gzipped', 'origin')
 
-    def __init__(self, payload, content_type, headers, status_code):
+    def __init__(self, payload, content_type, headers, status_code, gzipped=None, origin=None):
         self.payload = payload
         self.content_type = content_type
         self.headers = headers
         self.status_code = status_code
+        self.gzipped = gzipped # Payload compressed with gzip, if it was needed by any request so far
+        self.origin = origin or self # The response that self was copied from
+
+    def copy(self):
+        """ Returns a shallow copy of self - callers are free to modify the copy's payload without affecting other requests.
+        """
+        return _CachedResponse(self.payload, self.content_type, self.headers, self.status_code, self.gzipped, self)
 
 # ################################################################################################################################
 
@@ -154,13 +223,17 @@ class RequestDispatcher(object):
     """ Dispatches all the incoming HTTP/SOAP requests to appropriate handlers.
     """
     def __init__(self, url_data=None, security=None, request_handler=None, simple_io_config=None, return_tracebacks=None,
-            default_error_message=None):
+            default_error_message=None, gzip_min_size=MISC.DEFAULT_GZIP_MIN_SIZE, gzip_level=MISC.DEFAULT_GZIP_LEVEL,
+            gzip_chunk_size=MISC.DEFAULT_GZIP_CHUNK_SIZE):
         self.url_data = url_data
         self.security = security
         self.request_handler = request_handler
         self.simple_io_config = simple_io_config
         self.return_tracebacks = return_tracebacks
         self.default_error_message = default_error_message
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self.gzip_chunk_size = gzip_chunk_size
 
 # ################################################################################################################################
 
@@ -187,11 +260,52 @@ class RequestDispatcher(object):
 
         return soap_action.decode('utf-8')
 
+# ################################################################################################################################
+
+    def get_gzip_payload(self, response, wsgi_environ, _accepts_gzip=accepts_gzip, _CachedResponse=_CachedResponse):
+        """ Returns payload of a response from a channel using gzip. The payload is compressed only if the client accepts it
+        and if it is big enough for the compression to be worth it, otherwise it is returned as-is.
+        """
+        headers = wsgi_environ['zato.http.response.headers']
+
+        # What we return depends on what the client accepts so caches along the way need to know about it
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            headers['Vary'] = '{}, Accept-Encoding'.format(vary)
+
+        payload = response.payload
+
+        if not payload or not _accepts_gzip(wsgi_environ.get('HTTP_ACCEPT_ENCODING')):
+            return payload
+
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        if len(payload) < self.gzip_min_size:
+            return payload
+
+        headers['Content-Encoding'] = 'gzip'
+
+        # Responses from channel caches are compressed once and all the subsequent requests get them pre-compressed ..
+        if isinstance(response, _CachedResponse):
+            if response.gzipped is None:
+                response.origin.gzipped = response.gzipped = gzip_compress(payload, self.gzip_level)
+            return response.gzipped
+
+        # .. large ones are compressed as they are being sent ..
+        if len(payload) > self.gzip_chunk_size:
+            return gzip_stream(payload, self.gzip_level, self.gzip_chunk_size)
+
+        # .. and anything else is compressed in one go.
+        return gzip_compress(payload, self.gzip_level)
+
 # ################################################################################################################################
 
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store, _status_response=status_response,
         no_url_match=(None, False), _response_404=response_404, _has_debug=_has_debug,
-        _http_soap_action='HTTP_SOAPACTION', _stringio=StringIO, _gzipfile=GzipFile):
+        _http_soap_action='HTTP_SOAPACTION'):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
         configuration is one of the technical account or HTTP basic auth,
         the security validation is being performed. Otherwise, that step
@@ -271,17 +385,10 @@ class RequestDispatcher(object):
                 wsgi_environ['zato.http.response.headers'].update(response.headers)
                 wsgi_environ['zato.http.response.status'] = _status_response[response.status_code]
 
+                # Finally return payload to the client, compressed if needed
                 if channel_item['content_encoding'] == 'gzip':
+                    return self.get_gzip_payload(response, wsgi_environ)
 
-                    s = _stringio()
-                    with _gzipfile(fileobj=s, mode='w') as f:
-                        f.write(response.payload)
-                    response.payload = s.getvalue()
-                    s.close()
-
-                    wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
-
-                # Finally return payload to the client
                 return response.payload
 
             except Exception, e:
@@ -353,7 +460,18 @@ class RequestHandler(object):
     """
     def __init__(self, server=None):
         self.server = server # A ParallelServer instance
-        self.use_soap_envelope = asbool(self.server.fs_server_config.misc.use_soap_envelope)
+
+        misc = self.server.fs_server_config.misc
+        self.use_soap_envelope = asbool(misc.use_soap_envelope)
+
+        # How many responses from channel caches to keep in their ready-to-send form, how long to wait
+        # for a response that another greenlet is computing and whether previous responses may be returned in the meantime.
+        self.cache_memo_size = int(misc.get('http_cache_memo_size', MISC.DEFAULT_HTTP_CACHE_MEMO_SIZE))
+        self.cache_coalesce_timeout = float(misc.get('http_cache_coalesce_timeout', MISC.DEFAULT_HTTP_CACHE_COALESCE_TIMEOUT))
+        self.cache_stale_while_revalidate = asbool(misc.get('http_cache_stale_while_revalidate', False))
+
+        self.cache_memo = {}      # Cache key -> (value as stored in cache, _CachedResponse built out of it)
+        self.cache_in_flight = {} # Cache key -> AsyncResult set to a _CachedResponse by the greenlet computing it
 
 # ################################################################################################################################
 
@@ -421,10 +539,25 @@ class RequestHandler(object):
 
         return channel_params
 
+# ################################################################################################################################
+
+    def _memoize_cached_response(self, cache_key, value, response):
+        """ Keeps a response built out of a value from cache so that next time the same value is returned
+        by the cache the response does not need to be built again.
+        """
+        if not self.cache_memo_size:
+            return
+
+        # Make room for the new entry - any one will do, they all had to be built at least once anyway
+        if len(self.cache_memo) >= self.cache_memo_size and cache_key not in self.cache_memo:
+            self.cache_memo.popitem()
+
+        self.cache_memo[cache_key] = (value, response)
+
 # ################################################################################################################################
 
     def get_response_from_cache(self, service, raw_request, channel_item, channel_params, wsgi_environ, _loads=loads,
-        _CachedResponse=_CachedResponse, _HashCtx=_HashCtx, _sha256=sha256, split_re=regex_compile('........?').findall):
+        _CachedResponse=_CachedResponse, _HashCtx=_HashCtx, _sha256=sha256):
         """ Returns a cached response for incoming request or None if there is nothing cached for it.
         By default, an incoming request's hash is calculated by sha256 over a concatenation of:
           * WSGI REQUEST_METHOD   # E.g. GET or POST
@@ -440,7 +573,6 @@ class RequestHandler(object):
             query_string = str(sorted(channel_params.items()))
             data = '%s%s%s%s' % (wsgi_environ['REQUEST_METHOD'], wsgi_environ['PATH_INFO'], query_string, raw_request)
             hash_value = _sha256(data).hexdigest()
-            hash_value = '-'.join(split_re(hash_value))
 
         # No matter if hash value is default or from service, always prefix it with channel's type and ID
         cache_key = 'http-channel-%s-%s' % (channel_item['id'], hash_value)
@@ -448,25 +580,59 @@ class RequestHandler(object):
         # We have the key so now we can check if there is any matching response already stored in cache
         response = self.server.get_from_cache(channel_item['cache_type'], channel_item['cache_name'], cache_key)
 
-        # If there is any response, we can now load into a format that our callers expect
+        # If there is any response, we can now load into a format that our callers expect,
+        # unless we have already done it for the very same value.
         if response:
-            response = _loads(response)
+            memo = self.cache_memo.get(cache_key)
+            if memo and memo[0] == response:
+                return cache_key, memo[1].copy()
+
+            value = response
+            response = _loads(value)
             response = _CachedResponse(response['payload'], response['content_type'], response['headers'],
                 response['status_code'])
 
+            self._memoize_cached_response(cache_key, value, response)
+            response = response.copy()
+
         return cache_key, response
 
 # ################################################################################################################################
 
-    def set_response_in_cache(self, channel_item, key, response, _dumps=dumps):
+    def get_response_in_flight(self, cache_key, in_flight):
+        """ Returns a response for a cache key whose response is already being computed by another greenlet.
+        This is either the previous response for that key, if stale responses may be served, or the one being computed.
+        Returns None if the other greenlet did not produce a response in time or if it failed.
+        """
+        if self.cache_stale_while_revalidate:
+            memo = self.cache_memo.get(cache_key)
+            if memo:
+                return memo[1].copy()
+
+        response = in_flight.wait(self.cache_coalesce_timeout)
+        if response:
+            return response.copy()
+
+# ################################################################################################################################
+
+    def set_response_in_cache(self, channel_item, key, response, _dumps=dumps, _CachedResponse=_CachedResponse):
         """ Caches responses from this channel's invocation for as long as the cache is configured to keep it.
+        Returns a _CachedResponse that requests for the same key will be given.
         """
-        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, _dumps({
-            'payload': response.payload,
-            'content_type': response.content_type,
-            'headers': response.headers,
-            'status_code': response.status_code,
-        }))
+        cached = _CachedResponse(response.payload, response.content_type, dict(response.headers), response.status_code)
+
+        # Caches, including ones synchronized between workers, accept strings only
+        value = _dumps({
+            'payload': cached.payload,
+            'content_type': cached.content_type,
+            'headers': cached.headers,
+            'status_code': cached.status_code,
+        })
+
+        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, value)
+        self._memoize_cached_response(key, value, cached)
+
+        return cached
 
 # ################################################################################################################################
 
@@ -484,26 +650,52 @@ class RequestHandler(object):
         else:
             channel_params = None
 
+        # Set to an AsyncResult if we are the one computing a response that other requests for the same cache key will wait for
+        in_flight = None
+
         # If caching is configured for this channel, we need to first check if there is no response already
         if channel_item['cache_type']:
             cache_key, response = self.get_response_from_cache(service, raw_request, channel_item, channel_params, wsgi_environ)
             if response:
                 return response
 
+            # Perhaps another greenlet is already invoking the service for the same request ..
+            other_in_flight = self.cache_in_flight.get(cache_key)
+            if other_in_flight is not None:
+                response = self.get_response_in_flight(cache_key, other_in_flight)
+                if response:
+                    return response
+
+            # .. if not, we are the one to do it and all the others will wait for us.
+            else:
+                in_flight = self.cache_in_flight[cache_key] = AsyncResult()
+
         # Add any path params matched to WSGI environment so it can be easily accessible later on
         wsgi_environ['zato.http.path_params'] = url_match
 
-        # No cache for this channel or no cached response, invoke the service then.
-        response = service.update_handle(self._set_response_data, service, raw_request,
-            channel_type, channel_item.data_format, channel_item.transport, self.server, worker_store.broker_client,
-            worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
-            url_match=url_match, channel_item=channel_item, channel_params=channel_params,
-            merge_channel_params=channel_item.merge_url_params_req,
-            params_priority=channel_item.params_pri)
-
-        # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
-        if channel_item['cache_type']:
-            self.set_response_in_cache(channel_item, cache_key, response)
+        try:
+
+            # No cache for this channel or no cached response, invoke the service then.
+            response = service.update_handle(self._set_response_data, service, raw_request,
+                channel_type, channel_item.data_format, channel_item.transport, self.server, worker_store.broker_client,
+                worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
+                url_match=url_match, channel_item=channel_item, channel_params=channel_params,
+                merge_channel_params=channel_item.merge_url_params_req,
+                params_priority=channel_item.params_pri)
+
+            # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
+            if channel_item['cache_type']:
+                cached = self.set_response_in_cache(channel_item, cache_key, response)
+                if in_flight is not None:
+                    in_flight.set(cached)
+
+        finally:
+
+            # If we did not produce any response, other greenlets waiting for it will invoke the service on their own
+            if in_flight is not None:
+                if not in_flight.ready():
+                    in_flight.set(None)
+                self.cache_in_flight.pop(cache_key, None)
 
         # Having used the cache or not, we can return the response now
         return response
@@ -29,7 +29,8 @@ from zato.common.broker_message import code_to_name, SECURITY, VAULT as VAULT_BR
 from zato.common.dispatch import dispatcher
 from zato.common.util import parse_tls_channel_security_definition, update_apikey_username_to_channel
 from zato.server.connection.http_soap import Forbidden, Unauthorized
-from zato.server.jwt import JWT
+from zato.server.jwt import default_renew_interval as jwt_default_renew_interval, \
+     default_verified_cache_ttl as jwt_default_verified_cache_ttl, JWT
 from zato.url_dispatcher import CyURLData, Matcher
 
 logger = logging.getLogger(__name__)
@@ -48,7 +49,8 @@ class URLData(CyURLData, OAuthDataStore):
                  openstack_config=None, xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, \
                  vault_conn_sec_config=None, kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None,
                  jwt_secret=None, vault_conn_api=None):
-        super(URLData, self).__init__(channel_data)
+        super(URLData, self).__init__(channel_data, int(worker.server.fs_server_config.get('misc', {}).get(
+            'url_match_cache_size', MISC.DEFAULT_URL_MATCH_CACHE_SIZE)))
         self.worker = worker
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -68,6 +70,7 @@ class URLData(CyURLData, OAuthDataStore):
         self.odb = odb
         self.jwt_secret = jwt_secret
         self.vault_conn_api = vault_conn_api
+        self._jwt = None # Created on first use
         self.rbac_auth_type_hooks = self.worker.server.fs_server_config.rbac.auth_type_hook
 
         self.sec_config_getter = Bunch()
@@ -235,6 +238,17 @@ class URLData(CyURLData, OAuthDataStore):
 
 # ################################################################################################################################
 
+    def get_jwt(self):
+        """ Returns the JWT backend of this worker, which keeps tokens verified recently.
+        """
+        if not self._jwt:
+            config = self.worker.server.fs_server_config.get('jwt', {})
+            self._jwt = JWT(self.kvdb, self.odb, self.jwt_secret,
+                float(config.get('verified_cache_ttl', jwt_default_verified_cache_ttl)),
+                float(config.get('renew_interval', jwt_default_renew_interval)))
+
+        return self._jwt
+
     def _handle_security_jwt(self, cid, sec_def, path_info, body, wsgi_environ, ignored_post_data=None, enforce_auth=True):
         """ Performs the authentication using a JavaScript Web Token (JWT).
         """
@@ -256,7 +270,7 @@ class URLData(CyURLData, OAuthDataStore):
                 return False
 
         token = authorization.split('Bearer ', 1)[1]
-        result = JWT(self.kvdb, self.odb, self.jwt_secret).validate(sec_def.username, token.encode('utf8'))
+        result = self.get_jwt().validate(sec_def.username, token.encode('utf8'))
 
         if not result.valid:
             if enforce_auth:
@@ -631,6 +645,7 @@ class URLData(CyURLData, OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             self.channel_data.pop(match_idx)
+            self.invalidate_index()
 
 # ################################################################################################################################
 
@@ -859,6 +874,7 @@ class URLData(CyURLData, OAuthDataStore):
             del self.jwt_config[msg.old_name]
             self._update_jwt(msg.name, msg)
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
+            self._clear_jwt_verified()
 
     def on_broker_msg_SECURITY_JWT_DELETE(self, msg, *args):
         """ Deletes a JWT security definition.
@@ -867,6 +883,7 @@ class URLData(CyURLData, OAuthDataStore):
             self._delete_channel_data('jwt', msg.name)
             del self.jwt_config[msg.name]
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT, True)
+            self._clear_jwt_verified()
 
     def on_broker_msg_SECURITY_JWT_CHANGE_PASSWORD(self, msg, *args):
         """ Changes password of a JWT security definition.
@@ -874,6 +891,19 @@ class URLData(CyURLData, OAuthDataStore):
         with self.url_sec_lock:
             self.jwt_config[msg.name]['config']['password'] = msg.password
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
+            self._clear_jwt_verified()
+
+    def _clear_jwt_verified(self):
+        """ Makes all tokens be looked up in KVDB again after a JWT security definition changed.
+        """
+        if self._jwt:
+            self._jwt.verified.clear()
+
+    def on_broker_msg_SECURITY_JWT_TOKEN_DELETE(self, msg, *args):
+        """ Forgets a JWT token that was deleted, possibly in another server.
+        """
+        if self._jwt:
+            self._jwt.invalidate(msg.token.encode('utf8'))
 
 # ################################################################################################################################
 
@@ -1112,7 +1142,7 @@ class URLData(CyURLData, OAuthDataStore):
 
     def sort_channel_data(self):
         """ Sorts channel items by name and then re-arranges the result so that user-facing services are closer to the begining
-        of the list which makes it faster to look them up - searches in the list are O(n).
+        of the list, which is also the order in which they are matched.
         """
         channel_data = []
         user_services = []
@@ -1131,6 +1161,7 @@ class URLData(CyURLData, OAuthDataStore):
         channel_data.extend(internal_services)
 
         self.channel_data[:] = channel_data
+        self.invalidate_index()
 
 # ################################################################################################################################
 
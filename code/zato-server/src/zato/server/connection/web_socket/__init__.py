@@ -21,6 +21,7 @@ from bunch import Bunch, bunchify
 
 # gevent
 from gevent import sleep, socket, spawn
+from gevent.event import AsyncResult
 from gevent.lock import RLock
 
 # pyrapidjson
@@ -143,6 +144,13 @@ class WebSocket(_WebSocket):
         # Last the we received a ping response (pong) from our peer
         self.ping_last_response_time = None
 
+        # Background pings are sent by a scheduler shared by all connections in this worker,
+        # which also keeps track of what our last ping was (None = already responded to) and when it was sent.
+        self.ping_scheduler = self.config.parallel_server.worker_store.wsx_ping_scheduler
+        self.ping_bucket = None
+        self.ping_id = None
+        self.ping_sent_at = None
+
         #
         # If the peer ever subscribes to a pub/sub topic we will periodically
         # store in the ODB information about the last time the peer either sent
@@ -211,8 +219,9 @@ class WebSocket(_WebSocket):
         for name in _wsgi_drop_keys:
             self.initial_http_wsgi_environ.pop(name, None)
 
-        # Responses to previously sent requests - keyed by request IDs
-        self.responses_received = {}
+        # Requests sent to the client that we are still waiting for responses to - request IDs -> AsyncResult objects,
+        # each one is removed by whoever sent the request, no matter if a response arrived or not.
+        self.responses_expected = {}
 
         _local_address = self.sock.getsockname()
         self._local_address = '{}:{}'.format(_local_address[0], _local_address[1])
@@ -536,49 +545,35 @@ class WebSocket(_WebSocket):
 
 # ################################################################################################################################
 
-    def send_background_pings(self, ping_extend=30):
-
-        logger.info('Starting WSX background pings for `%s`', self.peer_conn_info_pretty)
-
+    def send_background_ping(self, _Class=InvokeClientRequest):
+        """ Sends a ping whose response will be handled in self.ponged. Called by self.ping_scheduler.
+        """
         try:
-            while self.stream and (not self.server_terminated):
-
-                # Sleep for N seconds before sending a ping but check if we are connected upfront because
-                # we could have disconnected in between while and sleep calls.
-                sleep(ping_extend)
-
-                # Ok, still connected
-                if self.stream and (not self.server_terminated):
-                    try:
-                        response = self.invoke_client(new_cid(), None, use_send=False)
-                    except RuntimeError:
-                        logger.warn('Closing connection due to `%s`', format_exc())
-                        self.on_socket_terminated()
-
-                    with self.update_lock:
-                        if response:
-                            self.pings_missed = 0
-                            self.ping_last_response_time = datetime.utcnow()
-                            self.token.extend(ping_extend)
-                        else:
-                            # self._peer_address, action, self._local_address, self.config.name
-                            self.pings_missed += 1
-                            if self.pings_missed < self.pings_missed_threshold:
-                                logger.warn(
-                                    'Peer %s (%s) missed %s/%s ping messages from %s (%s). Last response time: %s{} (%s)'.format(
-                                        ' UTC' if self.ping_last_response_time else '', self.peer_conn_info_pretty),
-                                    self._peer_address, self._peer_fqdn, self.pings_missed, self.pings_missed_threshold,
-                                    self._local_address, self.config.name, self.ping_last_response_time)
-                            else:
-                                self.on_forbidden('missed {}/{} ping messages'.format(
-                                    self.pings_missed, self.pings_missed_threshold))
-
-                # No stream or server already = we can quit
-                else:
-                    return
+            self.ping(_Class(self.ping_id, None, None).serialize())
+        except RuntimeError:
+            logger.warn('Closing connection due to `%s`', format_exc())
+            self.on_socket_terminated()
 
-        except Exception:
-            logger.warn(format_exc())
+    def on_background_pong(self):
+        """ Our peer responded to the last background ping.
+        """
+        self.ping_scheduler.on_pong(self)
+        self.pings_missed = 0
+        self.ping_last_response_time = datetime.utcnow()
+        self.token.extend(self.ping_scheduler.interval)
+
+    def on_ping_missed(self):
+        """ Our peer did not respond to the last background ping before the next one was due.
+        """
+        self.pings_missed += 1
+        if self.pings_missed < self.pings_missed_threshold:
+            logger.warn(
+                'Peer %s (%s) missed %s/%s ping messages from %s (%s). Last response time: %s{} (%s)'.format(
+                    ' UTC' if self.ping_last_response_time else '', self.peer_conn_info_pretty),
+                self._peer_address, self._peer_fqdn, self.pings_missed, self.pings_missed_threshold,
+                self._local_address, self.config.name, self.ping_last_response_time)
+        else:
+            self.on_forbidden('missed {}/{} ping messages'.format(self.pings_missed, self.pings_missed_threshold))
 
 # ################################################################################################################################
 
@@ -625,7 +620,7 @@ class WebSocket(_WebSocket):
         if hook:
             hook(**self._get_hook_request())
 
-        spawn(self.send_background_pings)
+        self.ping_scheduler.register(self)
 
 # ################################################################################################################################
 
@@ -778,17 +773,27 @@ class WebSocket(_WebSocket):
                 request['msg'] = msg
                 hook(**request)
 
-        # Regular synchronous response, simply enqueue it and someone else will take care of it
+        # Regular synchronous response, hand it over to whoever is waiting for it
         else:
-            self.responses_received[msg.in_reply_to] = msg
+            self._set_client_response(msg.in_reply_to, msg)
 
-    def _has_client_response(self, request_id):
-        return self.responses_received.get(request_id)
+    def _set_client_response(self, request_id, response):
+        """ Wakes up the greenlet waiting for a response to request_id. Responses that no one waits for,
+        e.g. because they arrived after a timeout, are dropped.
+        """
+        async_result = self.responses_expected.get(request_id)
+        if async_result is not None:
+            async_result.set(response)
+        else:
+            logger.info('Ignoring response to `%s` (not waited for), conn:`%s`', request_id, self.peer_conn_info_pretty)
 
-    def _wait_for_client_response(self, request_id, wait_time=5):
+    def _wait_for_client_response(self, request_id, async_result, wait_time=5):
         """ Wait until a response from client arrives and return it or return None if there is no response up to wait_time.
         """
-        return self._wait_for_event(wait_time, self._has_client_response, request_id=request_id)
+        try:
+            return async_result.wait(wait_time)
+        finally:
+            self.responses_expected.pop(request_id, None)
 
 # ################################################################################################################################
 
@@ -909,14 +914,25 @@ class WebSocket(_WebSocket):
             logger.info('Sending message `%s` from `%s` to `%s` `%s` `%s` `%s`', serialized,
                 self.python_id, self.pub_client_id, self.ext_client_id, self.ext_client_name, self.peer_conn_info_pretty)
 
-        # Actually send the message now
-        (self.send if use_send else self.ping)(serialized)
-
         # Wait for response but only if it is not a pub/sub message,
         # these are always asynchronous and that channel's WSX hook
         # will process the response, if any arrives.
-        if _Class is not InvokeClientPubSubRequest:
-            response = self._wait_for_client_response(msg.id, timeout)
+        needs_response = _Class is not InvokeClientPubSubRequest
+
+        # This needs to be registered before the message is sent in case the response arrives immediately
+        if needs_response:
+            async_result = self.responses_expected[msg.id] = AsyncResult()
+
+        # Actually send the message now
+        try:
+            (self.send if use_send else self.ping)(serialized)
+        except Exception:
+            if needs_response:
+                self.responses_expected.pop(msg.id, None)
+            raise
+
+        if needs_response:
+            response = self._wait_for_client_response(msg.id, async_result, timeout)
             if response:
                 return response if isinstance(response, bool) else response.data # It will be bool in pong responses
 
@@ -927,6 +943,7 @@ class WebSocket(_WebSocket):
             self._peer_address, self._peer_fqdn, self._local_address, self.config.name, self.ext_client_id,
             self.pub_client_id, ' {})'.format(self.ext_client_name) if self.ext_client_name else ')')
 
+        self.ping_scheduler.unregister(self)
         self.unregister_auth_client()
         del self.container.clients[self.pub_client_id]
 
@@ -939,6 +956,19 @@ class WebSocket(_WebSocket):
         self._close_connection('Disconnecting client from')
         self.close()
 
+# ################################################################################################################################
+
+    def on_ping_send_timeout(self):
+        """ A background ping could not be sent in time. Part of its frame may have been written already, which means
+        that nothing else can be sent to the peer, including a close frame, so the socket is simply closed.
+        """
+        self._disconnect_requested = True
+        self._close_connection('Background ping not sent in time, closing connection from')
+
+        self.server_terminated = True
+        self.client_terminated = True
+        self.close_connection()
+
 # ################################################################################################################################
 
     def opened(self, _now=datetime.utcnow, _timedelta=timedelta):
@@ -961,10 +991,17 @@ class WebSocket(_WebSocket):
 
     def ponged(self, msg, _loads=loads, _action=WEB_SOCKET.ACTION.CLIENT_RESPONSE):
 
-        # Pretend it's an actual response from the client,
-        # we cannot use in_reply_to because pong messages are 1:1 copies of ping ones.
+        # We cannot use in_reply_to because pong messages are 1:1 copies of ping ones.
         # TODO: Use lxml for XML eventually but for now we are always using JSON
-        self.responses_received[_loads(msg.data)['meta']['id']] = True
+        msg_id = _loads(msg.data)['meta']['id']
+
+        # Response to our background ping ..
+        if msg_id == self.ping_id:
+            self.on_background_pong()
+
+        # .. otherwise, pretend it's an actual response from the client.
+        else:
+            self._set_client_response(msg_id, True)
 
         # Since we received a pong response, it means that the peer is connected,
         # in which case we update its pub/sub metadata.
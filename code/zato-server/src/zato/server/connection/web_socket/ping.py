@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import deque
+from logging import getLogger
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent import sleep, spawn, Timeout
+from gevent.pool import Pool
+
+# Zato
+from zato.common import WEB_SOCKET
+from zato.common.util import new_cid
+
+# ################################################################################################################################
+
+logger = getLogger('zato_web_socket')
+
+# ################################################################################################################################
+
+class PingScheduler(object):
+    """ Sends background pings to all the WebSocket connections of a worker from a single greenlet.
+
+    Connections are spread across time buckets, each of which is visited once per ping interval, and connections
+    from a bucket are pinged in batches. Pings are not waited for - each connection reports its pong through
+    its own .ponged callback and a ping that is still unanswered when the next one is due counts as a missed one.
+
+    Pings are sent from a bounded pool of greenlets, each under a timeout, so that a peer which does not read
+    from its socket cannot hold up pings to other connections. Connections whose pings time out are closed.
+    """
+    def __init__(self, interval=WEB_SOCKET.DEFAULT.PING_INTERVAL, bucket_count=WEB_SOCKET.DEFAULT.PING_BUCKETS,
+            batch_size=WEB_SOCKET.DEFAULT.PING_BATCH_SIZE, rtt_samples=WEB_SOCKET.DEFAULT.PING_RTT_SAMPLES,
+            send_timeout=WEB_SOCKET.DEFAULT.PING_SEND_TIMEOUT, max_sending=WEB_SOCKET.DEFAULT.PING_MAX_SENDING):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.send_timeout = send_timeout
+        self.pool = Pool(max_sending)
+        self.buckets = [set() for x in range(bucket_count)]
+        self.tick = float(interval) / bucket_count
+        self.current_bucket = 0
+        self.rtt = deque(maxlen=rtt_samples) # Most recent round-trip times, in seconds
+        self.keep_running = True
+        self.greenlet = None
+
+# ################################################################################################################################
+
+    def register(self, conn):
+        """ Starts to send background pings to a connection. Its first ping will be sent in about self.interval seconds.
+        """
+        # The bucket that has just been visited is the one to be visited again the latest
+        conn.ping_bucket = self.current_bucket
+        self.buckets[conn.ping_bucket].add(conn)
+
+        if not self.greenlet:
+            self.greenlet = spawn(self.run)
+
+# ################################################################################################################################
+
+    def unregister(self, conn):
+        """ Stops sending background pings to a connection. It is safe to call it for ones that were never registered.
+        """
+        if conn.ping_bucket is not None:
+            self.buckets[conn.ping_bucket].discard(conn)
+            conn.ping_bucket = None
+
+# ################################################################################################################################
+
+    def on_pong(self, conn, _time=time):
+        """ Called by a connection that received a response to its background ping.
+        """
+        self.rtt.append(_time() - conn.ping_sent_at)
+        conn.ping_id = None
+
+# ################################################################################################################################
+
+    def get_rtt_percentiles(self, percentiles=(50, 90, 99)):
+        """ Returns percentiles of the most recent ping round-trip times, in milliseconds.
+        """
+        out = {}
+        rtt = sorted(self.rtt)
+
+        if rtt:
+            for percentile in percentiles:
+                idx = min(len(rtt) - 1, len(rtt) * percentile // 100)
+                out['p{}'.format(percentile)] = round(rtt[idx] * 1000, 2)
+
+        return out
+
+# ################################################################################################################################
+
+    def ping_bucket(self, bucket, _time=time, _new_cid=new_cid):
+        """ Sends pings to all connections from a bucket, yielding control to other greenlets after each batch.
+        """
+        for idx, conn in enumerate(list(bucket)):
+
+            if idx and idx % self.batch_size == 0:
+                sleep(0)
+
+            # Already disconnected, nothing to ping anymore
+            if not conn.stream or conn.server_terminated:
+                self.unregister(conn)
+                continue
+
+            # The peer did not respond to the previous ping in time - this may close the connection
+            if conn.ping_id:
+                conn.on_ping_missed()
+
+                if conn.server_terminated:
+                    self.unregister(conn)
+                    continue
+
+            conn.ping_id = _new_cid()
+            conn.ping_sent_at = _time()
+
+            # Blocks only if self.pool is full
+            self.pool.spawn(self.send_ping, conn)
+
+# ################################################################################################################################
+
+    def send_ping(self, conn):
+        """ Sends a background ping to a connection, giving up after self.send_timeout seconds.
+        """
+        is_sent = False
+
+        with Timeout(self.send_timeout, False):
+            conn.send_background_ping()
+            is_sent = True
+
+        # The ping could not be sent in time, e.g. because the peer does not read from its socket. The frame may have been
+        # written only partially so the connection cannot be used anymore.
+        if not is_sent:
+            logger.warn('WSX background ping not sent within %ss', self.send_timeout)
+
+            self.unregister(conn)
+            conn.on_ping_send_timeout()
+
+# ################################################################################################################################
+
+    def run(self):
+        logger.info('Starting WSX background pings every %ss, buckets:%s', self.interval, len(self.buckets))
+
+        while self.keep_running:
+            sleep(self.tick)
+
+            self.current_bucket = (self.current_bucket + 1) % len(self.buckets)
+
+            try:
+                self.ping_bucket(self.buckets[self.current_bucket])
+            except Exception:
+                logger.warn('Could not send WSX background pings, e:`%s`', format_exc())
+
+            # Report round-trip times once per each full round of pings
+            if self.current_bucket == 0 and self.rtt:
+                logger.info('WSX ping RTT (ms) %s', self.get_rtt_percentiles())
+
+# ################################################################################################################################
+
+    def stop(self):
+        self.keep_running = False
+        self.pool.kill()
+
+# ################################################################################################################################
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import hashlib
+from collections import deque
+from logging import getLogger
+from time import time
+
+# gevent
+from gevent.threadpool import ThreadPool
+
+# passlib
+from passlib.crypto import digest as passlib_digest
+
+# Zato
+from zato.common.exception import ServiceUnavailable
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+# PBKDF2 backends of passlib that compute hashes in C without holding the GIL
+_native_pbkdf2_backends = ('fastpbkdf2', 'hashlib-ssl')
+
+# ################################################################################################################################
+
+def has_native_pbkdf2():
+    """ Returns True if passlib computes PBKDF2 without holding the GIL, i.e. if native threads can run hashes in parallel
+    with the greenlets of a worker.
+    """
+    backends = getattr(passlib_digest, 'PBKDF2_BACKENDS', None)
+
+    # New in passlib 1.7.2, the first backend on the list is the one in use
+    if backends is not None:
+        return bool(backends) and backends[0] in _native_pbkdf2_backends
+
+    # Older versions use hashlib's implementation if it is built with OpenSSL, otherwise hashlib's is in pure Python.
+    pbkdf2_hmac = getattr(hashlib, 'pbkdf2_hmac', None)
+    return pbkdf2_hmac is not None and pbkdf2_hmac.__module__ != 'hashlib'
+
+# ################################################################################################################################
+
+class HashPool(object):
+    """ Runs hashing and verification of secrets in native threads. If passlib uses OpenSSL, PBKDF2 is computed without
+    holding the GIL, which means that while a greenlet waits for its hash, other greenlets of the same worker keep running.
+
+    At most self.size hashes are computed at a time and at most self.max_queued may wait for a thread,
+    any above that are rejected rather than made to wait indefinitely.
+    """
+    def __init__(self, size, max_queued, wait_time_samples=1000):
+        self.size = size
+        self.max_queued = max_queued
+        self.in_flight = 0 # Queued and currently being computed
+        self.rejected = 0
+        self.wait_time = deque(maxlen=wait_time_samples) # Most recent times spent in queue, in seconds
+        self.pool = ThreadPool(size) if size else None
+
+        if self.pool is not None and not has_native_pbkdf2():
+            logger.warn('PBKDF2 is computed in pure Python (backends:%s), hashing secrets will block other greenlets; ' +
+                'use a Python built with OpenSSL to avoid it', getattr(passlib_digest, 'PBKDF2_BACKENDS', None))
+
+# ################################################################################################################################
+
+    def _run(self, func, args, queued_at, _time=time):
+        """ Runs in a native thread, which is why it does not log anything.
+        """
+        self.wait_time.append(_time() - queued_at)
+        return func(*args)
+
+# ################################################################################################################################
+
+    def run(self, func, *args):
+        """ Runs func in one of the pool's threads, blocking the calling greenlet only, and returns its result.
+        Without a pool, func runs in the calling greenlet.
+        """
+        # Note that a ThreadPool without any tasks is false in boolean context, hence the explicit check
+        if self.pool is None:
+            return func(*args)
+
+        if self.in_flight >= self.size + self.max_queued:
+            self.rejected += 1
+            logger.warn('Secret hashing rejected, in-flight:%s, pool size:%s, max. queued:%s',
+                self.in_flight, self.size, self.max_queued)
+            raise ServiceUnavailable(None, 'Too many requests to hash secrets, try again later')
+
+        self.in_flight += 1
+
+        try:
+            return self.pool.spawn(self._run, func, args, time()).get()
+        finally:
+            self.in_flight -= 1
+
+# ################################################################################################################################
+
+    def get_stats(self, percentiles=(50, 90, 99)):
+        """ Returns current usage of the pool along with percentiles of recent queue wait times, in milliseconds.
+        """
+        out = {
+            'size': self.size,
+            'max_queued': self.max_queued,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+        }
+        wait_time = sorted(self.wait_time)
+
+        if wait_time:
+            for percentile in percentiles:
+                idx = min(len(wait_time) - 1, len(wait_time) * percentile // 100)
+                out['wait_p{}'.format(percentile)] = round(wait_time[idx] * 1000, 2)
+
+        return out
+
+# ################################################################################################################################
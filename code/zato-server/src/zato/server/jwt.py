@@ -13,6 +13,8 @@ import uuid
 from contextlib import closing
 from datetime import datetime
 from logging import getLogger
+from time import time
+from traceback import format_exc
 
 # Bunch
 from bunch import bunchify, Bunch
@@ -20,6 +22,9 @@ from bunch import bunchify, Bunch
 # Cryptography
 from cryptography.fernet import Fernet
 
+# gevent
+from gevent import spawn_later
+
 # JWT
 import jwt
 
@@ -33,20 +38,47 @@ logger = getLogger(__name__)
 
 # ################################################################################################################################
 
+# In seconds, how long a token once verified is accepted without looking it up in KVDB again
+default_verified_cache_ttl = 30
+
+# In seconds, how often sliding expiry of tokens used in the meantime is renewed in KVDB and ODB
+default_renew_interval = 5
+
+# ################################################################################################################################
+
+class _VerifiedToken(object):
+    """ A token found in KVDB, decrypted and decoded - accepted as is until expires_at.
+    """
+    __slots__ = ('token_data', 'expires_at')
+
+    def __init__(self, token_data, expires_at):
+        self.token_data = token_data
+        self.expires_at = expires_at
+
+# ################################################################################################################################
+
 class JWT(object):
-    """ JWT authentication backend.
+    """ JWT authentication backend. If verified_cache_ttl is given, tokens that were verified are kept in RAM
+    for that many seconds and during that time they are neither looked up in KVDB nor decrypted. If renew_interval is given,
+    sliding expiry of all tokens used in that many seconds is renewed in one go rather than on each validation.
     """
     ALGORITHM = 'HS256'
 
 # ################################################################################################################################
 
-    def __init__(self, kvdb, odb, secret):
+    def __init__(self, kvdb, odb, secret, verified_cache_ttl=0, renew_interval=0):
         self.odb = odb
         self.cache = RobustCache(kvdb, odb)
 
         self.secret = secret
         self.fernet = Fernet(self.secret)
 
+        self.verified_cache_ttl = verified_cache_ttl
+        self.renew_interval = renew_interval
+
+        self.verified = {} # Token -> _VerifiedToken
+        self.renewals = {} # Token -> its TTL, for tokens whose expiry will be renewed in the next batch
+
 # ################################################################################################################################
 
     def _lookup_jwt(self, username, password):
@@ -88,38 +120,95 @@ class JWT(object):
 
 # ################################################################################################################################
 
-    def validate(self, expected_username, token):
+    def validate(self, expected_username, token, _time=time):
         """ Check if the given token is (still) valid.
 
-        1. Look for the token in Cache without decrypting/decoding it.
-        2.a If not found, return "Invalid"
-        2.b If found:
-            3. decrypt
-            4. decode
+        1. Look for the token among ones verified recently, if found, skip to 5.
+        2. Look for the token in Cache without decrypting/decoding it.
+        3.a If not found, return "Invalid"
+        3.b If found:
+            4. decrypt and decode
             5. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
-            5. return "valid" + the token contents
+            6. return "valid" + the token contents
         """
-        if self.cache.get(token):
-            decrypted = self.fernet.decrypt(token)
-            token_data = bunchify(jwt.decode(decrypted, self.secret))
+        token_data = None
 
-            if token_data.username == expected_username:
+        if self.verified_cache_ttl:
+            verified = self.verified.get(token)
+            if verified:
+                if _time() < verified.expires_at:
+                    token_data = verified.token_data
+                else:
+                    del self.verified[token]
 
-                # Renew the token expiration
-                self.cache.put(token, token, token_data.ttl, async=True)
-                return Bunch(valid=True, token=token_data)
+        if not token_data:
+            if self.cache.get(token):
+                decrypted = self.fernet.decrypt(token)
+                token_data = bunchify(jwt.decode(decrypted, self.secret))
+
+                if self.verified_cache_ttl:
+                    self.verified[token] = _VerifiedToken(token_data, _time() + min(self.verified_cache_ttl, token_data.ttl))
 
             else:
-                return Bunch(valid=False, message='Unexpected user for token found')
+                return Bunch(valid=False, message='Invalid token')
+
+        if token_data.username == expected_username:
+
+            # Renew the token expiration
+            self._renew(token, token_data.ttl)
+            return Bunch(valid=True, token=token_data)
 
         else:
-            return Bunch(valid=False, message='Invalid token')
+            return Bunch(valid=False, message='Unexpected user for token found')
+
+# ################################################################################################################################
+
+    def _renew(self, token, ttl):
+        """ Renews expiration of a token, either immediately or in the next batch of renewals.
+        """
+        if not self.renew_interval:
+            self.cache.put(token, token, ttl, async=True)
+            return
+
+        if not self.renewals:
+            spawn_later(self.renew_interval, self._renew_batch)
+
+        self.renewals[token] = ttl
+
+# ################################################################################################################################
+
+    def _renew_batch(self, _time=time):
+        """ Renews expiration of all tokens used since the previous batch, and deletes expired ones among verified.
+        """
+        renewals, self.renewals = self.renewals, {}
+
+        now = _time()
+        for token, verified in self.verified.items():
+            if now >= verified.expires_at:
+                del self.verified[token]
+
+        if not renewals:
+            return
+
+        try:
+            self.cache.renew_many(renewals)
+        except Exception:
+            logger.warn('Could not renew expiration of %d JWT token(s), e:`%s`', len(renewals), format_exc())
+
+# ################################################################################################################################
+
+    def invalidate(self, token):
+        """ Forgets a token verified previously, e.g. because it was deleted in another worker or server.
+        """
+        self.verified.pop(token, None)
+        self.renewals.pop(token, None)
 
 # ################################################################################################################################
 
     def delete(self, token):
         """ Deletes a token in both KVDB and ODB.
         """
+        self.invalidate(token)
         self.cache.delete(token)
 
 # ################################################################################################################################
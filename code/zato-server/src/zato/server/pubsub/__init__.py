@@ -12,11 +12,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 from contextlib import closing
 from datetime import datetime
+from heapq import heapify, heappop, heappush
 from operator import attrgetter
 from traceback import format_exc
 
 # gevent
 from gevent import sleep, spawn
+from gevent.event import Event
 from gevent.lock import RLock
 
 # globre
@@ -84,6 +86,9 @@ _update_attrs = ('data', 'size', 'expiration', 'priority', 'pub_correl_id', 'in_
 
 _does_not_exist = object()
 
+# Below this size, the in-RAM backlog's expiry heap is never rebuilt to discard entries of messages no longer in RAM
+_expiry_heap_min_compact = 1024
+
 # ################################################################################################################################
 
 _default_expiration = PUBSUB.DEFAULT.EXPIRATION
@@ -289,6 +294,13 @@ class Topic(ToDictBase):
         # The last time a GD message was published to this topic
         self.gd_pub_time_max = None
 
+        # How many GD messages are in this topic without having been moved to any subscriber queue yet.
+        # Counted in SQL if unknown, e.g. after a cleanup or a new subscription, and incremented locally later on.
+        # Since other processes publish to the topic too, it is also counted anew periodically.
+        self.gd_depth = None
+        self.gd_depth_counted_at = 0
+        self.gd_depth_checks = 0 # How many depth checks used the local counter since it was last counted in SQL
+
 # ################################################################################################################################
 
     def _emit_set_hooks(self, ctx=None, _event=EventType.Topic.set_hooks):
@@ -414,6 +426,40 @@ class Topic(ToDictBase):
     def needs_depth_check(self):
         return self.msg_pub_counter_gd % self.depth_check_freq == 0
 
+# ################################################################################################################################
+
+    def incr_gd_depth(self, value):
+        """ Increases the local GD depth counter unless it is not known yet, in which case it will be counted in SQL.
+        """
+        if self.gd_depth is not None:
+            self.gd_depth += value
+
+# ################################################################################################################################
+
+    def reset_gd_depth(self):
+        """ Forces the GD depth to be counted in SQL during the next depth check.
+        """
+        self.gd_depth = None
+
+# ################################################################################################################################
+
+    def set_gd_depth(self, value, now):
+        """ Sets the GD depth to a value that was just counted in SQL.
+        """
+        self.gd_depth = value
+        self.gd_depth_counted_at = now
+        self.gd_depth_checks = 0
+
+# ################################################################################################################################
+
+    def needs_gd_depth_count(self, now, _max_checks=PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_CHECKS,
+        _max_age=PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_INTERVAL):
+        """ Called for each depth check, returns True if the GD depth needs to be counted in SQL, either because it is
+        not known or because the local counter has not been confirmed in SQL for too many checks or for too long.
+        """
+        self.gd_depth_checks += 1
+        return self.gd_depth is None or self.gd_depth_checks > _max_checks or now - self.gd_depth_counted_at >= _max_age
+
 # ################################################################################################################################
 
     def needs_meta_update(self):
@@ -514,6 +560,7 @@ class InRAMSyncBacklog(object):
         self.msg_id_to_sub_key = {} # Msg ID   -> Sub key set  - What subscribers are interested in a given message
         self.msg_id_to_msg = {}     # Msg ID   -> Message data - What is the actual contents of each message
         self.topic_msg_id = {}      # Topic ID -> Msg ID set --- What messages are available for each topic (no matter sub_key)
+        self.expiry_heap = []       # (Expiration time, Msg ID) - When messages expire, from the earliest one
         self.lock = RLock()
 
         # Start in background a cleanup task that deletes all expired and removed messages
@@ -550,6 +597,9 @@ class InRAMSyncBacklog(object):
             for msg in messages:
                 self.msg_id_to_msg[msg['pub_msg_id']] = msg
 
+                # .. make it known when it expires ..
+                heappush(self.expiry_heap, (msg['expiration_time'], msg['pub_msg_id']))
+
                 # .. attach server metadata ..
                 msg['server_name'] = self.pubsub.server.name
                 msg['server_pid'] = self.pubsub.server.pid
@@ -578,6 +628,9 @@ class InRAMSyncBacklog(object):
                 for attr in _update_attrs:
                     _msg[attr] = msg[attr]
 
+                # The previous entry, if expiration time changed, will be skipped when it is due
+                heappush(self.expiry_heap, (_msg['expiration_time'], _msg['pub_msg_id']))
+
                 # Ok, found and updated
                 return True
 
@@ -817,66 +870,92 @@ class InRAMSyncBacklog(object):
 
 # ################################################################################################################################
 
-    def run_cleanup_task(self, _utcnow=utcnow_as_ms, _sleep=sleep):
-        """ A background task waking up periodically to remove all expired and retrieved messages from backlog.
+    def _delete_expired(self, now, limit, _heappop=heappop):
+        """ Deletes up to limit messages that expired by now, returns how many were deleted and whether more may be due.
+        Must be called with self.lock held.
         """
-        while True:
-            try:
-                with self.lock:
+        # Local aliases
+        publishers = {}
+        expiry_heap = self.expiry_heap
+        len_expired = 0
 
-                    # Local alias
-                    publishers = {}
+        while expiry_heap and expiry_heap[0][0] <= now:
 
-                    # We keep them separate so as not to modify any objects during iteration.
-                    expired_msg = []
+            if len_expired == limit:
+                return len_expired, True
 
-                    # Calling it once will suffice.
-                    now = _utcnow()
+            _, msg_id = _heappop(expiry_heap)
+            msg = self.msg_id_to_msg.get(msg_id)
 
-                    for msg_id, msg in self.msg_id_to_msg.iteritems():
+            # The message was already delivered or deleted, or its expiration was extended in the meantime
+            # in which case there is another entry in the heap for it.
+            if not msg or msg['expiration_time'] > now:
+                continue
 
-                        if now >= msg['expiration_time']:
+            # It's possible that there will be many expired messages all sent by the same publisher
+            # so there is no need to query self.pubsub for each message.
+            if msg['published_by_id'] not in publishers:
+                publishers[msg['published_by_id']] = self.pubsub.get_endpoint_by_id(msg['published_by_id'])
 
-                            # It's possible that there will be many expired messages all sent by the same publisher
-                            # so there is no need to query self.pubsub for each message.
-                            if msg['published_by_id'] not in publishers:
-                                publishers[msg['published_by_id']] = self.pubsub.get_endpoint_by_id(msg['published_by_id'])
+            # We can be sure that it is always found
+            publisher = publishers[msg['published_by_id']]
 
-                            # We can be sure that it is always found
-                            publisher = publishers[msg['published_by_id']]
+            # Log the message to make sure the expiration event is always logged ..
+            logger_zato.info('Found an expired msg:`%s`, topic:`%s`, publisher:`%s`, pub_time:`%s`, exp:`%s`',
+                msg['pub_msg_id'], msg['topic_name'], publisher.name, msg['pub_time'], msg['expiration'])
 
-                            # Log the message to make sure the expiration event is always logged ..
-                            logger_zato.info('Found an expired msg:`%s`, topic:`%s`, publisher:`%s`, pub_time:`%s`, exp:`%s`',
-                                msg['pub_msg_id'], msg['topic_name'], publisher.name, msg['pub_time'], msg['expiration'])
+            # .. get all sub_keys waiting for the message and delete the message from each one,
+            # but note that there may be possibly no subscribers at all if the message was published
+            # to a topic without any subscribers ..
+            for sub_key in self.msg_id_to_sub_key.pop(msg_id):
+                self.sub_key_to_msg_id[sub_key].remove(msg_id)
 
-                            # .. and append it to the list of messages to be deleted.
-                            expired_msg.append((msg['pub_msg_id'], msg['topic_id']))
+            # .. remove all references to the message from topic ..
+            self.topic_msg_id[msg['topic_id']].remove(msg_id)
 
-                    # For logging what was done
-                    len_expired = len(expired_msg)
+            # .. and finally, remove the message's contents.
+            del self.msg_id_to_msg[msg_id]
 
-                    # Iterate over all the expired messages found and delete them from in-RAM structures
-                    for msg_id, topic_id in expired_msg:
+            len_expired += 1
 
-                        # Get all sub_keys waiting for these messages and delete the message from each one,
-                        # but note that there may be possibly no subscribers at all if the message was published
-                        # to a topic without any subscribers.
-                        for sub_key in self.msg_id_to_sub_key.pop(msg_id):
-                            self.sub_key_to_msg_id[sub_key].remove(msg_id)
+        # Entries of messages delivered in the meantime stay in the heap until they are due,
+        # so we rebuild it if most of it is such entries.
+        if len(expiry_heap) > _expiry_heap_min_compact and len(expiry_heap) > 2 * len(self.msg_id_to_msg):
+            expiry_heap[:] = [(_msg['expiration_time'], _msg_id) for _msg_id, _msg in self.msg_id_to_msg.iteritems()]
+            heapify(expiry_heap)
 
-                        # Remove all references to the message from topic
-                        self.topic_msg_id[topic_id].remove(msg_id)
+        return len_expired, False
 
-                        # And finally, remove the message's contents
-                        del self.msg_id_to_msg[msg_id]
+# ################################################################################################################################
+
+    def run_cleanup_task(self, interval=2, batch_size=1000, _utcnow=utcnow_as_ms, _sleep=sleep):
+        """ A background task waking up periodically to remove all expired messages from backlog. Only messages that are due
+        are visited, in batches of up to batch_size, and self.lock is released between batches.
+        """
+        while True:
+            try:
+                len_expired = 0
+                has_more = True
+
+                # Calling it once will suffice.
+                now = _utcnow()
+
+                while has_more:
+                    with self.lock:
+                        len_batch, has_more = self._delete_expired(now, batch_size)
+                        len_expired += len_batch
+
+                    # Let other greenlets run if there is another batch to delete
+                    if has_more:
+                        _sleep(0)
 
                 suffix = 's' if (len_expired==0 or len_expired > 1) else ''
                 len_messages = len(self.msg_id_to_msg)
                 if len_expired or len_messages:
-                    logger.info('In-RAM. Deleted %s pub/sub message%s. Left:%s' % (len_expired, suffix, self.msg_id_to_msg))
+                    logger.info('In-RAM. Deleted %s pub/sub message%s. Left:%s' % (len_expired, suffix, len_messages))
 
                 # Sleep for a moment before checking again but don't do it with self.lock held.
-                _sleep(2)
+                _sleep(interval)
 
             except Exception:
                 e = format_exc()
@@ -970,6 +1049,14 @@ class PubSub(object):
         # Manages access to service hooks
         self.hook_tool = HookTool(self.server, HookCtx, hook_type_to_method, self.invoke_service)
 
+        # IDs of topics that have had messages published since they were last synced with delivery tasks,
+        # along with an event that is set each time a topic is added to the set.
+        self.sync_ready_topic_ids = set()
+        self.sync_ready_event = Event()
+
+        # In seconds, how long to wait for more messages once any are published so that they are synced in one pass
+        self.sync_batch_window = float(server.fs_server_config.pubsub.get('sync_batch_window', 5)) / 1000.0
+
         spawn_greenlet(self.trigger_notify_pubsub_tasks)
 
 # ################################################################################################################################
@@ -1317,6 +1404,16 @@ class PubSub(object):
 
         self.subscriptions_by_sub_key[config.sub_key] = sub
 
+        # Messages published before there were any subscribers are still waiting to be synced
+        topic = self.topics.get(config.topic_id)
+        if topic:
+
+            # Messages waiting in the topic will be moved to the new subscriber's queue, changing the topic's depth
+            topic.reset_gd_depth()
+
+            if topic.sync_has_gd_msg or topic.sync_has_non_gd_msg:
+                self._mark_sync_ready(topic.id)
+
 # ################################################################################################################################
 
     def add_subscription(self, config):
@@ -2086,6 +2183,9 @@ class PubSub(object):
         else:
             topic.sync_has_non_gd_msg = value
 
+        if value:
+            self._mark_sync_ready(topic_id)
+
         self.emit_set_sync_has_msg({
             'topic_id': topic_id,
             'is_gd': is_gd,
@@ -2104,6 +2204,15 @@ class PubSub(object):
         with self.lock:
             self._set_sync_has_msg(topic_id, is_gd, value, source, gd_pub_time_max)
 
+# ################################################################################################################################
+
+    def _mark_sync_ready(self, topic_id):
+        """ Lets trigger_notify_pubsub_tasks know that the topic has messages that delivery tasks should be notified of.
+        Must be called with self.lock held.
+        """
+        self.sync_ready_topic_ids.add(topic_id)
+        self.sync_ready_event.set()
+
 # ################################################################################################################################
 
     def emit_loop_topic_id_dict(self, ctx=None, _event=EventType.PubSub.loop_topic_id_dict):
@@ -2136,8 +2245,8 @@ class PubSub(object):
 # ################################################################################################################################
 
     def trigger_notify_pubsub_tasks(self):
-        """ A background greenlet which periodically lets delivery tasks that there are perhaps
-        new GD messages for the topic this class represents.
+        """ A background greenlet which lets delivery tasks know that there are perhaps new messages for topics
+        they are subscribed to. It sleeps until messages are published and then visits only topics that have any.
         """
 
         # Local aliases
@@ -2150,10 +2259,15 @@ class PubSub(object):
         _new_cid      = new_cid
         _spawn        = spawn
         _sleep        = sleep
+        _utcnow_as_ms = utcnow_as_ms
         _self_lock    = self.lock
         _self_topics  = self.topics
         _keep_running = self.keep_running
 
+        _self_sync_ready_topic_ids = self.sync_ready_topic_ids
+        _self_sync_ready_event     = self.sync_ready_event
+        _self_sync_batch_window    = self.sync_batch_window
+
         _logger_info      = logger.info
         _logger_warn      = logger.warn
         _logger_zato_warn = logger_zato.warn
@@ -2212,27 +2326,46 @@ class PubSub(object):
 
 # ################################################################################################################################
 
+        # In seconds, set if any topic with messages could not be synced yet because of its task_sync_interval
+        next_sync_wait = None
+
         # Loop forever or until stopped
         while _keep_running:
 
-            # Sleep for a while before continuing - the call to sleep is here because this while loop is quite long
-            # so it would be inconvenient to have it down below.
-            _sleep(0.01)
+            # Sleep until there are messages for any topic or until a topic skipped previously can be synced ..
+            _self_sync_ready_event.wait(next_sync_wait)
+
+            # .. and let other messages published in the same burst arrive so that they are synced in the same pass.
+            _sleep(_self_sync_batch_window)
 
             # Blocks other pub/sub processes for a moment
             with _self_lock:
 
+                # Topics marked as ready from now on will set the event again
+                _self_sync_ready_event.clear()
+                next_sync_wait = None
+
                 # Will map a few temporary objects down below
                 topic_id_dict = {}
 
-                # Get all topics ..
-                for _topic in _self_topics.itervalues(): # type: Topic
+                # Get all topics that have any messages ..
+                for topic_id in list(_self_sync_ready_topic_ids):
+
+                    _topic = _self_topics.get(topic_id) # type: Topic
 
-                    # Does the topic require task synchronization now?
+                    # .. the topic may have been deleted in the meantime ..
+                    if not _topic:
+                        _self_sync_ready_topic_ids.discard(topic_id)
+                        continue
+
+                    # Does the topic require task synchronization now? If not, we will visit it again once it does.
                     if not _topic.needs_task_sync():
+                        sync_wait = max(_topic.task_sync_interval - (_utcnow_as_ms() - _topic.last_synced), 0)
+                        next_sync_wait = sync_wait if next_sync_wait is None else min(next_sync_wait, sync_wait)
                         continue
                     else:
                         _topic.update_task_sync_time()
+                        _self_sync_ready_topic_ids.discard(topic_id)
 
                     # OK, the time has come for this topic to sync its state with subscribers
                     # but still skip it if we know that there have been no messages published to it since the last time.
@@ -2388,6 +2521,21 @@ class PubSub(object):
 
         return response.response['msg_id']
 
+# ################################################################################################################################
+# ################################################################################################################################
+
+    def publish_many(self, msg_list, endpoint_id=None):
+        """ Publishes a batch of messages, each to its own topic given in topic_name, in a single SQL transaction.
+        Returns a list of message IDs in the same order as messages were given on input.
+        POST /zato/pubsub/publish
+        """
+        response = self.invoke_service('zato.pubsub.publish.publish-many', {
+            'msg_list': msg_list,
+            'endpoint_id': endpoint_id or self.server.default_internal_pubsub_endpoint_id,
+        }, serialize=False)
+
+        return response.response['msg_id_list']
+
 # ################################################################################################################################
 # ################################################################################################################################
 
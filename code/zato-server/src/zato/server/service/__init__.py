@@ -48,6 +48,7 @@ from zato.server.pattern.invoke_retry import InvokeRetry
 from zato.server.pattern.parallel import ParallelExec
 from zato.server.pubsub import PubSub
 from zato.server.service.reqresp import AMQPRequestData, Cloud, IBMMQRequestData, Outgoing, Request, Response
+from zato.server.service.reqresp.sio import get_sio_plan
 
 # Not used here in this module but it's convenient for callers to be able to import everything from a single namespace
 from zato.server.service.reqresp.sio import AsIs, CSV, Boolean, Date, DateTime, Dict, Float, ForceType, Integer, List, \
@@ -215,9 +216,12 @@ class Service(object):
     # For invoking other servers directly
     servers = None
 
+    # Built once per worker the first time a service needs them
+    _zmq_facade = None
+    _sms_api = None
+
     def __init__(self, _get_logger=logging.getLogger, _Bunch=Bunch, _Request=Request, _Response=Response,
-            _DictNav=DictNav, _ListNav=ListNav, _Outgoing=Outgoing, _WMQFacade=WMQFacade, _ZMQFacade=ZMQFacade,
-            *ignored_args, **ignored_kwargs):
+            _DictNav=DictNav, _ListNav=ListNav, *ignored_args, **ignored_kwargs):
         self.name = self.__class__.__service_name # Will be set through .get_name by Service Store
         self.impl_name = self.__class__.__service_impl_name # Ditto
         self.logger = _get_logger(self.name)
@@ -239,31 +243,80 @@ class Service(object):
         self.processing_time = None # Processing time in milliseconds
         self.usage = 0 # How many times the service has been invoked
         self.slow_threshold = maxint # After how many ms to consider the response came too late
-        self.msg = None
+        self._msg = None
         self.time = None
-        self.patterns = None
+        self._patterns = None
         self.user_config = None
         self.dictnav = _DictNav
         self.listnav = _ListNav
         self.has_validate_input = False
         self.has_validate_output = False
         self.cache = None
+        self._out = None
+
+    def _get_out(self):
+        """ Returns outgoing connections, available as self.out and self.outgoing. Most services never use them
+        so they are only built the first time they are needed.
+        """
+        if self._out is None:
+
+            if self.component_enabled_zeromq:
+                if not Service._zmq_facade:
+                    Service._zmq_facade = ZMQFacade(self._worker_store.zmq_out_api)
+
+            if self.component_enabled_sms:
+                if not Service._sms_api:
+                    Service._sms_api = SMSAPI(self._worker_store.sms_twilio_api)
+
+            self._out = Outgoing(
+                self.amqp,
+                self._out_ftp,
+                WMQFacade(self) if self.component_enabled_ibm_mq else None,
+                self._worker_config.out_odoo,
+                self._out_plain_http,
+                self._worker_config.out_soap,
+                self._worker_store.sql_pool_store,
+                self._worker_store.stomp_outconn_api,
+                Service._zmq_facade if self.component_enabled_zeromq else NO_DEFAULT_VALUE,
+                self._worker_store.outconn_wsx,
+                self._worker_store.vault_conn_api,
+                Service._sms_api if self.component_enabled_sms else None,
+                self._worker_config.out_sap,
+            )
+
+        return self._out
+
+    def _set_out(self, value):
+        self._out = value
+
+    out = outgoing = property(_get_out, _set_out)
+
+    def _get_msg(self):
+        """ Returns the message facade, available as self.msg, built the first time it is needed.
+        """
+        if self._msg is None and self.component_enabled_msg_path:
+            self._msg = MessageFacade(
+                self._json_pointer_store, self._xpath_store, self._msg_ns_store, self.request.payload, self.time)
 
-        self.out = self.outgoing = _Outgoing(
-            self.amqp,
-            self._out_ftp,
-            _WMQFacade(self) if self.component_enabled_ibm_mq else None,
-            self._worker_config.out_odoo,
-            self._out_plain_http,
-            self._worker_config.out_soap,
-            self._worker_store.sql_pool_store,
-            self._worker_store.stomp_outconn_api,
-            ZMQFacade(self._worker_store.zmq_out_api) if self.component_enabled_zeromq else NO_DEFAULT_VALUE,
-            self._worker_store.outconn_wsx,
-            self._worker_store.vault_conn_api,
-            SMSAPI(self._worker_store.sms_twilio_api) if self.component_enabled_sms else None,
-            self._worker_config.out_sap,
-        )
+        return self._msg
+
+    def _set_msg(self, value):
+        self._msg = value
+
+    msg = property(_get_msg, _set_msg)
+
+    def _get_patterns(self):
+        """ Returns integration patterns, available as self.patterns, built the first time they are needed.
+        """
+        if self._patterns is None and self.component_enabled_patterns:
+            self._patterns = PatternsFacade(self)
+
+        return self._patterns
+
+    def _set_patterns(self, value):
+        self._patterns = value
+
+    patterns = property(_get_patterns, _set_patterns)
 
     @staticmethod
     def get_name_static(class_):
@@ -338,21 +391,18 @@ class Service(object):
         if self.component_enabled_search:
             if not Service.search:
                 Service.search = SearchAPI(self._worker_store.search_es_api, self._worker_store.search_solr_api)
-        if self.component_enabled_msg_path:
-            self.msg = MessageFacade(
-                self._json_pointer_store, self._xpath_store, self._msg_ns_store, self.request.payload, self.time)
 
-        if self.component_enabled_patterns:
-            self.patterns = PatternsFacade(self)
+        # Message and patterns facades, as well as outgoing connections, are built on first use through properties
 
         if may_have_wsgi_environ:
             self.request.http.init(self.wsgi_environ)
 
         # self.is_sio attribute is set by ServiceStore during deployment
         if self.has_sio:
+            sio_plan = get_sio_plan(self.__class__, self.request.simple_io_config)
             self.request.init(True, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ,
-                self.server.encrypt)
-            self.response.init(self.cid, self.SimpleIO, self.data_format)
+                self.server.encrypt, sio_plan)
+            self.response.init(self.cid, self.SimpleIO, self.data_format, sio_plan)
 
         # Cache is always enabled
         self.cache = self._worker_store.cache_api
@@ -454,7 +504,7 @@ class Service(object):
             try:
 
                 if service.server.component_enabled.stats:
-                    service.usage = service.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, service.name))
+                    service.usage = service._worker_store.stats_collector.incr_usage(service.name)
                 service.invocation_time = _utcnow()
 
                 # All hooks are optional so we check if they have not been replaced with None by ServiceStore.
@@ -667,8 +717,7 @@ class Service(object):
         return cid
 
     def post_handle(self, _get_response_value=get_response_value, _utcnow=datetime.utcnow,
-        _service_time_basic=KVDB.SERVICE_TIME_BASIC, _service_time_raw=KVDB.SERVICE_TIME_RAW,
-        _service_time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE):
+        _req_resp_sample=KVDB.REQ_RESP_SAMPLE):
         """ An internal method executed after the service has completed and has
         a response ready to return. Updates its statistics and, optionally, stores
         a sample request/response pair.
@@ -688,21 +737,8 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
-
-                pipe.hset('%s%s' % (_service_time_basic, self.name), 'last', self.processing_time)
-                pipe.rpush('%s%s' % (_service_time_raw, self.name), self.processing_time)
-
-                key = '%s%s:%s' % (_service_time_raw_by_minute,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
-
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
-
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
-                pipe.execute()
+            # Statistics are collected in RAM and periodically stored in KVDB in background
+            self._worker_store.stats_collector.add_time(self.name, self.processing_time, self.handle_return_time)
 
         #
         # Sample requests/responses
@@ -727,7 +763,7 @@ class Service(object):
                 'req': req,
                 'resp':_get_response_value(self.response), # TODO: Don't parse it here and a moment later below
             }
-            self.kvdb.conn.hmset(key, data)
+            self.kvdb.conn.hmset('%s%s' % (_req_resp_sample, self.name), data)
 
         #
         # Slow responses
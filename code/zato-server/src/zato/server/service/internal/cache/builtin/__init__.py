@@ -16,7 +16,7 @@ from zato.common import CACHE as _COMMON_CACHE
 from zato.common.broker_message import CACHE
 from zato.common.odb.model import CacheBuiltin
 from zato.common.odb.query import cache_builtin_list
-from zato.server.service import Bool, Int
+from zato.server.service import Bool, Float, Int
 from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.internal.cache import common_instance_hook
 from zato.server.service.meta import CreateEditMeta, DeleteMeta, GetListMeta
@@ -61,10 +61,12 @@ class Get(AdminService):
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
             Int('current_size'))
+        output_optional = (Int('expired_total'), Int('last_sweep_deleted'), Float('last_sweep_duration'))
 
     def handle(self):
         response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
         response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        response.update(self.cache.get_sweep_stats(response['name']))
 
         self.response.payload = response
 
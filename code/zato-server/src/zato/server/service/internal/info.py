@@ -18,7 +18,7 @@ from zato.common import INFO_FORMAT, SERVER_JOIN_STATUS, SERVER_UP_STATUS
 from zato.common.broker_message import SERVER_STATUS
 from zato.common.odb.query import server_list
 from zato.common.component_info import format_info, get_info, get_worker_pids
-from zato.server.service import List, Service
+from zato.server.service import Float, Int, List, Service
 
 # ################################################################################################################################
 
@@ -85,6 +85,19 @@ class GetWorkerPids(Service):
 
 # ################################################################################################################################
 
+class GetHashPoolStats(Service):
+    """ Returns statistics of the pool of native threads that secrets are hashed in, including percentiles of recent
+    queue wait times in milliseconds. Each worker has its own pool so the statistics are those of the worker invoked.
+    """
+    class SimpleIO(object):
+        output_required = (Int('size'), Int('max_queued'), Int('in_flight'), Int('rejected'))
+        output_optional = (Float('wait_p50'), Float('wait_p90'), Float('wait_p99'))
+
+    def handle(self):
+        self.response.payload = self.server.hash_pool.get_stats()
+
+# ################################################################################################################################
+
 class SetServerUpStatus(Service):
     """ Notifies all worker processes that current one has just started.
     """
@@ -17,7 +17,7 @@ from rapidjson import dumps
 # Zato
 from zato.common import CHANNEL, CONTENT_TYPE, PUBSUB
 from zato.common.exception import BadRequest, Forbidden, PubSubSubscriptionExists
-from zato.server.service import AsIs, Int, Service
+from zato.server.service import AsIs, Int, List, Service
 from zato.server.service.internal.pubsub.subscription import CreateWSXSubscription
 
 # ################################################################################################################################
@@ -49,6 +49,15 @@ class TopicSIO(BaseSIO):
 
 # ################################################################################################################################
 
+class PublishManySIO:
+    input_required = (List('msg_list'),)
+    output_optional = (List('msg_id_list'),)
+    response_elem = None
+    skip_empty_keys = True
+    default_value = None
+
+# ################################################################################################################################
+
 class SubSIO(BaseSIO):
     input_optional = ('sub_key', 'delivery_method')
     output_optional = ('sub_key', 'queue_depth')
@@ -166,6 +175,34 @@ class TopicService(_PubSubService):
 
 # ################################################################################################################################
 
+class PublishManyService(_PubSubService):
+    """ Publishes a batch of messages, possibly to many topics, in a single call.
+    """
+    SimpleIO = PublishManySIO
+
+    def handle_POST(self):
+        """ POST /zato/pubsub/publish {"msg_list":[{"topic_name":"/my/topic", "data":"my data", ...}, ...]}
+        """
+        # Checks credentials and returns endpoint_id if valid
+        endpoint_id = self._pubsub_check_credentials()
+
+        msg_list = self.request.input.msg_list
+        if not msg_list:
+            raise BadRequest(self.cid, 'No msg_list sent on input')
+
+        # Ignore the header set by curl and similar tools
+        mime_type = self.wsgi_environ.get('CONTENT_TYPE')
+        mime_type = mime_type if mime_type != 'application/x-www-form-urlencoded' else CONTENT_TYPE.JSON
+
+        for item in msg_list:
+            if not item.get('data'):
+                raise BadRequest(self.cid, 'No data sent on input for topic `{}`'.format(item.get('topic_name')))
+            item.setdefault('mime_type', mime_type)
+
+        self.response.payload.msg_id_list = self.pubsub.publish_many(msg_list, endpoint_id)
+
+# ################################################################################################################################
+
 class SubscribeService(_PubSubService):
     """ Service through which REST clients subscribe to or unsubscribe from topics.
     """
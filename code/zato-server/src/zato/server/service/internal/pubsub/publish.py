@@ -9,12 +9,16 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import OrderedDict
 from contextlib import closing
 from json import dumps, loads
 from logging import DEBUG, getLogger
 from operator import itemgetter
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
 # datetutil
 from dateparser import parse as dt_parse
 
@@ -23,10 +27,10 @@ from gevent import spawn
 
 # Zato
 from zato.common import DATA_FORMAT, PUBSUB, ZATO_NONE
-from zato.common.exception import Forbidden, NotFound, ServiceUnavailable
+from zato.common.exception import BadRequest, Forbidden, NotFound, ServiceUnavailable
 from zato.common.odb.query.pubsub.cleanup import delete_enq_delivered, delete_enq_marked_deleted, delete_msg_delivered, \
      delete_msg_expired
-from zato.common.odb.query.pubsub.publish import sql_publish_with_retry
+from zato.common.odb.query.pubsub.publish import sql_publish_many_with_retry, sql_publish_with_retry
 from zato.common.odb.query.pubsub.topic import get_gd_depth_topic
 from zato.common.pubsub import PubSubMessage
 from zato.common.pubsub import new_msg_id
@@ -60,6 +64,7 @@ _meta_topic_optional = ('pub_correl_id', 'ext_client_id', 'in_reply_to')
 
 _log_turning_gd_msg = 'Turning message `%s` into a GD one ({})'
 _inserting_gd_msg = 'Inserting GD messages for topic `%s` `%s` published by `%s` (ext:%s) (cid:%s)'
+_inserting_gd_msg_many = 'Inserting GD messages for topics `%s` published by `%s` (cid:%s)'
 
 # ################################################################################################################################
 
@@ -303,41 +308,40 @@ class Publish(AdminService):
 
 # ################################################################################################################################
 
-    def handle(self):
-
-        input = self.request.input
-        pubsub = self.server.worker_store.pubsub # type: PubSub
-        endpoint_id = input.endpoint_id
-
-        # Will return publication pattern matched or raise an exception that we don't catch
-        endpoint_id, pub_pattern_matched = self.get_pub_pattern_matched(endpoint_id, input)
-
+    def get_topic(self, topic_name):
+        """ Returns a topic by its name or raises an exception if it does not exist or is not active.
+        """
         try:
-            topic = pubsub.get_topic_by_name(input.topic_name) # type: Topic
+            topic = self.server.worker_store.pubsub.get_topic_by_name(topic_name) # type: Topic
         except KeyError:
-            raise NotFound(self.cid, 'No such topic `{}`'.format(input.topic_name))
+            raise NotFound(self.cid, 'No such topic `{}`'.format(topic_name))
 
         # Reject the message is topic is not active
         if not topic.is_active:
-            raise ServiceUnavailable(self.cid, 'Topic is inactive `{}`'.format(input.topic_name))
+            raise ServiceUnavailable(self.cid, 'Topic is inactive `{}`'.format(topic_name))
 
-        # We always count time in milliseconds since UNIX epoch
-        now = utcnow_as_ms()
+        return topic
 
+# ################################################################################################################################
+
+    def get_subscriptions(self, topic, deliver_to_sk):
+        """ Returns subscriptions that messages published to input topic should be delivered to
+        along with a flag indicating whether any of them is a WSX one without a delivery server.
+        """
         # Get all subscribers for that topic from local worker store
-        all_subscriptions_by_topic = pubsub.get_subscriptions_by_topic(topic.name)
+        all_subscriptions_by_topic = self.server.worker_store.pubsub.get_subscriptions_by_topic(topic.name)
         len_all_sub = len(all_subscriptions_by_topic)
 
         # If we are to deliver the message(s) to only selected subscribers only,
         # filter out any unwated ones first.
-        if input.deliver_to_sk:
+        if deliver_to_sk:
 
             has_all = False
             subscriptions_by_topic = []
 
             # Get any matching subscriptions out of the whole set
             for sub in all_subscriptions_by_topic:
-                if sub.sub_key in input.deliver_to_sk:
+                if sub.sub_key in deliver_to_sk:
                     subscriptions_by_topic.append(sub)
 
         else:
@@ -367,6 +371,28 @@ class Publish(AdminService):
         logger_pubsub.info('Subscriptions for topic `%s` `%s` (a:%d, %d/%d, cid:%s)',
             topic.name, _subs_found, has_all, len(subscriptions_by_topic), len_all_sub, self.cid)
 
+        return subscriptions_by_topic, has_wsx_no_server
+
+# ################################################################################################################################
+
+    def handle(self):
+
+        input = self.request.input
+        pubsub = self.server.worker_store.pubsub # type: PubSub
+        endpoint_id = input.endpoint_id
+
+        # Will return publication pattern matched or raise an exception that we don't catch
+        endpoint_id, pub_pattern_matched = self.get_pub_pattern_matched(endpoint_id, input)
+
+        # Will raise an exception if there is no such topic or if it is not active
+        topic = self.get_topic(input.topic_name)
+
+        # We always count time in milliseconds since UNIX epoch
+        now = utcnow_as_ms()
+
+        # Get all subscribers that the message(s) should be delivered to
+        subscriptions_by_topic, has_wsx_no_server = self.get_subscriptions(topic, input.deliver_to_sk)
+
         # If input.data is a list, it means that it is a list of messages, each of which has its own
         # metadata. Otherwise, it's a string to publish and other input parameters describe it.
         data_list = input.data_list if input.data_list else None
@@ -401,22 +427,9 @@ class Publish(AdminService):
         len_gd_msg_list = len(ctx.gd_msg_list)
         has_gd_msg_list = bool(len_gd_msg_list)
 
-        # Just so it is not overlooked, log information that no subscribers are found for this topic
-        if not ctx.subscriptions_by_topic:
-
-            log_msg = 'No matching subscribers found for topic `%s` (cid:%s, rr:%d)'
-            log_msg_args = ctx.topic.name, self.cid, ctx.is_re_run
-
-            # There are no subscribers and depending on configuration we are to drop messages
-            # for whom no one is waiting or continue and place them in the topic directly.
-            if ctx.topic.config.get('on_no_subs_pub') == PUBSUB.ON_NO_SUBS_PUB.DROP.id:
-                log_msg_drop = 'Dropping messages. ' + log_msg
-                self.logger.info(log_msg_drop, *log_msg_args)
-                logger_pubsub.info(log_msg_drop, *log_msg_args)
-                return
-            else:
-                self.logger.info(log_msg, *log_msg_args)
-                logger_pubsub.info(log_msg, *log_msg_args)
+        # There may be no subscribers for this topic in which case we may need to drop all the messages
+        if self._needs_drop(ctx):
+            return
 
         # Local aliases
         has_pubsub_audit_log = self.server.has_pubsub_audit_log
@@ -432,23 +445,8 @@ class Publish(AdminService):
 
             with closing(self.odb.session()) as session:
 
-                # No matter if we can publish or not, we may possibly cleanup old messages first.
-                if ctx.topic.needs_msg_cleanup():
-                    self._cleanup_sql_data(session, ctx.cluster_id, ctx.topic.id, ctx.now)
-
-                # .. test first if we should check the depth in this iteration.
-                if ctx.topic.needs_depth_check():
-
-                    # Get current depth of this topic ..
-                    ctx.current_depth = get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id)
-
-                    # .. and abort if max depth is already reached.
-                    if ctx.current_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
-                        self.reject_publication(ctx.topic.name, True)
-                    else:
-
-                        # This only updates the local ctx variable
-                        ctx.current_depth = ctx.current_depth + len_gd_msg_list
+                # Cleans up old messages and checks if the topic's max depth is not reached
+                self._check_gd_depth(session, ctx)
 
                 pub_msg_list = [elem['pub_msg_id'] for elem in ctx.gd_msg_list]
 
@@ -464,17 +462,12 @@ class Publish(AdminService):
                 session.commit()
 
             # .. and set a flag to signal that there are some GD messages available
-            ctx.pubsub.set_sync_has_msg(ctx.topic.id, True, True, 'Publish.publish', ctx.now)
+            self._after_gd_commit(ctx)
 
         # Either commit succeeded or there were no GD messages on input but in both cases we can now,
         # optionally, store data in pub/sub audit log.
         if has_pubsub_audit_log:
-
-            msg = 'Message published. CID:`%s`, topic:`%s`, from:`%s`, ext_client_id:`%s`, pattern:`%s`, new_depth:`%s`' \
-                  ', GD data:`%s`, non-GD data:`%s`'
-
-            logger_audit.info(msg, self.cid, ctx.topic.name, self.pubsub.endpoints[ctx.endpoint_id].name,
-                ctx.ext_client_id, ctx.pub_pattern_matched, ctx.current_depth, ctx.gd_msg_list, ctx.non_gd_msg_list)
+            self._log_audit(ctx)
 
         # If this is the very first time we are running during this invocation, try to deliver non-GD messages
         if not ctx.is_re_run:
@@ -494,14 +487,7 @@ class Publish(AdminService):
                 if ctx.non_gd_msg_list:
 
                     # Turn all non-GD messages into GD ones.
-                    for msg in ctx.non_gd_msg_list:
-                        msg['has_gd'] = True
-
-                        logger_pubsub.info(_log_turning_gd_msg.format('no subscribers'), msg['pub_msg_id'])
-
-                        data_prefix, data_prefix_short = self._get_data_prefixes(msg['data'])
-                        msg['data_prefix'] = data_prefix
-                        msg['data_prefix_short'] = data_prefix_short
+                    self._turn_non_gd_into_gd(ctx.non_gd_msg_list)
 
                     # Note the reversed order - now non-GD messages are sent as GD ones and the list of non-GD messages is empty.
                     ctx.gd_msg_list = ctx.non_gd_msg_list[:]
@@ -511,10 +497,123 @@ class Publish(AdminService):
                     # Re-run with GD and non-GD reversed now
                     self._publish(ctx)
 
-        # Update topic and endpoint metadata in background if configured to - we have a series of if's to confirm
-        # if it's needed because it is not a given that each publication will required the update and we also
-        # want to ensure that if there are two thigns to be updated at a time, it is only one greenlet spawned
-        # which will in turn use a single Redis pipeline to cut down on the number of Redis calls needed.
+        # Update topic and endpoint metadata in background if configured to
+        self._spawn_update_pub_metadata(ctx)
+
+        # Return either a single msg_id if there was only one message published or a list of message IDs,
+        # one for each message published.
+        len_msg_list = len_gd_msg_list + len(ctx.non_gd_msg_list)
+
+        if len_msg_list == 1:
+            self.response.payload.msg_id = ctx.msg_id_list[0]
+        else:
+            self.response.payload.msg_id_list = ctx.msg_id_list
+
+# ################################################################################################################################
+
+    def _needs_drop(self, ctx):
+        """ Returns True if messages from ctx are to be dropped because there are no subscribers for their topic.
+        """
+        # Just so it is not overlooked, log information that no subscribers are found for this topic
+        if not ctx.subscriptions_by_topic:
+
+            log_msg = 'No matching subscribers found for topic `%s` (cid:%s, rr:%d)'
+            log_msg_args = ctx.topic.name, self.cid, ctx.is_re_run
+
+            # There are no subscribers and depending on configuration we are to drop messages
+            # for whom no one is waiting or continue and place them in the topic directly.
+            if ctx.topic.config.get('on_no_subs_pub') == PUBSUB.ON_NO_SUBS_PUB.DROP.id:
+                log_msg_drop = 'Dropping messages. ' + log_msg
+                self.logger.info(log_msg_drop, *log_msg_args)
+                logger_pubsub.info(log_msg_drop, *log_msg_args)
+                return True
+            else:
+                self.logger.info(log_msg, *log_msg_args)
+                logger_pubsub.info(log_msg, *log_msg_args)
+
+# ################################################################################################################################
+
+    def _check_gd_depth(self, session, ctx):
+        """ Cleans up old messages if it is time to and raises an exception if publishing ctx.gd_msg_list
+        would exceed the topic's max GD depth.
+        """
+        len_gd_msg_list = len(ctx.gd_msg_list)
+
+        # No matter if we can publish or not, we may possibly cleanup old messages first ..
+        if ctx.topic.needs_msg_cleanup():
+            self._cleanup_sql_data(session, ctx.cluster_id, ctx.topic.id, ctx.now)
+
+            # .. which means that the topic's depth needs to be counted anew.
+            ctx.topic.reset_gd_depth()
+
+        # .. test first if we should check the depth in this iteration.
+        if ctx.topic.needs_depth_check():
+
+            # Depth is maintained locally and counted in SQL only if we do not know it yet or if it is time
+            # to confirm it again, because other workers and servers publish to the same topic too ..
+            if ctx.topic.needs_gd_depth_count(ctx.now):
+                ctx.topic.set_gd_depth(get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id), ctx.now)
+
+            # .. and if it looks like max depth is reached, it may be because of messages already moved
+            # to subscriber queues or deleted in the meantime so we need to confirm it in SQL.
+            elif ctx.topic.gd_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
+                ctx.topic.set_gd_depth(get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id), ctx.now)
+
+            ctx.current_depth = ctx.topic.gd_depth
+
+            # .. and abort if max depth is already reached.
+            if ctx.current_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
+                self.reject_publication(ctx.topic.name, True)
+            else:
+
+                # This only updates the local ctx variable
+                ctx.current_depth = ctx.current_depth + len_gd_msg_list
+
+# ################################################################################################################################
+
+    def _after_gd_commit(self, ctx):
+        """ Updates topic's GD depth and flags after GD messages were committed to SQL.
+        """
+        # Messages published without subscribers stay in the topic and increase its depth
+        if not ctx.subscriptions_by_topic:
+            ctx.topic.incr_gd_depth(len(ctx.gd_msg_list))
+
+        # Set a flag to signal that there are some GD messages available
+        ctx.pubsub.set_sync_has_msg(ctx.topic.id, True, True, 'Publish.publish', ctx.now)
+
+# ################################################################################################################################
+
+    def _turn_non_gd_into_gd(self, non_gd_msg_list):
+        """ Turns in place all input non-GD messages into GD ones.
+        """
+        for msg in non_gd_msg_list:
+            msg['has_gd'] = True
+
+            logger_pubsub.info(_log_turning_gd_msg.format('no subscribers'), msg['pub_msg_id'])
+
+            data_prefix, data_prefix_short = self._get_data_prefixes(msg['data'])
+            msg['data_prefix'] = data_prefix
+            msg['data_prefix_short'] = data_prefix_short
+
+# ################################################################################################################################
+
+    def _log_audit(self, ctx):
+        """ Stores information about messages published in pub/sub audit log.
+        """
+        msg = 'Message published. CID:`%s`, topic:`%s`, from:`%s`, ext_client_id:`%s`, pattern:`%s`, new_depth:`%s`' \
+              ', GD data:`%s`, non-GD data:`%s`'
+
+        logger_audit.info(msg, self.cid, ctx.topic.name, self.pubsub.endpoints[ctx.endpoint_id].name,
+            ctx.ext_client_id, ctx.pub_pattern_matched, ctx.current_depth, ctx.gd_msg_list, ctx.non_gd_msg_list)
+
+# ################################################################################################################################
+
+    def _spawn_update_pub_metadata(self, ctx):
+        """ Updates topic and endpoint metadata in background if configured to - we have a series of if's to confirm
+        if it's needed because it is not a given that each publication will required the update and we also
+        want to ensure that if there are two thigns to be updated at a time, it is only one greenlet spawned
+        which will in turn use a single Redis pipeline to cut down on the number of Redis calls needed.
+        """
         if ctx.pubsub.has_meta_topic or ctx.pubsub.has_meta_endpoint:
 
             if ctx.pubsub.has_meta_topic and ctx.topic.needs_meta_update():
@@ -531,15 +630,6 @@ class Publish(AdminService):
                 spawn(self._update_pub_metadata, ctx, has_topic, has_endpoint,
                     ctx.pubsub.endpoint_meta_data_len, ctx.pubsub.endpoint_meta_max_history)
 
-        # Return either a single msg_id if there was only one message published or a list of message IDs,
-        # one for each message published.
-        len_msg_list = len_gd_msg_list + len(ctx.non_gd_msg_list)
-
-        if len_msg_list == 1:
-            self.response.payload.msg_id = ctx.msg_id_list[0]
-        else:
-            self.response.payload.msg_id_list = ctx.msg_id_list
-
 # ################################################################################################################################
 
     def reject_publication(self, topic_name, is_gd):
@@ -647,3 +737,155 @@ class Publish(AdminService):
             self.logger.warn('Error while updating pub metadata `%s`', format_exc())
 
 # ################################################################################################################################
+
+class PublishMany(Publish):
+    """ Publishes a batch of messages, each to its own topic, using a single SQL transaction for GD messages of all topics.
+    Each element of msg_list is a dictionary with topic_name and the same keys that each element of data_list
+    in zato.pubsub.publish.publish has.
+    """
+    class SimpleIO:
+        input_required = (List('msg_list'),)
+        input_optional = ('security_id', 'ws_channel_id', 'endpoint_id')
+        output_optional = (List('msg_id_list'),)
+
+# ################################################################################################################################
+
+    def _get_topic_pub_info(self, topic_name, endpoint_id):
+        """ Returns information about a topic that is shared by all messages published to it in a batch.
+        """
+        # Will return publication pattern matched or raise an exception that we don't catch
+        endpoint_id, pub_pattern_matched = self.get_pub_pattern_matched(endpoint_id, Bunch(
+            topic_name=topic_name, security_id=self.request.input.security_id, ws_channel_id=self.request.input.ws_channel_id))
+
+        # Will raise an exception if there is no such topic or if it is not active
+        topic = self.get_topic(topic_name)
+
+        # Messages published in batches are always delivered to all subscribers of a topic
+        subscriptions_by_topic, has_wsx_no_server = self.get_subscriptions(topic, None)
+
+        return Bunch(topic=topic, endpoint_id=endpoint_id, pub_pattern_matched=pub_pattern_matched,
+            subscriptions_by_topic=subscriptions_by_topic, has_wsx_no_server=has_wsx_no_server,
+            msg_id_list=[], gd_msg_list=[], non_gd_msg_list=[])
+
+# ################################################################################################################################
+
+    def handle(self):
+
+        input = self.request.input
+        pubsub = self.server.worker_store.pubsub # type: PubSub
+
+        # We always count time in milliseconds since UNIX epoch
+        now = utcnow_as_ms()
+
+        # Messages grouped by their topics, in the same order that topics were first found in on input
+        by_topic = OrderedDict()
+
+        # IDs of all messages published, in the same order that messages were given on input
+        msg_id_list = []
+
+        for item in input.msg_list:
+
+            topic_name = item.get('topic_name')
+            if not topic_name:
+                raise BadRequest(self.cid, 'Each message requires a topic_name')
+
+            info = by_topic.get(topic_name)
+            if not info:
+                info = by_topic[topic_name] = self._get_topic_pub_info(topic_name, input.endpoint_id)
+
+            msg = self._get_message(info.topic, item, now, info.pub_pattern_matched, info.endpoint_id,
+                info.subscriptions_by_topic, info.has_wsx_no_server)
+
+            # The message may have been skipped by a hook
+            if msg:
+                msg_id_list.append(msg.pub_msg_id)
+                info.msg_id_list.append(msg.pub_msg_id)
+                target_list = info.gd_msg_list if msg.has_gd else info.non_gd_msg_list
+                target_list.append(msg.to_dict())
+
+        ctx_list = []
+
+        for info in by_topic.itervalues():
+            if info.msg_id_list:
+                ctx_list.append(PubCtx(self.server.cluster_id, pubsub, info.topic, info.endpoint_id,
+                    pubsub.get_endpoint_by_id(info.endpoint_id).name, info.subscriptions_by_topic, info.msg_id_list,
+                    info.gd_msg_list, info.non_gd_msg_list, info.pub_pattern_matched, None, False, now))
+
+        # We have all the input data, publish the messages now
+        self._publish_many(ctx_list, now)
+
+        self.response.payload.msg_id_list = msg_id_list
+
+# ################################################################################################################################
+
+    def _publish_many(self, ctx_list, now):
+        """ Publishes GD and non-GD messages to their respective topics. GD messages of all the topics are stored in SQL
+        in one transaction, using one multi-row INSERT for topic messages and another one for subscriber queues.
+        """
+        has_pubsub_audit_log = self.server.has_pubsub_audit_log
+
+        # Topics whose messages are not dropped
+        to_publish = []
+
+        for ctx in ctx_list:
+
+            # There may be no subscribers for this topic in which case we may need to drop all the messages
+            if self._needs_drop(ctx):
+                continue
+
+            # Like in self._publish, without subscribers, all non-GD messages need to be stored in SQL.
+            # Unlike there, we know it upfront so they can be published along with other GD messages.
+            if not ctx.subscriptions_by_topic and ctx.non_gd_msg_list:
+                self._turn_non_gd_into_gd(ctx.non_gd_msg_list)
+                ctx.gd_msg_list.extend(ctx.non_gd_msg_list)
+                ctx.non_gd_msg_list[:] = []
+
+            # Increase message counters for this pub/sub server and endpoint ..
+            ctx.pubsub.incr_pubsub_msg_counter(ctx.endpoint_id)
+
+            # .. and for this topic.
+            ctx.topic.incr_topic_msg_counter(bool(ctx.gd_msg_list), bool(ctx.non_gd_msg_list))
+
+            to_publish.append(ctx)
+
+        gd_ctx_list = [ctx for ctx in to_publish if ctx.gd_msg_list]
+
+        # There is no point in running an SQL transaction if there are no GD messages
+        if gd_ctx_list:
+
+            with closing(self.odb.session()) as session:
+
+                # Cleans up old messages and checks if max depth is not reached for any of the topics
+                for ctx in gd_ctx_list:
+                    self._check_gd_depth(session, ctx)
+
+                if has_logger_pubsub_debug:
+                    logger_pubsub.debug(_inserting_gd_msg_many,
+                        [(ctx.topic.name, [elem['pub_msg_id'] for elem in ctx.gd_msg_list]) for ctx in gd_ctx_list],
+                        [ctx.endpoint_name for ctx in gd_ctx_list], self.cid)
+
+                # Runs SQL INSERT statements with messages for all the topics and subscriber queues
+                sql_publish_many_with_retry(session, self.cid, self.server.cluster_id,
+                    [(ctx.topic.id, ctx.subscriptions_by_topic, ctx.gd_msg_list) for ctx in gd_ctx_list], now)
+
+                # Run an SQL commit for all queries above ..
+                session.commit()
+
+            # .. and set flags to signal that there are some GD messages available.
+            for ctx in gd_ctx_list:
+                self._after_gd_commit(ctx)
+
+        for ctx in to_publish:
+
+            if has_pubsub_audit_log:
+                self._log_audit(ctx)
+
+            # Place all the non-GD messages in the in-RAM sync backlog, there are always subscribers at this point
+            if ctx.non_gd_msg_list:
+                ctx.pubsub.store_in_ram(self.cid, ctx.topic.id, ctx.topic.name,
+                    [item.sub_key for item in ctx.subscriptions_by_topic], ctx.non_gd_msg_list)
+
+            # Update topic and endpoint metadata in background if configured to
+            self._spawn_update_pub_metadata(ctx)
+
+# ################################################################################################################################
@@ -239,5 +239,11 @@ class LogOut(AdminService):
             self.logger.warn(format_exc(e))
             self.response.status_code = BAD_REQUEST
             self.response.payload.result = 'Token could not be deleted'
+        else:
+            # Each worker may still keep the token among ones verified recently
+            self.broker_client.publish({
+                'action': SECURITY.JWT_TOKEN_DELETE.value,
+                'token': token,
+            })
 
 # ################################################################################################################################
@@ -34,6 +34,7 @@ from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import get_hist_bucket, get_hist_stats
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
@@ -85,13 +86,32 @@ class BaseAggregatingService(AdminService):
         times = [int(elem) for elem in self.server.kvdb.conn.lrange(key, 0, batch_size)]
 
         if times:
-            mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
+            mean_percentile = self.get_mean_percentile(service_name)
             max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
 
             return min(times), max(times), (sp_stats.tmean(times, (None, max_score)) or 0), len(times)
         else:
             return 0, 0, 0, 0
 
+    def get_mean_percentile(self, service_name):
+        return int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
+
+    def get_hist(self, key):
+        """ Returns a histogram of processing times stored under a given key as a dictionary of time -> count.
+        """
+        return dict((int(bucket), int(count)) for bucket, count in self.server.kvdb.conn.hgetall(key).iteritems())
+
+    def consume_hist(self, key):
+        """ Like get_hist but also deletes the histogram, both in one transaction, so that nothing that workers
+        store in the meantime is lost.
+        """
+        with self.server.kvdb.conn.pipeline() as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            hist = pipe.execute()[0]
+
+        return dict((int(bucket), int(count)) for bucket, count in hist.iteritems())
+
     def collect_service_stats(self, keys_pattern, key_prefix, key_suffix, total_seconds,
                               suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
 
@@ -202,29 +222,45 @@ class ProcessRawTimes(BaseAggregatingService):
             key, value = item.split('=')
             config[key] = int(value)
 
+        # Workers store histograms of processing times ..
+        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_HISTOGRAM + '*'):
+
+            service_name = key.replace(KVDB.SERVICE_TIME_HISTOGRAM, '')
+            hist = self.consume_hist(key)
+
+            if hist:
+                batch_min, batch_max, batch_mean, _ = get_hist_stats(hist, self.get_mean_percentile(service_name))
+                self.update_all_time(service_name, batch_min, batch_max, batch_mean)
+
+        # .. though raw times may still exist, e.g. if they were stored by servers of an earlier version.
         for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
 
             service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
 
-            current_mean = float(
-                self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
-            current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
-            current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
-
             batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
                 key, service_name, config.max_batch_size)
 
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time', min(current_min, batch_min))
-            self.server.kvdb.conn.hset(
-                KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
+            self.update_all_time(service_name, batch_min, batch_max, batch_mean)
 
             # Services use RPUSH for storing raw times so we are safe to use LTRIM
             # in order to do away with the already processed ones
             self.server.kvdb.conn.ltrim(key, batch_total, -1)
 
+    def update_all_time(self, service_name, batch_min, batch_max, batch_mean):
+        """ Updates all-time min, max and mean processing times of a service with ones from a batch just processed.
+        """
+        current_mean = float(
+            self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
+        current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
+        current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
+
+        self.server.kvdb.conn.hset(
+           KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
+        self.server.kvdb.conn.hset(
+           KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time', min(current_min, batch_min))
+        self.server.kvdb.conn.hset(
+            KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
+
 # ##############################################################################
 
 class AggregateByMinute(BaseAggregatingService):
@@ -238,17 +274,33 @@ class AggregateByMinute(BaseAggregatingService):
         # Get all keys from a minute that is sure to have passed, for instance,
         # say it's 13:19 right now (regardless of the seconds part), we'll process everything
         # that happened in 13:17. Hence it's also important that any changes in the minutes
-        # to be picked up here below be kept in sync with the EXPIRE command Service._post_handle uses.
+        # to be picked up here below be kept in sync with the EXPIRE command ServiceStatsCollector.flush uses.
 
         now = datetime.utcnow()
         key_suffix = (now - timedelta(minutes=2)).strftime('%Y:%m:%d:%H:%M')
 
-        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+        # Service name -> histogram of its processing times in that minute
+        hist_by_service = {}
+
+        # Workers store histograms of processing times ..
+        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, key_suffix)):
+            service_name = key.replace(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, '').replace(':' + key_suffix, '')
+            hist_by_service[service_name] = self.get_hist(key)
 
+        # .. though raw times may still exist, e.g. if they were stored by servers of an earlier version.
+        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
             service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
+            hist = hist_by_service.setdefault(service_name, {})
+
+            for value in self.server.kvdb.conn.lrange(key, 0, -1):
+                bucket = get_hist_bucket(int(value))
+                hist[bucket] = hist.get(bucket, 0) + 1
+
+        for service_name, hist in hist_by_service.iteritems():
+
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            batch_min, batch_max, batch_mean, batch_total = get_hist_stats(hist, self.get_mean_percentile(service_name))
 
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
@@ -256,8 +308,8 @@ class AggregateByMinute(BaseAggregatingService):
             self.hset_aggr_key(aggr_key, 'usage', batch_total)
             self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
 
-            # Raw per-minute statistics keys will expire by themselves, we don't need
-            # to delete them manually.
+            # Per-minute histograms and raw statistics keys will expire by themselves,
+            # we don't need to delete them manually.
 
 class AggregateByHour(BaseAggregatingService):
     """ Creates per-hour stats.
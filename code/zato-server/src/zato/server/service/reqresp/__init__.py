@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import logging
 from copy import deepcopy
+from functools import partial
 from httplib import OK
 from itertools import chain
 from traceback import format_exc
@@ -30,11 +31,11 @@ from lxml.objectify import deannotate, Element, ElementMaker, ObjectifiedElement
 from sqlalchemy.util import KeyedTuple
 
 # Zato
-from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, TRACE1, ZatoException, \
-     ZATO_OK
+from zato.common import DATA_FORMAT, NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, TRACE1, \
+     ZatoException, ZATO_OK
 from zato.common.odb.api import WritableKeyedTuple
 from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.server.service.reqresp.sio import compile_sio, convert_param, ForceType, ServiceInput, SIOConverter
 
 logger = logging.getLogger(__name__)
 
@@ -134,16 +135,15 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func):
+    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func, sio_plan=None):
         """ Initializes the object with an invocation-specific data.
         """
         self.input = ServiceInput()
         self.encrypt_func = encrypt_func
 
         if is_sio:
-            required_list = getattr(sio, 'input_required', [])
-            required_list = [required_list] if isinstance(required_list, basestring) else required_list
-            self.init_flat_sio(cid, sio, data_format, transport, wsgi_environ, required_list)
+            sio_plan = sio_plan or compile_sio(sio, self.simple_io_config)
+            self.init_flat_sio(cid, sio_plan.input, data_format, transport, wsgi_environ)
 
         # We merge channel params in if requested even if it's not SIO
         else:
@@ -152,22 +152,15 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init_flat_sio(self, cid, sio, data_format, transport, wsgi_environ, required_list, _sio_container=(tuple, list)):
-        """ Initializes flat SIO requests, i.e. not list ones.
+    def init_flat_sio(self, cid, plan, data_format, transport, wsgi_environ, _dict_formats=(DATA_FORMAT.JSON, DATA_FORMAT.DICT,
+        None), _channel_over_msg=PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG):
+        """ Initializes flat SIO requests, i.e. not list ones, using a compiled input plan.
         """
         self.is_xml = data_format == SIMPLE_IO.FORMAT.XML
         self.data_format = data_format
         self.transport = transport
         self._wsgi_environ = wsgi_environ
-
-        optional_list = getattr(sio, 'input_optional', [])
-        optional_list = optional_list if isinstance(optional_list, _sio_container) else [optional_list]
-
-        path_prefix = getattr(sio, 'request_elem', 'request')
-        default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
-        use_text = getattr(sio, 'use_text', True)
-        use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
-        self.encrypt_secrets = getattr(sio, 'encrypt_secrets', True)
+        self.encrypt_secrets = plan.encrypt_secrets
 
         if self.simple_io_config:
             self.has_simple_io_config = True
@@ -177,32 +170,42 @@ class Request(SIOConverter):
         else:
             self.payload = self.raw_request
 
-        required_params = {}
-
-        if required_list:
-
-            required_list = required_list if isinstance(required_list, _sio_container) else [required_list]
+        if plan.required:
 
             # Needs to check for this exact default value to prevent a FutureWarning in 'if not self.payload'
             if self.payload == '' and not self.channel_params:
                 raise ZatoException(cid, 'Missing input')
 
-            required_params.update(self.get_params(
-                required_list, use_channel_params_only, path_prefix, default_value, use_text))
+        # Dict-like payloads are processed by the plan directly ..
+        if data_format in _dict_formats:
+            self.input.update(plan.get_params('' if plan.use_channel_params_only else self.payload, self.channel_params,
+                self.params_priority == _channel_over_msg, self.has_simple_io_config, self.encrypt_func, self.encrypt_secrets,
+                data_format, partial(self.get_param, plan)))
 
-        if optional_list:
-            optional_params = self.get_params(
-                optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
+        # .. whereas other ones need to visit each element separately.
         else:
-            optional_params = {}
+            if plan.required:
+                self.input.update(self.get_params(
+                    plan.required_params, plan.use_channel_params_only, plan.path_prefix, plan.default_value, plan.use_text))
 
-        self.input.update(required_params)
-        self.input.update(optional_params)
+            if plan.optional:
+                self.input.update(self.get_params(
+                    plan.optional_params, plan.use_channel_params_only, plan.path_prefix, plan.default_value, plan.use_text,
+                    False))
 
         for param, value in self.channel_params.iteritems():
             if param not in self.input:
                 self.input[param] = value
 
+# ################################################################################################################################
+
+    def get_param(self, plan, param, is_required):
+        """ Returns a single parameter that an input plan could not handle, e.g. because it is missing or is invalid,
+        which means that it is reported in the same way any other parameter would be.
+        """
+        return self.get_params([param], plan.use_channel_params_only, plan.path_prefix, plan.default_value, plan.use_text,
+            is_required).values()[0]
+
 # ################################################################################################################################
 
     def get_params(self, params_to_visit, use_channel_params_only, path_prefix='', default_value=NO_DEFAULT_VALUE,
@@ -263,38 +266,30 @@ class SimpleIOPayload(SIOConverter):
     """ Produces the actual response - XML, JSON - out of the user-provided SimpleIO abstract data.
     All of the attributes are prefixed with zato_ so that they don't conflict with non-Zato data..
     """
-    def __init__(self, zato_cid, data_format, required_list, optional_list, simple_io_config, response_elem, namespace,
-            output_repeated, skip_empty, ignore_skip_empty, allow_empty_required, _sio_container=(tuple, list)):
+    def __init__(self, zato_cid, data_format, plan, simple_io_config):
         self.zato_cid = zato_cid
         self.zato_data_format = data_format
         self.zato_is_xml = self.zato_data_format == SIMPLE_IO.FORMAT.XML
         self.zato_output = []
+        self.zato_plan = plan
 
-        required_list = required_list if isinstance(required_list, _sio_container) else [required_list]
-        optional_list = optional_list if isinstance(optional_list, _sio_container) else [optional_list]
-
-        self.zato_required = [(True, name) for name in required_list]
-        self.zato_optional = [(False, name) for name in optional_list]
+        self.zato_required = [(True, name) for name in plan.required_list]
+        self.zato_optional = [(False, name) for name in plan.optional_list]
 
-        self.zato_output_repeated = output_repeated
-        self.zato_skip_empty_keys = skip_empty
-        self.zato_force_empty_keys = ignore_skip_empty
-        self.zato_allow_empty_required = allow_empty_required
+        self.zato_output_repeated = plan.output_repeated
+        self.zato_skip_empty_keys = plan.skip_empty_keys
+        self.zato_force_empty_keys = plan.force_empty_keys
+        self.zato_allow_empty_required = plan.allow_empty_required
         self.zato_meta = {}
         self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
         self.int_parameters = simple_io_config.get('int_parameters', [])
         self.int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', [])
         self.date_time_format = simple_io_config.get('date_time_format', 'YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM')
-        self.response_elem = response_elem
-        self.namespace = namespace
-
-        self.zato_all_attrs = set()
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
-            self.zato_all_attrs.add(name)
+        self.response_elem = plan.response_elem
+        self.namespace = plan.namespace
+        self.zato_all_attrs = plan.all_attrs
 
-        self.set_expected_attrs(required_list, optional_list)
+        self.set_expected_attrs(plan.required_list, plan.optional_list)
 
     def __setslice__(self, i, j, seq):
         """ Assigns a list of output elements to self.zato_output, so that they
@@ -398,44 +393,22 @@ class SimpleIOPayload(SIOConverter):
         if self.zato_output_repeated:
             output = self.zato_output
         else:
-            output = set(dir(self)) & self.zato_all_attrs
-            output = [dict((name, getattr(self, name)) for name in output)]
+            output = [dict((name, getattr(self, name, '')) for name in self.zato_all_attrs)]
 
         if output:
 
             # All elements must be of the same type so it's OK to do it
             is_sa_namedtuple = isinstance(output[0], _keyed_tuple)
 
-            for item in output:
-
-                if self.zato_is_xml:
-                    out_item = Element('item')
-                else:
-                    out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
-
-                    if not elem_value and elem_value != 0:
-                        if self.zato_skip_empty_keys:
-                            if name not in self.zato_force_empty_keys:
-                                continue
-
-                    if isinstance(name, ForceType):
-                        name = name.name
-
-                    if isinstance(elem_value, basestring):
-                        elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
+            items = self.zato_plan.get_items(output, is_sa_namedtuple, self.zato_skip_empty_keys,
+                self.zato_allow_empty_required, self.zato_data_format, partial(Element, 'item') if self.zato_is_xml else dict,
+                self.zato_is_xml, self._getvalue)
 
-                    if self.zato_is_xml:
-                        setattr(out_item, name, elem_value)
-                    else:
-                        out_item[name] = elem_value
-
-                if self.zato_output_repeated:
-                    value.append(out_item)
-                else:
-                    value = out_item
+            if self.zato_output_repeated:
+                for item in items:
+                    value.append(item)
+            else:
+                value = items[0]
 
         if self.zato_is_xml:
             em = ElementMaker(annotate=False, namespace=self.namespace, nsmap={None:self.namespace})
@@ -565,24 +538,11 @@ class Response(object):
 
     payload = property(_get_payload, _set_payload)
 
-    def init(self, cid, io, data_format, _not_given=NOT_GIVEN):
+    def init(self, cid, io, data_format, sio_plan=None):
         self.data_format = data_format
 
-        required_list = getattr(io, 'output_required', [])
-        required_list = [required_list] if isinstance(required_list, basestring) else required_list
-
-        optional_list = getattr(io, 'output_optional', [])
-        optional_list = [optional_list] if isinstance(optional_list, basestring) else optional_list
-
-        response_elem = getattr(io, 'response_elem', _not_given)
-        response_elem = response_elem if response_elem != _not_given else 'response'
-        namespace = getattr(io, 'namespace', '')
-        output_repeated = getattr(io, 'output_repeated', False)
-        self.outgoing_declared = True if required_list or optional_list else False
-        skip_empty_keys = getattr(io, 'skip_empty_keys', False)
-        force_empty_keys = getattr(io, 'force_empty_keys', [])
-        allow_empty_required = getattr(io, 'allow_empty_required', False)
+        plan = (sio_plan or compile_sio(io, self.simple_io_config)).output
+        self.outgoing_declared = plan.has_output
 
-        if required_list or optional_list:
-            self._payload = SimpleIOPayload(cid, data_format, required_list, optional_list, self.simple_io_config,
-                response_elem, namespace, output_repeated, skip_empty_keys, force_empty_keys, allow_empty_required)
+        if plan.has_output:
+            self._payload = SimpleIOPayload(cid, data_format, plan, self.simple_io_config)
@@ -29,6 +29,7 @@ from zato.common import APISPEC, DATA_FORMAT, NO_DEFAULT_VALUE, PARAMS_PRIORITY,
      ZatoException, ZATO_NONE, ZATO_SEC_USE_RBAC
 from zato.common.exception import BadRequest, Reportable
 from zato.common.pubsub import PubSubMessage
+from zato.simpleio import Elem, ELEM_BOOL, ELEM_FORCE_TYPE, ELEM_INT, ELEM_PLAIN, ELEM_SECRET, InputPlan, OutputPlan, SIOPlan
 
 logger = logging.getLogger(__name__)
 
@@ -582,6 +583,96 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
 # ################################################################################################################################
 
+def _get_elem_kind(param, param_name, bool_parameter_prefixes, int_parameters, int_parameter_suffixes):
+    """ Returns what kind of conversions convert_sio would apply to an element, checking it in the same order as convert_sio.
+    """
+    if is_bool(param, param_name, bool_parameter_prefixes):
+        return ELEM_BOOL
+    elif isinstance(param, ForceType):
+        return ELEM_FORCE_TYPE
+    elif is_int(param_name, int_parameters, int_parameter_suffixes):
+        return ELEM_INT
+    elif is_secret(param_name):
+        return ELEM_SECRET
+    else:
+        return ELEM_PLAIN
+
+# ################################################################################################################################
+
+def _get_elems(params, is_required, default_value, force_empty_keys, skip_empty_keys, simple_io_config):
+    """ Returns a list of Elem objects for each of SimpleIO parameters given on input.
+    """
+    bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
+    int_parameters = simple_io_config.get('int_parameters', [])
+    int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', [])
+
+    out = []
+
+    for param in params:
+        param_name = param.name if isinstance(param, ForceType) else param
+        kind = _get_elem_kind(param, param_name, bool_parameter_prefixes, int_parameters, int_parameter_suffixes)
+
+        out.append(Elem(param, param_name, kind, is_required, isinstance(param, COMPLEX_VALUE),
+            isinstance(param, (AsIs, Opaque)), isinstance(param, AsIs), bool(skip_empty_keys and param in force_empty_keys),
+            resolve_default_value(param, default_value), resolve_default_value(param, '')))
+
+    return out
+
+# ################################################################################################################################
+
+def compile_sio(sio, simple_io_config, _sio_container=(tuple, list), _not_given=NOT_GIVEN):
+    """ Compiles a SimpleIO definition into a plan that requests and responses are processed with. Everything that does not
+    depend on a particular request, such as which conversions each element needs, is established here once.
+    """
+    config = simple_io_config or {}
+
+    input_required = getattr(sio, 'input_required', [])
+    input_required = input_required if isinstance(input_required, _sio_container) else [input_required]
+
+    input_optional = getattr(sio, 'input_optional', [])
+    input_optional = input_optional if isinstance(input_optional, _sio_container) else [input_optional]
+
+    default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
+
+    input_plan = InputPlan(
+        _get_elems(input_required, True, default_value, [], False, config),
+        _get_elems(input_optional, False, default_value, [], False, config),
+        getattr(sio, 'request_elem', 'request'), default_value, getattr(sio, 'use_text', True),
+        getattr(sio, 'use_channel_params_only', False), getattr(sio, 'encrypt_secrets', True))
+
+    output_required = getattr(sio, 'output_required', [])
+    output_required = output_required if isinstance(output_required, _sio_container) else [output_required]
+
+    output_optional = getattr(sio, 'output_optional', [])
+    output_optional = output_optional if isinstance(output_optional, _sio_container) else [output_optional]
+
+    response_elem = getattr(sio, 'response_elem', _not_given)
+    response_elem = response_elem if response_elem != _not_given else 'response'
+
+    skip_empty_keys = getattr(sio, 'skip_empty_keys', False)
+    force_empty_keys = getattr(sio, 'force_empty_keys', [])
+
+    output_plan = OutputPlan(
+        _get_elems(output_required, True, '', force_empty_keys, skip_empty_keys, config) +
+        _get_elems(output_optional, False, '', force_empty_keys, skip_empty_keys, config),
+        output_required, output_optional, response_elem, getattr(sio, 'namespace', ''), getattr(sio, 'output_repeated', False),
+        skip_empty_keys, force_empty_keys, getattr(sio, 'allow_empty_required', False))
+
+    return SIOPlan(simple_io_config, input_plan, output_plan)
+
+# ################################################################################################################################
+
+def get_sio_plan(class_, simple_io_config):
+    """ Returns a SimpleIO plan of a service class, compiling it first if there is none for this simple_io_config yet.
+    """
+    plan = class_.__dict__.get('_sio_plan')
+    if plan is None or plan.simple_io_config is not simple_io_config:
+        plan = compile_sio(class_.SimpleIO, simple_io_config)
+        class_._sio_plan = plan
+    return plan
+
+# ################################################################################################################################
+
 class SIO_TYPE_MAP:
 
 # ################################################################################################################################
@@ -20,7 +20,7 @@ from json import dumps
 from traceback import format_exc
 
 # Bunch
-from bunch import bunchify
+from bunch import Bunch, bunchify
 
 # dill
 from dill import dumps as dill_dumps, load as dill_load
@@ -46,6 +46,7 @@ from zato.common.odb.model.base import Base as ModelBase
 from zato.common.util import deployment_info, import_module_from_path, is_func_overridden, is_python_file, visit_py_source
 from zato.server.service import after_handle_hooks, after_job_hooks, before_handle_hooks, before_job_hooks, PubSubHook, Service
 from zato.server.service.internal import AdminService
+from zato.server.service.reqresp.sio import compile_sio
 
 # ################################################################################################################################
 
@@ -96,6 +97,10 @@ def set_up_class_attributes(class_, service_store=None, name=None):
         class_._json_pointer_store = service_store.server.worker_store.worker_config.json_pointer_store
         class_._xpath_store = service_store.server.worker_store.worker_config.xpath_store
 
+        # Compile SimpleIO definitions upfront so that the first request does not have to
+        if class_.has_sio:
+            class_._sio_plan = compile_sio(class_.SimpleIO, service_store.server.worker_store.worker_config.simple_io)
+
         _req_resp_freq_key = '%s%s' % (KVDB.REQ_RESP_SAMPLE, name)
         class_._req_resp_freq = int(service_store.server.kvdb.conn.hget(_req_resp_freq_key, 'freq') or 0)
 
@@ -316,8 +321,19 @@ class ServiceStore(InitializingObject):
 
             logger.info('Deploying %d cached internal services (%s)', len_si, self.server.name)
 
-            for idx, item in enumerate(items.service_info, 1):
-                self._visit_class(item.mod, deployed, item.class_, item.fs_location, True, sql_services.get(item.impl_name))
+            # Many services share a module so each module's source code is read only once
+            source_info = {}
+            to_process = []
+
+            for item in items.service_info:
+                si = source_info.get(item.mod)
+                if si is None:
+                    si = source_info[item.mod] = self._get_source_code_info(item.mod)
+
+                to_process.append(self._get_class_info(
+                    item.class_, item.fs_location, True, si, sql_services.get(item.impl_name)))
+
+            deployed.extend(self._visit_class_list(to_process))
 
             logger.info('Deployed %d cached internal services (%s)', len_si, self.server.name)
 
@@ -329,7 +345,7 @@ class ServiceStore(InitializingObject):
         """ Imports services from any of the supported sources, be it module names,
         individual files, directories or distutils2 packages (compressed or not).
         """
-        deployed = []
+        to_process = []
 
         for item in items:
             if has_debug:
@@ -339,24 +355,31 @@ class ServiceStore(InitializingObject):
 
             # A regular directory
             if os.path.isdir(item):
-                deployed.extend(self.import_services_from_directory(item, base_dir))
+                to_process.extend(self._collect_from_directory(item, base_dir))
 
             # .. a .py/.pyw
             elif is_python_file(item):
-                deployed.extend(self.import_services_from_file(item, is_internal, base_dir))
+                to_process.extend(self._collect_from_file(item, is_internal, base_dir))
 
             # .. must be a module object
             else:
-                deployed.extend(self.import_services_from_module(item, is_internal))
+                try:
+                    mod = import_module(item)
+                except ImportError:
+                    logger.warn('Could not import module `%s` (internal:%d)', item, is_internal)
+                    raise
+                else:
+                    to_process.extend(self._collect_from_module(mod, is_internal, inspect.getfile(mod)))
 
-        return deployed
+        # All the services from all the sources are added in one go
+        return self._visit_class_list(to_process)
 
 # ################################################################################################################################
 
-    def import_services_from_file(self, file_name, is_internal, base_dir):
-        """ Imports all the services from the path to a file.
+    def _collect_from_file(self, file_name, is_internal, base_dir):
+        """ Returns information about all the services from the path to a file, without deploying them yet.
         """
-        deployed = []
+        to_process = []
 
         try:
             mod_info = import_module_from_path(file_name, base_dir)
@@ -364,9 +387,16 @@ class ServiceStore(InitializingObject):
             msg = 'Could not load source, file_name:`%s`, e:`%s`'
             logger.error(msg, file_name, format_exc())
         else:
-            deployed.extend(self._visit_module(mod_info.module, is_internal, mod_info.file_name))
+            to_process.extend(self._collect_from_module(mod_info.module, is_internal, mod_info.file_name))
         finally:
-            return deployed
+            return to_process
+
+# ################################################################################################################################
+
+    def import_services_from_file(self, file_name, is_internal, base_dir):
+        """ Imports all the services from the path to a file.
+        """
+        return self._visit_class_list(self._collect_from_file(file_name, is_internal, base_dir))
 
 # ################################################################################################################################
 
@@ -381,12 +411,17 @@ class ServiceStore(InitializingObject):
         of Python source code to import, as is the case with services that have
         been hot-deployed.
         """
-        deployed = []
+        return self._visit_class_list(self._collect_from_directory(dir_name, base_dir))
+
+    def _collect_from_directory(self, dir_name, base_dir):
+        """ Returns information about all the services from a directory, without deploying them yet.
+        """
+        to_process = []
 
         for py_path in visit_py_source(dir_name):
-            deployed.extend(self.import_services_from_file(py_path, False, base_dir))
+            to_process.extend(self._collect_from_file(py_path, False, base_dir))
 
-        return deployed
+        return to_process
 
 # ################################################################################################################################
 
@@ -454,47 +489,76 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
-    def _visit_class(self, mod, deployed, class_, fs_location, is_internal, service_info=None, _utcnow=datetime.utcnow):
+    def _get_class_info(self, class_, fs_location, is_internal, source_info, service_info=None):
+        """ Returns everything that is needed to deploy a service class.
+        """
+        return Bunch(class_=class_, fs_location=fs_location, is_internal=is_internal, source_info=source_info,
+            service_info=service_info)
+
+# ################################################################################################################################
+
+    def _visit_class_list(self, to_process, _utcnow=datetime.utcnow):
+        """ Deploys all the service classes given on input, adding them to the ODB in bulk. Returns the classes deployed.
+        """
+        deployed = []
+
+        if not to_process:
+            return deployed
 
         now = _utcnow()
-        depl_info = dumps(deployment_info('service-store', str(class_), now.isoformat(), fs_location))
+        now_iso = now.isoformat()
+        odb_items = []
 
-        name = class_.get_name()
-        impl_name = class_.get_impl_name()
+        with self.update_lock:
 
-        set_up_class_attributes(class_, self, name)
+            for item in to_process:
 
-        self.services[impl_name] = {}
-        self.services[impl_name]['name'] = name
-        self.services[impl_name]['deployment_info'] = depl_info
-        self.services[impl_name]['service_class'] = class_
+                class_ = item.class_
+                depl_info = dumps(deployment_info('service-store', str(class_), now_iso, item.fs_location))
 
-        si = self._get_source_code_info(mod)
+                name = item.name = class_.get_name()
+                impl_name = item.impl_name = class_.get_impl_name()
 
-        if service_info:
-            service_id = service_info['id']
-            is_active = service_info['is_active']
-            slow_threshold = service_info['slow_threshold']
+                set_up_class_attributes(class_, self, name)
 
-            self.odb.add_service(name, impl_name, is_internal, now, dumps(str(depl_info)), si, service_info)
+                self.services[impl_name] = {}
+                self.services[impl_name]['name'] = name
+                self.services[impl_name]['deployment_info'] = depl_info
+                self.services[impl_name]['service_class'] = class_
 
-        else:
-            service_id, is_active, slow_threshold = self.odb.add_service(
-                name, impl_name, is_internal, now, dumps(str(depl_info)), si, service_info)
+                odb_items.append(Bunch(name=name, impl_name=impl_name, is_internal=item.is_internal,
+                    details=dumps(str(depl_info)), source_info=item.source_info, service_info=item.service_info))
+
+            odb_result = self.odb.add_services(odb_items, now)
+
+            for item in to_process:
+
+                class_ = item.class_
+                name = item.name
+                impl_name = item.impl_name
+
+                try:
+                    service_id, is_active, slow_threshold = odb_result[name]
+                except KeyError:
+                    logger.error('Could not add service `%s` to ODB (%s)', name, item.fs_location)
+                    del self.services[impl_name]
+                    continue
+
+                deployed.append(class_)
 
-        deployed.append(class_)
+                self.services[impl_name]['is_active'] = is_active
+                self.services[impl_name]['slow_threshold'] = slow_threshold
 
-        self.services[impl_name]['is_active'] = is_active
-        self.services[impl_name]['slow_threshold'] = slow_threshold
+                self.id_to_impl_name[service_id] = impl_name
+                self.impl_name_to_id[impl_name] = service_id
+                self.name_to_impl_name[name] = impl_name
 
-        self.id_to_impl_name[service_id] = impl_name
-        self.impl_name_to_id[impl_name] = service_id
-        self.name_to_impl_name[name] = impl_name
+                if has_debug:
+                    logger.debug('Imported service:`%s`', name)
 
-        if has_debug:
-            logger.debug('Imported service:`%s`', name)
+                class_.after_add_to_store(logger)
 
-        class_.after_add_to_store(logger)
+        return deployed
 
 # ################################################################################################################################
 
@@ -508,23 +572,35 @@ class ServiceStore(InitializingObject):
     def _visit_module(self, mod, is_internal, fs_location, needs_odb_deployment=True):
         """ Actually imports services from a module object.
         """
-        deployed = []
+        return self._visit_class_list(self._collect_from_module(mod, is_internal, fs_location))
+
+# ################################################################################################################################
+
+    def _collect_from_module(self, mod, is_internal, fs_location):
+        """ Returns information about all the services from a module object, without deploying them yet.
+        """
+        to_process = []
         try:
             for name in sorted(dir(mod)):
-                with self.update_lock:
-                    item = getattr(mod, name)
+                item = getattr(mod, name)
 
-                    if self._should_deploy(name, item):
-                        if item.before_add_to_store(logger):
-                            self._visit_class(mod, deployed, item, fs_location, is_internal)
-                        else:
-                            logger.info('Skipping `%s` from `%s`', item, fs_location)
+                if self._should_deploy(name, item):
+                    if item.before_add_to_store(logger):
+                        to_process.append(item)
+                    else:
+                        logger.info('Skipping `%s` from `%s`', item, fs_location)
+
+            # All the services from a module share its source code so it is read only once
+            if to_process:
+                si = self._get_source_code_info(mod)
+                to_process[:] = [self._get_class_info(class_, fs_location, is_internal, si) for class_ in to_process]
 
         except Exception:
             logger.error(
                 'Exception while visiting mod:`%s`, is_internal:`%s`, fs_location:`%s`, e:`%s`',
                 mod, is_internal, fs_location, format_exc())
-        finally:
-            return deployed
+            to_process = []
+
+        return to_process
 
 # ################################################################################################################################
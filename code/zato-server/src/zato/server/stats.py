@@ -10,15 +10,183 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from traceback import format_exc
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep, spawn
+
 # Zato
 from zato.common import KVDB
 
 logger = logging.getLogger(__name__)
 
+# How many most significant bits of a processing time are kept in a histogram bucket - with 7 bits, times up to 127 ms
+# are stored exactly and each larger one is off by less than 1/64 of its value.
+_hist_significant_bits = 7
+
+# How many seconds per-minute histograms are kept for in KVDB - they need to live long enough for AggregateByMinute
+# to process them, which it does two minutes after a given minute has passed.
+_hist_by_minute_expire = 300
+
+def get_hist_bucket(value, _significant_bits=_hist_significant_bits):
+    """ Returns the lower bound of a histogram bucket that value, a non-negative integer, belongs to.
+    """
+    shift = value.bit_length() - _significant_bits
+    return value if shift <= 0 else (value >> shift) << shift
+
+def get_hist_value_at(hist_items, idx):
+    """ Returns the idx-th smallest value, counting from 0, from a histogram's sorted (value, count) items.
+    """
+    seen = 0
+    for value, count in hist_items:
+        seen += count
+        if seen > idx:
+            return value
+
+def get_hist_stats(hist, mean_percentile):
+    """ Returns min, max, mean and usage count of values from a histogram, a dictionary of value -> count.
+    The mean is computed only out of values not greater than the one at mean_percentile, which is what
+    BaseAggregatingService.aggregate_raw_times does with raw lists of times.
+    """
+    hist_items = sorted(hist.items())
+    total = sum(count for _, count in hist_items)
+
+    if not total:
+        return 0, 0, 0, 0
+
+    # Same as scipy.stats.scoreatpercentile, i.e. values are interpolated if the percentile falls in between two of them
+    position = (total - 1) * mean_percentile / 100.0
+    lower_idx = int(position)
+    lower = get_hist_value_at(hist_items, lower_idx)
+    upper = get_hist_value_at(hist_items, min(lower_idx + 1, total - 1))
+    max_score = int(lower + (upper - lower) * (position - lower_idx))
+
+    mean_total = 0
+    mean_count = 0
+
+    for value, count in hist_items:
+        if value > max_score:
+            break
+        mean_total += value * count
+        mean_count += count
+
+    mean = mean_total / float(mean_count) if mean_count else 0
+
+    return hist_items[0][0], hist_items[-1][0], mean, total
+
+class ServiceStatsCollector(object):
+    """ Collects statistics of services invoked in current worker and periodically stores them in KVDB,
+    each time using a single pipeline for all the services.
+    """
+    def __init__(self, conn, flush_interval=5):
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self.keep_running = True
+
+        # Service name -> how many times it was invoked since the last flush
+        self.usage = {}
+
+        # Service name -> how many times it was invoked in total, as last reported by KVDB plus any invocations since then
+        self.usage_total = {}
+
+        # Service name -> the most recent processing time
+        self.last = {}
+
+        # Service name -> a histogram of processing times since the last flush
+        self.hist = {}
+
+        # (Service name, year, month, day, hour, minute) -> a histogram of processing times in that minute
+        self.hist_by_minute = {}
+
+    def start(self):
+        spawn(self._run)
+
+    def stop(self):
+        self.keep_running = False
+
+    def _run(self):
+        while self.keep_running:
+            sleep(self.flush_interval)
+            self.flush()
+
+    def incr_usage(self, service_name):
+        """ Increases the usage counter of a service and returns its total usage.
+        """
+        self.usage[service_name] = self.usage.get(service_name, 0) + 1
+
+        usage_total = self.usage_total.get(service_name, 0) + 1
+        self.usage_total[service_name] = usage_total
+
+        return usage_total
+
+    def add_time(self, service_name, proc_time, now, _get_hist_bucket=get_hist_bucket):
+        """ Adds the processing time of a service that completed at a given time, which is a datetime object.
+        """
+        bucket = _get_hist_bucket(proc_time)
+
+        self.last[service_name] = proc_time
+
+        hist = self.hist.get(service_name)
+        if hist is None:
+            hist = self.hist[service_name] = {}
+        hist[bucket] = hist.get(bucket, 0) + 1
+
+        minute_key = (service_name, now.year, now.month, now.day, now.hour, now.minute)
+
+        hist = self.hist_by_minute.get(minute_key)
+        if hist is None:
+            hist = self.hist_by_minute[minute_key] = {}
+        hist[bucket] = hist.get(bucket, 0) + 1
+
+    def flush(self, _usage=KVDB.SERVICE_USAGE, _basic=KVDB.SERVICE_TIME_BASIC, _hist=KVDB.SERVICE_TIME_HISTOGRAM,
+        _hist_by_minute=KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, _expire=_hist_by_minute_expire):
+        """ Stores in KVDB everything collected since the last flush.
+        """
+        # There is no context switch in between so no data will be lost
+        usage, self.usage = self.usage, {}
+        last, self.last = self.last, {}
+        hist, self.hist = self.hist, {}
+        hist_by_minute, self.hist_by_minute = self.hist_by_minute, {}
+
+        if not (usage or last):
+            return
+
+        usage_names = list(usage)
+
+        try:
+            with self.conn.pipeline(False) as pipe:
+
+                for name in usage_names:
+                    pipe.incrby(_usage + name, usage[name])
+
+                for name, value in last.iteritems():
+                    pipe.hset(_basic + name, 'last', value)
+
+                for name, name_hist in hist.iteritems():
+                    key = _hist + name
+                    for bucket, count in name_hist.iteritems():
+                        pipe.hincrby(key, bucket, count)
+
+                for (name, year, month, day, hour, minute), minute_hist in hist_by_minute.iteritems():
+                    key = '%s%s:%04d:%02d:%02d:%02d:%02d' % (_hist_by_minute, name, year, month, day, hour, minute)
+                    for bucket, count in minute_hist.iteritems():
+                        pipe.hincrby(key, bucket, count)
+                    pipe.expire(key, _expire)
+
+                result = pipe.execute()
+
+        except Exception:
+            logger.warn('Could not store service statistics, e:`%s`', format_exc())
+
+        else:
+            # Usage counters are shared by all workers so we take their current values from KVDB,
+            # along with anything that was invoked while the pipeline was running.
+            for name, value in zip(usage_names, result):
+                self.usage_total[name] = int(value) + self.usage.get(name, 0)
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
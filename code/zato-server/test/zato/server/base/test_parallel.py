@@ -12,11 +12,19 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import httplib
 from cStringIO import StringIO
 from datetime import datetime
+from time import time
 from unittest import TestCase
+from uuid import uuid4
 
 # Bunch
 from bunch import Bunch
 
+# gevent
+from gevent import sleep
+
+# mock
+from mock import Mock, patch
+
 # nose
 from nose.tools import eq_
 
@@ -29,6 +37,7 @@ from tzlocal import get_localzone
 # Zato
 from zato.common import CHANNEL, ZATO_NONE
 from zato.common.broker_message import SERVICE
+from zato.common.crypto import CryptoManager
 from zato.common.odb.api import ODBManager
 from zato.common.test import rand_int, rand_string
 from zato.common.util import new_cid, utcnow
@@ -36,6 +45,7 @@ from zato.server.connection.http_soap.channel import RequestDispatcher
 from zato.server.connection.http_soap.url_data import URLData
 from zato.server.base.parallel import ParallelServer
 from zato.server.base.parallel.http import ACCESS_LOG_DT_FORMAT
+from zato.server.config import ConfigDict, ConfigStore
 
 # ################################################################################################################################
 
@@ -226,3 +236,175 @@ class HTTPAccessLogTestCase(TestCase):
         eq_(extra.req_timestamp, request_timestamp)
 
 # ################################################################################################################################
+
+class FakeServerStartupIPC(object):
+    def __init__(self):
+        self.config_snapshot = None
+        self.timeout = None
+
+    def set_config_snapshot(self, info):
+        self.config_snapshot = info
+
+    def get_config_snapshot(self, timeout):
+        self.timeout = timeout
+        if self.config_snapshot is None:
+            raise KeyError('No snapshot')
+        return self.config_snapshot
+
+# ################################################################################################################################
+
+class ConfigSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.secret_key = CryptoManager.generate_key()
+
+    def get_server(self, startup_ipc, deployment_key, is_first_worker):
+        ps = ParallelServer()
+        ps.config = ConfigStore()
+        ps.fs_server_config = Bunch(misc=Bunch(config_snapshot_timeout='10', config_snapshot_wait_timeout='3'),
+            component_enabled=Bunch(stats='False', slow_response='False'))
+        ps.crypto_manager = CryptoManager(secret_key=self.secret_key)
+        ps.server_startup_ipc = startup_ipc
+        ps.deployment_key = deployment_key
+        ps.is_first_worker = is_first_worker
+        self.addCleanup(ps.config_snapshot_ipc.close)
+
+        return ps
+
+    @patch('zato.server.base.parallel.config.spawn_later')
+    def test_snapshot(self, spawn_later):
+
+        startup_ipc = FakeServerStartupIPC()
+        deployment_key = uuid4().hex
+
+        first = self.get_server(startup_ipc, deployment_key, True)
+        first.config.basic_auth = ConfigDict('basic_auth', Bunch(
+            {'my.sec': Bunch(config=Bunch(id=1, name='my.sec', password='my.password', last_modified=datetime.utcnow()))}))
+        first.config.service = ConfigDict('service_list', Bunch())
+        first.config.http_soap = [{'url_path': '/my/path', 'match_target': ':::/my/path'}]
+
+        # The first worker never uses snapshots, it publishes them
+        eq_(first._set_up_config_from_snapshot(), False)
+        first._publish_config_snapshot()
+
+        eq_(spawn_later.call_args[0], (10, first._remove_config_snapshot))
+
+        # Secrets are not kept in clear text in shared memory
+        info = startup_ipc.config_snapshot
+        data = first.config_snapshot_ipc.load(deployment_key, info['version'], info['size'])
+        self.assertNotIn(b'my.password', data)
+
+        other = self.get_server(startup_ipc, deployment_key, False)
+        eq_(other._set_up_config_from_snapshot(), True)
+
+        # Waiting for a snapshot has its own timeout, separate from how long the snapshot is kept around
+        eq_(startup_ipc.timeout, 3)
+
+        eq_(other.config.basic_auth.name, 'basic_auth')
+        eq_(other.config.basic_auth.get('my.sec'), first.config.basic_auth.get('my.sec'))
+        eq_(other.config.service.name, 'service_list')
+        eq_(other.config.http_soap, first.config.http_soap)
+
+        # Workers starting after the snapshot was removed need to read configuration from ODB
+        first._remove_config_snapshot()
+        eq_(startup_ipc.config_snapshot, {'version': None})
+
+        late = self.get_server(startup_ipc, deployment_key, False)
+        eq_(late._set_up_config_from_snapshot(), False)
+
+    @patch('zato.server.base.parallel.config.spawn_later')
+    def test_snapshot_publish_failure(self, spawn_later):
+
+        startup_ipc = FakeServerStartupIPC()
+        deployment_key = uuid4().hex
+
+        first = self.get_server(startup_ipc, deployment_key, True)
+        first.config.http_soap = []
+        first.config_snapshot_ipc.publish = Mock(side_effect=ValueError('Cannot publish'))
+        first._publish_config_snapshot()
+
+        # Other workers learn immediately that there is no snapshot to wait for
+        eq_(startup_ipc.config_snapshot, {'version': None})
+        eq_(spawn_later.call_count, 0)
+
+        other = self.get_server(startup_ipc, deployment_key, False)
+        eq_(other._set_up_config_from_snapshot(), False)
+
+    def test_snapshot_odb_failure(self):
+
+        startup_ipc = FakeServerStartupIPC()
+
+        first = self.get_server(startup_ipc, uuid4().hex, True)
+        first._set_up_odb_config = Mock(side_effect=ValueError('ODB unavailable'))
+
+        self.assertRaises(ValueError, first.set_up_config, None)
+        eq_(startup_ipc.config_snapshot, {'version': None})
+
+    def test_snapshot_disabled(self):
+
+        startup_ipc = FakeServerStartupIPC()
+
+        first = self.get_server(startup_ipc, uuid4().hex, True)
+        first.fs_server_config.misc.config_snapshot_timeout = '0'
+        first.config.http_soap = []
+        first._publish_config_snapshot()
+
+        eq_(startup_ipc.config_snapshot, None)
+
+# ################################################################################################################################
+
+class InvokeAllPIDsTestCase(TestCase):
+
+    @patch('zato.server.base.parallel.get_worker_pids')
+    def test_invoke_all_pids(self, get_worker_pids):
+
+        get_worker_pids.return_value = [1, 2, 3, 4]
+
+        def invoke_by_pid(service, request, pid, timeout):
+            if pid == 1:
+                sleep(0.1)
+                return True, {'pid': pid}
+            elif pid == 2:
+                sleep(0.1)
+                return False, 'Error in PID 2'
+            elif pid == 3:
+                sleep(timeout)
+                return False, None
+            else:
+                sleep(timeout * 10)
+
+        ps = ParallelServer()
+        ps.invoke_by_pid = invoke_by_pid
+
+        start = time()
+        out = ps.invoke_all_pids('my.service', None, timeout=0.2)
+
+        # All PIDs were invoked concurrently, including the one that did not time out on its own
+        self.assertLess(time() - start, 1.5)
+
+        eq_(out[1], {'is_ok': True, 'pid_data': {'pid': 1}, 'error_info': None})
+        eq_(out[2], {'is_ok': False, 'pid_data': None, 'error_info': 'Error in PID 2'})
+        eq_(out[3], {'is_ok': False, 'pid_data': None, 'error_info': 'No response from PID 3 in 0.2s'})
+        eq_(out[4], {'is_ok': False, 'pid_data': None, 'error_info': 'No response from PID 4 in 0.2s'})
+
+        # Failures mean that PIDs will be read anew next time
+        ps.invoke_all_pids('my.service', None, timeout=0.2)
+        eq_(get_worker_pids.call_count, 2)
+
+    @patch('zato.server.base.parallel.get_worker_pids')
+    def test_worker_pids_cached(self, get_worker_pids):
+
+        get_worker_pids.return_value = [1, 2]
+
+        ps = ParallelServer()
+        ps.invoke_by_pid = lambda service, request, pid, timeout: (True, pid)
+
+        for x in range(3):
+            eq_(ps.invoke_all_pids('my.service', None), {
+                1: {'is_ok': True, 'pid_data': 1, 'error_info': None},
+                2: {'is_ok': True, 'pid_data': 2, 'error_info': None},
+            })
+
+        eq_(get_worker_pids.call_count, 1)
+
+# ################################################################################################################################
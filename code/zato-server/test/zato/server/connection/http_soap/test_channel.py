@@ -10,12 +10,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from cStringIO import StringIO
+from gzip import GzipFile
 from httplib import OK
 from unittest import TestCase
 from uuid import uuid4
 
 # anyjson
-from anyjson import loads
+from anyjson import dumps, loads
 
 # arrow
 import arrow
@@ -23,6 +24,9 @@ import arrow
 # Bunch
 from bunch import Bunch
 
+# gevent
+from gevent import sleep, spawn
+
 # lxml
 from lxml import etree
 
@@ -556,3 +560,219 @@ class TestRequestHandler(TestCase):
 
         rh.set_content_type(response, rand_string(), rand_string(), None, FakeChannelItem())
         eq_(response.content_type, user_content_type)
+
+# ##############################################################################
+
+class TestRequestHandlerCache(TestCase):
+
+    def get_handler(self, stale_while_revalidate=False, invoke_sleep=0, invoke_error=None):
+
+        class _Service(object):
+            get_request_hash = None
+            invocations = []
+
+            def update_handle(_self, *ignored_args, **ignored_kwargs):
+                _Service.invocations.append(None)
+                sleep(invoke_sleep)
+                if invoke_error:
+                    raise invoke_error
+                response = DummyResponse('payload-{}'.format(len(_Service.invocations)))
+                response.headers = {'X-Zato-Test': 'abc'}
+                return response
+
+        class _server(object):
+            cache = {}
+            fs_server_config = Bunch(misc=Bunch(
+                use_soap_envelope=True, http_cache_stale_while_revalidate=stale_while_revalidate))
+
+            class service_store:
+                @staticmethod
+                def new_instance(service_impl_name):
+                    return _Service(), True
+
+            @staticmethod
+            def get_from_cache(cache_type, cache_name, key):
+                return _server.cache.get(key)
+
+            @staticmethod
+            def set_in_cache(cache_type, cache_name, key, value):
+                _server.cache[key] = value
+
+        rh = channel.RequestHandler(_server)
+        rh.create_channel_params = lambda *ignored_args, **ignored_kwargs: {}
+
+        return rh, _Service.invocations
+
+    def handle(self, rh):
+
+        channel_item = Bunch()
+        channel_item.id = 1
+        channel_item.service_impl_name = 'my.service'
+        channel_item.merge_url_params_req = True
+        channel_item.data_format = None
+        channel_item.transport = None
+        channel_item.params_pri = None
+        channel_item.cache_type = 'builtin'
+        channel_item.cache_name = 'default'
+
+        wsgi_environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/my/api'}
+
+        return rh.handle(new_cid(), {}, channel_item, wsgi_environ, '', Bunch(broker_client=None), None, None, None, None)
+
+    def test_cache_key(self):
+        rh, _ = self.get_handler()
+        self.handle(rh)
+
+        cache_key, = rh.server.cache.keys()
+        eq_(len(cache_key), len('http-channel-1-') + 64)
+        eq_(cache_key.count('-'), 3)
+
+    def test_hit_does_not_parse_cached_value(self):
+        rh, invocations = self.get_handler()
+
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-1')
+
+        def _loads(*ignored_args, **ignored_kwargs):
+            raise Exception('Unexpected call to loads')
+
+        cache_key, = rh.server.cache.keys()
+        wsgi_environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/my/api'}
+        channel_item = Bunch(id=1, cache_type='builtin', cache_name='default')
+
+        for x in range(3):
+            _, response = rh.get_response_from_cache(rh.server.service_store.new_instance(None)[0], '', channel_item, {},
+                wsgi_environ, _loads=_loads)
+            eq_(response.payload, 'payload-1')
+            eq_(response.headers, {'X-Zato-Test': 'abc'})
+
+            # Each caller gets its own copy that it can modify freely
+            response.payload = 'modified'
+
+        eq_(len(invocations), 1)
+
+        # A value that was changed in the cache, e.g. by another worker, is parsed again
+        rh.server.cache[cache_key] = dumps({'payload': 'payload-2', 'content_type': 'text/plain', 'headers': {},
+            'status_code': OK})
+
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-2')
+        eq_(len(invocations), 1)
+
+    def test_concurrent_misses_are_coalesced(self):
+        rh, invocations = self.get_handler(invoke_sleep=0.1)
+
+        greenlets = [spawn(self.handle, rh) for x in range(10)]
+        responses = [g.get() for g in greenlets]
+
+        eq_(len(invocations), 1)
+        eq_(set(response.payload for response in responses), set(['payload-1']))
+        eq_(rh.cache_in_flight, {})
+
+    def test_concurrent_misses_failure(self):
+        rh, invocations = self.get_handler(invoke_sleep=0.1, invoke_error=ValueError())
+
+        greenlets = [spawn(self.handle, rh) for x in range(3)]
+        for g in greenlets:
+            g.join()
+            self.assertIsInstance(g.exception, ValueError)
+
+        # Each greenlet tried to invoke the service on its own after the first one failed
+        eq_(len(invocations), 3)
+        eq_(rh.cache_in_flight, {})
+
+    def test_stale_while_revalidate(self):
+        rh, invocations = self.get_handler(stale_while_revalidate=True, invoke_sleep=0.1)
+        self.handle(rh)
+
+        # The entry expires ..
+        rh.server.cache.clear()
+
+        # .. one greenlet computes a new one ..
+        leader = spawn(self.handle, rh)
+        sleep(0.01)
+
+        # .. while another is given the previous one without waiting.
+        response = self.handle(rh)
+        eq_(response.payload, 'payload-1')
+        eq_(leader.ready(), False)
+
+        eq_(leader.get().payload, 'payload-2')
+        eq_(len(invocations), 2)
+
+# ##############################################################################
+
+class TestGzip(TestCase):
+
+    def gunzip(self, data):
+        return GzipFile(fileobj=StringIO(data)).read()
+
+    def test_accepts_gzip(self):
+        eq_(channel.accepts_gzip(None), False)
+        eq_(channel.accepts_gzip(''), False)
+        eq_(channel.accepts_gzip('identity'), False)
+        eq_(channel.accepts_gzip('gzip'), True)
+        eq_(channel.accepts_gzip('deflate, GZIP'), True)
+        eq_(channel.accepts_gzip('br;q=1.0, gzip;q=0.8'), True)
+        eq_(channel.accepts_gzip('gzip; q=0'), False)
+        eq_(channel.accepts_gzip('*'), True)
+        eq_(channel.accepts_gzip('*;q=0'), False)
+
+        # An explicit gzip entry takes precedence over a wildcard one, no matter in what order they are given
+        eq_(channel.accepts_gzip('*;q=0, gzip'), True)
+        eq_(channel.accepts_gzip('gzip, *;q=0'), True)
+        eq_(channel.accepts_gzip('*, gzip;q=0'), False)
+
+    def test_gzip_compress_stream(self):
+        data = rand_string() * 10000
+
+        eq_(self.gunzip(channel.gzip_compress(data, 6)), data)
+
+        chunks = list(channel.gzip_stream(data, 6, 1000))
+        self.assertGreater(len(chunks), 1)
+        eq_(self.gunzip(b''.join(chunks)), data)
+
+    def test_get_gzip_payload(self):
+        rd = channel.RequestDispatcher(gzip_min_size=100, gzip_chunk_size=10000)
+
+        def get_payload(response, accept_encoding='gzip', vary=None):
+            wsgi_environ = {'zato.http.response.headers': {}, 'HTTP_ACCEPT_ENCODING': accept_encoding}
+            if vary:
+                wsgi_environ['zato.http.response.headers']['Vary'] = vary
+            payload = rd.get_gzip_payload(response, wsgi_environ)
+            return payload, wsgi_environ['zato.http.response.headers']
+
+        # Too small to compress
+        payload, headers = get_payload(DummyResponse('abc'))
+        eq_(payload, 'abc')
+        eq_(headers, {'Vary': 'Accept-Encoding'})
+
+        # Client does not accept gzip
+        data = rand_string() * 10
+        payload, headers = get_payload(DummyResponse(data), accept_encoding=None, vary='Origin')
+        eq_(payload, data)
+        eq_(headers, {'Vary': 'Origin, Accept-Encoding'})
+
+        # Compressed in one go
+        payload, headers = get_payload(DummyResponse(data))
+        eq_(self.gunzip(payload), data)
+        eq_(headers, {'Vary': 'Accept-Encoding', 'Content-Encoding': 'gzip'})
+
+        # Streamed
+        large_data = rand_string() * 1000
+        payload, headers = get_payload(DummyResponse(large_data))
+        eq_(self.gunzip(b''.join(payload)), large_data)
+        eq_(headers['Content-Encoding'], 'gzip')
+
+        # Cached responses are compressed once only
+        cached = channel._CachedResponse(data, 'text/plain', {}, OK)
+
+        payload, headers = get_payload(cached.copy())
+        eq_(self.gunzip(payload), data)
+        eq_(cached.gzipped, payload)
+
+        copy = cached.copy()
+        eq_(copy.gzipped, payload)
+
+        payload2, _ = get_payload(copy)
+        self.assertIs(payload2, payload)
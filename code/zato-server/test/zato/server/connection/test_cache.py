@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import dumps, loads
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch, bunchify
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common import CACHE
+from zato.common.broker_message import CACHE as CACHE_BROKER_MSG
+from zato.server.connection.cache import CacheAPI
+
+# ################################################################################################################################
+
+class _BrokerClient(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg):
+        # Go through JSON to make sure that whatever is published can be serialized
+        self.published.append(bunchify(loads(dumps(msg))))
+
+# ################################################################################################################################
+
+class _Server(object):
+    def __init__(self, worker_id, cache_config):
+        self.worker_id = worker_id
+        self.broker_client = _BrokerClient()
+        self.fs_server_config = Bunch(cache=cache_config)
+
+# ################################################################################################################################
+
+class CacheSyncBatchTestCase(TestCase):
+
+    def get_api(self, worker_id, sync_batch_window=5, sync_batch_max_ops=500):
+        api = CacheAPI(_Server(worker_id, {'sync_batch_window':sync_batch_window, 'sync_batch_max_ops':sync_batch_max_ops}))
+        api.create(Bunch({
+            'name': 'test',
+            'cache_type': CACHE.TYPE.BUILTIN,
+            'is_default': True,
+            'max_size': 100,
+            'max_item_size': 1000,
+            'extend_expiry_on_get': True,
+            'extend_expiry_on_set': True,
+            'sync_method': CACHE.SYNC_METHOD.IN_BACKGROUND.id,
+        }))
+        return api
+
+    def deliver(self, source, target):
+        for msg in source.server.broker_client.published:
+            if msg.action == CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value:
+                target.sync_after_batch(CACHE.TYPE.BUILTIN, msg)
+            elif msg.action == CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_SET.value:
+                target.sync_after_set(CACHE.TYPE.BUILTIN, msg)
+            elif msg.action == CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_DELETE.value:
+                target.sync_after_delete(CACHE.TYPE.BUILTIN, msg)
+
+# ################################################################################################################################
+
+    def test_batch_coalesces_sets(self):
+
+        source = self.get_api(1)
+        target = self.get_api(2)
+
+        cache = source.default
+
+        for idx in range(10):
+            cache.set('key1', 'value{}'.format(idx))
+
+        cache.set('key2', 'value2')
+        cache.delete('key2')
+        cache.set('key3', 'value3')
+
+        sleep(0.05)
+
+        published = source.server.broker_client.published
+        self.assertEquals(len(published), 1)
+
+        msg = published[0]
+        self.assertEquals(msg.action, CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value)
+
+        # All .set calls of key1 were coalesced into the last one, the order of other operations is kept
+        self.assertListEqual([(item.key, item.get('value')) for item in msg.ops],
+            [('key1', 'value9'), ('key2', 'value2'), ('key2', None), ('key3', 'value3')])
+
+        self.deliver(source, target)
+
+        self.assertEquals(target.default.get('key1'), 'value9')
+        self.assertNotIn('key2', target.default)
+        self.assertEquals(target.default.get('key3'), 'value3')
+
+# ################################################################################################################################
+
+    def test_batch_failed_op_skipped(self):
+
+        source = self.get_api(1)
+        target = self.get_api(2)
+
+        source.default.set('key1', 'value1')
+        sleep(0.05)
+
+        # The target never received the first batch so it does not have key1 that the next batch expires ..
+        del source.server.broker_client.published[:]
+
+        source.default.expire('key1', 10)
+        source.default.set('key2', 'value2')
+        sleep(0.05)
+
+        self.deliver(source, target)
+
+        # .. which does not prevent the operation that follows from being applied.
+        self.assertNotIn('key1', target.default)
+        self.assertEquals(target.default.get('key2'), 'value2')
+
+# ################################################################################################################################
+
+    def test_batch_not_coalesced_across_other_ops(self):
+
+        source = self.get_api(1)
+        cache = source.default
+
+        cache.set('key1', 'value1')
+        cache.set('zzz1', 'value1')
+        cache.delete_by_prefix('zzz', True)
+        cache.set('key1', 'value2')
+
+        sleep(0.05)
+
+        msg = source.server.broker_client.published[0]
+        self.assertListEqual([(item.key, item.get('value')) for item in msg.ops],
+            [('key1', 'value1'), ('zzz1', 'value1'), ('zzz', None), ('key1', 'value2')])
+
+# ################################################################################################################################
+
+    def test_batch_max_ops(self):
+
+        source = self.get_api(1, sync_batch_max_ops=3)
+        cache = source.default
+
+        for idx in range(7):
+            cache.set('key{}'.format(idx), idx)
+
+        sleep(0.05)
+
+        published = source.server.broker_client.published
+        self.assertListEqual([len(msg.get('ops', [msg])) for msg in published], [3, 3, 1])
+
+# ################################################################################################################################
+
+    def test_batching_disabled(self):
+
+        source = self.get_api(1, sync_batch_window=0)
+        target = self.get_api(2)
+
+        source.default.set('key1', 'value1')
+        source.default.set('key1', 'value2')
+
+        sleep(0.01)
+
+        published = source.server.broker_client.published
+        self.assertEquals(len(published), 2)
+        self.assertTrue(all(msg.action == CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_SET.value for msg in published))
+
+        self.deliver(source, target)
+        self.assertEquals(target.default.get('key1'), 'value2')
+
+# ################################################################################################################################
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import loads
+from time import time
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.util import new_cid
+from zato.server.connection.web_socket import WebSocket
+from zato.server.connection.web_socket.ping import PingScheduler
+
+# ################################################################################################################################
+
+class InvokeClientTestCase(TestCase):
+
+    def get_web_socket(self, reply_after=None):
+
+        # Not going through __init__ because it expects a live socket and a fully configured server
+        wsx = WebSocket.__new__(WebSocket)
+        wsx.responses_expected = {}
+        wsx.peer_conn_info_pretty = 'test'
+        wsx.python_id = wsx.pub_client_id = wsx.ext_client_id = wsx.ext_client_name = 'test'
+        wsx.sent = []
+
+        def reply(msg_id):
+            sleep(reply_after)
+            wsx._handle_client_response(new_cid(), Bunch(in_reply_to=msg_id, data='Response to {}'.format(msg_id)))
+
+        def send(serialized):
+            msg_id = loads(serialized)['meta']['id']
+            wsx.sent.append(msg_id)
+            if reply_after is not None:
+                spawn(reply, msg_id)
+
+        wsx.send = send
+        return wsx
+
+    def test_invoke_client_response(self):
+        wsx = self.get_web_socket(reply_after=0.01)
+
+        cids = [new_cid() for x in range(10)]
+        greenlets = [spawn(wsx.invoke_client, cid, {'a': 1}, timeout=5) for cid in cids]
+
+        for cid, g in zip(cids, greenlets):
+            eq_(g.get(), 'Response to {}'.format(cid))
+
+        eq_(wsx.sent, cids)
+        eq_(wsx.responses_expected, {})
+
+    def test_invoke_client_timeout(self):
+        wsx = self.get_web_socket()
+
+        eq_(wsx.invoke_client(new_cid(), {'a': 1}, timeout=0.05), None)
+        eq_(wsx.responses_expected, {})
+
+    def test_late_response_is_dropped(self):
+        wsx = self.get_web_socket(reply_after=0.1)
+
+        eq_(wsx.invoke_client(new_cid(), {'a': 1}, timeout=0.01), None)
+        sleep(0.15)
+
+        eq_(wsx.responses_expected, {})
+
+# ################################################################################################################################
+
+class _PingConn(object):
+    """ Stands in for a WebSocket connection in tests of the ping scheduler.
+    """
+    def __init__(self, responds=True, ping_blocks_for=0):
+        self.responds = responds
+        self.ping_blocks_for = ping_blocks_for
+        self.stream = True
+        self.server_terminated = False
+        self.ping_bucket = None
+        self.ping_id = None
+        self.ping_sent_at = None
+        self.pings_sent = 0
+        self.pings_missed = 0
+        self.send_timed_out = False
+
+    def send_background_ping(self):
+        if self.ping_blocks_for:
+            sleep(self.ping_blocks_for)
+        self.pings_sent += 1
+
+    def on_ping_missed(self):
+        self.pings_missed += 1
+        if self.pings_missed == 2:
+            self.server_terminated = True
+
+    def on_ping_send_timeout(self):
+        self.send_timed_out = True
+        self.server_terminated = True
+
+# ################################################################################################################################
+
+class PingSchedulerTestCase(TestCase):
+
+    def test_ping_bucket(self):
+        scheduler = PingScheduler(bucket_count=3, batch_size=2)
+
+        conns = [_PingConn(responds=bool(idx % 2)) for idx in range(5)]
+        for conn in conns:
+            scheduler.register(conn)
+
+        scheduler.greenlet.kill()
+        bucket = scheduler.buckets[0]
+        eq_(len(bucket), 5)
+
+        for x in range(3):
+            scheduler.ping_bucket(bucket)
+            scheduler.pool.join()
+            for conn in conns:
+                if conn.responds:
+                    scheduler.on_pong(conn)
+
+        for conn in conns:
+            if conn.responds:
+                eq_(conn.pings_sent, 3)
+                eq_(conn.pings_missed, 0)
+                self.assertIn(conn, bucket)
+            else:
+                # Missed the first two pings, after which the connection was closed and dropped from the scheduler
+                eq_(conn.pings_sent, 2)
+                eq_(conn.pings_missed, 2)
+                self.assertNotIn(conn, bucket)
+                eq_(conn.ping_bucket, None)
+
+        eq_(len(scheduler.rtt), 6)
+        eq_(sorted(scheduler.get_rtt_percentiles()), ['p50', 'p90', 'p99'])
+
+    def test_disconnected_conns_are_unregistered(self):
+        scheduler = PingScheduler()
+        conn = _PingConn()
+        scheduler.register(conn)
+        scheduler.greenlet.kill()
+
+        conn.stream = None
+        scheduler.ping_bucket(scheduler.buckets[conn.ping_bucket])
+        scheduler.pool.join()
+
+        eq_(conn.pings_sent, 0)
+        eq_(sum(len(bucket) for bucket in scheduler.buckets), 0)
+
+    def test_blocked_ping_closes_connection(self):
+        scheduler = PingScheduler(send_timeout=0.05)
+
+        blocked = _PingConn(ping_blocks_for=10)
+        conns = [_PingConn() for x in range(3)]
+
+        for conn in [blocked] + conns:
+            scheduler.register(conn)
+
+        scheduler.greenlet.kill()
+        bucket = scheduler.buckets[blocked.ping_bucket]
+
+        # Pinging the bucket does not wait for the blocked connection ..
+        start = time()
+        scheduler.ping_bucket(bucket)
+        self.assertLess(time() - start, 0.05)
+
+        # .. the other connections are pinged in the meantime ..
+        sleep(0)
+        for conn in conns:
+            eq_(conn.pings_sent, 1)
+
+        # .. and the blocked one is closed once the timeout is reached because its frame may have been sent only in part.
+        scheduler.pool.join()
+
+        eq_(blocked.pings_sent, 0)
+        eq_(blocked.send_timed_out, True)
+        self.assertNotIn(blocked, bucket)
+
+        # The other connections are still pinged
+        scheduler.ping_bucket(bucket)
+        scheduler.pool.join()
+
+        for conn in conns:
+            eq_(conn.pings_sent, 2)
+
+    def test_get_rtt_percentiles(self):
+        scheduler = PingScheduler()
+        eq_(scheduler.get_rtt_percentiles(), {})
+
+        scheduler.rtt.extend(idx / 1000.0 for idx in range(1, 101))
+        eq_(scheduler.get_rtt_percentiles(), {'p50': 51.0, 'p90': 91.0, 'p99': 100.0})
+
+# ################################################################################################################################
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import Mock, patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import PUBSUB
+from zato.common.exception import BadRequest, ServiceUnavailable
+from zato.server.pubsub import PubSub, Topic
+from zato.server.service.internal.pubsub.publish import Publish, PublishMany
+from zato.server.service.internal.pubsub.pubapi import PublishManyService
+
+# ################################################################################################################################
+
+def get_topic(id=1, name='/my/topic', max_depth_gd=100, has_gd=True):
+    return Topic(Bunch(id=id, name=name, is_active=True, is_internal=False, max_depth_gd=max_depth_gd, max_depth_non_gd=1000,
+        has_gd=has_gd, depth_check_freq=1, pub_buffer_size_gd=0, task_delivery_interval=2000, meta_store_frequency=1,
+        task_sync_interval=500), 'server1', 123)
+
+# ################################################################################################################################
+
+def get_service(class_):
+
+    # Not going through __init__ because it expects a service store to have set up the class
+    service = class_.__new__(class_)
+    service.cid = 'cid1'
+    service.logger = Mock()
+
+    return service
+
+# ################################################################################################################################
+
+class _PubSub(object):
+    """ Stands in for PubSub, keeping track of messages that it was given.
+    """
+    data_prefix_len = 2048
+    data_prefix_short_len = 64
+    has_meta_topic = False
+    has_meta_endpoint = False
+
+    def __init__(self, topics, subscriptions):
+        self.topics = dict((topic.name, topic) for topic in topics)
+        self.subscriptions = subscriptions
+        self.sub_key_servers = {}
+        self.in_ram = []
+        self.sync_has_gd_msg = []
+
+    def is_allowed_pub_topic_by_endpoint_id(self, topic_name, endpoint_id):
+        return 'pub=/*'
+
+    def get_topic_by_name(self, topic_name):
+        return self.topics[topic_name]
+
+    def get_subscriptions_by_topic(self, topic_name):
+        return self.subscriptions.get(topic_name, [])
+
+    def get_sub_key_server(self, sub_key):
+        return True
+
+    def get_endpoint_by_id(self, endpoint_id):
+        return Bunch(name='endpoint.{}'.format(endpoint_id))
+
+    def incr_pubsub_msg_counter(self, endpoint_id):
+        pass
+
+    def set_sync_has_msg(self, topic_id, is_gd, value, source, gd_pub_time_max):
+        self.sync_has_gd_msg.append(topic_id)
+
+    def store_in_ram(self, cid, topic_id, topic_name, sub_keys, non_gd_msg_list):
+        self.in_ram.append((topic_name, sub_keys, [msg['pub_msg_id'] for msg in non_gd_msg_list]))
+
+# ################################################################################################################################
+
+class _ODBSession(object):
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class CheckGDDepthTestCase(TestCase):
+
+    def setUp(self):
+        self.service = get_service(Publish)
+        self.topic = get_topic(max_depth_gd=100)
+
+        # So that neither a cleanup nor skipping a depth check is due
+        self.topic.msg_pub_counter_gd = 1
+
+    def check(self, now, len_gd_msg_list=1):
+        ctx = Bunch(topic=self.topic, cluster_id=1, now=now, gd_msg_list=[{}] * len_gd_msg_list, current_depth=None)
+        self.service._check_gd_depth(None, ctx)
+        return ctx
+
+    @patch('zato.server.service.internal.pubsub.publish.get_gd_depth_topic')
+    def test_recount_every_n_checks(self, get_gd_depth_topic):
+        get_gd_depth_topic.return_value = 10
+
+        # Unknown depth is counted in SQL ..
+        eq_(self.check(1000.0).current_depth, 11)
+        eq_(get_gd_depth_topic.call_count, 1)
+
+        # .. and then maintained locally for a number of checks ..
+        for x in range(PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_CHECKS):
+            self.topic.incr_gd_depth(1)
+            self.check(1000.0)
+
+        eq_(get_gd_depth_topic.call_count, 1)
+        eq_(self.topic.gd_depth, 10 + PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_CHECKS)
+
+        # .. after which it is counted anew, e.g. because other processes published to the topic in the meantime.
+        get_gd_depth_topic.return_value = 50
+        eq_(self.check(1000.0).current_depth, 51)
+        eq_(get_gd_depth_topic.call_count, 2)
+
+    @patch('zato.server.service.internal.pubsub.publish.get_gd_depth_topic')
+    def test_recount_every_n_seconds(self, get_gd_depth_topic):
+        get_gd_depth_topic.return_value = 10
+
+        self.check(1000.0)
+        self.check(1000.0 + PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_INTERVAL - 1)
+        eq_(get_gd_depth_topic.call_count, 1)
+
+        self.check(1000.0 + PUBSUB.DEFAULT.GD_DEPTH_RECOUNT_INTERVAL)
+        eq_(get_gd_depth_topic.call_count, 2)
+
+    @patch('zato.server.service.internal.pubsub.publish.get_gd_depth_topic')
+    def test_max_depth_confirmed_in_sql(self, get_gd_depth_topic):
+        get_gd_depth_topic.return_value = 10
+        self.check(1000.0)
+
+        # Locally, it looks like max depth would be exceeded but SQL says otherwise ..
+        self.topic.incr_gd_depth(90)
+        get_gd_depth_topic.return_value = 20
+
+        eq_(self.check(1000.0).current_depth, 21)
+        eq_(get_gd_depth_topic.call_count, 2)
+
+        # .. unless it really is exceeded.
+        self.topic.incr_gd_depth(80)
+        get_gd_depth_topic.return_value = 100
+        self.assertRaises(ServiceUnavailable, self.check, 1000.0)
+
+# ################################################################################################################################
+
+class PublishManyTestCase(TestCase):
+
+    def setUp(self):
+        self.topic_gd = get_topic(1, '/gd', has_gd=True)
+        self.topic_non_gd = get_topic(2, '/non-gd', has_gd=False)
+        self.topic_no_subs = get_topic(3, '/no-subs', has_gd=False)
+
+        self.pubsub = _PubSub([self.topic_gd, self.topic_non_gd, self.topic_no_subs], {
+            '/gd': [Bunch(sub_key='sk.1', sub_pattern_matched='sub=/*', endpoint_id=10)],
+            '/non-gd': [Bunch(sub_key='sk.2', sub_pattern_matched='sub=/*', endpoint_id=20)],
+        })
+
+        self.service = get_service(PublishMany)
+        self.service.pubsub = self.pubsub
+        self.service.odb = Bunch(session=_ODBSession)
+        self.service.server = Bunch(cluster_id=1, has_pubsub_audit_log=False, worker_store=Bunch(pubsub=self.pubsub))
+        self.service.response = Bunch(payload=Bunch())
+
+    def publish(self, msg_list):
+        self.service.request = Bunch(input=Bunch(msg_list=msg_list, endpoint_id=5, security_id=None, ws_channel_id=None))
+        self.service.handle()
+        return self.service.response.payload.msg_id_list
+
+    @patch('zato.server.service.internal.pubsub.publish.get_gd_depth_topic')
+    @patch('zato.server.service.internal.pubsub.publish.sql_publish_many_with_retry')
+    def test_publish_many(self, sql_publish_many_with_retry, get_gd_depth_topic):
+        get_gd_depth_topic.return_value = 0
+
+        msg_id_list = self.publish([
+            {'topic_name': '/gd', 'data': 'a', 'msg_id': 'm1'},
+            {'topic_name': '/non-gd', 'data': 'b', 'msg_id': 'm2'},
+            {'topic_name': '/no-subs', 'data': 'c', 'msg_id': 'm3'},
+            {'topic_name': '/gd', 'data': 'd', 'msg_id': 'm4', 'has_gd': False},
+            {'topic_name': '/non-gd', 'data': 'e', 'msg_id': 'm5', 'has_gd': True},
+            {'topic_name': '/gd', 'data': 'f', 'msg_id': 'm6'},
+        ])
+
+        # Message IDs are returned in the same order that messages were given in ..
+        eq_(msg_id_list, ['m1', 'm2', 'm3', 'm4', 'm5', 'm6'])
+
+        # .. while GD messages of all the topics are stored in SQL in one call, grouped by topic in the order of their
+        # first appearance on input. Non-GD messages to a topic without subscribers are turned into GD ones.
+        eq_(sql_publish_many_with_retry.call_count, 1)
+
+        topic_msg_list = sql_publish_many_with_retry.call_args[0][3]
+        eq_([(topic_id, [msg['pub_msg_id'] for msg in gd_msg_list]) for topic_id, _, gd_msg_list in topic_msg_list], [
+            (1, ['m1', 'm6']),
+            (2, ['m5']),
+            (3, ['m3']),
+        ])
+        eq_(sorted(self.pubsub.sync_has_gd_msg), [1, 2, 3])
+
+        # Non-GD messages go to the in-RAM backlog for their topic's subscribers
+        eq_(self.pubsub.in_ram, [
+            ('/gd', ['sk.1'], ['m4']),
+            ('/non-gd', ['sk.2'], ['m2']),
+        ])
+
+    @patch('zato.server.service.internal.pubsub.publish.sql_publish_many_with_retry')
+    def test_publish_many_non_gd_only(self, sql_publish_many_with_retry):
+
+        msg_id_list = self.publish([
+            {'topic_name': '/non-gd', 'data': 'a', 'msg_id': 'm1'},
+            {'topic_name': '/non-gd', 'data': 'b', 'msg_id': 'm2'},
+        ])
+
+        eq_(msg_id_list, ['m1', 'm2'])
+        eq_(self.pubsub.in_ram, [('/non-gd', ['sk.2'], ['m1', 'm2'])])
+
+        # No SQL transaction without GD messages
+        eq_(sql_publish_many_with_retry.call_count, 0)
+
+    @patch('zato.server.service.internal.pubsub.publish.get_gd_depth_topic')
+    @patch('zato.server.service.internal.pubsub.publish.sql_publish_many_with_retry')
+    def test_publish_many_max_depth(self, sql_publish_many_with_retry, get_gd_depth_topic):
+
+        # One of the topics is full so nothing is published, including messages to other topics
+        get_gd_depth_topic.side_effect = lambda session, cluster_id, topic_id: 100 if topic_id == 3 else 0
+
+        self.assertRaises(ServiceUnavailable, self.publish, [
+            {'topic_name': '/gd', 'data': 'a'},
+            {'topic_name': '/no-subs', 'data': 'b'},
+        ])
+
+        eq_(sql_publish_many_with_retry.call_count, 0)
+        eq_(self.pubsub.sync_has_gd_msg, [])
+        eq_(self.pubsub.in_ram, [])
+
+    def test_publish_many_no_topic_name(self):
+        self.assertRaises(BadRequest, self.publish, [{'data': 'a'}])
+
+# ################################################################################################################################
+
+class PubSubPublishManyTestCase(TestCase):
+
+    def test_publish_many(self):
+        pubsub = PubSub.__new__(PubSub)
+        pubsub.server = Mock(default_internal_pubsub_endpoint_id=5)
+        pubsub.server.invoke.return_value = Bunch(response={'msg_id_list': ['m1', 'm2']})
+
+        msg_list = [{'topic_name': '/a', 'data': 'a'}, {'topic_name': '/b', 'data': 'b'}]
+
+        # The internal endpoint is used by default ..
+        eq_(pubsub.publish_many(msg_list), ['m1', 'm2'])
+        eq_(pubsub.server.invoke.call_args[0], ('zato.pubsub.publish.publish-many', {'msg_list': msg_list, 'endpoint_id': 5}))
+
+        # .. unless a specific one is given.
+        pubsub.publish_many(msg_list, 7)
+        eq_(pubsub.server.invoke.call_args[0][1]['endpoint_id'], 7)
+
+# ################################################################################################################################
+
+class PublishManyServiceTestCase(TestCase):
+
+    def get_service(self, msg_list, content_type='application/x-www-form-urlencoded'):
+        service = get_service(PublishManyService)
+        service._pubsub_check_credentials = lambda: 5
+        service.wsgi_environ = {'CONTENT_TYPE': content_type}
+        service.request = Bunch(input=Bunch(msg_list=msg_list))
+        service.response = Bunch(payload=Bunch())
+        service.pubsub = Mock()
+        service.pubsub.publish_many.return_value = ['m1', 'm2']
+
+        return service
+
+    def test_handle_POST(self):
+        service = self.get_service([
+            {'topic_name': '/a', 'data': 'a'},
+            {'topic_name': '/b', 'data': 'b', 'mime_type': 'text/xml'},
+        ])
+        service.handle_POST()
+
+        eq_(service.response.payload.msg_id_list, ['m1', 'm2'])
+        eq_(service.pubsub.publish_many.call_args[0], ([
+            {'topic_name': '/a', 'data': 'a', 'mime_type': 'application/json'},
+            {'topic_name': '/b', 'data': 'b', 'mime_type': 'text/xml'},
+        ], 5))
+
+    def test_handle_POST_invalid_input(self):
+        self.assertRaises(BadRequest, self.get_service([]).handle_POST)
+        self.assertRaises(BadRequest, self.get_service([{'topic_name': '/a'}]).handle_POST)
+
+# ################################################################################################################################
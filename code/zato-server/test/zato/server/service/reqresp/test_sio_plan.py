@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import loads
+from logging import getLogger
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import DATA_FORMAT, PARAMS_PRIORITY, ParsingException, ZatoException
+from zato.server.service.reqresp import Request, Response
+from zato.server.service.reqresp.sio import AsIs, Boolean, compile_sio, CSV, get_sio_plan, Integer, List, Opaque
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# The same as in a default simple-io.conf file
+simple_io_config = {
+    'int_parameters': ['id'],
+    'int_parameter_suffixes': ['_count', '_id', '_size', '_timeout'],
+    'bool_parameter_prefixes': ['by_', 'has_', 'is_', 'may_', 'needs_', 'should_'],
+}
+
+# ################################################################################################################################
+
+class _SIO(object):
+    input_required = ('name', 'user_id', 'is_active', Integer('count'), 'password')
+    input_optional = ('opt', 'opt_id', Boolean('flag'), CSV('tags'), List('items'), AsIs('raw_id'), Opaque('extra'),
+        Integer('limit', default=10))
+    output_required = ('name', 'user_id', 'is_active')
+    output_optional = ('opt', 'opt_id', Boolean('flag'), CSV('tags'), AsIs('raw_id'), Integer('limit', default=10))
+
+# ################################################################################################################################
+
+class SIOPlanTestCase(TestCase):
+
+    def get_request(self, payload, channel_params=None, params_priority=PARAMS_PRIORITY.MSG_OVER_CHANNEL_PARAMS):
+        request = Request(logger)
+        request.simple_io_config = simple_io_config
+        request.payload = request.raw_request = payload
+        request.channel_params.update(channel_params or {})
+        request.params_priority = params_priority
+        return request
+
+    def get_expected_input(self, request, data_format=DATA_FORMAT.JSON):
+        """ Returns input the way it is produced by visiting each element separately, i.e. without an input plan.
+        """
+        request.data_format = data_format
+        request.has_simple_io_config = True
+        request.bool_parameter_prefixes = simple_io_config['bool_parameter_prefixes']
+        request.int_parameters = simple_io_config['int_parameters']
+        request.int_parameter_suffixes = simple_io_config['int_parameter_suffixes']
+
+        expected = {}
+        expected.update(request.get_params(_SIO.input_required, False, 'request'))
+        expected.update(request.get_params(_SIO.input_optional, False, 'request', is_required=False))
+
+        for name, value in request.channel_params.items():
+            expected.setdefault(name, value)
+
+        return expected
+
+    def get_response(self, payload, data_format=DATA_FORMAT.JSON, skip_empty_keys=False):
+        sio = type(str('SIO'), (_SIO,), {'skip_empty_keys': skip_empty_keys, 'force_empty_keys': ['opt']})
+        response = Response(logger, simple_io_config=simple_io_config)
+        response.init('abc', sio, data_format)
+
+        if isinstance(payload, list):
+            response.payload[:] = payload
+        else:
+            response.payload = payload
+
+        return response.payload.getvalue()
+
+# ################################################################################################################################
+
+    def test_input_same_as_elem_by_elem(self):
+
+        payloads = [
+            {'name':'a', 'user_id':'123', 'is_active':'true', 'count':'5', 'password':'secret'},
+            {'name':b'\xc5\xbc', 'user_id':'', 'is_active':'', 'count':'', 'password':'', 'opt':'', 'opt_id':'', 'flag':'',
+             'tags':'a,b', 'items':'x', 'raw_id':'0001', 'extra':{'a':1}},
+            {'name':1, 'user_id':123, 'is_active':False, 'count':5, 'password':'ZATO_NONE', 'opt':None, 'opt_id':None,
+             'flag':'off', 'tags':'', 'items':['x', 'y'], 'limit':'', 'raw_id':None},
+        ]
+
+        for payload in payloads:
+            for channel_params in ({}, {'opt':'from-channel', 'other':'x'}, {'user_id':'456', 'is_active':'false'}):
+                for params_priority in PARAMS_PRIORITY:
+
+                    request = self.get_request(payload, channel_params, params_priority)
+                    request.init(True, 'abc', _SIO, DATA_FORMAT.JSON, None, {}, lambda value: 'enc-' + value)
+
+                    expected_request = self.get_request(payload, channel_params, params_priority)
+                    expected_request.encrypt_func = lambda value: 'enc-' + value
+
+                    self.assertDictEqual(request.input, self.get_expected_input(expected_request))
+
+# ################################################################################################################################
+
+    def test_input_errors(self):
+
+        # Missing required element
+        request = self.get_request({'name':'a'})
+        self.assertRaises(ParsingException, request.init, True, 'abc', _SIO, DATA_FORMAT.JSON, None, {}, None)
+
+        # Invalid value of an integer
+        request = self.get_request({'name':'a', 'user_id':'abc', 'is_active':'1', 'count':'1', 'password':'1'})
+        self.assertRaises(ParsingException, request.init, True, 'abc', _SIO, DATA_FORMAT.JSON, None, {}, None)
+
+        # Required element given in channel params only
+        request = self.get_request({'name':'a', 'is_active':'1', 'count':'1', 'password':'1'}, {'user_id':'456'})
+        request.init(True, 'abc', _SIO, DATA_FORMAT.JSON, None, {}, None)
+        self.assertEquals(request.input.user_id, 456)
+
+        request = self.get_request('')
+        self.assertRaises(ZatoException, request.init, True, 'abc', _SIO, DATA_FORMAT.JSON, None, {}, None)
+
+# ################################################################################################################################
+
+    def test_output_flat(self):
+
+        response = loads(self.get_response({'name':'a', 'user_id':'123', 'is_active':'1', 'opt_id':'', 'flag':'',
+            'tags':['a', 'b'], 'raw_id':'0001', 'limit':'5'}))
+
+        self.assertDictEqual(response, {'response': {'name':'a', 'user_id':123, 'is_active':True, 'opt':'', 'opt_id':None,
+            'flag':'', 'tags':'a,b', 'raw_id':'0001', 'limit':5}})
+
+        # Empty values are skipped, unless they are in force_empty_keys
+        response = loads(self.get_response({'name':'a', 'user_id':'123', 'is_active':'1'}, skip_empty_keys=True))
+        self.assertDictEqual(response, {'response': {'name':'a', 'user_id':123, 'is_active':True, 'opt':''}})
+
+# ################################################################################################################################
+
+    def test_output_list(self):
+
+        items = [
+            {'name':'a', 'user_id':'1', 'is_active':'0'},
+            Bunch(name='b', user_id='2', is_active='1', opt='c', limit=3),
+        ]
+        response = loads(self.get_response(items, skip_empty_keys=True))
+
+        self.assertListEqual(response['response'], [
+            {'name':'a', 'user_id':1, 'is_active':False, 'opt':''},
+            {'name':'b', 'user_id':2, 'is_active':True, 'opt':'c', 'limit':3},
+        ])
+
+        # Required element missing
+        self.assertRaises(ZatoException, self.get_response, [{'name':'a', 'user_id':''}])
+
+# ################################################################################################################################
+
+    def test_output_xml(self):
+
+        response = self.get_response([{'name':'a', 'user_id':'1', 'is_active':'0'}], DATA_FORMAT.XML, skip_empty_keys=True)
+
+        self.assertIn(b'<item_list><item><name>a</name><user_id>1</user_id><is_active>false</is_active><opt></opt></item>'
+            b'</item_list>', response)
+
+# ################################################################################################################################
+
+    def test_plan_per_class_and_config(self):
+
+        class MyService(object):
+            SimpleIO = _SIO
+
+        class MyOtherService(MyService):
+            pass
+
+        plan = get_sio_plan(MyService, simple_io_config)
+        self.assertIs(get_sio_plan(MyService, simple_io_config), plan)
+        self.assertIsNot(get_sio_plan(MyOtherService, simple_io_config), plan)
+
+        # A new configuration means that elements may need to be converted differently
+        new_plan = get_sio_plan(MyService, dict(simple_io_config, int_parameters=[]))
+        self.assertIsNot(new_plan, plan)
+        self.assertIs(get_sio_plan(MyService, new_plan.simple_io_config), new_plan)
+
+        self.assertEquals([elem.name for elem in compile_sio(_SIO, None).input.required], list(_SIO.input_required[:3]) +
+            ['count', 'password'])
+
+# ################################################################################################################################
@@ -447,3 +447,67 @@ class SelfOutgoingSelfOut(ServiceTestCase):
         """
         instance = self.invoke(InputLogger, {}, {})
         self.assertIs(instance.outgoing, instance.out)
+
+# ################################################################################################################################
+
+class LazyFacadesTestCase(TestCase):
+
+    def setUp(self):
+
+        class MyService(Service):
+            pass
+
+        MyService.component_enabled_msg_path = True
+        self.MyService = MyService
+
+    def test_out_built_on_first_use(self):
+        instance = self.MyService()
+        self.assertIsNone(instance._out)
+
+        out = instance.out
+
+        self.assertIs(instance.out, out)
+        self.assertIs(instance.outgoing, out)
+        self.assertIs(out.ibm_mq.service, instance)
+
+    def test_out_shared_facades(self):
+        instance1 = self.MyService()
+        instance2 = self.MyService()
+
+        self.assertIsNot(instance1.out, instance2.out)
+        self.assertIsNot(instance1.out.ibm_mq, instance2.out.ibm_mq)
+
+        # These do not depend on a particular service instance so they are built once
+        self.assertIs(instance1.out.zmq, instance2.out.zmq)
+        self.assertIs(instance1.out.sms, instance2.out.sms)
+
+    def test_out_set(self):
+        instance = self.MyService()
+        out = object()
+
+        instance.out = out
+        self.assertIs(instance.out, out)
+        self.assertIs(instance.outgoing, out)
+
+    def test_msg_patterns_built_on_first_use(self):
+        instance = self.MyService()
+        instance.request.payload = {'a': 'b'}
+
+        self.assertIsNone(instance._msg)
+        self.assertIsNone(instance._patterns)
+
+        msg = instance.msg
+        patterns = instance.patterns
+
+        self.assertIs(instance.msg, msg)
+        self.assertIs(instance.patterns, patterns)
+        self.assertIs(msg._payload, instance.request.payload)
+        self.assertIs(patterns.fanout.source, instance)
+
+    def test_msg_patterns_disabled(self):
+        instance = self.MyService()
+        instance.component_enabled_msg_path = False
+        instance.component_enabled_patterns = False
+
+        self.assertIsNone(instance.msg)
+        self.assertIsNone(instance.patterns)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from imp import new_module
+from tempfile import NamedTemporaryFile
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.server.service import Service
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+
+class _ODB(object):
+    def __init__(self, skip_names=()):
+        self.skip_names = skip_names
+        self.calls = []
+
+    def add_services(self, items, deployment_time):
+        self.calls.append(items)
+
+        out = {}
+        for idx, item in enumerate(items, 1):
+            if item.name not in self.skip_names:
+                out[item.name] = (item.service_info['id'] if item.service_info else idx, True, 123)
+
+        return out
+
+# ################################################################################################################################
+
+class ServiceStoreDeployTestCase(TestCase):
+
+    def get_module(self, name, service_count):
+
+        source_file = NamedTemporaryFile(suffix='.py')
+        source_file.write(b'# Source of {}'.format(name))
+        source_file.flush()
+        self.addCleanup(source_file.close)
+
+        mod = new_module(name)
+        mod.__file__ = source_file.name
+
+        for idx in range(service_count):
+            class_name = 'MyService{}'.format(idx)
+            class_ = type(str(class_name), (Service,), {'name': '{}.{}'.format(name, idx), '__module__': name})
+            setattr(mod, class_name, class_)
+
+        return mod
+
+    def get_store(self, odb):
+        store = ServiceStore({}, odb=odb, server=Bunch(is_sso_enabled=True))
+        store.patterns_matcher.special_case = True
+        return store
+
+    @patch('zato.server.service.store.set_up_class_attributes')
+    def test_deploy_in_bulk(self, ignored_set_up_class_attributes):
+
+        odb = _ODB(skip_names=['my.mod2.1'])
+        store = self.get_store(odb)
+
+        mod1 = self.get_module('my.mod1', 3)
+        mod2 = self.get_module('my.mod2', 2)
+
+        get_source_code_info = store._get_source_code_info
+        source_code_mods = []
+
+        def _get_source_code_info(mod):
+            source_code_mods.append(mod)
+            return get_source_code_info(mod)
+
+        store._get_source_code_info = _get_source_code_info
+
+        to_process = store._collect_from_module(mod1, False, mod1.__file__)
+        to_process.extend(store._collect_from_module(mod2, False, mod2.__file__))
+
+        deployed = store._visit_class_list(to_process)
+
+        # Each module was read only once and all services went to the ODB in one call
+        eq_(source_code_mods, [mod1, mod2])
+        eq_(len(odb.calls), 1)
+        eq_(sorted(item.name for item in odb.calls[0]), ['my.mod1.0', 'my.mod1.1', 'my.mod1.2', 'my.mod2.0', 'my.mod2.1'])
+        eq_(odb.calls[0][0].source_info.source, b'# Source of my.mod1')
+        self.assertIs(odb.calls[0][0].source_info, odb.calls[0][2].source_info)
+
+        # A service that could not be added to the ODB is not deployed
+        eq_(sorted(class_.get_name() for class_ in deployed), ['my.mod1.0', 'my.mod1.1', 'my.mod1.2', 'my.mod2.0'])
+        eq_(sorted(store.name_to_impl_name), ['my.mod1.0', 'my.mod1.1', 'my.mod1.2', 'my.mod2.0'])
+        eq_(len(store.services), 4)
+
+        for impl_name, service_id in store.impl_name_to_id.items():
+            eq_(store.id_to_impl_name[service_id], impl_name)
+            eq_(store.services[impl_name]['slow_threshold'], 123)
+
+    @patch('zato.server.service.store.set_up_class_attributes')
+    def test_nothing_to_deploy(self, ignored_set_up_class_attributes):
+
+        odb = _ODB()
+        store = self.get_store(odb)
+
+        eq_(store._visit_module(self.get_module('my.mod3', 0), False, None), [])
+        eq_(odb.calls, [])
+
+# ################################################################################################################################
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from thread import get_ident
+from time import sleep as native_sleep
+from unittest import TestCase
+
+# gevent
+from gevent import sleep, spawn
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# passlib
+from passlib.crypto import digest as passlib_digest
+
+# Zato
+from zato.common.exception import ServiceUnavailable
+from zato.server.hash_pool import has_native_pbkdf2, HashPool
+
+# ################################################################################################################################
+
+class HashPoolTestCase(TestCase):
+
+    def test_run_inline(self):
+        pool = HashPool(0, 0)
+        eq_(pool.run(get_ident), get_ident())
+        eq_(pool.get_stats()['size'], 0)
+
+    def test_run_in_thread(self):
+        pool = HashPool(2, 10)
+
+        eq_(pool.run(lambda a, b: a + b, 1, 2), 3)
+        self.assertNotEqual(pool.run(get_ident), get_ident())
+
+        # Exceptions are propagated to the calling greenlet
+        self.assertRaises(ValueError, pool.run, int, 'abc')
+
+        stats = pool.get_stats()
+        eq_(stats['in_flight'], 0)
+        eq_(sorted(key for key in stats if key.startswith('wait_')), ['wait_p50', 'wait_p90', 'wait_p99'])
+
+    def test_other_greenlets_keep_running(self):
+        pool = HashPool(1, 10)
+        ticks = []
+
+        def tick():
+            for x in range(5):
+                ticks.append(x)
+                sleep(0.01)
+
+        g = spawn(tick)
+
+        # Blocks the native thread, yet the greenlet above can still run
+        pool.run(native_sleep, 0.2)
+        eq_(ticks, [0, 1, 2, 3, 4])
+        g.join()
+
+    def test_queue_is_bounded(self):
+        pool = HashPool(1, 1)
+
+        # One is being computed and one is queued, there is no room for more
+        greenlets = [spawn(pool.run, native_sleep, 0.1) for x in range(2)]
+        sleep(0)
+
+        self.assertRaises(ServiceUnavailable, pool.run, native_sleep, 0)
+        eq_(pool.get_stats()['rejected'], 1)
+
+        for g in greenlets:
+            g.join()
+
+        eq_(pool.get_stats()['in_flight'], 0)
+        eq_(pool.run(lambda: 123), 123)
+
+    def test_has_native_pbkdf2(self):
+        with patch.object(passlib_digest, 'PBKDF2_BACKENDS', ['hashlib-ssl', 'builtin'], create=True):
+            eq_(has_native_pbkdf2(), True)
+
+        with patch.object(passlib_digest, 'PBKDF2_BACKENDS', ['builtin'], create=True):
+            eq_(has_native_pbkdf2(), False)
+
+    def test_warns_without_native_pbkdf2(self):
+        with patch('zato.server.hash_pool.has_native_pbkdf2', return_value=False):
+            with patch('zato.server.hash_pool.logger') as logger:
+
+                # Nothing to warn about if hashing is not offloaded to threads at all ..
+                HashPool(0, 0)
+                eq_(logger.warn.call_count, 0)
+
+                # .. but if it is, it will not help other greenlets.
+                HashPool(1, 0)
+                eq_(logger.warn.call_count, 1)
+
+# ################################################################################################################################
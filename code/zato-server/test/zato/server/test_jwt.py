@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Cryptography
+from cryptography.fernet import Fernet
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.server.jwt import JWT
+
+# ################################################################################################################################
+
+class _Cache(object):
+    """ Stands in for RobustCache, keeping track of calls made to it.
+    """
+    def __init__(self):
+        self.data = {}
+        self.get_calls = 0
+        self.put_calls = []
+        self.renew_many_calls = []
+
+    def get(self, key):
+        self.get_calls += 1
+        return self.data.get(key)
+
+    def put(self, key, value, ttl=None, async=True):
+        self.put_calls.append(key)
+        self.data[key] = value
+
+    def renew_many(self, renewals):
+        self.renew_many_calls.append(renewals)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+# ################################################################################################################################
+
+class JWTTestCase(TestCase):
+
+    def get_jwt(self, verified_cache_ttl=30, renew_interval=0.01):
+        backend = JWT(None, None, Fernet.generate_key(), verified_cache_ttl, renew_interval)
+        backend.cache = _Cache()
+        return backend
+
+    def get_token(self, backend, username='user1', ttl=60):
+        token = backend._create_token(username=username, ttl=ttl)
+        backend.cache.data[token] = token
+        return token
+
+# ################################################################################################################################
+
+    def test_verified_token_not_looked_up_again(self):
+        backend = self.get_jwt()
+        token = self.get_token(backend)
+
+        for _ in range(3):
+            result = backend.validate('user1', token)
+            self.assertTrue(result.valid)
+            self.assertEquals(result.token.username, 'user1')
+
+        self.assertEquals(backend.cache.get_calls, 1)
+        self.assertFalse(backend.validate('user2', token).valid)
+
+# ################################################################################################################################
+
+    def test_verified_cache_disabled(self):
+        backend = self.get_jwt(verified_cache_ttl=0, renew_interval=0)
+        token = self.get_token(backend)
+
+        for _ in range(3):
+            self.assertTrue(backend.validate('user1', token).valid)
+
+        self.assertEquals(backend.cache.get_calls, 3)
+        self.assertEquals(backend.cache.put_calls, [token] * 3)
+
+# ################################################################################################################################
+
+    def test_verified_token_expired(self):
+        backend = self.get_jwt(verified_cache_ttl=1)
+        token = self.get_token(backend)
+
+        self.assertTrue(backend.validate('user1', token, _time=lambda: 1000).valid)
+        self.assertTrue(backend.validate('user1', token, _time=lambda: 1000.5).valid)
+        self.assertEquals(backend.cache.get_calls, 1)
+
+        # Expired locally and no longer in KVDB either
+        del backend.cache.data[token]
+        self.assertFalse(backend.validate('user1', token, _time=lambda: 1001).valid)
+        self.assertEquals(backend.cache.get_calls, 2)
+
+# ################################################################################################################################
+
+    def test_renewals_coalesced(self):
+        backend = self.get_jwt()
+        token1 = self.get_token(backend, ttl=60)
+        token2 = self.get_token(backend, ttl=120)
+
+        for _ in range(5):
+            backend.validate('user1', token1)
+            backend.validate('user1', token2)
+
+        self.assertEquals(backend.cache.renew_many_calls, [])
+        sleep(0.05)
+
+        self.assertEquals(backend.cache.put_calls, [])
+        self.assertEquals(backend.cache.renew_many_calls, [{token1:60, token2:120}])
+
+# ################################################################################################################################
+
+    def test_invalidate(self):
+        backend = self.get_jwt()
+        token = self.get_token(backend)
+
+        self.assertTrue(backend.validate('user1', token).valid)
+
+        # Deleted in another worker - KVDB is not consulted until the token is invalidated locally
+        del backend.cache.data[token]
+        self.assertTrue(backend.validate('user1', token).valid)
+
+        backend.invalidate(token)
+        self.assertFalse(backend.validate('user1', token).valid)
+
+        # No renewal of a token already deleted
+        sleep(0.05)
+        self.assertEquals(backend.cache.renew_many_calls, [])
+
+# ################################################################################################################################
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+from gevent.event import Event
+from gevent.lock import RLock
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.util.event import EventLog
+from zato.server.pubsub import InRAMSyncBacklog, PubSub, Topic
+
+# ################################################################################################################################
+
+def get_topic(id, name, task_sync_interval=0):
+    return Topic(Bunch(id=id, name=name, is_active=True, is_internal=False, max_depth_gd=100, max_depth_non_gd=100,
+        has_gd=False, depth_check_freq=1, pub_buffer_size_gd=0, task_delivery_interval=2000, meta_store_frequency=1,
+        task_sync_interval=task_sync_interval), 'server1', 123)
+
+# ################################################################################################################################
+
+class InRAMSyncBacklogTestCase(TestCase):
+
+    def setUp(self):
+        self.pubsub = Bunch(server=Bunch(name='server1', pid=123), get_endpoint_by_id=lambda endpoint_id: Bunch(name='ep1'))
+
+        # The cleanup task is not started, expired messages are deleted by tests directly
+        with patch('zato.server.pubsub.spawn_greenlet'):
+            self.backlog = InRAMSyncBacklog(self.pubsub)
+
+    def add_messages(self, *expiration_times):
+        messages = []
+
+        for expiration_time in expiration_times:
+            messages.append({
+                'pub_msg_id': 'msg.{}'.format(len(self.backlog.msg_id_to_msg) + len(messages)),
+                'expiration_time': expiration_time,
+                'expiration': 1000,
+                'published_by_id': 1,
+                'topic_id': 1,
+                'topic_name': '/my/topic',
+                'pub_time': 0,
+            })
+
+        self.backlog.add_messages('cid1', 1, '/my/topic', 100000, ['sk.1'], messages)
+
+        return [msg['pub_msg_id'] for msg in messages]
+
+# ################################################################################################################################
+
+    def test_delete_expired_limit(self):
+        self.add_messages(10, 11, 12, 13, 14, 1000)
+
+        # Only messages that are due are deleted, up to limit at a time, with has_more indicating if there may be more of them
+        eq_(self.backlog._delete_expired(100, 2), (2, True))
+        eq_(self.backlog._delete_expired(100, 2), (2, True))
+        eq_(self.backlog._delete_expired(100, 2), (1, False))
+        eq_(self.backlog._delete_expired(100, 2), (0, False))
+
+        eq_(list(self.backlog.msg_id_to_msg), ['msg.5'])
+        eq_(self.backlog.topic_msg_id[1], set(['msg.5']))
+        eq_(self.backlog.sub_key_to_msg_id['sk.1'], set(['msg.5']))
+
+    def test_delete_expired_in_order(self):
+        msg_ids = self.add_messages(30, 10, 20)
+
+        eq_(self.backlog._delete_expired(100, 1), (1, True))
+        eq_(sorted(self.backlog.msg_id_to_msg), [msg_ids[0], msg_ids[2]])
+
+        eq_(self.backlog._delete_expired(100, 1), (1, True))
+        eq_(list(self.backlog.msg_id_to_msg), [msg_ids[0]])
+
+    def test_delete_expired_skips_delivered(self):
+        msg_ids = self.add_messages(10, 20)
+
+        # Delivered in the meantime, its entry is still in the heap
+        self.backlog.delete_msg_by_id(msg_ids[0])
+        eq_(len(self.backlog.expiry_heap), 2)
+
+        # The stale entry is skipped rather than counted as an expired message
+        eq_(self.backlog._delete_expired(100, 10), (1, False))
+        eq_(self.backlog.msg_id_to_msg, {})
+        eq_(self.backlog.expiry_heap, [])
+
+    def test_delete_expired_skips_extended(self):
+        msg_id = self.add_messages(10)[0]
+
+        # Its expiration time is extended, which adds another entry to the heap
+        msg = dict(self.backlog.msg_id_to_msg[msg_id], msg_id=msg_id, data='', size=0, priority=5, pub_correl_id=None,
+            in_reply_to=None, mime_type=None, expiration_time=50)
+        self.backlog.update_msg(msg)
+        eq_(len(self.backlog.expiry_heap), 2)
+
+        # The entry for the original expiration time is skipped ..
+        eq_(self.backlog._delete_expired(20, 10), (0, False))
+        eq_(list(self.backlog.msg_id_to_msg), [msg_id])
+        eq_(self.backlog.expiry_heap, [(50, msg_id)])
+
+        # .. and the message expires at the new time.
+        eq_(self.backlog._delete_expired(50, 10), (1, False))
+        eq_(self.backlog.msg_id_to_msg, {})
+
+    def test_delete_expired_compacts_heap(self):
+        msg_ids = self.add_messages(*range(1000, 2100))
+
+        # Most of the messages are delivered before they expire ..
+        self.backlog.delete_messages(msg_ids[:1000])
+        eq_(len(self.backlog.expiry_heap), 1100)
+
+        # .. so entries for them are removed from the heap even though none of them is due yet.
+        eq_(self.backlog._delete_expired(10, 10), (0, False))
+        eq_(sorted(self.backlog.expiry_heap), [(1000 + idx, msg_ids[idx]) for idx in range(1000, 1100)])
+
+        # A heap that is not big enough is not compacted
+        self.backlog.delete_messages(msg_ids[1000:1090])
+        eq_(self.backlog._delete_expired(10, 10), (0, False))
+        eq_(len(self.backlog.expiry_heap), 100)
+
+# ################################################################################################################################
+
+class NotifyPubSubTasksTestCase(TestCase):
+
+    def setUp(self):
+        self.invoked = []
+
+        # Not going through __init__ because it expects a fully configured server
+        self.pubsub = pubsub = PubSub.__new__(PubSub)
+        pubsub.lock = RLock()
+        pubsub.keep_running = True
+        pubsub.sync_ready_topic_ids = set()
+        pubsub.sync_ready_event = Event()
+        pubsub.sync_batch_window = 0.01
+        pubsub.event_log = EventLog('test')
+        pubsub.topics = dict((topic.id, topic) for topic in [
+            get_topic(1, '/t1'), get_topic(2, '/t2'), get_topic(3, '/t3'), get_topic(4, '/t4', task_sync_interval=60000)])
+
+        pubsub.invoke_service = lambda name, request: self.invoked.append(request['topic_name'])
+        pubsub.get_subscriptions_by_topic = lambda topic_name: [Bunch(sub_key='sk{}'.format(topic_name))]
+        pubsub.get_delivery_server_by_sub_key = lambda sub_key: True
+        pubsub.sync_backlog = Bunch(_get_delete_messages_by_sub_keys=lambda topic_id, sub_keys: [])
+
+        greenlet = spawn(pubsub.trigger_notify_pubsub_tasks)
+        self.addCleanup(greenlet.kill)
+
+    def test_only_ready_topics_notified(self):
+        topics = self.pubsub.topics
+
+        # Nothing is published yet so there is nothing to notify tasks of
+        sleep(0.05)
+        eq_(self.invoked, [])
+
+        # This topic has a message but it was not marked as ready, which means that it will not be visited ..
+        topics[2].sync_has_gd_msg = True
+
+        # .. unlike these ones, although the last one's task sync interval does not let it be synced yet.
+        for topic_id in 1, 3, 4:
+            self.pubsub.set_sync_has_msg(topic_id, True, True, 'test', 0)
+
+        eq_(self.pubsub.sync_ready_topic_ids, set([1, 3, 4]))
+        sleep(0.1)
+
+        eq_(sorted(self.invoked), ['/t1', '/t3'])
+
+        # Topics that were synced are removed from the ready set and have their flags reset ..
+        eq_(self.pubsub.sync_ready_topic_ids, set([4]))
+        eq_(topics[1].sync_has_gd_msg, False)
+        eq_(topics[3].sync_has_gd_msg, False)
+
+        # .. while the others are left as they were.
+        eq_(topics[2].sync_has_gd_msg, True)
+        eq_(topics[4].sync_has_gd_msg, True)
+
+        # Another message marks a topic as ready again
+        self.pubsub.set_sync_has_msg(1, False, True, 'test', None)
+        sleep(0.1)
+
+        eq_(sorted(self.invoked), ['/t1', '/t1', '/t3'])
+        eq_(self.pubsub.sync_ready_topic_ids, set([4]))
+
+# ################################################################################################################################
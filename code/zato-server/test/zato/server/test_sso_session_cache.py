@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.broker_message import SSO as BROKER_MSG_SSO
+from zato.sso.session import SessionAPI, SessionCache
+
+# ################################################################################################################################
+
+# Stands in for rows returned by SQL queries
+SessionRow = namedtuple('SessionRow', ['ust', 'user_id', 'expiration_time'])
+
+# ################################################################################################################################
+
+class _ODBSession(object):
+    """ Stands in for an SQL session, keeping track of statements executed.
+    """
+    def __init__(self, executed, fail, on_execute):
+        self.executed = executed
+        self.fail = fail
+        self.on_execute = on_execute
+
+    def execute(self, statement, params):
+        if self.on_execute:
+            self.on_execute()
+        if self.fail:
+            raise Exception('Cannot connect to SQL')
+        self.executed.append(params)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class SessionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2019, 1, 1)
+        self.executed = []
+        self.fail = False
+        self.on_execute = None
+
+        patcher = patch('zato.sso.session.spawn_later')
+        self.spawn_later = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_cache(self, ttl=10, max_size=100, flush_interval=2):
+        cache = SessionCache(ttl, max_size, flush_interval)
+        cache.odb_session_func = lambda: _ODBSession(self.executed, self.fail, self.on_execute)
+        return cache
+
+    def get_row(self, ust, user_id='user1', expires_in=3600):
+        return SessionRow(ust, user_id, self.now + timedelta(seconds=expires_in))
+
+# ################################################################################################################################
+
+    def test_get_ttl(self):
+        cache = self.get_cache(ttl=10)
+        info = cache.set('ust1', self.get_row('ust1'), self.now)
+
+        eq_(cache.get('ust1', self.now + timedelta(seconds=9)), info)
+
+        # Cached for too long already
+        eq_(cache.get('ust1', self.now + timedelta(seconds=10)), None)
+        self.assertNotIn('ust1', cache.sessions)
+
+    def test_get_session_expired(self):
+        cache = self.get_cache(ttl=10)
+        cache.set('ust1', self.get_row('ust1', expires_in=5), self.now)
+
+        eq_(cache.get('ust1', self.now + timedelta(seconds=4)).ust, 'ust1')
+
+        # Still within TTL but the session itself has expired
+        eq_(cache.get('ust1', self.now + timedelta(seconds=5)), None)
+        self.assertNotIn('ust1', cache.sessions)
+
+    def test_get_missing(self):
+        cache = self.get_cache()
+        eq_(cache.get('ust1', self.now), None)
+
+    def test_disabled(self):
+        cache = self.get_cache(ttl=0)
+        row = self.get_row('ust1')
+
+        # Returned as it was given on input and not cached
+        self.assertIs(cache.set('ust1', row, self.now), row)
+        eq_(cache.get('ust1', self.now), None)
+
+    def test_max_size(self):
+        cache = self.get_cache(max_size=2)
+
+        for ust in 'ust1', 'ust2', 'ust3':
+            cache.set(ust, self.get_row(ust), self.now)
+
+        # The oldest entry was evicted
+        eq_(list(cache.sessions), ['ust2', 'ust3'])
+        eq_(cache.get('ust1', self.now), None)
+
+        # Setting an existing entry again does not evict anything
+        cache.set('ust3', self.get_row('ust3'), self.now)
+        eq_(list(cache.sessions), ['ust2', 'ust3'])
+
+# ################################################################################################################################
+
+    def test_renewals_coalesced(self):
+        cache = self.get_cache()
+        info = cache.set('ust1', self.get_row('ust1'), self.now)
+
+        for idx in range(1, 6):
+            cache.renew('ust1', self.now + timedelta(hours=idx))
+        cache.renew('ust2', self.now + timedelta(hours=1))
+
+        # The cached session was renewed immediately ..
+        eq_(info.expiration_time, self.now + timedelta(hours=5))
+
+        # .. and a single flush was scheduled for all renewals ..
+        eq_(self.spawn_later.call_count, 1)
+        eq_(self.spawn_later.call_args[0], (2, cache.flush))
+
+        # .. which saves only the latest expiration time of each session in one batch.
+        cache.flush()
+
+        eq_(len(self.executed), 1)
+        eq_(sorted(self.executed[0]), sorted([
+            {'b_ust': 'ust1', 'b_expiration_time': self.now + timedelta(hours=5)},
+            {'b_ust': 'ust2', 'b_expiration_time': self.now + timedelta(hours=1)},
+        ]))
+        eq_(cache.renewals, {})
+        eq_(cache.flush_scheduled, False)
+
+        # Nothing new to save
+        cache.flush()
+        eq_(len(self.executed), 1)
+
+    def test_flush_failure_requeued(self):
+        cache = self.get_cache()
+
+        cache.renew('ust1', self.now + timedelta(hours=1))
+        cache.renew('ust2', self.now + timedelta(hours=1))
+
+        self.fail = True
+        cache.flush()
+
+        # Renewals are kept for the next flush, which is scheduled right away
+        eq_(cache.renewals, {'ust1': self.now + timedelta(hours=1), 'ust2': self.now + timedelta(hours=1)})
+        eq_(cache.flush_scheduled, True)
+        eq_(self.spawn_later.call_count, 2)
+
+        # A session renewed again while a flush is in progress keeps its newer expiration time
+        self.on_execute = lambda: cache.renew('ust1', self.now + timedelta(hours=2))
+        cache.flush()
+        self.on_execute = None
+
+        eq_(cache.renewals, {'ust1': self.now + timedelta(hours=2), 'ust2': self.now + timedelta(hours=1)})
+
+        self.fail = False
+        cache.flush()
+
+        eq_(len(self.executed), 1)
+        eq_(cache.renewals, {})
+
+# ################################################################################################################################
+
+    def test_invalidate_by_ust(self):
+        cache = self.get_cache()
+        cache.set('ust1', self.get_row('ust1'), self.now)
+        cache.set('ust2', self.get_row('ust2'), self.now)
+        cache.renew('ust1', self.now + timedelta(hours=2))
+
+        cache.invalidate(ust='ust1')
+
+        eq_(cache.get('ust1', self.now), None)
+        eq_(cache.get('ust2', self.now).ust, 'ust2')
+        eq_(cache.renewals, {})
+
+    def test_invalidate_by_user_id(self):
+        cache = self.get_cache()
+        cache.set('ust1', self.get_row('ust1', 'user1'), self.now)
+        cache.set('ust2', self.get_row('ust2', 'user1'), self.now)
+        cache.set('ust3', self.get_row('ust3', 'user2'), self.now)
+
+        cache.invalidate(user_id='user1')
+
+        eq_(list(cache.sessions), ['ust3'])
+
+# ################################################################################################################################
+
+    def test_set_prefers_newer_renewal(self):
+        cache = self.get_cache()
+
+        # Renewed locally but not saved in SQL yet, so SQL returns an older expiration time ..
+        cache.renew('ust1', self.now + timedelta(hours=2))
+        info = cache.set('ust1', self.get_row('ust1', expires_in=3600), self.now)
+        eq_(info.expiration_time, self.now + timedelta(hours=2))
+
+        # .. unless what SQL returns is newer, e.g. because another worker renewed it.
+        info = cache.set('ust1', self.get_row('ust1', expires_in=3 * 3600), self.now)
+        eq_(info.expiration_time, self.now + timedelta(hours=3))
+
+# ################################################################################################################################
+
+class SessionAPIInvalidateTestCase(TestCase):
+
+    def test_invalidate_without_server_uses_publish_func(self):
+        published = []
+
+        api = SessionAPI(Bunch(session=Bunch()), None, None, None, None)
+        api.set_broker_publish_func(published.append)
+        api.invalidate(user_id='user1')
+
+        eq_(published, [{'action': BROKER_MSG_SSO.SESSION_INVALIDATE.value, 'ust': None, 'user_id': 'user1'}])
+
+    def test_invalidate_without_server_or_publish_func(self):
+        api = SessionAPI(Bunch(session=Bunch()), None, None, None, None)
+
+        # Nothing to publish to, only the local cache is cleared
+        api.invalidate(user_id='user1')
+
+# ################################################################################################################################
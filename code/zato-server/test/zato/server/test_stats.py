@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from random import randint, seed
+from unittest import TestCase
+
+# SciPy
+from scipy import stats as sp_stats
+
+# Zato
+from zato.common import KVDB
+from zato.server.stats import get_hist_bucket, get_hist_stats, ServiceStatsCollector
+
+# ################################################################################################################################
+
+class _Pipeline(object):
+    """ Stands in for a Redis pipeline, executing commands against a dictionary.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        self.conn.executed.append(self.commands)
+        out = []
+
+        for name, args in self.commands:
+            if name == 'incrby':
+                key, value = args
+                self.conn.data[key] = self.conn.data.get(key, 0) + value
+                out.append(self.conn.data[key])
+            elif name == 'hset':
+                key, field, value = args
+                self.conn.data.setdefault(key, {})[field] = value
+                out.append(1)
+            elif name == 'hincrby':
+                key, field, value = args
+                hash_ = self.conn.data.setdefault(key, {})
+                hash_[field] = hash_.get(field, 0) + value
+                out.append(hash_[field])
+            else:
+                out.append(True)
+
+        return out
+
+class _Conn(object):
+    def __init__(self):
+        self.data = {}
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+# ################################################################################################################################
+
+class HistogramTestCase(TestCase):
+
+    def get_hist(self, times):
+        hist = {}
+        for value in times:
+            bucket = get_hist_bucket(value)
+            hist[bucket] = hist.get(bucket, 0) + 1
+        return hist
+
+    def test_bucket(self):
+        for value in range(128):
+            self.assertEquals(get_hist_bucket(value), value)
+
+        for value in (128, 129, 1000, 12345, 10 ** 7):
+            bucket = get_hist_bucket(value)
+            self.assertLessEqual(bucket, value)
+            self.assertLess(value - bucket, value / 64.0)
+
+        self.assertEquals(get_hist_bucket(1000), get_hist_bucket(1001))
+
+    def test_stats_same_as_raw_times(self):
+        seed(10)
+
+        for mean_percentile in (0, 50, 90, 99, 100):
+            for _ in range(20):
+                times = [randint(0, 127) for _ in range(randint(1, 200))]
+                max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
+                expected = min(times), max(times), sp_stats.tmean(times, (None, max_score)), len(times)
+
+                min_, max_, mean, total = get_hist_stats(self.get_hist(times), mean_percentile)
+                self.assertEquals((min_, max_, total), (expected[0], expected[1], expected[3]))
+                self.assertAlmostEquals(mean, expected[2])
+
+    def test_stats_empty(self):
+        self.assertEquals(get_hist_stats({}, 50), (0, 0, 0, 0))
+
+# ################################################################################################################################
+
+class ServiceStatsCollectorTestCase(TestCase):
+
+    def test_flush(self):
+        conn = _Conn()
+        collector = ServiceStatsCollector(conn)
+
+        now = datetime(2019, 1, 2, 3, 4, 5)
+        later = datetime(2019, 1, 2, 3, 5, 0)
+
+        for _ in range(3):
+            collector.incr_usage('my.service')
+        collector.add_time('my.service', 10, now)
+        collector.add_time('my.service', 10, now)
+        collector.add_time('my.service', 20, later)
+
+        collector.flush()
+
+        # Everything is stored in a single pipeline
+        self.assertEquals(len(conn.executed), 1)
+
+        self.assertEquals(conn.data[KVDB.SERVICE_USAGE + 'my.service'], 3)
+        self.assertEquals(conn.data[KVDB.SERVICE_TIME_BASIC + 'my.service'], {'last': 20})
+        self.assertEquals(conn.data[KVDB.SERVICE_TIME_HISTOGRAM + 'my.service'], {10:2, 20:1})
+        self.assertEquals(conn.data[KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'my.service:2019:01:02:03:04'], {10:2})
+        self.assertEquals(conn.data[KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'my.service:2019:01:02:03:05'], {20:1})
+
+        # Nothing to store
+        collector.flush()
+        self.assertEquals(len(conn.executed), 1)
+
+    def test_usage_total(self):
+        conn = _Conn()
+        collector = ServiceStatsCollector(conn)
+
+        # Other workers invoked the service already
+        conn.data[KVDB.SERVICE_USAGE + 'my.service'] = 100
+
+        self.assertEquals(collector.incr_usage('my.service'), 1)
+        collector.flush()
+
+        self.assertEquals(collector.incr_usage('my.service'), 102)
+        self.assertEquals(conn.data[KVDB.SERVICE_USAGE + 'my.service'], 101)
+
+# ################################################################################################################################
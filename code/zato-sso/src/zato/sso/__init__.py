@@ -109,6 +109,11 @@ class const:
         def __iter__(self):
             return iter([self.and_, self.or_])
 
+    class session_cache:
+        ttl = 10 # In seconds
+        max_size = 10000
+        renew_flush_interval = 2 # In seconds
+
 # ################################################################################################################################
 
 class ValidationError(Exception):
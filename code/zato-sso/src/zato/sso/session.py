@@ -9,16 +9,27 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import OrderedDict
 from contextlib import closing
 from datetime import datetime, timedelta
 from logging import getLogger
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import spawn_later
+
 # ipaddress
 from ipaddress import ip_address
 
+# SQLAlchemy
+from sqlalchemy import and_, bindparam
+
 # Zato
 from zato.common.audit import audit_pii
+from zato.common.broker_message import SSO as BROKER_MSG_SSO
 from zato.common.odb.model import SSOSession as SessionModel
 from zato.sso import const, status_code, Session as SessionEntity, ValidationError
 from zato.sso.attr import AttrAPI
@@ -36,6 +47,16 @@ SessionModelInsert = SessionModelTable.insert
 SessionModelUpdate = SessionModelTable.update
 SessionModelDelete = SessionModelTable.delete
 
+# Used to save renewals in batches - sessions never have their expiration time moved back
+_renew_batch = SessionModelUpdate().\
+    values({
+        'expiration_time': bindparam('b_expiration_time'),
+    }).\
+    where(and_(
+        SessionModelTable.c.ust==bindparam('b_ust'),
+        SessionModelTable.c.expiration_time < bindparam('b_expiration_time'),
+    ))
+
 # ################################################################################################################################
 
 class LoginCtx(object):
@@ -91,22 +112,170 @@ class SessionInfo(object):
 
 # ################################################################################################################################
 
+class SessionCache(object):
+    """ Keeps sessions recently read from SQL so that repeated verifications within self.ttl seconds do not query SQL.
+    Renewals are applied to cached sessions immediately and saved to SQL in batches, at most once in self.flush_interval
+    seconds, which means that a renewal is saved only once no matter how many times a session was renewed in the meantime.
+    Since each worker has its own cache, entries need to be invalidated in all workers of all servers each time
+    a session is deleted or its user's data changes.
+    """
+    def __init__(self, ttl, max_size, flush_interval):
+        self.ttl = timedelta(seconds=ttl)
+        self.is_enabled = bool(ttl)
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.odb_session_func = None
+        self.sessions = OrderedDict() # UST -> (time until which it can be used, session info)
+        self.renewals = {}            # UST -> the latest expiration time not saved in SQL yet
+        self.flush_scheduled = False
+
+# ################################################################################################################################
+
+    def get(self, ust, now):
+        """ Returns information about a session or None if it is not in cache, if it is there for too long already
+        or if the session has already expired.
+        """
+        entry = self.sessions.get(ust)
+        if entry:
+            valid_until, info = entry
+            if now < valid_until and now < info.expiration_time:
+                return info
+            else:
+                self.sessions.pop(ust, None)
+
+# ################################################################################################################################
+
+    def set(self, ust, info, now):
+        """ Caches information about a session read from SQL and returns its copy that callers should use instead.
+        """
+        if not self.is_enabled:
+            return info
+
+        info = Bunch(info._asdict())
+
+        # This worker may have renewed the session more recently than what SQL already has
+        expiration_time = self.renewals.get(ust)
+        if expiration_time and expiration_time > info.expiration_time:
+            info.expiration_time = expiration_time
+
+        # Drop the oldest entry if there is no more room
+        if ust not in self.sessions and len(self.sessions) >= self.max_size:
+            self.sessions.popitem(last=False)
+
+        self.sessions[ust] = (now + self.ttl, info)
+
+        return info
+
+# ################################################################################################################################
+
+    def renew(self, ust, expiration_time):
+        """ Sets a new expiration time for a session, to be saved in SQL in background.
+        """
+        entry = self.sessions.get(ust)
+        if entry:
+            entry[1].expiration_time = expiration_time
+
+        self.renewals[ust] = expiration_time
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            spawn_later(self.flush_interval, self.flush)
+
+# ################################################################################################################################
+
+    def flush(self):
+        """ Saves in SQL all renewals collected since the previous flush.
+        """
+        self.flush_scheduled = False
+        renewals, self.renewals = self.renewals, {}
+
+        if not renewals:
+            return
+
+        try:
+            with closing(self.odb_session_func()) as session:
+                session.execute(_renew_batch, [{'b_ust': ust, 'b_expiration_time': expiration_time}
+                    for ust, expiration_time in renewals.items()])
+                session.commit()
+        except Exception:
+            logger.warn('Could not save %d session renewal(s), e:`%s`', len(renewals), format_exc())
+
+            # Try again with the next flush, unless a given session has been renewed again in the meantime
+            for ust, expiration_time in renewals.items():
+                self.renewals.setdefault(ust, expiration_time)
+
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                spawn_later(self.flush_interval, self.flush)
+
+# ################################################################################################################################
+
+    def invalidate(self, ust=None, user_id=None):
+        """ Removes from cache a single session by its UST, or all sessions of a user.
+        """
+        if ust:
+            self.sessions.pop(ust, None)
+            self.renewals.pop(ust, None)
+
+        if user_id:
+            for key, (_, info) in self.sessions.items():
+                if info.user_id == user_id:
+                    self.sessions.pop(key, None)
+
+# ################################################################################################################################
+
 class SessionAPI(object):
     """ Logs a user in or out, provided that all authentication and authorization checks succeed,
     or returns details about already existing sessions.
     """
-    def __init__(self, sso_conf, encrypt_func, decrypt_func, hash_func, verify_hash_func):
+    def __init__(self, sso_conf, encrypt_func, decrypt_func, hash_func, verify_hash_func, server=None):
         self.sso_conf = sso_conf
         self.encrypt_func = encrypt_func
         self.decrypt_func = decrypt_func
         self.hash_func = hash_func
         self.verify_hash_func = verify_hash_func
+        self.server = server
         self.odb_session_func = None
 
+        # Publishes broker messages in processes that have no server, e.g. CLI
+        self.broker_publish_func = None
+
+        # Sessions are cached only in servers - other processes, such as CLI, do not receive broker messages
+        # that invalidate cached entries, and they may not live long enough to save renewals.
+        cache_ttl = int(sso_conf.session.get('cache_ttl', const.session_cache.ttl)) if server else 0
+        self.cache = SessionCache(cache_ttl,
+            int(sso_conf.session.get('cache_max_size', const.session_cache.max_size)),
+            float(sso_conf.session.get('renew_flush_interval', const.session_cache.renew_flush_interval)))
+
 # ################################################################################################################################
 
     def set_odb_session_func(self, func):
         self.odb_session_func = func
+        self.cache.odb_session_func = func
+
+# ################################################################################################################################
+
+    def set_broker_publish_func(self, func):
+        self.broker_publish_func = func
+
+# ################################################################################################################################
+
+    def invalidate(self, ust=None, user_id=None):
+        """ Removes a session, or all sessions of a user, from caches of all workers of all servers.
+        """
+        self.cache.invalidate(ust, user_id)
+
+        msg = {
+            'action': BROKER_MSG_SSO.SESSION_INVALIDATE.value,
+            'ust': ust,
+            'user_id': user_id,
+        }
+
+        if self.server:
+            self.server.broker_client.publish(msg)
+
+        elif self.broker_publish_func:
+            self.broker_publish_func(msg)
 
 # ################################################################################################################################
 
@@ -388,8 +557,13 @@ class SessionAPI(object):
         now = _now()
         ctx = VerifyCtx(self.decrypt_func(ust) if needs_decrypt else ust, remote_addr, current_app)
 
-        # Look up user and raise exception if not found by input UST
-        sso_info = self._get_session_by_ust(session, ctx.ust, now)
+        # Look up user and raise exception if not found by input UST, unless it has been just verified in this worker
+        sso_info = self.cache.get(ctx.ust, now)
+
+        if not sso_info:
+            sso_info = self._get_session_by_ust(session, ctx.ust, now)
+            if sso_info:
+                sso_info = self.cache.set(ctx.ust, sso_info, now)
 
         # Invalid UST or the session has already expired but in either case
         # we can not access it.
@@ -402,12 +576,17 @@ class SessionAPI(object):
         # Everything is validated, we can renew the session, if told to.
         if renew:
             expiration_time = now + timedelta(minutes=self.sso_conf.session.expiry)
-            session.execute(
-                SessionModelUpdate().values({
-                    'expiration_time': expiration_time,
-            }).where(
-                SessionModelTable.c.ust==ctx.ust
-            ))
+
+            # With a cache, renewals are saved in SQL in background
+            if self.cache.is_enabled:
+                self.cache.renew(ctx.ust, expiration_time)
+            else:
+                session.execute(
+                    SessionModelUpdate().values({
+                        'expiration_time': expiration_time,
+                }).where(
+                    SessionModelTable.c.ust==ctx.ust
+                ))
             return expiration_time
         else:
             # Indicate success
@@ -526,11 +705,14 @@ class SessionAPI(object):
             # Check that the session and user exist ..
             if self._get(session, ust, current_app, remote_addr, needs_decrypt=False, renew=False):
 
-                # .. and if so, delete the session now.
+                # .. and if so, delete the session now ..
                 session.execute(
                     SessionModelDelete().\
                     where(SessionModelTable.c.ust==ust)
                 )
                 session.commit()
 
+                # .. making sure it cannot be used from any cache either.
+                self.invalidate(ust=ust)
+
 # ################################################################################################################################
@@ -210,7 +210,8 @@ class UserAPI(object):
         self.password_expiry = self.sso_conf.password.expiry
 
         # For convenience, sessions are accessible through user API.
-        self.session = SessionAPI(self.sso_conf, self.encrypt_func, self.decrypt_func, self.hash_func, self.verify_hash_func)
+        self.session = SessionAPI(self.sso_conf, self.encrypt_func, self.decrypt_func, self.hash_func, self.verify_hash_func,
+            server)
 
 # ################################################################################################################################
 
@@ -218,6 +219,11 @@ class UserAPI(object):
         self.odb_session_func = func
         self.session.set_odb_session_func(func)
 
+# ################################################################################################################################
+
+    def set_broker_publish_func(self, func):
+        self.session.set_broker_publish_func(func)
+
 # ################################################################################################################################
 
     def _create_sql_user(self, ctx, _utcnow=_utcnow, _timedelta=timedelta):
@@ -632,6 +638,9 @@ class UserAPI(object):
             ).rowcount
             session.commit()
 
+            # Sessions of a deleted user cannot be used anymore
+            self.session.invalidate(user_id=user.user_id)
+
             if rows_matched != 1:
                 msg = 'Expected for rows_matched to be 1 instead of %d, user_id:`%s`, username:`%s`'
                 logger.warn(msg, rows_matched, user_id, username)
@@ -661,6 +670,8 @@ class UserAPI(object):
 
     def _lock_user_cli(self, user_id, is_locked):
         """ Locks or unlocks a user account. Used by CLI, does not check any permissions.
+        Servers are told to drop the user's cached sessions only if a broker publish function was set,
+        otherwise they may keep accepting them for up to sso.conf's session.cache_ttl seconds.
         """
         with closing(self.odb_session_func()) as session:
             session.execute(
@@ -672,19 +683,22 @@ class UserAPI(object):
             )
             session.commit()
 
+        # Locked users must not be able to use sessions they already have
+        self.session.invalidate(user_id=user_id)
+
 # ################################################################################################################################
 
     def lock_user_cli(self, user_id):
         """ Locks a user account. Does not check any permissions.
         """
-        self._lock_user(user_id, True)
+        self._lock_user_cli(user_id, True)
 
 # ################################################################################################################################
 
     def unlock_user_cli(self, user_id):
         """ Unlocks a user account. Does not check any permissions.
         """
-        self._lock_user(user_id, False)
+        self._lock_user_cli(user_id, False)
 
 # ################################################################################################################################
 
@@ -860,6 +874,9 @@ class UserAPI(object):
                 )
                 session.commit()
 
+            # Cached sessions contain user attributes, such as is_locked, which may have just changed
+            self.session.invalidate(user_id=_user_id)
+
 # ################################################################################################################################
 
     def update_current_user(self, cid, data, current_ust, current_app, remote_addr):
@@ -893,6 +910,9 @@ class UserAPI(object):
         set_password(self.odb_session_func, self.encrypt_func, self.hash_func, self.sso_conf, user_id, password,
             must_change, password_expiry)
 
+        # Cached sessions contain password-related attributes, such as its expiry time
+        self.session.invalidate(user_id=user_id)
+
 # ################################################################################################################################
 
     def change_password(self, cid, data, current_ust, current_app, remote_addr):
@@ -966,10 +986,10 @@ class UserAPI(object):
 
 # ################################################################################################################################
 
-    def _change_approval_status(self, user_id, new_value, current_ust, current_app, remote_addr):
+    def _change_approval_status(self, cid, user_id, new_value, current_ust, current_app, remote_addr):
         """ Changes a given user's approval_status to 'value'.
         """
-        return self._update_user({'approval_status': new_value}, current_ust, current_app, remote_addr, user_id=user_id)
+        return self._update_user(cid, {'approval_status': new_value}, current_ust, current_app, remote_addr, user_id=user_id)
 
 # ################################################################################################################################
 
@@ -980,7 +1000,12 @@ class UserAPI(object):
         audit_pii.info(cid, 'user.approve_user', target_user=user_id,
             extra={'current_app':current_app, 'remote_addr':remote_addr})
 
-        return self._change_approval_status(user_id, const.approval_status.approved, current_ust, current_app, remote_addr)
+        out = self._change_approval_status(cid, user_id, const.approval_status.approved, current_ust, current_app, remote_addr)
+
+        # Cached sessions of that user need to be verified against the new status
+        self.session.invalidate(user_id=user_id)
+
+        return out
 
 # ################################################################################################################################
 
@@ -990,7 +1015,12 @@ class UserAPI(object):
         # PII audit comes first
         audit_pii.info(cid, 'user.reject_user', target_user=user_id, extra={'current_app':current_app, 'remote_addr':remote_addr})
 
-        return self._change_approval_status(user_id, const.approval_status.rejected, current_ust, current_app, remote_addr)
+        out = self._change_approval_status(cid, user_id, const.approval_status.rejected, current_ust, current_app, remote_addr)
+
+        # Cached sessions of that user need to be verified against the new status
+        self.session.invalidate(user_id=user_id)
+
+        return out
 
 # ################################################################################################################################
 